@@ -0,0 +1,245 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script converts several chemical mechanism files -- in
+# FACSIMILE (.fac) or KPP (.kpp) format -- with mech_converter.py, in
+# parallel: each conversion runs in its own process, in its own output
+# directory, and writes its messages to mech_converter.log in that
+# directory. A summary of the conversions (output directory, time,
+# status) is printed at the end.
+#
+# The output directory of a mechanism is OUTPUT/<name of the mechanism
+# file without the extension>, unless it is given explicitly with
+# MECH=DIR. The files of the configuration directory which are read
+# by the conversion (environmentVariables.config, customRateFuncs.f90
+# and the configuration files used by --prune) are copied to the
+# output directory, unless it already has them.
+#
+# ARGUMENTS:
+#   1. paths to the mechanism files (.fac or .kpp), to directories
+#      (all the *.fac and *.kpp files in the directory), or MECH=DIR
+#      (mechanism file and output directory)
+#
+# OPTIONS:
+#   --config DIR   path to the model configuration directory used as a
+#                  template [default: model/configuration/]
+#   --output DIR   path to the directory of the output directories
+#                  [default: batch_output/]
+#   --mcm DIR      path to the MCM data files directory [default: mcm/]
+#   --jobs N       number of conversions in parallel [default: number of CPUs]
+#
+# and the options of mech_converter.py (e.g. --shards, --cse,
+# --jacobian), which are applied to all the mechanisms.
+#
+# The exit code is 1 if any conversion has failed.
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+import contextlib
+import traceback
+import concurrent.futures
+import mech_converter
+import mechanism_pruning
+
+
+# Files of the configuration directory which are read by the conversion.
+configFiles = ['environmentVariables.config', 'customRateFuncs.f90'] \
+    + mechanism_pruning.configFiles
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def mechanism_files(paths, output_dir):
+    """
+    Find the mechanism files to convert, and their output directories.
+
+    Args:
+        paths (list): paths to the mechanism files, to directories, or
+                      MECH=DIR
+        output_dir (str): path to the directory of the output directories
+
+    Returns:
+        jobs (list): (mechanism file, output directory) of each conversion
+    """
+
+    jobs = []
+    for path in paths:
+        if '=' in path and not os.path.exists(path):
+            mech_file, mech_dir = path.split('=', 1)
+            jobs.append((mech_file, mech_dir))
+        elif os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, '*.fac')) + glob.glob(os.path.join(path, '*.kpp')))
+            if not found:
+                print('No chemical mechanism (*.fac or *.kpp) found in ' + path)
+            for mech_file in found:
+                jobs.append((mech_file, None))
+        else:
+            jobs.append((path, None))
+
+    jobs = [(mech_file, mech_dir if mech_dir else
+             os.path.join(output_dir, os.path.splitext(os.path.basename(mech_file))[0]))
+            for mech_file, mech_dir in jobs]
+    for mech_file, _ in jobs:
+        assert os.path.isfile(mech_file), 'Failed to find file ' + mech_file
+    mech_dirs = [os.path.normpath(mech_dir) for _, mech_dir in jobs]
+    duplicates = sorted(set(d for d in mech_dirs if mech_dirs.count(d) > 1))
+    assert not duplicates, 'Several mechanisms have the same output directory: ' \
+        + ', '.join(duplicates) + ' (use MECH=DIR)'
+    return jobs
+
+def prepare_output_dir(mech_dir, config_dir):
+    """
+    Create the output directory of a conversion, and copy the files of the
+    configuration directory which are read by the conversion.
+
+    Args:
+        mech_dir (str): path to the output directory
+        config_dir (str): path to the model configuration directory
+    """
+
+    if not os.path.isdir(mech_dir):
+        os.makedirs(mech_dir)
+    for filename in configFiles:
+        source = os.path.join(config_dir, filename)
+        target = os.path.join(mech_dir, filename)
+        if os.path.isfile(source) and not os.path.isfile(target):
+            shutil.copy(source, target)
+
+def convert_mechanism(mech_file, mech_dir, mcm_dir, options):
+    """
+    Convert a chemical mechanism with mech_converter.py, with the messages
+    written to mech_converter.log in the output directory. This function
+    is run in a worker process.
+
+    Args:
+        mech_file (str): path to the mechanism file
+        mech_dir (str): path to the output directory
+        mcm_dir (str): path to the MCM data files directory
+        options (dict): keyword arguments of convert_to_fortran()
+
+    Returns:
+        mech_file (str): path to the mechanism file
+        mech_dir (str): path to the output directory
+        seconds (float): time of the conversion
+        error (str): error message, or None if the conversion succeeded
+    """
+
+    start = time.perf_counter()
+    error = None
+    with open(os.path.join(mech_dir, 'mech_converter.log'), 'w') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            try:
+                mech_converter.convert_to_fortran(mech_file, mech_dir, mcm_dir, **options)
+            except (Exception, SystemExit) as e:
+                traceback.print_exc(file=log_file)
+                error = str(e).strip() or type(e).__name__
+    return mech_file, mech_dir, time.perf_counter() - start, error
+
+def convert_mechanisms(jobs, mcm_dir, options, processes):
+    """
+    Convert the chemical mechanisms in parallel.
+
+    Args:
+        jobs (list): (mechanism file, output directory) of each conversion
+        mcm_dir (str): path to the MCM data files directory
+        options (dict): keyword arguments of convert_to_fortran()
+        processes (int): number of conversions in parallel
+
+    Returns:
+        results (list): (mechanism file, output directory, time, error) of
+                        each conversion, in the order of jobs
+    """
+
+    if processes == 1:
+        return [convert_mechanism(mech_file, mech_dir, mcm_dir, options)
+                for mech_file, mech_dir in jobs]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(convert_mechanism, mech_file, mech_dir, mcm_dir, options)
+                   for mech_file, mech_dir in jobs]
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            print(('OK     ' if result[3] is None else 'FAILED ') + result[0])
+            sys.stdout.flush()
+            results.append(result)
+    order = {mech_dir: k for k, (_, mech_dir) in enumerate(jobs)}
+    return sorted(results, key=lambda result: order[result[1]])
+
+def print_summary(results):
+    """
+    Print a summary of the conversions: output directory, time and status
+    (with the first line of the error message of the failed conversions).
+
+    Args:
+        results (list): (mechanism file, output directory, time, error) of
+                        each conversion
+    """
+
+    width = max([len('mechanism')] + [len(result[0]) for result in results])
+    dir_width = max([len('output directory')] + [len(result[1]) for result in results])
+    print('%-*s  %-*s  %9s  %s' % (width, 'mechanism', dir_width, 'output directory', 'time (s)', 'status'))
+    for mech_file, mech_dir, seconds, error in results:
+        status = 'OK' if error is None else 'FAILED: ' + error.splitlines()[0]
+        print('%-*s  %-*s  %9.2f  %s' % (width, mech_file, dir_width, mech_dir, seconds, status))
+    failed = sum(1 for result in results if result[3] is not None)
+    print(str(len(results) - failed) + ' of ' + str(len(results)) + ' mechanisms converted.')
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Convert several chemical mechanisms (.fac or .kpp) to the Fortran format '
+        'used by AtChem2, in parallel.')
+    parser.add_argument('mech_files', nargs='+', metavar='MECH',
+                        help='path to a chemical mechanism file (.fac or .kpp), to a directory '
+                        'of mechanism files, or MECH=DIR to set the output directory')
+    parser.add_argument('--config', default='./model/configuration/', metavar='DIR',
+                        help='path to the model configuration directory used as a template '
+                        '[default: %(default)s]')
+    parser.add_argument('--output', default='./batch_output/', metavar='DIR',
+                        help='path to the directory of the output directories [default: %(default)s]')
+    parser.add_argument('--mcm', default='./mcm/', metavar='DIR',
+                        help='path to the MCM data files directory [default: %(default)s]')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), metavar='N',
+                        help='number of conversions in parallel [default: number of CPUs]')
+    mech_converter.add_converter_options(parser)
+    args = parser.parse_args()
+
+    # Check that the files and directories exist
+    assert os.path.exists(args.config), 'Failed to find directory ' + args.config
+    assert os.path.exists(args.mcm), 'Failed to find directory ' + args.mcm
+    assert args.jobs >= 1, 'The number of jobs must be positive'
+    assert args.shards >= 0, 'The number of mechanism shards must not be negative'
+
+    jobs = mechanism_files(args.mech_files, args.output)
+    if not jobs:
+        print('No chemical mechanism to convert.')
+        sys.exit(1)
+    for _, mech_dir in jobs:
+        prepare_output_dir(mech_dir, args.config)
+
+    print('Converting ' + str(len(jobs)) + ' chemical mechanisms with '
+          + str(min(args.jobs, len(jobs))) + ' processes...')
+    sys.stdout.flush()
+    results = convert_mechanisms(jobs, args.mcm, mech_converter.converter_options(args),
+                                 min(args.jobs, len(jobs)))
+    print_summary(results)
+    if any(result[3] is not None for result in results):
+        sys.exit(1)
+
+# Call the main function if executed as script
+if __name__ == '__main__':
+    main()
@@ -30,6 +30,16 @@
 #    - parameters to calculate photolysis rates
 #    By default, argument $3 is: ./mcm/
 #
+# Options for mech_converter.py (e.g. `--shards 8`) can be passed with
+# the environment variable ATCHEM2_CONVERTER_OPTIONS. The shared library
+# is compiled with as many parallel jobs as there are processors.
+#
+# If the chemical mechanism, its configuration and the conversion
+# scripts have not changed since a previous build, the mechanism files
+# and the shared library are restored from a local cache instead of
+# being generated again (see build/mechanism_cache.py). Set the
+# environment variable ATCHEM2_CACHE=0 to disable the cache.
+#
 # Usage:
 #   ./build/build_atchem2.sh /path/to/mechanism/file
 #   ./build/build_atchem2.sh /path/to/mechanism/file /path/to/mechanism/directory
@@ -43,18 +53,38 @@ echo "* Chemical mechanism file:" $1
 echo "* Fortran mechanism directory [ default = ./model/configuration/ ]:" $2
 echo "* MCM data files directory [ default = ./mcm/ ]:" $3
 
-echo ""
-echo "-> Call mech_converter.py"
-python ./build/mech_converter.py $1 $2 $3
+MECH_DIR=${2:-./model/configuration/}
+MCM_DIR=${3:-./mcm/}
+
+NPROC=$(getconf _NPROCESSORS_ONLN 2>/dev/null || echo 1)
+
+CACHE_KEY=""
+if [ "$ATCHEM2_CACHE" != "0" ]; then
+  CACHE_KEY=$(python ./build/mechanism_cache.py key $1 $MECH_DIR $MCM_DIR $ATCHEM2_CONVERTER_OPTIONS)
+fi
 
 echo ""
-echo "-> Create shared library"
-if [ -z $2 ]; then
-  make sharedlib
-  echo "=> shared library created in: ./model/configuration/"
+if [ -n "$CACHE_KEY" ] && python ./build/mechanism_cache.py restore $CACHE_KEY $MECH_DIR; then
+  echo "=> mechanism files and shared library restored from cache in:" $MECH_DIR
 else
-  make sharedlib SHAREDLIBDIR=$2
-  echo "=> shared library created in:" $2
+  echo "-> Call mech_converter.py"
+  python ./build/mech_converter.py $1 $MECH_DIR $MCM_DIR $ATCHEM2_CONVERTER_OPTIONS
+  BUILD_STATUS=$?
+
+  echo ""
+  echo "-> Create shared library"
+  if [ -z $2 ]; then
+    make -j $NPROC sharedlib || BUILD_STATUS=1
+    echo "=> shared library created in: ./model/configuration/"
+  else
+    make -j $NPROC sharedlib SHAREDLIBDIR=$2 || BUILD_STATUS=1
+    echo "=> shared library created in:" $2
+  fi
+
+  # Only store successful builds in the cache.
+  if [ -n "$CACHE_KEY" ] && [ $BUILD_STATUS -eq 0 ]; then
+    python ./build/mechanism_cache.py store $CACHE_KEY $MECH_DIR
+  fi
 fi
 
 echo ""
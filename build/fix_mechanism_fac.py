@@ -29,27 +29,176 @@
 #   % 3.8D-13*EXP(780/TEMP)*(1/(1+498*EXP(-1160/TEMP))) : CH3O2 + HO2 = HCHO ;
 #   % 2.3D-12*EXP(360/TEMP)*0.001 : CH3O2 + NO = CH3NO3 ;
 #
+# The file is processed one line at a time. mech_converter.py checks
+# the .fac file with check_fac_file() before writing any output, then
+# reads the corrected lines from fix_fac_lines(), without modifying the
+# .fac file; fix_fac_full_file() corrects the .fac file in place.
+#
 # ARGUMENT:
 #   1. path to the mechanism .fac file
 # -------------------------------------------------------------------- #
 from __future__ import print_function
-from functools import reduce
+import os
 import sys
 import re
+import shutil
+import tempfile
 
 
 # =========================== FUNCTIONS =========================== #
 
 
+def repair_continuation_lines(lines, stats):
+    """
+    Concatenate the lines of the 'Reaction definitions' section which
+    don't start with a '%' (or a '*' for comments) onto the previous
+    line: they are the continuation of a reaction broken by an
+    incorrect newline character. A reaction can be broken over more
+    than two lines: the continuation lines are concatenated until one
+    of them ends the reaction with a ';'. The lines are processed one
+    at a time, with only the current line held in memory.
+
+    Args:
+        lines (iterable): lines of the .fac file, without newline characters
+        stats (dict): counters of the lines read ('items') and of the lines
+                      concatenated ('corrections'), updated in place
+
+    Yields:
+        line_number (int): number of the first line in the .fac file
+        line (str): corrected line, without newline character
+    """
+
+    in_reaction_definition_section = False
+    pending = None
+    # True if the previous line is a reaction which has been completed by a
+    # continuation line: the next lines are not concatenated onto it again.
+    completed = False
+    for line_number, line in enumerate(lines, 1):
+        stats['items'] += 1
+        # Only do other checks if we've reached the 'Reaction definitions' section.
+        if in_reaction_definition_section and not re.match(r'\*', line) \
+           and not re.match(r'%', line) and pending is not None and not completed:
+            pending = (pending[0], pending[1] + ' ' + line)
+            completed = pending[1].rstrip().endswith(';')
+            stats['corrections'] += 1
+            continue
+        completed = False
+        # Check to see whether we are entering the 'Reaction definitions' section.
+        if 'Reaction definitions.' in line:
+            in_reaction_definition_section = True
+        if pending is not None:
+            yield pending
+        pending = (line_number, line)
+    if pending is not None:
+        yield pending
+
+def split_stacked_lines(numbered_lines, input_file):
+    """
+    Split the lines which have been double-stacked (two statements ending
+    with ';' on the same line) into two lines, after the header of the
+    file (up to 'Generic Rate Coefficients'), which often contains
+    semicolons within the lines. Empty lines after the header are
+    removed.
+
+    Args:
+        numbered_lines (iterable): (line number, line) of the .fac file, as
+                                   returned by repair_continuation_lines
+        input_file (str): name of the .fac file, for the error messages
+
+    Yields:
+        line (str): corrected line, without newline character
+    """
+
+    in_header = True
+    for line_number, line in numbered_lines:
+        if re.search(r'Generic Rate Coefficients', line):
+            assert in_header, str(input_file) + ': more than one Generic Rate Coefficients section.'
+            in_header = False
+        if in_header:
+            yield line
+            continue
+
+        # Split by semicolons, but we keep the semicolons this way, and
+        # remove empty sub-strings.
+        pieces = []
+        for elem in re.split(r'(;)', line):
+            if elem == ';':
+                pieces[-1] += elem
+            else:
+                pieces.append(elem)
+        pieces = [item for item in pieces if item]
+
+        # Lines with more than 2 elements are where more than one line is broken
+        # running together. At this point, the file is too broken to easily fix
+        # manually -- get the user to fix it and run again.
+        if len(pieces) > 2:
+            sys.exit('The inputted file is broken near line ' + str(line_number) \
+                     + ' in a way that this script cannot handle.' \
+                     + ' Please manually fix this error and re-run this script.')
+        for item in pieces:
+            yield item
+    assert not in_header, str(input_file) + ': no Generic Rate Coefficients section.'
+
+def fix_fac_lines(lines, input_file, stats=None):
+    """
+    Given the lines of a .fac file, return the same lines, but with
+    incorrect newline characters removed and the affected lines
+    concatenated correctly (see the documentation of
+    repair_continuation_lines and split_stacked_lines). The lines are
+    processed in a single pass, one at a time, so that the chemical
+    mechanism never needs to be held in memory.
+
+    The script exits with an error if a line is too broken to be fixed:
+    use check_fac_file() first, before writing any output, to avoid
+    leaving the output incomplete.
+
+    Args:
+        lines (iterable): lines of the .fac file
+        input_file (str): name of the .fac file, for the error messages
+        stats (dict): if given, counters of the lines read ('items') and of
+                      the lines concatenated ('corrections'), updated in place
+
+    Yields:
+        line (str): corrected line, with a newline character
+    """
+
+    # Using splitlines() on each line, we take out the errant carriage
+    # returns, and, for any line with such on it, we return it to the list.
+    if stats is None:
+        stats = {}
+    stats.update({'items': 0, 'corrections': 0})
+    split_lines = (item for line in lines for item in (line.splitlines() or ['']))
+    for line in split_stacked_lines(repair_continuation_lines(split_lines, stats), input_file):
+        yield line + '\n'
+
+# ------------------------------------------------------------ #
+
+def check_fac_file(input_file):
+    """
+    Given a .fac file, check that its incorrect newline characters can
+    be fixed by fix_fac_lines(), and print the number of lines read and
+    of corrections made. The file is read one line at a time, and it is
+    not modified. The script exits with an error if a line is too broken
+    to be fixed.
+
+    Args:
+        input_file (str): name of the .fac file to be checked
+    """
+
+    stats = {}
+    with open(input_file, 'r') as file_open:
+        for _ in fix_fac_lines(file_open, input_file, stats):
+            pass
+    print(str(input_file) + ': file read in ' + str(stats['items']) + ' items.')
+    print(str(stats['corrections']) + ' corrections made -- the lines are concatenated while they are read.')
+
+# ------------------------------------------------------------ #
+
 def fix_fac_full_contents(input_file):
     """
     Given a .fac file, return the contents of the file, but with
     incorrect newline characters removed and the affected lines
-    concatenated correctly.
-
-    WARNING: this will probably fail if a line is REALLY long,
-    stretching over two full lines, but in this case it should then
-    give an error as output.
+    concatenated correctly (see the documentation of fix_fac_lines).
 
     Args:
         input_file (str): name of the .fac file to be corrected
@@ -59,84 +208,8 @@ def fix_fac_full_contents(input_file):
                            as a separate string
     """
 
-    # Using splitlines() rather than readlines(), we take out the
-    # errant carriage returns, and, for any line with such on it, we
-    # return it to the list.
     with open(input_file, 'r') as file_open:
-        contents = file_open.read().splitlines()
-
-    # print contents
-    orig_contents_len = len(contents)
-    print(str(input_file) + ': file read in ' + str(orig_contents_len) + ' items.')
-    contents_count = 0
-
-    # This variable will hold the indices to be deleted once their
-    # contents have been concatenated onto the previous element.
-    to_delete = []
-
-    # First, wait until we reach a line containing 'Reaction definitions'.
-    # Second, ignore comment lines.
-    # Third, correct the lines which don't start with a '%': they should
-    # be concatenated onto the previous entry.
-    in_reaction_definition_section = False
-    for i, line in enumerate(contents):
-        if not in_reaction_definition_section:
-            # Check to see whether we are entering the 'Reaction definitions' section.
-            if 'Reaction definitions.' in line:
-                in_reaction_definition_section = True
-        # Only do other checks if we've reached the 'Reaction definitions' section.
-        else:
-            if re.match(r'\*', line):
-                pass
-            elif not re.match(r'%', line):
-                # print 'fail'
-                # print contents[i-1], 'XX', contents[i], 'XX', contents[i+1]
-                contents[i-1] += ' ' + line
-                # print contents[i-1]
-                contents_count += 1
-                to_delete.append(i)
-    print(str(contents_count) + ' corrections made -- now removing old.')
-
-    # Remove old elements which have now been concatenated onto previous.
-    for i in reversed(to_delete):
-        del contents[i]
-    assert orig_contents_len == contents_count + len(contents), str(input_file) \
-        + ': file is probably too messed up with carriage returns for this script to fix.'
-
-    # If there are any lines that have now been doubled-stacked, break them into pieces.
-    # Find the end of the header section, because we don't want to parse that section
-    # anymore. It often contains semicolons within the lines as well as at the end,
-    # which breaks all our logic.
-    end_of_header_index = [i for i, item in enumerate(contents) \
-                           if re.search(r'Generic Rate Coefficients', item)]
-    assert len(end_of_header_index) == 1
-    end_of_header_index = end_of_header_index[0]
-
-    # Split non-header lines by semicolons, but we keep the semicolons this way.
-    interim_contents = [reduce(lambda acc, elem: acc[:-1] + [acc[-1] + elem] \
-                               if elem == ';' else acc + [elem], re.split(r'(;)', element), []) \
-                        for element in contents[end_of_header_index:]]
-
-    # Remove empty sub-strings.
-    interim_contents = [[item for item in sublist if item] for sublist in interim_contents]
-
-    # Look for any lines containing more than 2 elements. These are lines where
-    # more than one line is broken running together. At this point, the file is
-    # too broken to easily fix manually -- get the user to fix it and run again.
-    if max((len(line) for line in interim_contents)) > 2:
-        # Get index of line with error
-        line_lengths = [len(line) for line in interim_contents]
-        error_line = line_lengths.index(max(line_lengths)) + end_of_header_index + 1
-        sys.exit('The inputted file is broken near line ' + str(error_line) \
-                 + ' in a way that this script cannot handle.' \
-                 + ' Please manually fix this error and re-run this script.')
-
-    # Reattach the header lines, and unwrap the list of lists in interim_contents.
-    fixed_file = contents[:end_of_header_index] \
-        + [item for sublist in interim_contents for item in sublist]
-
-    # Return the corrected mechanism file
-    return fixed_file
+        return [line[:-1] for line in fix_fac_lines(file_open, input_file)]
 
 # ------------------------------------------------------------ #
 
@@ -146,9 +219,10 @@ def fix_fac_full_file(input_file):
     same contents, but with incorrect newline characters removed and
     the affected lines concatenated correctly.
 
-    All the work is done by the fix_fac_contents() function -- see its
+    All the work is done by the fix_fac_lines() function -- see its
     documentation for details. This function is just a wrapper to
-    write the output of fix_fac_contents() back to the same .fac file.
+    write the output of fix_fac_lines() to a temporary file, which
+    then replaces the .fac file.
 
     Args:
         input_file (str): name of the .fac file to be fixed
@@ -156,11 +230,15 @@ def fix_fac_full_file(input_file):
 
     print('Running fix_fac_full_file() on: ' + str(input_file))
 
-    contents = fix_fac_full_contents(input_file)
-    contents = [item + '\n' for item in contents]
-
-    with open(input_file, 'w') as file_open:
-        file_open.writelines(contents)
+    # Check the whole file first, so that it is not replaced if it is too
+    # broken to be fixed.
+    check_fac_file(input_file)
+    with open(input_file, 'r') as file_open, \
+         tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(input_file)),
+                                     delete=False) as fixed_file:
+        fixed_file.writelines(fix_fac_lines(file_open, input_file))
+    shutil.copymode(input_file, fixed_file.name)
+    os.replace(fixed_file.name, input_file)
 
 
 # =========================== MAIN =========================== #
@@ -169,7 +247,7 @@ def fix_fac_full_file(input_file):
 def main():
     # Pass argument from command line -- name of the .fac file to be fixed
     if len(sys.argv) > 1:
-        fix_fac_full_contents(sys.argv[1])
+        check_fac_file(sys.argv[1])
     else:
         print('*****************************************************')
         print('* Please pass a filename (.fac) as script argument. *')
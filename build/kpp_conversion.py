@@ -15,127 +15,188 @@
 # structure of the files generated by the MCM web extractor. A minimal
 # example of this structure is: `mcm/mechanism_skel.kpp`.
 #
+# mech_converter.py reads the lines of the converted chemical
+# mechanism directly from fac_lines(), without writing the .fac
+# file. When executed as a script, the .fac file is written next to
+# the .kpp file.
+#
 # ARGUMENT:
 #   1. path to the mechanism .kpp file
 # -------------------------------------------------------------------- #
 from __future__ import print_function
 import sys
 import re
+import itertools
 
 
 # =========================== FUNCTIONS =========================== #
 
 
-def mechanism_section(input_lines, start_section, end_section):
+def kpp_error(input_file, line_number, message):
     """
-    Parse the content of a file, provided in the form of a list
-    (each line of the file an item of the list), and extract the
-    section of the file delimited by two given markers.
+    Return the error raised for a line of a .kpp file that cannot be
+    converted to FACSIMILE format.
 
     Args:
-        input_lines (list): file to parse, each line is a separate string
-        start_section (str): marker for the beginning of the section
-        end_section (str): marker for the end of the section
+        input_file (str): name of the .kpp file
+        line_number (int): number of the line, from 1 (0 for the whole file)
+        message (str): description of the error
 
     Returns:
-        section_lines (list): file section, each line is a separate string
-
+        error (RuntimeError): error with the location of the line
     """
 
-    nlines = len(input_lines)
+    location = str(input_file) + (', line ' + str(line_number) if line_number else '')
+    return RuntimeError(location + ': ' + message)
 
-    start_i = 0
-    for i in range(start_i, nlines):
-        if start_section in input_lines[i]:
-            start_i = i + 1
-            break
+# ------------------------------------------------------------ #
+
+def convert_ro2(line):
+    """
+    Converts a line of the summation of organic peroxy radicals (RO2)
+    to FACSIMILE format.
 
-    end_i = nlines
-    if end_section:
-        for i in range (start_i, nlines):
-            if end_section in input_lines[i]:
-                end_i = i + 1
-                break
+    Args:
+        line (str): line with part of the RO2 sum in KPP
+
+    Returns:
+        fac_line (str): the same part of the RO2 sum in FACSIMILE, or None if
+                        the line is not a sum of RO2 species
+    """
 
-    section_lines = input_lines[start_i:end_i]
-    return section_lines
+    new_line = re.sub(r'C\(ind_([A-Z0-9_]+)\s*\)', r'\1', line)
+    new_line = re.sub(r'\s*&', r'', new_line.strip())
+    if not re.match(r'^[A-Za-z0-9_+\s]*$', new_line):
+        return None
+    return new_line
 
 # ------------------------------------------------------------ #
 
-def convert_ro2(kpp_lines):
+def convert_rate(line):
     """
-    Converts the summation of organic peroxy radicals (RO2) to
-    FACSIMILE format.
+    Converts a generic or complex rate coefficient to FACSIMILE format.
 
     Args:
-        kpp_lines (list): lines with the RO2 sum in KPP
+        line (str): line with the rate coefficient in KPP
 
     Returns:
-        fac_lines (list): lines with the RO2 sum in FACSIMILE
+        name (str): name of the rate coefficient, or None if the line is not
+                    an assignment
+        fac_line (str): line with the rate coefficient in FACSIMILE
     """
 
-    fac_lines = []
-    for line in kpp_lines:
-        new_line = re.sub(r'C\(ind_([A-Z0-9_]+)\s*\)', r'\1', line)
-        new_line = re.sub(r'\s*&', r'', new_line.strip())
-        fac_lines.append(new_line)
-    return fac_lines
+    react_line = re.split(r'=', line)
+    if len(react_line) != 2 or not react_line[0].strip() or not react_line[1].strip():
+        return None, None
+    react_line[1] = react_line[1].replace('**', '@')
+    return react_line[0].strip(), react_line[0].strip() + ' = ' + react_line[1].strip() + ' ;\n'
 
 # ------------------------------------------------------------ #
 
-def convert_rates(kpp_lines):
+def convert_reaction(line):
     """
-    Converts the generic and complex rate coefficients to
-    FACSIMILE format.
+    Converts a chemical reaction to FACSIMILE format.
 
     Args:
-        kpp_lines (list): lines with the rate coefficients in KPP
+        line (str): line with the chemical reaction in KPP (e.g.
+                    '{2.} O + O3 = : 8.0D-12*EXP(-2060/TEMP) ;')
 
     Returns:
-        fac_lines1 (list): lines with the generic rate coefficients in FACSIMILE
-        fac_lines2 (list): lines with the complex rate coefficients in FACSIMILE
-
+        fac_line (str): line with the chemical reaction in FACSIMILE, or None
+                        if the line is not a chemical reaction
     """
 
-    # list of generic rate coefficients -- this list may change with
-    # future updates of the MCM
-    simple_list = ['KRO2NO','KRO2HO2','KAPHO2','KAPNO','KRO2NO3','KNO3AL','KDEC',
-                   'KROPRIM','KROSEC','KCH3O2','K298CH3O2','K14ISOM1']
-
-    fac_lines1 = []
-    fac_lines2 = []
-    for line in kpp_lines:
-        react_line = re.split(r'=', line)
-        react_line[1] = react_line[1].replace('**', '@')
-        new_line = react_line[0].strip() + ' = ' + react_line[1].strip() + ' ;\n'
-        if react_line[0].strip() in simple_list:
-            fac_lines1.append(new_line)
-        else:
-            fac_lines2.append(new_line)
-    return fac_lines1, fac_lines2
+    react_line = re.split(r'[}:;]', line)
+    if len(react_line) != 4 or react_line[1].count('=') != 1 \
+       or not react_line[2].strip() or react_line[3].strip():
+        return None
+    rate_coeff = re.sub(r'J\((\d+)\)', r'J<\1>', react_line[2])
+    rate_coeff = rate_coeff.replace('**', '@')
+    return '%' + rate_coeff + ':' + react_line[1] + ';\n'
 
 # ------------------------------------------------------------ #
 
-def convert_reactions(kpp_lines):
+def parse_kpp(input_file):
     """
-    Converts the chemical reactions to FACSIMILE format.
+    Read a .kpp file in a single pass, and convert its content to
+    FACSIMILE format. The file is split into 4 sections: the generic
+    rate coefficients (1), the complex rate coefficients (2), the
+    summation of organic peroxy radicals (RO2) (3) and the chemical
+    reactions (4). The parts of the RO2 sum and the rate coefficients
+    are kept in memory until the chemical reactions are reached; the
+    chemical reactions are converted one at a time.
+
+    The .kpp file must have the structure of the files generated by
+    the MCM web extractor: the RO2 sum, starting with 'RO2 = &', and
+    the rate coefficients, ending with 'CALL mcm_constants(...)' and
+    '#ENDINLINE', followed by the chemical reactions after
+    '#EQUATIONS'. A RuntimeError with the number of the line is raised
+    if the file has a different structure.
 
     Args:
-        kpp_lines (list): lines with the chemical reactions in KPP
+        input_file (str): name of the .kpp file to convert
 
-    Returns:
-        fac_lines (list): lines with the chemical reactions in FACSIMILE
+    Yields:
+        section (int): number of the section (1 to 4, in this order)
+        item (str): line of the section in FACSIMILE format (part of the
+                    RO2 sum, without newline, for section 3)
     """
 
-    fac_lines = []
-    for line in kpp_lines:
-        if re.match(r'{\d+\.}', line):
-            react_line = re.split(r'[}:;]', line)
-            rate_coeff = re.sub(r'J\((\d+)\)', r'J<\1>', react_line[2])
-            rate_coeff = rate_coeff.replace('**', '@')
-            new_line = '%' + rate_coeff + ':' + react_line[1] + ';\n'
-            fac_lines.append(new_line)
-    return fac_lines
+    # list of generic rate coefficients -- this list may change with
+    # future updates of the MCM
+    simple_list = ['KRO2NO','KRO2HO2','KAPHO2','KAPNO','KRO2NO3','KNO3AL','KDEC',
+                   'KROPRIM','KROSEC','KCH3O2','K298CH3O2','K14ISOM1']
+
+    peroxy_radicals = []
+    generic_rates = []
+    complex_reactions = []
+    # Position in the file: before the RO2 sum, in the RO2 sum, in the rate
+    # coefficients, before the chemical reactions, in the chemical reactions.
+    state = 'start'
+    with open(input_file, 'r') as file_open:
+        for line_number, line in enumerate(file_open, 1):
+            if state == 'start':
+                if re.match(r'\s*RO2\s*=\s*&', line):
+                    state = 'peroxy'
+            elif state == 'peroxy':
+                ro2 = convert_ro2(line)
+                if ro2 is None:
+                    raise kpp_error(input_file, line_number, 'not a sum of RO2 species (C(ind_...))')
+                peroxy_radicals.append(ro2)
+                if not line.rstrip().endswith('&'):
+                    state = 'rates'
+            elif state == 'rates':
+                if '#ENDINLINE' in line:
+                    for item in generic_rates:
+                        yield 1, item
+                    for item in complex_reactions:
+                        yield 2, item
+                    for item in peroxy_radicals:
+                        yield 3, item
+                    state = 'inline'
+                elif line.strip() and not re.match(r'\s*CALL\b', line, re.I):
+                    name, rate = convert_rate(line)
+                    if name is None:
+                        raise kpp_error(input_file, line_number,
+                                        'rate coefficient is not of the form NAME = expression')
+                    if name in simple_list:
+                        generic_rates.append(rate)
+                    else:
+                        complex_reactions.append(rate)
+            elif state == 'inline':
+                if '#EQUATIONS' in line:
+                    state = 'equations'
+            elif re.match(r'{\d+\.}', line):
+                reaction = convert_reaction(line)
+                if reaction is None:
+                    raise kpp_error(input_file, line_number, 'chemical reaction is not of the form '
+                                    '{N.} reactants = products : rate ;')
+                yield 4, reaction
+
+    missing = {'start': "'RO2 = &'", 'peroxy': 'the end of the RO2 sum',
+               'rates': "'#ENDINLINE'", 'inline': "'#EQUATIONS'"}
+    if state in missing:
+        raise kpp_error(input_file, 0, missing[state] + ' not found')
 
 # ------------------------------------------------------------ #
 
@@ -143,10 +204,7 @@ def kpp_to_facsimile(input_file):
     """Split a .kpp file into 4 sections: the summation of organic
     peroxy radicals (RO2), the generic and complex rate coefficients,
     the chemical reactions. Each section is separately converted to
-    FACSIMILE format.
-
-    WARNING: this function may fail if the .kpp file has a different
-    structure from the .kpp files generated by the MCM web extractor.
+    FACSIMILE format (see the documentation of parse_kpp).
 
     Args:
         input_file (str): name of the .kpp file to convert
@@ -159,31 +217,45 @@ def kpp_to_facsimile(input_file):
 
     """
 
-    # Read in the .kpp mechanism file
-    with open(input_file, 'r') as file_open:
-        contents = file_open.readlines()
-
-    # Peroxy radicals section
-    start_peroxy = 'RO2 = & '
-    end_peroxy = ') \n'
-    peroxy_lines = mechanism_section(contents, start_peroxy, end_peroxy)
-    peroxy_radicals = convert_ro2(peroxy_lines)
-
-    # Generic Rate Coefficients, Complex reactions sections
-    start_rates = ') \n'
-    end_rates = '#ENDINLINE'
-    rates_lines = mechanism_section(contents, start_rates, end_rates)
-    rates_lines = rates_lines[:-2]   # remove `CALL mcm_constants()` line
-    generic_rates, complex_reactions = convert_rates(rates_lines)
-
-    # Reaction definitions section
-    start_reactions = '#EQUATIONS'
-    end_reactions = ''   # file ends after list of reactions
-    reactions_lines = mechanism_section(contents, start_reactions, end_reactions)
-    reaction_definitions = convert_reactions(reactions_lines)
+    sections = {1: [], 2: [], 3: [], 4: []}
+    for section, item in parse_kpp(input_file):
+        sections[section].append(item)
 
     # Sections of the mechanism file converted to KPP format
-    return generic_rates, complex_reactions, peroxy_radicals, reaction_definitions
+    return sections[1], sections[2], sections[3], sections[4]
+
+# ------------------------------------------------------------ #
+
+def fac_lines(input_file):
+    """
+    Convert a .kpp file to FACSIMILE format, and return the lines of
+    the chemical mechanism one at a time, as they would be read from a
+    .fac file (without blank lines after the 'Generic Rate
+    Coefficients' header). The .kpp file is read in a single pass, and
+    no file is written (see the documentation of parse_kpp).
+
+    Args:
+        input_file (str): name of the .kpp file to convert
+
+    Yields:
+        line (str): line of the chemical mechanism in FACSIMILE format
+    """
+
+    headers = {1: '* Generic Rate Coefficients ;\n', 2: '* Complex reactions ;\n',
+               3: '* Peroxy radicals ;\n', 4: '* Reaction definitions ;\n'}
+    peroxy_radicals = []
+    current = 0
+    yield '\n'
+    for section, item in itertools.chain(parse_kpp(input_file), [(4, None)]):
+        while current < section:
+            current += 1
+            if current == 4:
+                yield 'RO2 = ' + ''.join(peroxy_radicals) + ';\n'
+            yield headers[current]
+        if section == 3:
+            peroxy_radicals.append(item)
+        elif item is not None:
+            yield item
 
 # ------------------------------------------------------------ #
 
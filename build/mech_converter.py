@@ -24,28 +24,89 @@
 # - mechanism.ro2
 # - mechanism.f90
 #
+# and, if the --shards option is used, the mechanism_shard_*.f90 files.
+#
 # Acknowledgements: B. Nelson, M. Newland, A. Mayhew
 #
 # ARGUMENTS:
 #   1. path to the mechanism .fac file
 #   2. path to the model configuration directory [default: model/configuration/]
 #   3. path to the MCM data files directory [default: mcm/]
+#
+# OPTIONS:
+#   --shards N   split the reaction rates into N Fortran files
+#                (mechanism_shard_*.f90), which can be compiled in parallel
+#   --cse        evaluate the subexpressions which appear in more than one
+#                reaction rate only once, and store them in the vector q
+#   --fold       evaluate the arithmetic between numeric literals in the
+#                rate expressions at conversion time
+#   --groups     split update_p into groups of rates with the same inputs
+#                (see rateGroups), which AtChem2 recomputes only when
+#                their inputs change
+#   --reorder    renumber the species to reduce the bandwidth of the
+#                Jacobian matrix (see species_ordering.py), and report
+#                the bandwidth
+#   --jacobian   write the analytic Jacobian matrix of the chemical
+#                mechanism to mechanism_jac.f90 (see mechanism_jacobian.py)
+#   --prune      remove the reactions which can never take place, starting
+#                from the species in the configuration files (see
+#                mechanism_pruning.py), and report the number of reactions
+#                and species removed
+#   --scenarios FILE
+#                with --prune, also start from the species in the
+#                configuration files of each scenario of FILE, the list of
+#                the scenarios passed to the --scenarios flag of atchem2
+#   --merge      merge the reactions with the same reactants and the same
+#                rate expression into one reaction, and write the numbers of
+#                the original reactions to mechanism.map
 # -------------------------------------------------------------------- #
 from __future__ import print_function
 import os
 import sys
 import re
+import argparse
+import glob
+import shutil
+import tempfile
+import contextlib
+from functools import lru_cache
 import fix_mechanism_fac
 import kpp_conversion
+import rate_expressions
+import species_ordering
+import mechanism_jacobian
+import mechanism_pruning
+
+reservedSpeciesList = {'N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC', 'JFAC',
+                       'DILUTE', 'ROOF', 'ASA', 'RO2'}
+reservedOtherList = {'EXP', 'LOG10', 'TEMP', 'PRESS', 'J', 't'}
+
+# Arguments of the update_p subroutine in mechanism.f90, and of the subroutines
+# of the mechanism shards.
+update_p_args = 'p, q, t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, RO2'
+update_p_in_args = 't, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2'
+
+# Groups of rates, in order of dependency: rates which depend on nothing
+# (constant), on the environment variables (env), on the photolysis rates
+# (j), and on the RO2 sum, the model time or the custom rate functions (ro2).
+# Each group may also depend on the previous groups.
+rateGroups = ['constant', 'env', 'j', 'ro2']
+envVariablesList = {'TEMP', 'PRESS', 'N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC',
+                    'JFAC', 'DILUTE', 'ROOF', 'ROOFOPEN', 'ASA'}
+
+# References to q (group 1) and names (group 2) in a Fortran rate expression.
+rate_inputs_regex = re.compile(r'\bq\((\d+)\)|\b([A-Za-z_]\w*)')
 
-reservedSpeciesList = ['N2', 'O2', 'M', 'RH', 'H2O', 'BLHEIGHT', 'DEC', 'JFAC',
-                       'DILUTE', 'ROOF', 'ASA', 'RO2']
-reservedOtherList = ['EXP', 'LOG10', 'TEMP', 'PRESS', 'J', 't']
+# Note at the top of the generated Fortran files.
+generated_note = '! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py\n'
+
+# Sections of symbols (group 1) and non-symbols (group 2) in a rate expression.
+token_regex = re.compile(r'([()\-+*@/, ]+)|([^()\-+*@/, ]+)')
 
 # =========================== FUNCTIONS =========================== #
 
 
-def tokenise_and_process(input_string, vars_dict):
+def tokenise_and_process(input_string, vars_dict, custom_functions=frozenset()):
     """
     This function takes in a single string, and a dictionary of known
     variables from previous lines, and returns the same string but
@@ -58,6 +119,9 @@ def tokenise_and_process(input_string, vars_dict):
                             of the return string (new_rhs)
         vars_dict (dict): a dictionary containing all the known
                               variables up to this point
+        custom_functions (set): names of the user-defined custom rate
+                                functions, which are carried through as-is
+                                (in a similar manner to LOG10)
 
     Returns:
         new_rhs (str): a string based on input_string, but with references
@@ -70,56 +134,27 @@ def tokenise_and_process(input_string, vars_dict):
     assert isinstance(vars_dict, dict), \
         'tokenise_and_process: vars_dict is not of type dict: ' + str(vars_dict)
 
-    # Generate start and end points of sections of symbols and nonsymbols
-    symbol_regex = r'[()\-+*@/, ]+'
-    nonsymbol_regex = r'[^()\-+*@/, ]+'
-
-    list_of_symbol_starts = [m.start(0) for m in re.finditer(symbol_regex, input_string)]
-    list_of_symbol_ends = [m.end(0) for m in re.finditer(symbol_regex, input_string)]
-    list_of_nonsymbol_starts = [m.start(0) for m in re.finditer(nonsymbol_regex, input_string)]
-    list_of_nonsymbol_ends = [m.end(0) for m in re.finditer(nonsymbol_regex, input_string)]
-    new_rhs = ''
-
-    # Now that the symbol/non-symbol sections are identified, we need to create
-    # the new string by recombining the other sections in the right order, with
-    # some replaced by q(i) syntax.
+    # Recombine the symbol/non-symbol sections in the right order, but replace
+    # the non-symbols that aren't numbers, reserved words or reserved species
+    # (and thus must be new species/intermediate values) with q(i) notation.
     #
-    # Recombine the lists in the right order, but replace the  non-symbols that
-    # aren't numbers, reserved words or reserved species (and thus must be new
-    # species/intermediate values) with q(i) notation.
-    #
-    # Loop while there are any substrings left.
-    while list_of_symbol_starts != [] or list_of_nonsymbol_starts != []:
-        # We should use the next symbol if:
-        #  1) both lists are non-empty and the symbols list has a lower first element, or
-        #  2) only the symbols list has anything left in it.
-        if ((list_of_symbol_starts != [] and list_of_nonsymbol_starts != []) \
-            and list_of_symbol_starts[0] < list_of_nonsymbol_starts[0]) \
-            or (list_of_symbol_starts != [] and list_of_nonsymbol_starts == []):
-            # Add next symbol. Print the substring as-is.
-            new_rhs += input_string[list_of_symbol_starts[0]:list_of_symbol_ends[0]]
-            # Remove the indices of this substring from the lists.
-            del list_of_symbol_starts[0]
-            del list_of_symbol_ends[0]
-        # Otherwise, if there are only non-symbols left, or if the non-symbols
-        # list has a lower first element.
+    # The sections are identified in a single pass by token_regex: for each
+    # match, group 2 is set if the section is a non-symbol.
+    new_rhs = []
+    for match in token_regex.finditer(input_string):
+        varname = match.group(2)
+        # If it's not a number or a reserved word, it must be a variable,
+        # so substitute with the relevant element from q.
+        if varname is not None and varname[0] not in '0123456789' \
+           and varname not in reservedSpeciesList and varname not in reservedOtherList \
+           and varname not in custom_functions:
+            new_rhs.append('q(' + str(vars_dict[varname]) + ')')
+        # Otherwise, just print the substring as-is.
         else:
-            # Add next non-symbol. Get the substring of interest.
-            varname = input_string[list_of_nonsymbol_starts[0]:list_of_nonsymbol_ends[0]]
-            # If it's not a number or a reserved word, it must be a variable,
-            # so substitute with the relevant element from q.
-            if not re.match(r'^[0-9]', varname) and varname not in reservedSpeciesList \
-               and varname not in reservedOtherList:
-                new_rhs += 'q(' + str(vars_dict[varname]) + ')'
-            # Otherwise, just print the substring as-is.
-            else:
-                new_rhs += input_string[list_of_nonsymbol_starts[0]:list_of_nonsymbol_ends[0]]
-            # Remove the indices of this substring from the lists.
-            del list_of_nonsymbol_starts[0]
-            del list_of_nonsymbol_ends[0]
+            new_rhs.append(match.group(0))
 
     # Return the reconstructed string.
-    return new_rhs
+    return ''.join(new_rhs)
 
 def separate_stoichiometry(input_species):
     """
@@ -149,7 +184,774 @@ def separate_stoichiometry(input_species):
                         format: '{input_species}'. Note that species names should
                         not begin with numerical characters.""")
 
-def convert_to_fortran(input_file, mech_dir, mcm_vers):
+def species_number(species_name, species_dict):
+    """
+    This function returns the ID number of a species, registering it as
+    a new species if it has not been seen before. Species are numbered
+    from 1 in the order in which they are first encountered.
+
+    Args:
+        species_name (str): name of the species
+        species_dict (dict): insertion-ordered dictionary mapping the names
+                             of the known species to their ID numbers
+
+    Returns:
+        number (int): ID number of the species
+    """
+
+    number = species_dict.get(species_name)
+    if number is None:
+        number = len(species_dict) + 1
+        species_dict[species_name] = number
+    return number
+
+@lru_cache(maxsize=None)
+def read_ro2_reference(ro2_file):
+    """
+    This function reads in a reference list of RO2 species from the MCM
+    (peroxy-radicals_v*). The list is only read once for each file, and
+    then cached for the subsequent conversions.
+
+    Args:
+        ro2_file (str): relative or absolute reference to the RO2 list file
+
+    Returns:
+        RO2List_reference (frozenset): names of the RO2 species in the list
+    """
+
+    with open(ro2_file, 'r') as RO2List_file:
+        return frozenset(r.rstrip() for r in RO2List_file)
+
+def mechanism_sections(mech_lines):
+    """
+    This function splits the lines of a chemical mechanism in FACSIMILE
+    format into the following sections:
+
+    0. everything up to 'Generic Rate Coefficients' (ignored)
+    1. 'Generic Rate Coefficients'
+    2. 'Complex reactions'
+    3. 'Peroxy radicals'
+    4. 'Reaction definitions'
+
+    The lines are consumed one at a time, so that the mechanism file
+    never needs to be held in memory.
+
+    Args:
+        mech_lines (iterable): lines of the chemical mechanism
+
+    Yields:
+        section (int): number of the section the line belongs to
+        line (str): line of the chemical mechanism
+    """
+
+    section_headers = ['Generic Rate Coefficients', 'Complex reactions',
+                       'Peroxy radicals', 'Reaction definitions']
+    section = 0
+    for line in mech_lines:
+        for header in section_headers:
+            if header in line:
+                section += 1
+        assert section <= 4, 'Error, section is not in [0,4]'
+        yield section, line
+
+def read_ro2_sum(line):
+    """
+    This function returns the names of the RO2 species in a line of the
+    'Peroxy radicals' section of a chemical mechanism.
+
+    Args:
+        line (str): line of the 'Peroxy radicals' section
+
+    Returns:
+        ro2_names (list): names of the RO2 species in the line
+    """
+
+    if re.match(r'\*', line):
+        return []
+    # We have an equals sign on the first line. Handle this by splitting against '=',
+    # then taking the last element of the resulting list, which will either be the
+    # right-hand side of the first line, or the whole of any other line. Similarly,
+    # the final line will end with a colon. Handle in a similar way. Then split
+    # by '+', and remove empty strings.
+    return [elem.strip() for elem in line.split('=')[-1].split(';')[0].strip().split('+') \
+            if elem.strip()]
+
+def fortran_rate_coefficient(line):
+    """
+    This function reformats a line of the sections 'Generic Rate
+    Coefficients' and 'Complex reactions' of a chemical mechanism to
+    Fortran syntax.
+
+    Args:
+        line (str): definition of a rate coefficient (e.g. 'KD0 = 1.0D-31*M ;')
+
+    Returns:
+        cleaned_line (str): the same definition in Fortran syntax
+    """
+
+    # Match anything like '@-dd.d' and replaces with '**(-dd.d)'.
+    # Use '(?<=@)' as a lookbehind assertion, then matches any combination
+    # of digits and decimal points. Replace the negative number by its
+    # bracketed version. Also convert all '@' to '**' etc...
+    line2 = re.sub(r'(?<=@)-[0-9.]*',
+                   r'(\g<0>)',
+                   line.replace(';', '').strip()
+                   ).replace('@', '**')
+    # Append `_DP` to the end of all digits that aren't followed
+    # by more digits or letters (targets a few too many).
+    line2 = re.sub(r'[0-9]+(?![a-zA-Z0-9\.])',
+                   r'\g<0>_DP',
+                   line2)
+    # Undo the suffix `_DP` for any species names and for LOG10.
+    line2 = re.sub(r'\b(?P<speciesnames>[a-zA-Z][a-zA-Z0-9]*)_DP',
+                   r'\g<speciesnames>',
+                   line2)
+    # Undo the suffix `_DP` for any numbers like 1D7 or 2.3D-8.
+    line2 = re.sub(r'\b(?P<doubles1>[0-9][0-9\.]*)[dDeE](?P<doubles2>[+-]*[0-9]+)_DP',
+                   r'\g<doubles1>e\g<doubles2>_DP',
+                   line2)
+    # Add .0 to any literals that don't have a decimal place. This is
+    # necessary as it seems you can't use extended precision on such a
+    # number -- gfortran complains about an unknown integer kind, when
+    # it should really be a real kind.
+    line2 = re.sub(r'(?<![\.0-9+-dDeE])(?P<doubles>[0-9]+)_DP',
+                   r'\g<doubles>.0_DP',
+                   line2)
+
+    # Strip whitespace, ';' and '%'.
+    return line2.strip().strip('%;').strip()
+
+def fortran_reaction_rate(rate):
+    """
+    This function reformats the rate of a reaction from the section
+    'Reaction definitions' of a chemical mechanism to Fortran syntax.
+
+    Args:
+        rate (str): rate of the reaction (e.g. '5.6D-34*N2*(TEMP/300)@-2.6*O2')
+
+    Returns:
+        string (str): the same rate in Fortran syntax
+    """
+
+    # Match anything like '@-dd.d' and replaces with '**(-dd.d)'.
+    # Use '(?<=@)' as a lookbehind assertion, then matches any combination
+    # of digits and decimal points. Replace the negative number by its
+    # bracketed version.
+    string = re.sub(r'(?<=@)-[0-9.]*', r'(\g<0>)', rate)
+    # Now convert all '@' to '**' etc...
+    string = string.replace('@', '**')
+    string = string.replace('<', '(')
+    string = string.replace('>', ')')
+    # Replace any float-type numbers (xxx.xxxE+xx)
+    # with a double-type number (xxx.xxxD+xx)
+    string = re.sub(r'(?P<single>[0-9]+\.[0-9]+)[eE]',
+                    r'\g<single>D',
+                    string)
+    return string
+
+def read_dilute(mech_dir):
+    """
+    This function checks the DILUTE environment variable to identify
+    whether dilution should be applied.
+
+    Args:
+        mech_dir (str): directory containing environmentVariables.config
+
+    Returns:
+        dilute (str or bool): value of DILUTE, or False if it is NOTUSED
+    """
+
+    dilute = False
+    with open(mech_dir + '/environmentVariables.config') as env_var_file:
+        for x in env_var_file:
+            x = x.split()
+            try:
+                if x[1] == 'DILUTE' and x[2] != 'NOTUSED':
+                    dilute = x[2]
+            except IndexError:
+                continue
+    return dilute
+
+def read_custom_functions(mech_dir):
+    """
+    This function reads in the names of the user-defined custom rate
+    functions, so that they can be carried through the rate definitions
+    (in a similar manner to LOG10).
+
+    Args:
+        mech_dir (str): directory containing customRateFuncs.f90
+
+    Returns:
+        custom_func_names (list): names of the custom rate functions
+    """
+
+    with open(mech_dir + '/customRateFuncs.f90') as custom_func_file:
+        func_def_pat = r'function +([a-zA-Z0-9_]*) *\('
+        return re.findall(func_def_pat, custom_func_file.read(), re.I)
+
+def is_reaction_line(line):
+    """
+    This function checks whether a line of the 'Reaction definitions'
+    section of a chemical mechanism is a reaction, rather than a comment
+    (beginning with '!', ';' or '*') or a blank line.
+
+    Args:
+        line (str): line of the 'Reaction definitions' section
+
+    Returns:
+        is_reaction (bool): True if the line is a reaction
+    """
+
+    return re.match(r'[!;*]', line) is None and not line.isspace()
+
+def reaction_stoichiometry(line):
+    """
+    This function returns the reactants and the products of a reaction
+    of the 'Reaction definitions' section of a chemical mechanism, with
+    their stoichiometric coefficients.
+
+    Args:
+        line (str): reaction, e.g. '% J<4> : O3 = O1D ;'
+
+    Returns:
+        reactants (dict): name -> stoichiometric coefficient of the reactants
+        products (dict): name -> stoichiometric coefficient of the products
+    """
+
+    [_, rhs] = re.split(r':', line.strip().strip('%;').strip())
+    sides = []
+    for side in re.split(r'=', rhs):
+        species = {}
+        if side.strip():
+            for x in re.split(r'[+]', side):
+                x_coeff, x_name = separate_stoichiometry(x.strip())
+                species[x_name] = species.get(x_name, 0.0) + x_coeff
+        sides.append(species)
+    return tuple(sides)
+
+def mechanism_lines(input_file):
+    """
+    This function returns the lines of a chemical mechanism in FACSIMILE
+    format, one at a time. A chemical mechanism in KPP format is
+    converted to FACSIMILE format while it is read, without writing a
+    .fac file (see the documentation of `kpp_conversion.py`). The errant
+    newlines of a .fac file are fixed while it is read, without
+    modifying the file (see the documentation of `fix_mechanism_fac.py`).
+
+    Args:
+        input_file (str): relative or absolute reference to the .fac or .kpp file
+
+    Yields:
+        line (str): line of the chemical mechanism in FACSIMILE format
+    """
+
+    if input_file.split('.')[-1] == 'kpp':
+        yield from kpp_conversion.fac_lines(input_file)
+    else:
+        with open(input_file, 'r') as input_mech:
+            yield from fix_mechanism_fac.fix_fac_lines(input_mech, input_file)
+
+def read_mechanism_reactions(input_fac):
+    """
+    This function reads the reactions and the RO2 sum of a chemical
+    mechanism in FACSIMILE format.
+
+    Args:
+        input_fac (str): relative or absolute reference to the .fac or .kpp file
+
+    Returns:
+        reactions (list): (reactants, products) of each reaction, as returned
+                          by reaction_stoichiometry
+        ro2List (list): names of the RO2 species in the RO2 sum
+        reaction_lines (list): line of each reaction
+    """
+
+    reactions = []
+    ro2List = []
+    reaction_lines = []
+    for section, line in mechanism_sections(mechanism_lines(input_fac)):
+        if section == 3:
+            ro2List.extend(read_ro2_sum(line))
+        elif section == 4 and is_reaction_line(line):
+            reactions.append(reaction_stoichiometry(line))
+            reaction_lines.append(line)
+    return reactions, ro2List, reaction_lines
+
+def write_selected_reactions(input_fac, keep, ro2List, removed_species, out_file,
+                             replacements=None):
+    """
+    This function writes a chemical mechanism in FACSIMILE format with
+    only some of its reactions, some of which may be replaced by other
+    lines. The RO2 sum in section 'Peroxy radicals'
+    is written on one line, without the removed species. The RO2
+    species which are not in the mechanism at all are kept in the RO2
+    sum, so that they are reported as errors by the conversion.
+
+    Args:
+        input_fac (str): relative or absolute reference to the .fac or .kpp file
+        keep (list): True for each reaction to write
+        ro2List (list): names of the RO2 species in the RO2 sum
+        removed_species (set): names of the species which are only in the
+                               reactions which are not written
+        out_file (file): file to write the chemical mechanism to
+        replacements (dict): reaction index (from 0) -> line written instead
+                             of the reaction
+    """
+
+    ro2_written = False
+    reactionNumber = 0
+    for section, line in mechanism_sections(mechanism_lines(input_fac)):
+        if section == 3 and (read_ro2_sum(line) or '=' in line):
+            if not ro2_written:
+                out_file.write('RO2 = ' + ' + '.join(
+                    x for x in ro2List if x not in removed_species) + ' ;\n')
+                ro2_written = True
+            continue
+        if section == 4 and is_reaction_line(line):
+            reactionNumber += 1
+            if not keep[reactionNumber - 1]:
+                continue
+            if replacements and reactionNumber - 1 in replacements:
+                line = replacements[reactionNumber - 1]
+        out_file.write(line)
+
+def removed_species(reactions, keep):
+    """
+    This function finds the species which are only in the reactions
+    removed from a chemical mechanism.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction
+        keep (list): True for each reaction which is kept
+
+    Returns:
+        removed (set): names of the removed species
+        number_of_species (int): number of species in all the reactions
+    """
+
+    all_species = set()
+    kept_species = set()
+    for k, (reactants, products) in enumerate(reactions):
+        all_species.update(reactants, products)
+        if keep[k]:
+            kept_species.update(reactants, products)
+    return all_species - kept_species, len(all_species)
+
+def stoichiometry_string(species):
+    """
+    This function writes the reactants or the products of a reaction,
+    with their stoichiometric coefficients, as in a chemical mechanism
+    in FACSIMILE format.
+
+    Args:
+        species (dict): name -> stoichiometric coefficient
+
+    Returns:
+        string (str): e.g. 'HO2 + 0.5 HCHO'
+    """
+
+    terms = []
+    for x, coeff in species.items():
+        if coeff == 1.0:
+            terms.append(x)
+        else:
+            terms.append(('%.15f' % coeff).rstrip('0').rstrip('.') + ' ' + x)
+    return ' + '.join(terms)
+
+def merge_duplicate_reactions(reactions, reaction_lines, keep):
+    """
+    This function merges the kept reactions of a chemical mechanism
+    which have the same reactants (with the same stoichiometric
+    coefficients) and the same rate expression (ignoring whitespace).
+    The n reactions of each group are replaced by one reaction, at the
+    place of the first one, with n times the rate expression and the
+    sum of the stoichiometric coefficients of the products divided by
+    n. The loss of the reactants and the production of the products
+    are the same as with the separate reactions.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, as returned
+                          by reaction_stoichiometry
+        reaction_lines (list): line of each reaction
+        keep (list): True for each reaction to keep, updated in place (the
+                     merged reactions, except the first, are not kept)
+
+    Returns:
+        replacements (dict): reaction index (from 0) of the first reaction of
+                             each group -> line of the merged reaction
+        merged (dict): reaction index (from 0) of each merged reaction ->
+                       reaction index of the first reaction of its group
+    """
+
+    groups = {}
+    for k, (reactants, _) in enumerate(reactions):
+        if keep[k]:
+            rate = re.split(r':', reaction_lines[k].strip().strip('%;').strip())[0]
+            groups.setdefault((re.sub(r'\s', '', rate), tuple(sorted(reactants.items()))), []).append(k)
+
+    replacements = {}
+    merged = {}
+    for members in groups.values():
+        if len(members) == 1:
+            continue
+        first = members[0]
+        products = {}
+        for k in members:
+            for x, coeff in reactions[k][1].items():
+                products[x] = products.get(x, 0.0) + coeff
+            merged[k] = first
+            keep[k] = k == first
+        [rate, rhs] = re.split(r':', reaction_lines[first].strip().strip('%;').strip())
+        replacements[first] = '% (' + rate.strip() + ')*' + str(len(members)) + ' : ' \
+            + re.split(r'=', rhs)[0].strip() + ' = ' \
+            + stoichiometry_string({x: coeff / len(members) for x, coeff in products.items()}) + ' ;\n'
+    return replacements, merged
+
+def write_reaction_map(map_file, keep, merged, reaction_lines):
+    """
+    This function writes the number of each reaction of a chemical
+    mechanism in the converted mechanism, to trace the reaction rates
+    of the converted mechanism back to the original reactions. Each
+    line has the number of a reaction in the original mechanism, its
+    number in the converted mechanism (0 if the reaction has been
+    removed) and the original reaction.
+
+    Args:
+        map_file (file): mechanism.map, open for writing
+        keep (list): True for each reaction which is written to the
+                     converted mechanism
+        merged (dict): reaction index (from 0) of each merged reaction ->
+                       reaction index of the first reaction of its group
+        reaction_lines (list): line of each reaction
+    """
+
+    new_number = {}
+    for k, kept in enumerate(keep):
+        if kept:
+            new_number[k] = len(new_number) + 1
+    map_file.write(generated_note.replace('!', '#', 1))
+    for k, line in enumerate(reaction_lines):
+        map_file.write(str(k + 1) + ' ' + str(new_number.get(merged.get(k, k), 0))
+                       + ' !' + line.strip() + '\n')
+
+def filter_mechanism(input_fac, mech_dir, prune=False, merge=False, scenarios=None):
+    """
+    This function removes from a chemical mechanism the reactions which
+    can never take place in a model run (prune), starting from the
+    species which have a concentration at the start of the model run
+    (see the documentation of `mechanism_pruning.py`), and merges the
+    duplicate reactions (merge, see merge_duplicate_reactions). The
+    species which are only in the removed reactions are removed from
+    the RO2 sum in section 'Peroxy radicals', which is written on one
+    line. With merge, the numbers of the reactions in the converted
+    mechanism go to mechanism.map (see write_reaction_map).
+
+    Args:
+        input_fac (str): relative or absolute reference to the .fac or .kpp file
+        mech_dir (str): directory containing the configuration files
+        prune (bool): if True, remove the reactions which can never take place
+        merge (bool): if True, merge the duplicate reactions
+        scenarios (str): path to the list of the scenarios, whose configuration
+                         files are used by prune too, or None
+
+    Returns:
+        filtered_mech (file): temporary file with the filtered chemical mechanism,
+                              open for reading
+    """
+
+    reactions, ro2List, reaction_lines = read_mechanism_reactions(input_fac)
+    if prune:
+        scenario_dirs = mechanism_pruning.scenario_directories(scenarios) if scenarios else []
+        keep = mechanism_pruning.pruned_reactions([(set(r), set(p)) for r, p in reactions],
+                                                  mechanism_pruning.seed_species(mech_dir, scenario_dirs),
+                                                  mechanism_pruning.required_species(mech_dir, scenario_dirs))
+        removed, numberOfSpecies = removed_species(reactions, keep)
+        print('Pruning: ' + str(keep.count(False)) + ' of ' + str(len(reactions)) + ' reactions and '
+              + str(len(removed)) + ' of ' + str(numberOfSpecies) + ' species removed')
+    else:
+        keep = [True] * len(reactions)
+        removed = set()
+
+    replacements = {}
+    if merge:
+        replacements, merged = merge_duplicate_reactions(reactions, reaction_lines, keep)
+        print('Merging: ' + str(len(merged)) + ' reactions merged into ' + str(len(replacements)))
+        with open(os.path.join(mech_dir, 'mechanism.map'), 'w') as map_file:
+            write_reaction_map(map_file, keep, merged, reaction_lines)
+
+    filtered_mech = tempfile.TemporaryFile('w+')
+    write_selected_reactions(input_fac, keep, ro2List, removed, filtered_mech, replacements)
+    filtered_mech.seek(0)
+    return filtered_mech
+
+def rate_group(expression, q_groups):
+    """
+    This function finds the group of a rate (see rateGroups) from the
+    inputs of its Fortran expression: the last group of any of the
+    variables, photolysis rates and elements of q it depends on.
+
+    Args:
+        expression (str): rate expression in Fortran syntax, with the
+                          rate coefficients as elements of q
+        q_groups (dict): group of each of the elements of q defined so far
+
+    Returns:
+        group (int): index of the group in rateGroups
+    """
+
+    group = 0
+    for match in rate_inputs_regex.finditer(expression):
+        if match.group(1) is not None:
+            group = max(group, q_groups[int(match.group(1))])
+        elif match.group(2) in ('EXP', 'LOG10'):
+            continue
+        elif match.group(2) in envVariablesList:
+            group = max(group, 1)
+        elif match.group(2) == 'J':
+            group = max(group, 2)
+        # RO2, t, custom rate functions and any other name.
+        else:
+            group = 3
+    return group
+
+def write_mechanism_header(mech_rates_file, ro2List, RO2List_reference,
+                           mechanism_rates_coeff_list, shards=0):
+    """
+    This function writes the first part of mechanism.f90, up to the
+    'Reaction definitions': the warnings about the RO2 species, the
+    head of the update_p subroutine and the Fortran lines of sections
+    'Generic Rate Coefficients' and 'Complex reactions'.
+
+    Args:
+        mech_rates_file (file): mechanism.f90, open for writing
+        ro2List (list): RO2 species from the RO2 sum
+        RO2List_reference (frozenset): reference list of RO2 species from the MCM
+        mechanism_rates_coeff_list (list): Fortran lines of the rate coefficients
+        shards (int): number of mechanism shards used by update_p
+    """
+
+    # Check that each of the RO2s from 'Peroxy radicals' are present
+    # in the RO2 reference list from the MCM. If not, print a warning
+    # at the top of mechanism.f90 for each errant species.
+    print('Looping over inputted RO2s')
+    for ro2_species in [element for element in ro2List if element not in RO2List_reference]:
+        print('\n\t!!! WARNING !!!')
+        print('  The following species are not present in the RO2 reference list:\n    ' + ro2_species)
+        print('  Should they be included in the RO2 sum?\n')
+        mech_rates_file.write('! ' + ro2_species + ' is not in the RO2 reference list for this version of the MCM\n')
+
+    mech_rates_file.write("""
+module mechanism_mod
+    use, intrinsic :: iso_c_binding
+    implicit none
+
+contains
+
+    subroutine update_p(""" + update_p_args + """) bind(c,name='update_p')
+
+        use custom_functions_mod
+""" + ''.join('        use mechanism_shard_' + str(k) + '_mod\n' for k in range(1, shards + 1)) \
+        + """        integer, parameter :: DP = selected_real_kind( p = 15, r = 307 )
+        real(c_double), intent(inout) :: p(*), q(*)
+        real(c_double), intent(in) :: """ + update_p_in_args + """
+        """)
+
+    # Write out 'Generic Rate Coefficients' and 'Complex reactions'.
+    for item in mechanism_rates_coeff_list:
+        mech_rates_file.write(item)
+
+def open_mechanism_shards(mech_dir, shards, groups=False):
+    """
+    This function creates the files of the mechanism shards
+    (mechanism_shard_*.f90), and writes the head of each of them. Each
+    shard is a Fortran module with a subroutine which calculates a
+    subset of the reaction rates (vector p). The shards are called by
+    the update_p subroutine in mechanism.f90, and can be compiled in
+    parallel. Shards left over from a previous conversion are removed.
+
+    If the rates are grouped, only the head of the module is written:
+    the subroutines of the groups are written by write_rate_groups().
+
+    Args:
+        mech_dir (str): directory where the mechanism.* files are created
+        shards (int): number of mechanism shards
+        groups (bool): True if the rates are grouped
+
+    Returns:
+        shard_files (list): files of the mechanism shards, open for writing
+    """
+
+    for old_shard in glob.glob(os.path.join(mech_dir, 'mechanism_shard_*')):
+        os.remove(old_shard)
+
+    shard_files = []
+    for k in range(1, shards + 1):
+        shard_file = open(os.path.join(mech_dir, 'mechanism_shard_' + str(k) + '.f90'), 'w')
+        shard_file.write(generated_note)
+        shard_file.write("""
+module mechanism_shard_""" + str(k) + """_mod
+    use, intrinsic :: iso_c_binding
+    implicit none
+
+contains
+""")
+        if not groups:
+            shard_file.write(shard_head('update_p_shard_' + str(k)))
+        shard_files.append(shard_file)
+    return shard_files
+
+def shard_head(name):
+    """
+    This function returns the head of a subroutine of a mechanism shard.
+
+    Args:
+        name (str): name of the subroutine
+
+    Returns:
+        head (str): head of the subroutine, in Fortran
+    """
+
+    return """
+    subroutine """ + name + """(""" + update_p_args + """)
+
+        use custom_functions_mod
+        integer, parameter :: DP = selected_real_kind( p = 15, r = 307 )
+        real(c_double), intent(inout) :: p(*)
+        real(c_double), intent(in) :: q(*), """ + update_p_in_args + """
+"""
+
+def shard_calls(names):
+    """
+    This function returns the calls to the subroutines of the mechanism
+    shards. The shards calculate different reaction rates, so each call
+    is an OpenMP section, run in parallel if AtChem2 is compiled with
+    OpenMP (otherwise the OpenMP directives are comments).
+
+    Args:
+        names (list): names of the subroutines of the shards
+
+    Returns:
+        calls (str): calls to the subroutines, in Fortran
+    """
+
+    return '!$omp parallel sections\n' \
+        + ''.join('!$omp section\ncall ' + name + '(' + update_p_args + ')\n' for name in names) \
+        + '!$omp end parallel sections\n'
+
+def close_mechanism_shards(mech_rates_file, shard_files):
+    """
+    This function writes the end of each of the mechanism shards
+    (mechanism_shard_*.f90) and closes them, then writes the calls to
+    the subroutines of the shards in update_p.
+
+    Args:
+        mech_rates_file (file): mechanism.f90, open for writing
+        shard_files (list): files of the mechanism shards, open for writing
+    """
+
+    for k, shard_file in enumerate(shard_files, 1):
+        shard_file.write("""
+    end subroutine update_p_shard_""" + str(k) + """
+end module mechanism_shard_""" + str(k) + """_mod
+""")
+        shard_file.close()
+    if shard_files:
+        mech_rates_file.write(shard_calls(['update_p_shard_' + str(k) for k in range(1, len(shard_files) + 1)]))
+
+def write_rate_groups(mech_rates_file, shard_files, mechanism_rates_coeff_list, q_groups,
+                      rate_items, dilute_lines, shards):
+    """
+    This function writes the rates of mechanism.f90 (and of the
+    mechanism shards, if any) split into groups, one subroutine per
+    group (see rateGroups): update_p_constant, update_p_env, update_p_j
+    and update_p_ro2. AtChem2 calls the subroutine of a group only
+    when the inputs of the group have changed since the previous call;
+    update_p calls all the groups. Comment lines go to the same group
+    as the next rate.
+
+    The head of mechanism.f90 and of the update_p subroutine must
+    already be written. This function writes the rest of mechanism.f90.
+
+    Args:
+        mech_rates_file (file): mechanism.f90, open for writing
+        shard_files (list): files of the mechanism shards, open for writing
+        mechanism_rates_coeff_list (list): Fortran lines of the rate coefficients
+        q_groups (dict): group of each element of q
+        rate_items (list): lines of the reaction rates, as tuples (file index,
+                           group or None for comments, line)
+        dilute_lines (list): Fortran lines of the dilution reactions
+        shards (int): number of mechanism shards
+    """
+
+    # Split the rate coefficients and the reaction rates into groups.
+    coeff_groups = [[] for _ in rateGroups]
+    comments = []
+    for item in mechanism_rates_coeff_list:
+        match = re.match(r'q\((\d+)\)', item)
+        if match is None:
+            comments.append(item)
+        else:
+            coeff_groups[q_groups[int(match.group(1))]].extend(comments + [item])
+            comments = []
+    coeff_groups[-1].extend(comments)
+
+    rates_by_group = [[[] for _ in rateGroups] for _ in range(max(shards, 1))]
+    comments = []
+    for file_index, group, line in rate_items:
+        if group is None:
+            comments.append(line)
+        else:
+            rates_by_group[file_index][group].extend(comments + [line])
+            comments = []
+    rates_by_group[-1][-1].extend(comments)
+    # The dilution reactions depend on DILUTE. With shards, they are calculated
+    # in mechanism.f90, after the calls to the shards.
+    if not shards:
+        rates_by_group[0][1].extend(dilute_lines)
+
+    for name in rateGroups:
+        mech_rates_file.write('call update_p_' + name + '(' + update_p_args + ')\n')
+    mech_rates_file.write("""
+    end subroutine update_p
+""")
+
+    for group, name in enumerate(rateGroups):
+        mech_rates_file.write("""
+    subroutine update_p_""" + name + """(""" + update_p_args + """) bind(c,name='update_p_""" + name + """')
+
+        use custom_functions_mod
+""" + ''.join('        use mechanism_shard_' + str(k) + '_mod\n' for k in range(1, shards + 1)) \
+            + """        integer, parameter :: DP = selected_real_kind( p = 15, r = 307 )
+        real(c_double), intent(inout) :: p(*), q(*)
+        real(c_double), intent(in) :: """ + update_p_in_args + """
+""")
+        mech_rates_file.writelines(coeff_groups[group])
+        if shards:
+            for k, shard_file in enumerate(shard_files, 1):
+                shard_name = 'update_p_shard_' + str(k) + '_' + name
+                shard_file.write(shard_head(shard_name))
+                shard_file.writelines(rates_by_group[k - 1][group])
+                shard_file.write("""
+    end subroutine """ + shard_name + """
+""")
+            mech_rates_file.write(shard_calls(['update_p_shard_' + str(k) + '_' + name
+                                               for k in range(1, shards + 1)]))
+            if group == 1:
+                mech_rates_file.writelines(dilute_lines)
+        else:
+            mech_rates_file.writelines(rates_by_group[0][group])
+        mech_rates_file.write("""
+    end subroutine update_p_""" + name + """
+""")
+
+    mech_rates_file.write('end module mechanism_mod\n')
+    for k, shard_file in enumerate(shard_files, 1):
+        shard_file.write('end module mechanism_shard_' + str(k) + '_mod\n')
+        shard_file.close()
+
+def convert_to_fortran(input_file, mech_dir, mcm_vers, shards=0, cse=False, fold=False,
+                       groups=False, reorder=False, jacobian=False, prune=False,
+                       merge=False, scenarios=None):
     """
     This function converts a chemical mechanism file into the
     Fortran-compatible format used by the AtChem2 ODE solver. The
@@ -183,6 +985,59 @@ def convert_to_fortran(input_file, mech_dir, mcm_vers):
     * The ID numbers and names of all RO2 species in section 'Peroxy
       radicals' go to the mechanism.ro2 file.
 
+    Optionally, the reaction rates can be split across several Fortran
+    files (mechanism_shard_*.f90), which can be compiled in parallel
+    (see the documentation of open_mechanism_shards).
+
+    Optionally, the operations between numeric literals in the rate
+    coefficients and in the reaction rates (e.g. '1.0D-11*0.5') are
+    evaluated at conversion time, and the double precision literals
+    are written in a canonical form (e.g. '5.0e-12_DP').
+
+    Optionally, the subexpressions which appear in more than one
+    reaction rate (e.g. 'q(12)*0.917' or '2.7D-12*EXP(360/TEMP)') are
+    evaluated only once per call to update_p: they are assigned to
+    additional elements of vector q, after the rate coefficients, and
+    replaced by these elements in the reaction rates (see the
+    documentation of `rate_expressions.py`).
+
+    Optionally, the rates are split into groups which depend on the
+    same inputs (see the documentation of write_rate_groups), so that
+    AtChem2 only recomputes the rates whose inputs have changed.
+
+    Optionally, the species are renumbered so that the nonzero elements
+    of the Jacobian matrix are close to the diagonal, and the bandwidth
+    of the Jacobian matrix is reported, to set the bandwidth of the
+    banded preconditioner in solver.parameters (see the documentation
+    of `species_ordering.py`).
+
+    Optionally, the nonzero elements of the Jacobian matrix of the
+    chemical mechanism go to the mechanism_jac.f90 file, in compressed
+    sparse row format (see the documentation of `mechanism_jacobian.py`).
+    A mechanism_jac.f90 file left over from a previous conversion is
+    removed.
+
+    Optionally, the reactions which can never take place in a model run
+    are removed, starting from the species in initialConcentrations.config,
+    speciesConstrained.config and speciesConstant.config (see the
+    documentation of `mechanism_pruning.py` and of filter_mechanism). The
+    remaining species and reactions are numbered as in a chemical
+    mechanism without the removed reactions.
+
+    Optionally, the reactions with the same reactants and the same rate
+    expression are merged into one reaction (see the documentation of
+    merge_duplicate_reactions), and the number of each reaction of the
+    chemical mechanism in the converted mechanism goes to the
+    mechanism.map file. A mechanism.map file left over from a previous
+    conversion is removed.
+
+    The chemical mechanism is read one line at a time, and the
+    reactions are written to the mechanism.* files as they are
+    processed, so that the memory used by the conversion depends on
+    the number of species and rate coefficients, but not on the size
+    of the mechanism file. The reaction rates are kept in memory only
+    if the common subexpressions are eliminated or the rates are grouped.
+
     Args:
         input_file (str): relative or absolute reference to the .fac file
         mech_dir (str): relative or absolute reference to the directory where
@@ -192,6 +1047,18 @@ def convert_to_fortran(input_file, mech_dir, mcm_vers):
         mcm_vers (str): relative or absolute reference to the directory containing
                         the reference list of RO2 species (peroxy-radicals_v*)
                         By default it is: mcm/
+        shards (int): number of mechanism shards to split the reaction rates into.
+                      By default it is 0 (the reaction rates are all in mechanism.f90)
+        cse (bool): if True, eliminate the common subexpressions of the reaction rates
+        fold (bool): if True, fold the constants in the rate coefficients and reaction rates
+        groups (bool): if True, split the rates into groups with the same inputs
+        reorder (bool): if True, renumber the species to reduce the bandwidth of
+                        the Jacobian matrix
+        jacobian (bool): if True, write the analytic Jacobian matrix to mechanism_jac.f90
+        prune (bool): if True, remove the reactions which can never take place
+        merge (bool): if True, merge the duplicate reactions
+        scenarios (str): with prune, path to the list of the scenarios, whose
+                         configuration files are used too, or None
     """
 
     # Get the directory and filename of input_file, and check that they exist.
@@ -203,66 +1070,15 @@ def convert_to_fortran(input_file, mech_dir, mcm_vers):
         'The input file ' + str(input_path) + ' does not exist.'
     print('Chemical mechanism file in:', input_directory)
 
-    # Check if the chemical mechanism file is in KPP format, in which case convert it
-    # to FACSIMILE format (see documentation of `kpp_conversion.py` for more info)
-    if input_filename.split('.')[-1] == 'kpp':
-        input_fac = kpp_conversion.write_fac_file(input_path)
-    else:
-        input_fac = input_path
-
-    # Check and fix the .fac file of any errant newlines (see documentation
-    # of `fix_mechanism_fac.py` for more info).
-    fix_mechanism_fac.fix_fac_full_file(input_fac)
-
-    # Read in the input file.
-    print('Reading input file')
-    with open(input_fac, 'r') as input_mech:
-        mechList = input_mech.readlines()
-
-    # Split the lines into the following sections:
-    # - Ignore everything up to Generic Rate Coefficients
-    # - Generic Rate Coefficients
-    # - Complex reactions
-    # - Peroxy radicals
-    # - Reaction definitions
-    section_headers_indices = [0, 1, 2, 3]
-    section_headers = ['Generic Rate Coefficients', 'Complex reactions',
-                       'Peroxy radicals', 'Reaction definitions']
-    generic_rate_coefficients = []
-    complex_reactions = []
-    peroxy_radicals = []
-    reaction_definitions = []
-
-    section = 0
-    for line in mechList:
-        for header_index in section_headers_indices:
-            if section_headers[header_index] in line:
-                section += 1
-        if section == 1:
-            generic_rate_coefficients.append(line)
-        elif section == 2:
-            complex_reactions.append(line)
-        elif section == 3:
-            peroxy_radicals.append(line)
-        elif section == 4:
-            reaction_definitions.append(line)
-        else:
-            assert section == 0, 'Error, section is not in [0,4]'
-
-    # Convert peroxy_radicals to a list of strings, with each of the RO2 species from the RO2 sum
-    # in the 'Peroxy radicals' section.
-    ro2List = []
-    for item in peroxy_radicals:
-        if not re.match(r'\*', item):
-            # We have an equals sign on the first line. Handle this by splitting against '=',
-            # then taking the last element of the resulting list, which will either be the
-            # right-hand side of the first line, or the whole of any other line. Similarly,
-            # the final line will end with a colon. Handle in a similar way. Then split
-            # by '+'. Append each item to ro2_input: multiple appends use 'extend'.
-            ro2List.extend([elem.strip() for elem in \
-                            item.split('=')[-1].split(';')[0].strip().split('+')])
-    # Remove empty strings.
-    ro2List = list(filter(None, ro2List))
+    # A chemical mechanism file in KPP format is converted to FACSIMILE format
+    # while it is read (see documentation of `kpp_conversion.py` for more info).
+    # Otherwise, the .fac file is checked and fixed of any errant newlines while
+    # it is read (see documentation of `fix_mechanism_fac.py` for more info). The
+    # whole .fac file is checked first, so that no output is written if it is too
+    # broken to be fixed.
+    input_fac = input_path
+    if input_filename.split('.')[-1] != 'kpp':
+        fix_mechanism_fac.check_fac_file(input_fac)
 
     # Read in the reference list of RO2 species from the MCM (peroxy-radicals_v*).
     #
@@ -271,312 +1087,292 @@ def convert_to_fortran(input_file, mech_dir, mcm_vers):
     # - change the filename if using a version of the MCM other than the default (v3.3.1)
     #
     # TODO: implement a different way to set the mcm version (see issue #297)
-    with open(os.path.join(mcm_vers, 'peroxy-radicals_v3.3.1'), 'r') as RO2List_file:
-        RO2List_reference = [r.rstrip() for r in RO2List_file.readlines()]
-
-    # Check that each of the RO2s from 'Peroxy radicals' are present
-    # in the RO2 reference list from the MCM. If not, print a warning
-    # at the top of mechanism.f90 for each errant species.
-    print('Looping over inputted RO2s')
-
-    with open(os.path.join(mech_dir, 'mechanism.f90'), 'w') as mech_rates_file:
-        mech_rates_file.write('! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py\n')
-
-        for ro2_species in [element for  element in ro2List if element not in RO2List_reference]:
-            print('\n\t!!! WARNING !!!')
-            print('  The following species are not present in the RO2 reference list:\n    ' + ro2_species)
-            print('  Should they be included in the RO2 sum?\n')
-            mech_rates_file.write('! ' + ro2_species + ' is not in the RO2 reference list for this version of the MCM\n')
+    RO2List_reference = read_ro2_reference(os.path.abspath(os.path.join(mcm_vers,
+                                                                        'peroxy-radicals_v3.3.1')))
 
     # Check the DILUTE environment variable to identify whether dilution should be applied.
-    dilute = False
-    with open(mech_dir + '/environmentVariables.config') as env_var_file:
-        environmentVariables = env_var_file.readlines()
-        for x in environmentVariables:
-            x = x.split()
-            try:
-                if x[1] == 'DILUTE' and x[2] != 'NOTUSED':
-                    dilute = x[2]
-            except IndexError:
-                continue
-
-    # -------------------------------------------------
-    # Read in the names of user-defined custom rate functions and add them
-    # to the list of reserved names so that they will be carried through the
-    # rate definitions (in a similar manner to LOG10)
-    with open(mech_dir + '/customRateFuncs.f90') as custom_func_file:
-        func_def_pat = r'function +([a-zA-Z0-9_]*) *\('
-        custom_func_names = re.findall(func_def_pat, custom_func_file.read(), re.I)
-
-        for n in custom_func_names:
-            reservedOtherList.append(n)
-
-    # Initialise list, dictionary and a counter.
+    dilute = read_dilute(mech_dir)
+
+    # Read in the names of user-defined custom rate functions, so that they will
+    # be carried through the rate definitions (in a similar manner to LOG10).
+    # They are not added to reservedOtherList, so that they do not leak into
+    # the next conversions in the same process.
+    custom_functions = frozenset(read_custom_functions(mech_dir))
+
+    # Initialise lists, dictionaries and counters:
+    # - mechanism_rates_coeff_list holds the Fortran lines of the sections
+    #   'Generic Rate Coefficients' and 'Complex reactions'.
+    # - variablesDict maps the name of each rate coefficient to its element of q.
+    # - ro2List holds the RO2 species from the RO2 sum in 'Peroxy radicals'.
+    # - speciesDict maps the name of each species to its ID number; the ID numbers
+    #   are assigned in order of appearance, and may be changed at the end (reorder).
     mechanism_rates_coeff_list = []
     variablesDict = {}
+    ro2List = []
+    speciesDict = {}
+    numberOfGenericComplex = 0
     reactionNumber = 0
-
-    # Process sections 1 and 2 ('Generic Rate Coefficients', 'Complex reactions'):
-    # - copy comment lines across.
-    # - other lines are reformatted to Fortran syntax, then their contents edited
-    #   to convert individual rate names to elements in a vector q.
-    for line in generic_rate_coefficients + complex_reactions:
-
-        # Check for comments (beginning with a '!'), or blank lines.
-        if (re.match(r'!', line) is not None) or (line.isspace()):
-            mechanism_rates_coeff_list.append(line)
-        # Check for lines starting with either ';' or '*', and write these as comments.
-        elif (re.match(r';', line) is not None) or (re.match(r'[*]', line) is not None):
-            mechanism_rates_coeff_list.append('!' + line)
-        # Otherwise assume all remaining lines are in the correct format, and process them.
-        else:
-            reactionNumber += 1   # keep track of the line we are processing
-
-            # Match anything like '@-dd.d' and replaces with '**(-dd.d)'.
-            # Use '(?<=@)' as a lookbehind assertion, then matches any combination
-            # of digits and decimal points. Replace the negative number by its
-            # bracketed version. Also convert all '@' to '**' etc...
-            line2 = re.sub(r'(?<=@)-[0-9.]*',
-                           r'(\g<0>)',
-                           line.replace(';', '').strip()
-                           ).replace('@', '**')
-            # Append `_DP` to the end of all digits that aren't followed
-            # by more digits or letters (targets a few too many).
-            line2 = re.sub(r'[0-9]+(?![a-zA-Z0-9\.])',
-                           r'\g<0>_DP',
-                           line2)
-            # Undo the suffix `_DP` for any species names and for LOG10.
-            line2 = re.sub(r'\b(?P<speciesnames>[a-zA-Z][a-zA-Z0-9]*)_DP',
-                           r'\g<speciesnames>',
-                           line2)
-            # Undo the suffix `_DP` for any numbers like 1D7 or 2.3D-8.
-            line2 = re.sub(r'\b(?P<doubles1>[0-9][0-9\.]*)[dDeE](?P<doubles2>[+-]*[0-9]+)_DP',
-                           r'\g<doubles1>e\g<doubles2>_DP',
-                           line2)
-            # Add .0 to any literals that don't have a decimal place. This is
-            # necessary as it seems you can't use extended precision on such a
-            # number -- gfortran complains about an unknown integer kind, when
-            # it should really be a real kind.
-            line2 = re.sub(r'(?<![\.0-9+-dDeE])(?P<doubles>[0-9]+)_DP',
-                           r'\g<doubles>.0_DP',
-                           line2)
-
-            # Strip whitespace, ';' and '%'.
-            cleaned_line = line2.strip().strip('%;').strip()
-
-            # Process the assignment: split by '=' into variable names
-            # and values, then strip each.
-            [lhs, rhs] = re.split(r'=', cleaned_line)
-
-            variable_name = lhs.strip()
-            value = rhs.strip()
-
-            # TODO: check for duplicates
-            variablesDict[variable_name] = reactionNumber
-
-            # Replace any variables declared here with references to q: each new
-            # variable is assigned to a new element of q.
-            new_rhs = tokenise_and_process(value, variablesDict)
-
-            # Save the resulting string to mechanism_rates_coeff_list.
-            mechanism_rates_coeff_list.append('q('+str(variablesDict[variable_name]) + ') = ' \
-                                              + new_rhs + '  !' + cleaned_line + '\n')
-
-    # Save the number of such equations to be output to mechanism.{prod,reac}.
-    numberOfGenericComplex = reactionNumber
-
-    # -------------------------------------------------
-
-    # Initialise a few variables.
-    speciesList = []
-    rateConstants = []
-    reactionNumber = 0
-
-    # Process 'Reaction definitions'. We process this before 'Peroxy radicals'
-    # because that relies on SpeciesList, which is generated here.
-    # - copy comment lines across
-    # - other lines are split into their consituent parts:
-    #   - rateConstants are the reaction rates; these are processed via
-    #     reformatting and tokenisation to use the vector q where needed.
-    #   - the reactants and products of each species are collected up, numbered
-    #     as necessary, and their placements output to mechanism.{prod,reac,species}
-    mech_reac_list = []
-    mech_prod_list = []
-
-    # Loop over all lines in the reaction_definitions section of the input file.
-    for line in reaction_definitions:
-
-        # Check for comments (beginning with a '!'), or blank lines.
-        if (re.match(r'!', line) is not None) or (line.isspace()):
-            rateConstants.append(line)
-        # Check for lines starting with either ';' or '*', and write these as comments.
-        elif (re.match(r';', line) is not None) or (re.match(r'[*]', line) is not None):
-            rateConstants.append('!' + line)
-        # Otherwise assume all remaining lines are in the correct format, and process them.
-        else:
-            reactionNumber += 1   # keep track of the line we are processing
-
-            # Strip whitespace, ';' and '%'.
-            line = line.strip().strip('%;').strip()
-
-            # Split by ':' -- lhs is reaction rate, rhs is reaction equation.
-            [lhs, rhs] = re.split(r':', line)
-
-            # Add reaction rate to rateConstants.
-            rateConstants.append(lhs)
-
-            # Process the reaction: split by '=' into reactants and products.
-            [reactantsList, productsList] = re.split(r'=', rhs)
-
-            # Process each of reactants and products by splitting by '+'.
-            # Strip each at this stage.
-            reactants = [item.strip() for item in re.split(r'[+]', reactantsList)]
-            products = [item.strip() for item in re.split(r'[+]', productsList)]
-
-            # Ignore empty reactantsList.
-            if not reactantsList.strip() == '':
-                # Compare each reactant against known species and note the
-                # stoichometric coefficients for each reactant.
-                reactantNums = []
-                reactantStoichs = []
-                for x in reactants:
-                    #split the reactant into the species name and the stoichometric coefficient
-                    x_coeff, x_name = separate_stoichiometry(x)
-                    # Add the stoichometric coefficient to reactantStoichs
-                    reactantStoichs.append(x_coeff)
-                    # If the reactant is a known species then add its number to reactantNums.
-                    if x_name in speciesList:
-                        reactantNums.append(speciesList.index(x_name)+1)
+    numberOfFolded = 0
+    # With cse or groups, the lines of the 'Reaction definitions' go to rate_lines,
+    # as tuples (file index, reaction rate or None for comments, line), and are
+    # written to mechanism.f90 only when all the reaction rates are known.
+    # q_groups holds the group of each element of q.
+    rate_lines = []
+    q_groups = {}
+
+    # The lines of mechanism.{reac,prod} are written to temporary files, because
+    # the first line of each file holds the number of species and reactions,
+    # which are only known at the end.
+    print('Reading input file')
+    mech_map_path = os.path.join(mech_dir, 'mechanism.map')
+    if os.path.exists(mech_map_path):
+        os.remove(mech_map_path)
+    with (filter_mechanism(input_fac, mech_dir, prune, merge, scenarios) if prune or merge \
+          else contextlib.closing(mechanism_lines(input_fac))) as input_mech, \
+         open(os.path.join(mech_dir, 'mechanism.f90'), 'w') as mech_rates_file, \
+         tempfile.TemporaryFile('w+') as mech_reac_file, \
+         tempfile.TemporaryFile('w+') as mech_prod_file:
+
+        mech_rates_file.write(generated_note)
+        header_written = False
+
+        # The reaction rates are written either to mechanism.f90, or to the mechanism
+        # shards (reaction i goes to shard (i-1) mod shards).
+        shard_files = open_mechanism_shards(mech_dir, shards, groups)
+        rates_files = shard_files if shard_files else [mech_rates_file]
+
+        for section, line in mechanism_sections(input_mech):
+
+            # Process sections 1 and 2 ('Generic Rate Coefficients', 'Complex reactions'):
+            # - copy comment lines across.
+            # - other lines are reformatted to Fortran syntax, then their contents edited
+            #   to convert individual rate names to elements in a vector q.
+            if section in (1, 2):
+                # Check for comments (beginning with a '!'), or blank lines.
+                if (re.match(r'!', line) is not None) or (line.isspace()):
+                    mechanism_rates_coeff_list.append(line)
+                # Check for lines starting with either ';' or '*', and write these as comments.
+                elif (re.match(r';', line) is not None) or (re.match(r'[*]', line) is not None):
+                    mechanism_rates_coeff_list.append('!' + line)
+                # Otherwise assume all remaining lines are in the correct format, and process them.
+                else:
+                    numberOfGenericComplex += 1   # keep track of the line we are processing
+
+                    cleaned_line = fortran_rate_coefficient(line)
+
+                    # Process the assignment: split by '=' into variable names
+                    # and values, then strip each.
+                    [lhs, rhs] = re.split(r'=', cleaned_line)
+
+                    variable_name = lhs.strip()
+                    value = rhs.strip()
+
+                    # TODO: check for duplicates
+                    variablesDict[variable_name] = numberOfGenericComplex
+
+                    # Replace any variables declared here with references to q: each new
+                    # variable is assigned to a new element of q.
+                    new_rhs = tokenise_and_process(value, variablesDict, custom_functions)
+                    if fold:
+                        new_rhs, n_folded = rate_expressions.fold_rate_expression(new_rhs)
+                        numberOfFolded += n_folded
+                    if groups:
+                        q_groups[numberOfGenericComplex] = rate_group(new_rhs, q_groups)
+
+                    # Save the resulting string to mechanism_rates_coeff_list.
+                    mechanism_rates_coeff_list.append('q('+str(variablesDict[variable_name]) + ') = ' \
+                                                      + new_rhs + '  !' + cleaned_line + '\n')
+
+            # Process section 3 ('Peroxy radicals'): collect the RO2 species from the RO2 sum.
+            elif section == 3:
+                ro2List.extend(read_ro2_sum(line))
+
+            # Process section 4 ('Reaction definitions'):
+            # - copy comment lines across
+            # - other lines are split into their consituent parts:
+            #   - the reaction rates are processed via reformatting and tokenisation
+            #     to use the vector q where needed, and written to mechanism.f90.
+            #   - the reactants and products of each species are collected up, numbered
+            #     as necessary, and their placements output to mechanism.{prod,reac,species}
+            elif section == 4:
+                # All the previous sections are complete: write the head of mechanism.f90.
+                if not header_written and not cse and not groups:
+                    write_mechanism_header(mech_rates_file, ro2List, RO2List_reference,
+                                           mechanism_rates_coeff_list, shards)
+                    header_written = True
+
+                # Comments go to the same file as the next reaction.
+                file_index = reactionNumber % len(rates_files)
+
+                # Check for comments (beginning with a '!'), or blank lines.
+                if (re.match(r'!', line) is not None) or (line.isspace()):
+                    comment = line
+                # Check for lines starting with either ';' or '*', and write these as comments.
+                elif (re.match(r';', line) is not None) or (re.match(r'[*]', line) is not None):
+                    comment = '!' + line
+                else:
+                    comment = None
+
+                if comment is not None:
+                    if cse or groups:
+                        rate_lines.append((file_index, None, comment))
                     else:
-                        # Reactant x is not a known species. Add reactant to speciesList,
-                        # then add this number to reactantNums to record this reaction.
-                        speciesList.append(x_name)
-                        reactantNums.append(len(speciesList))
-
-                # Write the reactants to mech_reac_list.
-                mech_reac_list.extend([f'{reactionNumber} {z} {y}\n' for \
-                                       y,z in zip(reactantStoichs, reactantNums)])
-
-            # Ignore empty productsList.
-            if not productsList.strip() == '':
-                # Compare each product against known species and note the
-                # stoichometric coefficients for each product.
-                productNums = []
-                productStoichs = []
-                for x in products:
-                    #split the product into the species name and the stoichometric coefficient
-                    x_coeff, x_name = separate_stoichiometry(x)
-                    # Add the stoichometric coefficient to productStoichs
-                    productStoichs.append(x_coeff)
-
-                    # If the reactant is a known species then add its number to reactantNums.
-                    if x_name in speciesList:
-                        productNums.append(speciesList.index(x_name)+1)
+                        rates_files[file_index].write(comment)
+                # Otherwise assume all remaining lines are in the correct format, and process them.
+                else:
+                    reactionNumber += 1   # keep track of the line we are processing
+
+                    # Strip whitespace, ';' and '%'.
+                    reaction = line.strip().strip('%;').strip()
+
+                    # Split by ':' -- lhs is reaction rate, rhs is reaction equation.
+                    [lhs, rhs] = re.split(r':', reaction)
+
+                    # Write the reaction rate to mechanism.f90 (or to a mechanism shard).
+                    rate = tokenise_and_process(fortran_reaction_rate(lhs), variablesDict,
+                                                custom_functions)
+                    if fold:
+                        rate, n_folded = rate_expressions.fold_rate_expression(rate)
+                        numberOfFolded += n_folded
+                    if cse or groups:
+                        rate_lines.append((file_index, rate, line))
                     else:
-                        # Product x is not a known species. Add product to speciesList,
-                        # then add this number to productNums to record this reaction.
-                        speciesList.append(x_name)
-                        productNums.append(len(speciesList))
-
-                # Write the products to mech_prod_list.
-                mech_prod_list.extend([f'{reactionNumber} {z} {y}\n' for \
-                                       y,z in zip(productStoichs, productNums)])
-
-    # -------------------------------------------------
-
-    # Write out species for reactions to apply dilution factor if DILUTE is not NOTUSED.
-    if dilute:
-        for spec in speciesList:
-            reactionNumber += 1
-            mech_reac_list.append(str(reactionNumber) + ' ' \
-                                  + str(speciesList.index(spec) + 1) + ' 1.0\n')
-
-    with open(os.path.join(mech_dir, 'mechanism.prod'), 'w') as prod_file:
-        # Output number of species and number of reactions.
-        prod_file.write(str(len(speciesList)) + ' ' + str(reactionNumber) \
-                        + ' ' + str(numberOfGenericComplex) \
-                        + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n')
-        # Write all other lines.
-        for line in mech_prod_list:
-            prod_file.write(line)
-
-    with open(os.path.join(mech_dir, 'mechanism.reac'), 'w') as reac_file:
-        # Output number of species and number of reactions.
-        reac_file.write(str(len(speciesList)) + ' ' + str(reactionNumber) \
-                        + ' ' + str(numberOfGenericComplex) \
-                        + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n')
-        # Write all other lines.
-        for line in mech_reac_list:
-            reac_file.write(line)
-
-    # Write speciesList to mechanism.species, indexed by 1 to len(speciesList).
-    with open(os.path.join(mech_dir, 'mechanism.species'), 'w') as species_file:
-        for i, x in zip(range(1, len(speciesList) + 1), speciesList):
-            species_file.write(str(i) + ' ' + str(x) + '\n')
-
-    # Write out the rate coefficients.
-    i = 0
-    mech_rates_list = []
-    for rate_counter, x in zip(range(len(mechList)), rateConstants):
-        if (re.match(r'!', x) is not None) | (x.isspace()):
-            mech_rates_list.append(str(x))
+                        rates_files[file_index].write('p(' + str(reactionNumber) + ') = ' \
+                                                      + rate + '  !' + line)
+
+                    # Process the reaction: split by '=' into reactants and products.
+                    [reactantsList, productsList] = re.split(r'=', rhs)
+
+                    # Ignore empty reactantsList. Otherwise split by '+', compare each
+                    # reactant against known species, and write the species number and
+                    # the stoichometric coefficient of each reactant to mechanism.reac.
+                    if not reactantsList.strip() == '':
+                        for x in re.split(r'[+]', reactantsList):
+                            # Split the reactant into the species name and the stoichometric
+                            # coefficient. If the reactant is not a known species, it is added
+                            # to speciesDict.
+                            x_coeff, x_name = separate_stoichiometry(x.strip())
+                            mech_reac_file.write(f'{reactionNumber} {species_number(x_name, speciesDict)} {x_coeff}\n')
+
+                    # Ignore empty productsList. Otherwise, same as for the reactants.
+                    if not productsList.strip() == '':
+                        for x in re.split(r'[+]', productsList):
+                            x_coeff, x_name = separate_stoichiometry(x.strip())
+                            mech_prod_file.write(f'{reactionNumber} {species_number(x_name, speciesDict)} {x_coeff}\n')
+
+        if fold:
+            print('Constant folding: ' + str(numberOfFolded) + ' operations evaluated')
+
+        # Assign the common subexpressions of the reaction rates to new elements
+        # of q, after the rate coefficients.
+        if cse:
+            temporaries, new_rates, n_costly = rate_expressions.eliminate_rate_subexpressions(
+                [rate for _, rate, _ in rate_lines if rate is not None],
+                numberOfGenericComplex + 1)
+            if temporaries:
+                mechanism_rates_coeff_list.append('\n! Common subexpressions of the reaction rates\n')
+            for index, expression in temporaries:
+                mechanism_rates_coeff_list.append('q(' + str(index) + ') = ' + expression + '\n')
+                if groups:
+                    q_groups[index] = rate_group(expression, q_groups)
+            numberOfGenericComplex += len(temporaries)
+            print('Common subexpressions: ' + str(len(temporaries)) + ' assigned to q, EXP calls '
+                  + str(n_costly[0]) + ' -> ' + str(n_costly[2]) + ', ** operations '
+                  + str(n_costly[1]) + ' -> ' + str(n_costly[3]))
+
+        # Write out further reactions to implement the dilution factor if DILUTE is not NOTUSED:
+        # one for each species.
+        dilute_lines = []
+        if dilute:
+            for speciesNumber in speciesDict.values():
+                reactionNumber += 1
+                mech_reac_file.write(str(reactionNumber) + ' ' + str(speciesNumber) + ' 1.0\n')
+                dilute_lines.append('p(' + str(reactionNumber) + ') = DILUTE ! DILUTE\n')
+
+        # The mechanism may have no reactions (or the reactions have been kept in memory).
+        if not header_written:
+            write_mechanism_header(mech_rates_file, ro2List, RO2List_reference,
+                                   [] if groups else mechanism_rates_coeff_list,
+                                   0 if groups else shards)
+
+        # Write out the reaction rates kept in memory, as tuples (file index,
+        # group or None for comments, line).
+        rate_items = []
+        if cse or groups:
+            new_rates = iter(new_rates) if cse else None
+            rateNumber = 0
+            for file_index, rate, line in rate_lines:
+                if rate is None:
+                    rate_items.append((file_index, None, line))
+                else:
+                    rateNumber += 1
+                    if cse:
+                        rate = next(new_rates)
+                    rate_items.append((file_index, rate_group(rate, q_groups) if groups else 0,
+                                       'p(' + str(rateNumber) + ') = ' + rate + '  !' + line))
+
+        if groups:
+            write_rate_groups(mech_rates_file, shard_files, mechanism_rates_coeff_list, q_groups,
+                              rate_items, dilute_lines, shards)
         else:
-            # Match anything like '@-dd.d' and replaces with '**(-dd.d)'.
-            # Use '(?<=@)' as a lookbehind assertion, then matches any combination
-            # of digits and decimal points. Replace the negative number by its
-            # bracketed version.
-            i += 1
-            string = re.sub(r'(?<=@)-[0-9.]*', r'(\g<0>)', x)
-            # Now convert all '@' to '**' etc...
-            string = string.replace('@', '**')
-            string = string.replace('<', '(')
-            string = string.replace('>', ')')
-            # Replace any float-type numbers (xxx.xxxE+xx)
-            # with a double-type number (xxx.xxxD+xx)
-            string = re.sub(r'(?P<single>[0-9]+\.[0-9]+)[eE]',
-                            r'\g<single>D',
-                           string)
-            mech_rates_list.append('p(' + str(i) + ') = ' \
-                                   + tokenise_and_process(string, variablesDict) \
-                                   + '  !' + reaction_definitions[rate_counter])
-
-    # Write out further reactions to implement the dilution factor.
-    if dilute:
-        for _ in speciesList:
-            i += 1
-            mech_rates_list.append('p(' + str(i) + ') = DILUTE ! DILUTE\n')
-
-    # -------------------------------------------------
-
-    # Combine mechanism rates and RO2 sum files.
-    with open(os.path.join(mech_dir, 'mechanism.f90'), 'a') as mech_rates_coeff_file:
-        mech_rates_coeff_file.write("""
-module mechanism_mod
-    use, intrinsic :: iso_c_binding
-    implicit none
-
-contains
-
-    subroutine update_p(p, q, t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, RO2) bind(c,name='update_p')
-
-        use custom_functions_mod
-        integer, parameter :: DP = selected_real_kind( p = 15, r = 307 )
-        real(c_double), intent(inout) :: p(*), q(*)
-        real(c_double), intent(in) :: t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2
-        """)
+            for file_index, _, line in rate_items:
+                rates_files[file_index].write(line)
 
-        # Write out 'Generic Rate Coefficients' and 'Complex reactions'.
-        for item in mechanism_rates_coeff_list:
-            mech_rates_coeff_file.write(item)
+            # Call the mechanism shards from update_p.
+            close_mechanism_shards(mech_rates_file, shard_files)
 
-        # Write out 'Reaction definitions'.
-        for r in mech_rates_list:
-            mech_rates_coeff_file.write(r)
-        mech_rates_coeff_file.write("""
+            mech_rates_file.writelines(dilute_lines)
+            mech_rates_file.write("""
     end subroutine update_p
 end module mechanism_mod
 """)
 
+        if reorder or jacobian:
+            reactions = species_ordering.read_reactions(mech_reac_file, mech_prod_file)
+
+        # Renumber the species with the Reverse Cuthill-McKee algorithm: new_number
+        # holds the new ID number of each species.
+        if reorder:
+            new_number = species_ordering.reverse_cuthill_mckee(
+                len(speciesDict), species_ordering.coupling_graph(len(speciesDict), reactions))
+            reordered_reactions = species_ordering.renumber_reactions(reactions, new_number)
+            print('Bandwidth of the Jacobian matrix (upper, lower): '
+                  + '%d, %d before reordering, %d, %d after reordering' \
+                  % (species_ordering.bandwidths(reactions) + species_ordering.bandwidths(reordered_reactions)))
+            for x in speciesDict:
+                speciesDict[x] = new_number[speciesDict[x]]
+            reactions = reordered_reactions
+
+        mech_jac_path = os.path.join(mech_dir, 'mechanism_jac.f90')
+        if os.path.exists(mech_jac_path):
+            os.remove(mech_jac_path)
+        if jacobian:
+            with open(mech_jac_path, 'w') as mech_jac_file:
+                numberOfNonZeros = mechanism_jacobian.write_mechanism_jacobian(
+                    mech_jac_file, len(speciesDict), reactions, generated_note)
+            print('Jacobian matrix: ' + str(numberOfNonZeros) + ' nonzero elements written to: '
+                  + mech_jac_path)
+
+        # Output number of species and number of reactions, then copy all the other lines.
+        for filename, body_file in [('mechanism.prod', mech_prod_file),
+                                    ('mechanism.reac', mech_reac_file)]:
+            with open(os.path.join(mech_dir, filename), 'w') as out_file:
+                out_file.write(str(len(speciesDict)) + ' ' + str(reactionNumber) \
+                               + ' ' + str(numberOfGenericComplex) \
+                               + ' numberOfSpecies numberOfReactions numberOfGenericComplex\n')
+                body_file.seek(0)
+                if reorder:
+                    for line in body_file:
+                        reaction, species, coeff = line.split()
+                        out_file.write(reaction + ' ' + str(new_number[int(species)]) + ' ' + coeff + '\n')
+                else:
+                    shutil.copyfileobj(body_file, out_file)
+
+    # Write speciesDict to mechanism.species, indexed by 1 to len(speciesDict).
+    with open(os.path.join(mech_dir, 'mechanism.species'), 'w') as species_file:
+        for x, i in sorted(speciesDict.items(), key=lambda item: item[1]):
+            species_file.write(str(i) + ' ' + str(x) + '\n')
+
     # -------------------------------------------------
 
     # Finally, now that we have the full list of species, we can output the RO2s to
@@ -584,16 +1380,13 @@ end module mechanism_mod
     # using the species ID number of the RO2.
     print('Adding RO2s to: ' + mech_dir + '/mechanism.ro2')
     with open(os.path.join(mech_dir, 'mechanism.ro2'), 'w') as ro2_file:
-        ro2_file.write('! Note that this file is automatically generated by build/mech_converter.py -- Any manual edits to this file will be overwritten when calling build/mech_converter.py\n')
+        ro2_file.write(generated_note)
 
         for ro2List_i in ro2List:
-            for speciesNumber, y in zip(range(1, len(speciesList) + 1), speciesList):
-                if ro2List_i.strip() == y.strip():
-                    ro2_file.write(str(speciesNumber) + ' !' + ro2List_i.strip() + '\n')
-                    # Exit loop early if species found.
-                    break
-            # This code only executes if the break is NOT called, i.e. if the
-            # loop runs to completion without the RO2 being found in the speciesList.
+            speciesNumber = speciesDict.get(ro2List_i.strip())
+            if speciesNumber is not None:
+                ro2_file.write(str(speciesNumber) + ' !' + ro2List_i.strip() + '\n')
+            # The RO2 is not in speciesDict, i.e. it is not in the mechanism.
             else:
                 error_message = ''.join([
                   ' ****** ',
@@ -608,29 +1401,88 @@ end module mechanism_mod
 # =========================== MAIN =========================== #
 
 
+def add_converter_options(parser):
+    """
+    Add the optional arguments of the conversion to an argument parser
+    (shared with batch_converter.py).
+
+    Args:
+        parser (argparse.ArgumentParser): the argument parser
+    """
+
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help='split the reaction rates into N Fortran files, which can be '
+                        'compiled in parallel [default: %(default)s]')
+    parser.add_argument('--cse', action='store_true',
+                        help='evaluate the subexpressions which appear in more than one '
+                        'reaction rate only once per call')
+    parser.add_argument('--groups', action='store_true',
+                        help='split the rates into groups with the same inputs, which are '
+                        'recomputed only when their inputs change')
+    parser.add_argument('--reorder', action='store_true',
+                        help='renumber the species to reduce the bandwidth of the Jacobian '
+                        'matrix, and report the bandwidth')
+    parser.add_argument('--jacobian', action='store_true',
+                        help='write the analytic Jacobian matrix of the chemical mechanism '
+                        'to mechanism_jac.f90')
+    parser.add_argument('--fold', action='store_true',
+                        help='evaluate the arithmetic between numeric literals in the rate '
+                        'expressions at conversion time')
+    parser.add_argument('--prune', action='store_true',
+                        help='remove the reactions which can never take place, starting from '
+                        'the species in the configuration files; if the model is run with '
+                        'scenarios, pass their list with --scenarios too, otherwise the species '
+                        'only in the configuration files of the scenarios may be removed')
+    parser.add_argument('--scenarios', metavar='FILE', default=None,
+                        help='with --prune, also start from the species in the configuration '
+                        'files of each scenario of FILE, the list of the scenarios passed to '
+                        'the --scenarios flag of atchem2')
+    parser.add_argument('--merge', action='store_true',
+                        help='merge the reactions with the same reactants and the same rate '
+                        'expression, and write the numbers of the original reactions to '
+                        'mechanism.map')
+
+def converter_options(args):
+    """
+    Collect the optional arguments of the conversion from the parsed
+    arguments.
+
+    Args:
+        args (argparse.Namespace): the parsed arguments
+
+    Returns:
+        options (dict): keyword arguments of convert_to_fortran()
+    """
+
+    return {'shards': args.shards, 'cse': args.cse, 'fold': args.fold,
+            'groups': args.groups, 'reorder': args.reorder,
+            'jacobian': args.jacobian, 'prune': args.prune, 'merge': args.merge,
+            'scenarios': args.scenarios}
+
 def main():
     print('Processing chemical mechanism...')
-    assert len(sys.argv) > 1, \
-        'Enter the filename of a chemical mechanism (.fac or .kpp) as argument:'
-    mech_file = sys.argv[1]
-    # config_dir defaults to model/configuration/, if not given as argument
-    if len(sys.argv) <= 2:
-        config_dir = './model/configuration/'
-    else:
-        config_dir = sys.argv[2]
-    # mcm_dir defaults to mcm/, if not given as argument
-    if len(sys.argv) <= 3:
-        mcm_dir = './mcm/'
-    else:
-        mcm_dir = sys.argv[3]
+    parser = argparse.ArgumentParser(
+        description='Convert a chemical mechanism (.fac or .kpp) to the Fortran format used by AtChem2.')
+    parser.add_argument('mech_file',
+                        help='path to the chemical mechanism file (.fac or .kpp)')
+    parser.add_argument('config_dir', nargs='?', default='./model/configuration/',
+                        help='path to the model configuration directory [default: %(default)s]')
+    parser.add_argument('mcm_dir', nargs='?', default='./mcm/',
+                        help='path to the MCM data files directory [default: %(default)s]')
+    add_converter_options(parser)
+    args = parser.parse_args()
+    mech_file = args.mech_file
+    config_dir = args.config_dir
+    mcm_dir = args.mcm_dir
 
     # Check that the files and directories exist
     assert os.path.isfile(mech_file), 'Failed to find file ' + mech_file
     assert os.path.exists(config_dir), 'Failed to find directory ' + config_dir
     assert os.path.exists(mcm_dir), 'Failed to find directory ' + mcm_dir
+    assert args.shards >= 0, 'The number of mechanism shards must not be negative'
 
     # Call the conversion to Fortran function
-    convert_to_fortran(mech_file, config_dir, mcm_dir)
+    convert_to_fortran(mech_file, config_dir, mcm_dir, **converter_options(args))
     print('... chemical mechanism converted to Fortran.')
 
 # Call the main function if executed as script
@@ -0,0 +1,340 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script manages a local cache of converted chemical mechanisms,
+# so that `build/build_atchem2.sh` does not need to run
+# mech_converter.py and recompile the shared library when the
+# chemical mechanism has not changed since a previous build.
+#
+# Each entry of the cache is identified by a key, which is the hash of
+# all the files that determine the output of the conversion:
+#
+# - the chemical mechanism file (.fac or .kpp)
+# - environmentVariables.config (DILUTE)
+# - customRateFuncs.f90
+# - with the --prune option, the configuration files which list the
+#   species of the model (initialConcentrations.config,
+#   speciesConstrained.config, speciesConstant.config,
+#   outputSpecies.config and outputRates.config), and, with the
+#   --scenarios option too, the list of the scenarios and the same
+#   configuration files of each scenario
+# - the reference list of RO2 species from the MCM
+# - the mechanism conversion scripts (build/*.py)
+# - the Fortran files and the Makefile used to build the shared library
+# - the options passed to mech_converter.py
+#
+# Each entry contains the mechanism.{species,reac,prod,ro2,f90} files,
+# the mechanism shards (mechanism_shard_*.f90), the analytic Jacobian
+# matrix (mechanism_jac.f90) and the map of the merged reactions
+# (mechanism.map), if any, and the shared library
+# (mechanism.so). The least recently used entries are removed
+# when the total size of the cache exceeds a given limit.
+#
+# The location and the size limit of the cache can be set with the
+# environment variables ATCHEM2_CACHE_DIR [default: ~/.cache/atchem2/]
+# and ATCHEM2_CACHE_SIZE (in MB) [default: 1024]. Set ATCHEM2_CACHE=0
+# to disable the cache.
+#
+# ARGUMENTS:
+#   1. command: `key`, `restore`, `store` or `stats`
+#   `key`:     2. path to the mechanism file
+#              3. path to the model configuration directory
+#              4. path to the MCM data files directory
+#              5... options passed to mech_converter.py, if any
+#   `restore`: 2. cache key
+#              3. path to the model configuration directory
+#   `store`:   2. cache key
+#              3. path to the model configuration directory
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import json
+import shutil
+import hashlib
+import glob
+import tempfile
+import mechanism_pruning
+
+# Files generated by the build process, which are saved in each cache entry.
+cachedFiles = ['mechanism.species', 'mechanism.reac', 'mechanism.prod',
+               'mechanism.ro2', 'mechanism.f90', 'mechanism.so']
+
+# Files generated by the build process only with some options of
+# mech_converter.py, which are saved in the cache entry if they exist.
+optionalFiles = ['mechanism_shard_*.f90', 'mechanism_jac.f90', 'mechanism.map']
+
+# Files of the AtChem2 distribution, relative to the main directory, which
+# affect the output of the build process.
+converterFiles = ['build/mech_converter.py', 'build/fix_mechanism_fac.py',
+                  'build/kpp_conversion.py', 'build/rate_expressions.py',
+                  'build/species_ordering.py', 'build/mechanism_jacobian.py',
+                  'build/mechanism_pruning.py',
+                  'src/dataStructures.f90', 'Makefile']
+
+# Configuration files which determine the output of the conversion with
+# the --prune option of mech_converter.py.
+pruningFiles = ['initialConcentrations.config', 'speciesConstrained.config',
+                'speciesConstant.config', 'outputSpecies.config', 'outputRates.config']
+
+# Name of the file, in the cache directory, with the hit/miss counters.
+statsFile = 'stats.json'
+
+# =========================== FUNCTIONS =========================== #
+
+
+def cache_directory():
+    """
+    Return the directory of the cache, and create it if necessary.
+
+    Returns:
+        cache_dir (str): path to the cache directory
+    """
+
+    cache_dir = os.environ.get('ATCHEM2_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'), '.cache', 'atchem2'))
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+# ------------------------------------------------------------ #
+
+def option_value(options, name):
+    """
+    Return the value of an option passed to mech_converter.py, either as
+    `name=value` or as `name value`.
+
+    Args:
+        options (list): options passed to mech_converter.py
+        name (str): name of the option (e.g. --scenarios)
+
+    Returns:
+        value (str): value of the option, or None if it is not given
+    """
+
+    for i, option in enumerate(options):
+        if option.startswith(name + '='):
+            return option.split('=', 1)[1]
+        if option == name and i + 1 < len(options):
+            return options[i + 1]
+    return None
+
+# ------------------------------------------------------------ #
+
+def cache_key(mech_file, mech_dir, mcm_dir, options=()):
+    """
+    Calculate the key of the cache entry for a chemical mechanism. The
+    key is the SHA-256 hash of the content of all the files that
+    determine the output of the conversion to Fortran (see the
+    documentation at the top of this script). Missing files are
+    hashed as empty.
+
+    Args:
+        mech_file (str): path to the chemical mechanism file
+        mech_dir (str): path to the model configuration directory
+        mcm_dir (str): path to the MCM data files directory
+        options (list): options passed to mech_converter.py
+
+    Returns:
+        key (str): hexadecimal hash of the input files
+    """
+
+    main_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    input_files = [mech_file,
+                   os.path.join(mech_dir, 'environmentVariables.config'),
+                   os.path.join(mech_dir, 'customRateFuncs.f90'),
+                   os.path.join(mcm_dir, 'peroxy-radicals_v3.3.1')] \
+        + [os.path.join(main_dir, f) for f in converterFiles]
+    if '--prune' in options:
+        input_files += [os.path.join(mech_dir, f) for f in pruningFiles]
+        scenarios = option_value(options, '--scenarios')
+        if scenarios:
+            input_files.append(scenarios)
+            for scenario_dir in mechanism_pruning.scenario_directories(scenarios):
+                input_files += [os.path.join(scenario_dir, f) for f in pruningFiles]
+
+    key = hashlib.sha256()
+    for i, f in enumerate(input_files):
+        # The extension of the mechanism file determines its format.
+        name = os.path.basename(f) if i == 0 else str(i)
+        key.update(name.encode() + b'\0')
+        if os.path.isfile(f):
+            with open(f, 'rb') as file_open:
+                for block in iter(lambda: file_open.read(1 << 20), b''):
+                    key.update(block)
+        key.update(b'\0')
+    key.update(' '.join(options).encode())
+    return key.hexdigest()
+
+# ------------------------------------------------------------ #
+
+def optional_files(directory):
+    """
+    Return the names of the optional files generated by mech_converter.py
+    in a directory: the mechanism shards (mechanism_shard_*.f90) and the
+    analytic Jacobian matrix (mechanism_jac.f90).
+
+    Args:
+        directory (str): path to the directory
+
+    Returns:
+        files (list): names of the optional files
+    """
+
+    return [os.path.basename(f) for pattern in optionalFiles
+            for f in glob.glob(os.path.join(directory, pattern))]
+
+# ------------------------------------------------------------ #
+
+def update_stats(cache_dir, result):
+    """
+    Increment the hit or miss counter of the cache, and return the
+    updated counters.
+
+    Args:
+        cache_dir (str): path to the cache directory
+        result (str): 'hit' or 'miss'
+
+    Returns:
+        stats (dict): number of cache hits and misses
+    """
+
+    stats_path = os.path.join(cache_dir, statsFile)
+    try:
+        with open(stats_path, 'r') as stats_file:
+            stats = json.load(stats_file)
+    except (IOError, ValueError):
+        stats = {'hit': 0, 'miss': 0}
+    stats[result] = stats.get(result, 0) + 1
+    with open(stats_path, 'w') as stats_file:
+        json.dump(stats, stats_file)
+    return stats
+
+# ------------------------------------------------------------ #
+
+def restore(key, mech_dir):
+    """
+    Copy the files of a cache entry to the model configuration
+    directory, if the entry exists.
+
+    Args:
+        key (str): key of the cache entry
+        mech_dir (str): path to the model configuration directory
+
+    Returns:
+        found (bool): True if the entry was found and restored
+    """
+
+    cache_dir = cache_directory()
+    entry = os.path.join(cache_dir, key)
+    found = all(os.path.isfile(os.path.join(entry, f)) for f in cachedFiles)
+    if found:
+        for old_file in optional_files(mech_dir):
+            os.remove(os.path.join(mech_dir, old_file))
+        for f in cachedFiles + optional_files(entry):
+            shutil.copy2(os.path.join(entry, f), os.path.join(mech_dir, f))
+        # Mark the entry as the most recently used.
+        os.utime(entry, None)
+    stats = update_stats(cache_dir, 'hit' if found else 'miss')
+    print('Mechanism cache ' + ('hit' if found else 'miss') + ': ' + key[:12] \
+          + ' (' + str(stats['hit']) + ' hits, ' + str(stats['miss']) + ' misses)')
+    return found
+
+# ------------------------------------------------------------ #
+
+def store(key, mech_dir, max_size):
+    """
+    Save the files generated by the build process in a new cache
+    entry, then remove the least recently used entries until the
+    size of the cache is below the given limit.
+
+    Args:
+        key (str): key of the cache entry
+        mech_dir (str): path to the model configuration directory
+        max_size (int): maximum size of the cache, in bytes
+    """
+
+    cache_dir = cache_directory()
+    entry = os.path.join(cache_dir, key)
+    if not all(os.path.isfile(os.path.join(mech_dir, f)) for f in cachedFiles):
+        print('Mechanism cache: build files not found in ' + mech_dir + ', nothing to store')
+        return
+
+    # Copy the files to a temporary directory and then rename it, so that
+    # a build running in parallel never sees an incomplete entry.
+    if not os.path.isdir(entry):
+        tmp_entry = tempfile.mkdtemp(dir=cache_dir, prefix='.tmp-')
+        for f in cachedFiles + optional_files(mech_dir):
+            shutil.copy2(os.path.join(mech_dir, f), os.path.join(tmp_entry, f))
+        try:
+            os.rename(tmp_entry, entry)
+        except OSError:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.utime(entry, None)
+    print('Mechanism cache: stored ' + key[:12])
+
+    evict(cache_dir, max_size)
+
+# ------------------------------------------------------------ #
+
+def evict(cache_dir, max_size):
+    """
+    Remove the least recently used entries of the cache until its
+    total size is below the given limit.
+
+    Args:
+        cache_dir (str): path to the cache directory
+        max_size (int): maximum size of the cache, in bytes
+    """
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        entry = os.path.join(cache_dir, name)
+        if os.path.isdir(entry) and not name.startswith('.'):
+            size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+            entries.append((os.path.getmtime(entry), size, entry))
+
+    total_size = sum(e[1] for e in entries)
+    for _, size, entry in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total_size -= size
+        print('Mechanism cache: evicted ' + os.path.basename(entry)[:12])
+
+# =========================== MAIN =========================== #
+
+
+def main():
+    assert len(sys.argv) > 1, \
+        'Enter a command (key, restore, store, stats) as argument'
+    command = sys.argv[1]
+    max_size = int(float(os.environ.get('ATCHEM2_CACHE_SIZE', 1024)) * 1024 * 1024)
+
+    if command == 'key':
+        print(cache_key(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:]))
+    elif command == 'restore':
+        # Exit with a non-zero code on a cache miss.
+        if not restore(sys.argv[2], sys.argv[3]):
+            sys.exit(1)
+    elif command == 'store':
+        store(sys.argv[2], sys.argv[3], max_size)
+    elif command == 'stats':
+        stats_path = os.path.join(cache_directory(), statsFile)
+        if os.path.isfile(stats_path):
+            with open(stats_path, 'r') as stats_file:
+                print(stats_file.read())
+    else:
+        sys.exit('Unknown command: ' + command)
+
+# Call the main function if executed as script
+if __name__ == '__main__':
+    main()
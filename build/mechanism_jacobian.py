@@ -0,0 +1,231 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script contains the functions used by mech_converter.py to
+# write the analytic Jacobian matrix of a chemical mechanism to the
+# mechanism_jac.f90 file.
+#
+# The rate of reaction k is r(k) = p(k) * y(1)**c(1) * y(2)**c(2) ...,
+# where p(k) is the reaction rate calculated by update_p, y are the
+# concentrations of the reactants and c their stoichiometric
+# coefficients (as in the resid subroutine of AtChem2). The element
+# (i, j) of the Jacobian matrix is the sum, over the reactions which
+# have species j as a reactant, of the net stoichiometric coefficient
+# of species i (products minus reactants) times the derivative of
+# r(k) with respect to y(j).
+#
+# The nonzero elements of the Jacobian matrix are stored in
+# compressed sparse row (CSR) format: the elements of row i are
+# jac(jacRowStart(i):jacRowStart(i+1)-1), and their column numbers are
+# jacColumns(jacRowStart(i):jacRowStart(i+1)-1), in increasing order.
+#
+# The derivatives of the rates of the reactions are stored as tables
+# (data statements) which are evaluated by a loop, rather than as one
+# Fortran statement for each term, because large mechanisms have
+# hundreds of thousands of terms and straight-line code takes too
+# long to compile.
+#
+# mechanism_jac.f90 contains the module mechanism_jac_mod, with three
+# subroutines which are loaded by AtChem2 from the shared library:
+#
+# - jacobian_size(numberOfSpecies, numberOfNonZeros)
+# - jacobian_pattern(rowStart, columns): sparsity pattern
+# - jacobian_values(p, y, jac): values of the nonzero elements
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def jacobian_terms(reactions):
+    """
+    Find the terms of the nonzero elements of the Jacobian matrix.
+
+    Args:
+        reactions (dict): reaction number -> (reactants, products), where
+                          reactants and products map each species number to
+                          its stoichiometric coefficient
+
+    Returns:
+        terms (list): tuples (reaction number, species j, reactants,
+                      [(species i, net stoichiometric coefficient)]), one for
+                      each reactant j of each reaction
+        pattern (list): sorted list of the (row, column) of the nonzero elements
+    """
+
+    terms = []
+    pattern = set()
+    for reaction in sorted(reactions):
+        reactants, products = reactions[reaction]
+        net = {}
+        for species, coeff in reactants.items():
+            net[species] = net.get(species, 0.0) - coeff
+        for species, coeff in products.items():
+            net[species] = net.get(species, 0.0) + coeff
+        rows = [(i, coeff) for i, coeff in sorted(net.items()) if coeff != 0.0]
+        for j in sorted(reactants):
+            terms.append((reaction, j, reactants, rows))
+            pattern.update((i, j) for i, _ in rows)
+    return terms, sorted(pattern)
+
+def fortran_real(value):
+    """
+    Write a real number as a Fortran literal of kind c_double.
+
+    Args:
+        value (float): number
+
+    Returns:
+        literal (str): Fortran literal
+    """
+
+    return repr(float(value)) + '_c_double'
+
+def fortran_array(kind, name, values):
+    """
+    Write the declaration of a Fortran array and its values, as data
+    statements of ten values each (an array constructor cannot have
+    more than 65535 elements).
+
+    Args:
+        kind (str): type of the array
+        name (str): name of the array
+        values (list): values of the elements of the array, as strings
+
+    Returns:
+        lines (list): lines of the declaration
+    """
+
+    lines = ['    ' + kind + ' :: ' + name + '(' + str(len(values)) + ')\n']
+    for start in range(0, len(values), 10):
+        chunk = values[start:start + 10]
+        lines.append('    data ' + name + '(' + str(start + 1) + ':' + str(start + len(chunk)) + ') / ' \
+                     + ', '.join(chunk) + ' /\n')
+    return lines
+
+def write_mechanism_jacobian(mech_jac_file, number_of_species, reactions, note):
+    """
+    Write the mechanism_jac.f90 file: the sparsity pattern of the
+    Jacobian matrix in CSR format, the tables of the terms of the
+    nonzero elements, and the subroutines which return the sparsity
+    pattern and calculate the nonzero elements.
+
+    Each term is the derivative d of the rate of a reaction with respect
+    to one of its reactants: d = termCoeff * p(termReaction) * the
+    product of y(factorSpecies)**factorExponent over the factors of the
+    term. Each term is then added to the elements of the Jacobian
+    matrix in positions entryPosition, multiplied by entryCoeff.
+
+    Args:
+        mech_jac_file (file): mechanism_jac.f90, open for writing
+        number_of_species (int): number of species, numbered from 1
+        reactions (dict): reaction number -> (reactants, products)
+        note (str): note at the top of the file
+
+    Returns:
+        number_of_nonzeros (int): number of nonzero elements
+    """
+
+    terms, pattern = jacobian_terms(reactions)
+    position = {element: k for k, element in enumerate(pattern, 1)}
+    row_start = [0, 1] + [0] * number_of_species
+    for i, _ in pattern:
+        row_start[i + 1] += 1
+    for i in range(2, number_of_species + 2):
+        row_start[i] += row_start[i - 1]
+    number_of_nonzeros = len(pattern)
+
+    # Tables of the terms, of their factors and of the elements they are added to.
+    term_reaction, term_coeff, factor_start, factor_species, factor_exponent = [], [], ['1'], [], []
+    entry_start, entry_position, entry_coeff = ['1'], [], []
+    for reaction, j, reactants, rows in terms:
+        if not rows:
+            continue
+        term_reaction.append(str(reaction))
+        term_coeff.append(fortran_real(reactants[j]))
+        for species in sorted(reactants):
+            exponent = reactants[species] - 1.0 if species == j else reactants[species]
+            if exponent != 0.0:
+                factor_species.append(str(species))
+                factor_exponent.append(fortran_real(exponent))
+        factor_start.append(str(len(factor_species) + 1))
+        for i, coeff in rows:
+            entry_position.append(str(position[(i, j)]))
+            entry_coeff.append(fortran_real(coeff))
+        entry_start.append(str(len(entry_position) + 1))
+
+    mech_jac_file.write(note)
+    mech_jac_file.write("""
+module mechanism_jac_mod
+    use, intrinsic :: iso_c_binding
+    implicit none
+
+    ! Sparsity pattern of the Jacobian matrix, in compressed sparse row format
+""")
+    mech_jac_file.writelines(fortran_array('integer(c_int)', 'jacRowStart',
+                                           [str(x) for x in row_start[1:]]))
+    mech_jac_file.writelines(fortran_array('integer(c_int)', 'jacColumns',
+                                           [str(j) for _, j in pattern]))
+    mech_jac_file.write("""
+    ! Terms of the nonzero elements of the Jacobian matrix
+""")
+    for kind, name, values in [('integer(c_int)', 'termReaction', term_reaction),
+                               ('real(c_double)', 'termCoeff', term_coeff),
+                               ('integer(c_int)', 'factorStart', factor_start),
+                               ('integer(c_int)', 'factorSpecies', factor_species),
+                               ('real(c_double)', 'factorExponent', factor_exponent),
+                               ('integer(c_int)', 'entryStart', entry_start),
+                               ('integer(c_int)', 'entryPosition', entry_position),
+                               ('real(c_double)', 'entryCoeff', entry_coeff)]:
+        mech_jac_file.writelines(fortran_array(kind, name, values))
+    mech_jac_file.write("""
+contains
+
+    subroutine jacobian_size(numberOfSpecies, numberOfNonZeros) bind(c,name='jacobian_size')
+        integer(c_int), intent(out) :: numberOfSpecies, numberOfNonZeros
+
+        numberOfSpecies = """ + str(number_of_species) + """
+        numberOfNonZeros = """ + str(number_of_nonzeros) + """
+    end subroutine jacobian_size
+
+    subroutine jacobian_pattern(rowStart, columns) bind(c,name='jacobian_pattern')
+        integer(c_int), intent(out) :: rowStart(*), columns(*)
+
+        rowStart(1:""" + str(number_of_species + 1) + """) = jacRowStart
+        columns(1:""" + str(number_of_nonzeros) + """) = jacColumns
+    end subroutine jacobian_pattern
+
+    subroutine jacobian_values(p, y, jac) bind(c,name='jacobian_values')
+        real(c_double), intent(in) :: p(*), y(*)
+        real(c_double), intent(out) :: jac(*)
+        real(c_double) :: d
+        integer :: t, k
+
+        jac(1:""" + str(number_of_nonzeros) + """) = 0.0_c_double
+        do t = 1, """ + str(len(term_reaction)) + """
+            d = termCoeff(t) * p(termReaction(t))
+            do k = factorStart(t), factorStart(t + 1) - 1
+                if ( factorExponent(k) == 1.0_c_double ) then
+                    d = d * y(factorSpecies(k))
+                else
+                    d = d * y(factorSpecies(k)) ** factorExponent(k)
+                end if
+            end do
+            do k = entryStart(t), entryStart(t + 1) - 1
+                jac(entryPosition(k)) = jac(entryPosition(k)) + entryCoeff(k) * d
+            end do
+        end do
+    end subroutine jacobian_values
+end module mechanism_jac_mod
+""")
+    return number_of_nonzeros
@@ -0,0 +1,221 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script contains the functions used by mech_converter.py to
+# remove from a chemical mechanism the reactions which can never take
+# place in a model run.
+#
+# The species which have a concentration at the start of the model
+# run are those with a nonzero value in initialConcentrations.config,
+# and those in speciesConstrained.config and speciesConstant.config.
+# A reaction can take place if all its reactants have a concentration
+# (a reaction without reactants always takes place), and then its
+# products have a concentration too. The other reactions have a rate
+# of exactly zero for the whole model run, and the other species have
+# a concentration of exactly zero, so removing them does not change
+# the results of the model.
+#
+# The species which AtChem2 looks up by name (the species in the
+# configuration files above, and in outputSpecies.config and
+# outputRates.config) must stay in the mechanism: if all the
+# reactions of such a species are removed, the first of them is kept
+# (it has a rate of zero).
+#
+# With the --scenarios flag of atchem2, each scenario can have its own
+# configuration files, in the directory of the same name next to the
+# list of the scenarios. The mechanism is shared by all the scenarios,
+# so the species of the configuration files of all the scenarios are
+# used, together with those of the model configuration directory.
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+
+
+# Configuration files with the species which AtChem2 looks up by name.
+configFiles = ['initialConcentrations.config', 'speciesConstrained.config',
+               'speciesConstant.config', 'outputSpecies.config', 'outputRates.config']
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def read_config_species(config_file, nonzero=False):
+    """
+    Read the names of the species in the first column of a configuration
+    file. A missing file has no species.
+
+    Args:
+        config_file (str): path to the configuration file
+        nonzero (bool): if True, only read the species whose value (second
+                        column) is not zero
+
+    Returns:
+        names (set): names of the species
+    """
+
+    names = set()
+    if not os.path.isfile(config_file):
+        return names
+    with open(config_file, 'r') as config:
+        for line in config:
+            fields = line.split()
+            if not fields:
+                continue
+            if nonzero and len(fields) > 1 \
+               and float(fields[1].replace('D', 'e').replace('d', 'e')) == 0.0:
+                continue
+            names.add(fields[0])
+    return names
+
+def scenario_directories(scenarios_file):
+    """
+    Find the directories of the scenarios of a list of scenarios (see
+    the --scenarios flag of atchem2): the directories with the names in
+    the list, one per line, next to the list.
+
+    Args:
+        scenarios_file (str): path to the list of the scenarios
+
+    Returns:
+        directories (list): paths to the directories of the scenarios
+    """
+
+    with open(scenarios_file, 'r') as scenarios:
+        names = [line.strip() for line in scenarios if line.strip()]
+    return [os.path.join(os.path.dirname(scenarios_file), name) for name in names]
+
+def seed_species(mech_dir, scenario_dirs=()):
+    """
+    Find the species which have a concentration at the start of the
+    model run, or of any of the scenarios.
+
+    Args:
+        mech_dir (str): path to the model configuration directory
+        scenario_dirs (list): paths to the directories of the scenarios, if any
+
+    Returns:
+        seeds (set): names of the species
+    """
+
+    seeds = set()
+    for directory in [mech_dir] + list(scenario_dirs):
+        seeds |= read_config_species(os.path.join(directory, 'initialConcentrations.config'), nonzero=True) \
+            | read_config_species(os.path.join(directory, 'speciesConstrained.config')) \
+            | read_config_species(os.path.join(directory, 'speciesConstant.config'))
+    return seeds
+
+def required_species(mech_dir, scenario_dirs=()):
+    """
+    Find the species which AtChem2 looks up by name, in the model run or
+    in any of the scenarios, and which must stay in the mechanism.
+
+    Args:
+        mech_dir (str): path to the model configuration directory
+        scenario_dirs (list): paths to the directories of the scenarios, if any
+
+    Returns:
+        required (set): names of the species
+    """
+
+    required = set()
+    for directory in [mech_dir] + list(scenario_dirs):
+        for filename in configFiles:
+            required |= read_config_species(os.path.join(directory, filename))
+    return required
+
+def reachable_reactions(reactions, seeds):
+    """
+    Find the reactions which can take place, starting from the species
+    which have a concentration: each reaction takes place once all its
+    reactants have a concentration.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, as sets of
+                          species names
+        seeds (set): names of the species which have a concentration
+
+    Returns:
+        fired (list): True for each reaction which can take place
+        reached (set): names of the species which have a concentration
+    """
+
+    # missing[k] is the number of reactants of reaction k without a concentration.
+    missing = [len(reactants) for reactants, _ in reactions]
+    consumers = {}
+    for k, (reactants, _) in enumerate(reactions):
+        for x in reactants:
+            consumers.setdefault(x, []).append(k)
+
+    fired = [False] * len(reactions)
+    reached = set()
+    pending = list(seeds)
+    ready = [k for k, n in enumerate(missing) if n == 0]
+    while pending or ready:
+        while pending:
+            x = pending.pop()
+            if x in reached:
+                continue
+            reached.add(x)
+            for k in consumers.get(x, []):
+                missing[k] -= 1
+                if missing[k] == 0:
+                    ready.append(k)
+        while ready:
+            k = ready.pop()
+            fired[k] = True
+            pending.extend(x for x in reactions[k][1] if x not in reached)
+    return fired, reached
+
+def keep_required_species(reactions, keep, required):
+    """
+    Keep, for each required species which is not in the kept reactions,
+    the first reaction of the species.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, as sets of
+                          species names
+        keep (list): True for each reaction to keep, updated in place
+        required (set): names of the species which must stay in the mechanism
+    """
+
+    kept_species = set()
+    first_reaction = {}
+    for k, (reactants, products) in enumerate(reactions):
+        if keep[k]:
+            kept_species |= reactants | products
+        for x in reactants | products:
+            first_reaction.setdefault(x, k)
+    for x in sorted(required):
+        if x in first_reaction and x not in kept_species:
+            k = first_reaction[x]
+            keep[k] = True
+            kept_species |= reactions[k][0] | reactions[k][1]
+
+def pruned_reactions(reactions, seeds, required):
+    """
+    Select the reactions to keep in the mechanism: the reactions which
+    can take place, and, for each required species which is not in
+    these reactions, the first reaction of the species.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, as sets of
+                          species names
+        seeds (set): names of the species which have a concentration
+        required (set): names of the species which must stay in the mechanism
+
+    Returns:
+        keep (list): True for each reaction to keep
+    """
+
+    keep, _ = reachable_reactions(reactions, seeds)
+    keep_required_species(reactions, keep, required)
+    return keep
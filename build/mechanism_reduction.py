@@ -0,0 +1,369 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script reduces a chemical mechanism to a skeletal mechanism
+# with the Directed Relation Graph (DRG) method (Lu and Law, Proc.
+# Combust. Inst. 30, 1333-1341, 2005), using the reaction rates of a
+# reference model run, and compares the results of a model run with
+# the skeletal mechanism to the reference model run.
+#
+# The reaction rates are read from the `reactionRates/` directory of
+# the output of the reference model run (see `reaction rates output
+# step size` in model.parameters) or, if it is empty, from the
+# productionRates.output and lossRates.output files (only the
+# reactions of the species in outputRates.config). The reference
+# model run must use the chemical mechanism converted without the
+# --prune and --merge options, so that the reactions have the same
+# numbers.
+#
+# At each output time, species A depends on species B if the
+# reactions which involve B make a fraction larger than the threshold
+# of the total production and loss of A:
+#
+#   sum_k |nu(A,k) w(k)| delta(B,k) / sum_k |nu(A,k) w(k)| > threshold
+#
+# where w(k) is the rate of reaction k, nu(A,k) the net stoichiometric
+# coefficient of A in reaction k, and delta(B,k) = 1 if B is a
+# reactant or a product of reaction k. The skeletal mechanism has
+# the species on which the target species depend, directly or
+# through other species, at any output time, and the reactions
+# between these species only. The species in the configuration files
+# (see `mechanism_pruning.py`) are also target species, and stay in
+# the skeletal mechanism.
+#
+# The skeletal mechanism is written in FACSIMILE format, and can be
+# converted by mech_converter.py. The RO2 sum is written without the
+# removed species.
+#
+# ARGUMENTS:
+#   1. command: `reduce` or `validate`
+#   `reduce`:   2. path to the chemical mechanism file (.fac or .kpp)
+#               3. path to the output directory of the reference model run
+#               4. path to the model configuration directory
+#               5. path to the skeletal mechanism file to write (.fac)
+#   `validate`: 2. path to the output directory of the reference model run
+#               3. path to the output directory of the model run with the
+#                  skeletal mechanism
+#
+# OPTIONS:
+#   --targets "A B ..."  target species [default: "O3 OH HO2 NO NO2"]
+#   --threshold X        threshold of the DRG method (`reduce`) [default: 0.1]
+#   --tolerance X        largest relative difference of the concentrations
+#                        of the target species (`validate`) [default: 0.05]
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import glob
+import argparse
+import mech_converter
+import mechanism_pruning
+
+# Default target species: ozone, HOx and NOx.
+defaultTargets = 'O3 OH HO2 NO NO2'
+
+# Concentrations of the reference run smaller than this fraction of the
+# largest concentration of a species are compared as absolute differences.
+concentrationFloor = 1.0e-3
+
+# =========================== FUNCTIONS =========================== #
+
+
+def read_reaction_rates(output_dir, reactions):
+    """
+    Read the rates of the reactions at each output time of a model run,
+    from the reactionRates/ directory or, if it is empty, from the
+    productionRates.output and lossRates.output files. The rate of a
+    reaction in productionRates.output (lossRates.output) is divided by
+    the stoichiometric coefficient of the species in the products
+    (reactants) of the reaction.
+
+    Args:
+        output_dir (str): path to the output directory of the model run
+        reactions (list): (reactants, products) of each reaction, with their
+                          stoichiometric coefficients
+
+    Returns:
+        samples (list): dict reaction index (from 0) -> absolute value of the
+                        reaction rate, for each output time
+    """
+
+    samples = []
+    for rates_file in sorted(glob.glob(os.path.join(output_dir, 'reactionRates', '*'))):
+        sample = {}
+        with open(rates_file, 'r') as rates:
+            next(rates, None)
+            for line in rates:
+                fields = line.split()
+                # The reactions after the chemical mechanism are the dilution reactions.
+                if len(fields) == 2 and int(fields[0]) <= len(reactions):
+                    sample[int(fields[0]) - 1] = abs(float(fields[1]))
+        samples.append(sample)
+    if samples:
+        return samples
+
+    by_time = {}
+    for filename, side in [('productionRates.output', 1), ('lossRates.output', 0)]:
+        rates_file = os.path.join(output_dir, filename)
+        if not os.path.isfile(rates_file):
+            continue
+        with open(rates_file, 'r') as rates:
+            next(rates, None)
+            for line in rates:
+                fields = line.split()
+                if len(fields) < 5:
+                    continue
+                k = int(fields[3]) - 1
+                if k >= len(reactions):
+                    continue
+                coeff = reactions[k][side].get(fields[2], 1.0) or 1.0
+                by_time.setdefault(fields[0], {})[k] = abs(float(fields[4])) / coeff
+    return [by_time[t] for t in sorted(by_time, key=float)]
+
+def net_stoichiometry(reactions):
+    """
+    Calculate the net stoichiometric coefficients (products minus
+    reactants) of the species of each reaction.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, with their
+                          stoichiometric coefficients
+
+    Returns:
+        net (list): dict name -> nonzero net stoichiometric coefficient, for
+                    each reaction
+    """
+
+    net = []
+    for reactants, products in reactions:
+        coeffs = dict(products)
+        for x, coeff in reactants.items():
+            coeffs[x] = coeffs.get(x, 0.0) - coeff
+        net.append({x: coeff for x, coeff in coeffs.items() if coeff != 0.0})
+    return net
+
+def relation_graph(reactions, samples, threshold):
+    """
+    Build the directed relation graph of a chemical mechanism: species A
+    depends on species B if, at any output time, the reactions which
+    involve B make a fraction larger than the threshold of the total
+    production and loss of A.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, with their
+                          stoichiometric coefficients
+        samples (list): reaction rates at each output time (see
+                        read_reaction_rates)
+        threshold (float): threshold of the DRG method
+
+    Returns:
+        graph (dict): name of species A -> set of the names of the species
+                      A depends on
+    """
+
+    net = net_stoichiometry(reactions)
+    members = [set(reactants) | set(products) for reactants, products in reactions]
+    graph = {}
+    for sample in samples:
+        total = {}
+        partial = {}
+        for k, rate in sample.items():
+            if rate == 0.0:
+                continue
+            for a, coeff in net[k].items():
+                flux = abs(coeff) * rate
+                total[a] = total.get(a, 0.0) + flux
+                partial_a = partial.setdefault(a, {})
+                for b in members[k]:
+                    partial_a[b] = partial_a.get(b, 0.0) + flux
+        for a, partial_a in partial.items():
+            graph.setdefault(a, set()).update(
+                b for b, flux in partial_a.items() if b != a and flux > threshold * total[a])
+    return graph
+
+def skeletal_reactions(reactions, samples, targets, threshold, required=()):
+    """
+    Select the reactions of the skeletal mechanism: the reactions
+    between the species on which the target species depend, directly or
+    through other species. For each required species which is not in
+    these reactions, the first reaction of the species is also kept.
+
+    Args:
+        reactions (list): (reactants, products) of each reaction, with their
+                          stoichiometric coefficients
+        samples (list): reaction rates at each output time (see
+                        read_reaction_rates)
+        targets (set): names of the target species
+        threshold (float): threshold of the DRG method
+        required (set): names of the species which must stay in the mechanism
+
+    Returns:
+        keep (list): True for each reaction to keep
+    """
+
+    graph = relation_graph(reactions, samples, threshold)
+    kept_species = set()
+    pending = list(targets)
+    while pending:
+        x = pending.pop()
+        if x not in kept_species:
+            kept_species.add(x)
+            pending.extend(graph.get(x, ()))
+
+    keep = [kept_species.issuperset(reactants) and kept_species.issuperset(products)
+            for reactants, products in reactions]
+    mechanism_pruning.keep_required_species([(set(r), set(p)) for r, p in reactions],
+                                            keep, set(required))
+    return keep
+
+def reduce_mechanism(mech_file, output_dir, mech_dir, skeletal_file, targets, threshold):
+    """
+    Write the skeletal mechanism of a chemical mechanism, and report the
+    number of reactions and species removed.
+
+    Args:
+        mech_file (str): path to the chemical mechanism file (.fac or .kpp)
+        output_dir (str): path to the output directory of the reference model run
+        mech_dir (str): path to the model configuration directory
+        skeletal_file (str): path to the skeletal mechanism file to write
+        targets (list): names of the target species
+        threshold (float): threshold of the DRG method
+    """
+
+    reactions, ro2List, _ = mech_converter.read_mechanism_reactions(mech_file)
+    samples = read_reaction_rates(output_dir, reactions)
+    assert samples, 'No reaction rates found in ' + output_dir
+    missing = len(reactions) - len(set().union(*samples))
+    if missing > 0:
+        print('Warning: no rate for ' + str(missing) + ' of ' + str(len(reactions))
+              + ' reactions, which are considered to have a rate of zero')
+
+    required = mechanism_pruning.required_species(mech_dir)
+    keep = skeletal_reactions(reactions, samples, set(targets) | required, threshold, required)
+    removed, numberOfSpecies = mech_converter.removed_species(reactions, keep)
+    with open(skeletal_file, 'w') as skeletal_mech:
+        mech_converter.write_selected_reactions(mech_file, keep, ro2List, removed, skeletal_mech)
+    print('Reduction (threshold ' + str(threshold) + '): ' + str(keep.count(False)) + ' of '
+          + str(len(reactions)) + ' reactions and ' + str(len(removed)) + ' of '
+          + str(numberOfSpecies) + ' species removed')
+    print('Skeletal mechanism written to: ' + skeletal_file)
+
+def read_concentrations(output_dir):
+    """
+    Read the concentrations of the species in speciesConcentrations.output.
+
+    Args:
+        output_dir (str): path to the output directory of the model run
+
+    Returns:
+        concentrations (dict): name -> list of the concentrations of the species
+    """
+
+    with open(os.path.join(output_dir, 'speciesConcentrations.output'), 'r') as conc_file:
+        names = conc_file.readline().split()
+        concentrations = {x: [] for x in names}
+        for line in conc_file:
+            for x, value in zip(names, line.split()):
+                concentrations[x].append(float(value))
+    return concentrations
+
+def validate_reduction(reference_dir, skeletal_dir, targets, tolerance):
+    """
+    Compare the concentrations of the target species in a model run
+    with the skeletal mechanism to those in the reference model run. The
+    difference is relative to the concentration in the reference model
+    run, or to concentrationFloor times the largest concentration of the
+    species, whichever is larger.
+
+    Args:
+        reference_dir (str): path to the output directory of the reference run
+        skeletal_dir (str): path to the output directory of the run with the
+                            skeletal mechanism
+        targets (list): names of the target species
+        tolerance (float): largest relative difference of the concentrations
+
+    Returns:
+        valid (bool): True if all the differences are within the tolerance
+    """
+
+    reference = read_concentrations(reference_dir)
+    skeletal = read_concentrations(skeletal_dir)
+    valid = True
+    for x in targets:
+        if x not in reference or x not in skeletal:
+            print('%-12s not in speciesConcentrations.output' % x)
+            valid = False
+            continue
+        floor = concentrationFloor * max(abs(c) for c in reference[x])
+        difference = max([abs(s - r) / max(abs(r), floor, sys.float_info.min)
+                          for r, s in zip(reference[x], skeletal[x])] or [0.0])
+        if len(reference[x]) != len(skeletal[x]):
+            print('%-12s different number of output times' % x)
+            valid = False
+        elif difference > tolerance:
+            valid = False
+        print('%-12s largest relative difference %.3e %s' % (
+            x, difference, 'OK' if difference <= tolerance else 'FAILED'))
+    return valid
+
+
+# =========================== MAIN =========================== #
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Reduce a chemical mechanism with the Directed Relation Graph method, '
+        'and compare the results of the reduced mechanism to a reference model run.')
+    subparsers = parser.add_subparsers(dest='command')
+    reduce_parser = subparsers.add_parser('reduce', help='write the skeletal mechanism')
+    reduce_parser.add_argument('mech_file',
+                               help='path to the chemical mechanism file (.fac or .kpp)')
+    reduce_parser.add_argument('output_dir',
+                               help='path to the output directory of the reference model run')
+    reduce_parser.add_argument('config_dir',
+                               help='path to the model configuration directory')
+    reduce_parser.add_argument('skeletal_file',
+                               help='path to the skeletal mechanism file to write (.fac)')
+    reduce_parser.add_argument('--threshold', type=float, default=0.1,
+                               help='threshold of the DRG method [default: %(default)s]')
+    validate_parser = subparsers.add_parser('validate',
+                                            help='compare a model run with the skeletal '
+                                            'mechanism to the reference model run')
+    validate_parser.add_argument('reference_dir',
+                                 help='path to the output directory of the reference model run')
+    validate_parser.add_argument('skeletal_dir',
+                                 help='path to the output directory of the model run with '
+                                 'the skeletal mechanism')
+    validate_parser.add_argument('--tolerance', type=float, default=0.05,
+                                 help='largest relative difference of the concentrations of '
+                                 'the target species [default: %(default)s]')
+    for subparser in [reduce_parser, validate_parser]:
+        subparser.add_argument('--targets', default=defaultTargets,
+                               help='target species [default: "%(default)s"]')
+    args = parser.parse_args()
+
+    if args.command == 'reduce':
+        assert os.path.isfile(args.mech_file), 'Failed to find file ' + args.mech_file
+        assert 0.0 < args.threshold < 1.0, 'The threshold must be between 0 and 1'
+        reduce_mechanism(args.mech_file, args.output_dir, args.config_dir, args.skeletal_file,
+                         args.targets.split(), args.threshold)
+    elif args.command == 'validate':
+        if not validate_reduction(args.reference_dir, args.skeletal_dir, args.targets.split(),
+                                  args.tolerance):
+            sys.exit(1)
+    else:
+        parser.print_usage()
+        sys.exit(1)
+
+# Call the main function if executed as script
+if __name__ == '__main__':
+    main()
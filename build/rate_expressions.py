@@ -0,0 +1,716 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script contains the functions used by mech_converter.py to
+# parse the rate expressions of a chemical mechanism -- after they
+# have been converted to Fortran syntax -- into expression trees,
+# to transform the expression trees, and to write them back to
+# Fortran.
+#
+# An expression tree is made of nested tuples, so that identical
+# subexpressions compare (and hash) as equal:
+#
+# - ('num', text): numeric literal, e.g. ('num', '2.7D-12')
+# - ('var', name): variable, e.g. ('var', 'TEMP')
+# - ('call', name, args): function call or array element,
+#   e.g. ('call', 'EXP', (('var', 'X'),)) or ('call', 'q', (('num', '3'),))
+# - ('neg', operand): unary minus
+# - ('pos', operand): unary plus
+# - (op, left, right): binary operation, where op is one of
+#   '+', '-', '*', '/', '**'
+#
+# The trees preserve the order of evaluation of the original
+# expressions, so writing a tree back to Fortran gives an expression
+# which evaluates to exactly the same value. The transformations
+# (constant folding, elimination of common subexpressions) also
+# preserve the value of the expressions, bit for bit.
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import re
+import math
+import struct
+
+# Arrays of the mechanism: their elements are treated as variables.
+arrayNames = {'q', 'J'}
+
+# Intrinsic functions which can appear in the rate expressions. Calls to
+# other functions (e.g. user-defined custom rate functions) are never moved
+# or merged, as they may not be pure.
+intrinsicFunctions = {'EXP', 'LOG', 'LOG10', 'SQRT', 'ABS', 'MIN', 'MAX'}
+
+# Tokens of a Fortran expression: numbers, names, operators and brackets.
+token_regex = re.compile(r'\s*(?:'
+                         r'(?P<num>(?:\d+\.?\d*|\.\d+)(?:[dDeE][+-]?\d+)?(?:_\w+)?)'
+                         r'|(?P<name>[A-Za-z_]\w*)'
+                         r'|(?P<op>\*\*|[-+*/(),]))')
+
+# Numeric literals: mantissa, exponent and kind parameter.
+literal_regex = re.compile(r'^(?P<mantissa>\d+\.?\d*|\.\d+)'
+                           r'(?:(?P<letter>[dDeE])(?P<exponent>[+-]?\d+))?(?:_(?P<kind>\w+))?$')
+
+# Kinds of the numeric literals, in order of promotion in mixed operations.
+INTEGER, SINGLE, DOUBLE = 0, 1, 2
+
+# Range of the default integer kind.
+maxInteger = 2**31 - 1
+
+# Binding strength of each type of node, used to decide where to write brackets.
+precedence = {'+': 1, '-': 1, 'neg': 1, 'pos': 1, '*': 2, '/': 2, '**': 3}
+atomPrecedence = 4
+
+
+class ExpressionError(ValueError):
+    """
+    Raised when a rate expression cannot be parsed.
+    """
+
+# =========================== FUNCTIONS =========================== #
+
+
+def tokenise(expression):
+    """
+    Split a Fortran expression into tokens.
+
+    Args:
+        expression (str): Fortran expression
+
+    Returns:
+        tokens (list): list of tuples (type, text), where type is
+                       'num', 'name' or 'op'
+    """
+
+    tokens = []
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = token_regex.match(expression, pos)
+        if match is None or match.end() == pos:
+            raise ExpressionError('Cannot parse rate expression "' + expression \
+                                  + '" at character ' + str(pos + 1))
+        tokens.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return tokens
+
+# ------------------------------------------------------------ #
+
+def parse(expression):
+    """
+    Parse a Fortran expression into an expression tree, following the
+    Fortran rules of precedence: '**' binds tightest and is right
+    associative, then '*' and '/', then '+', '-' and the unary
+    minus. Operators of equal precedence are left associative.
+
+    Args:
+        expression (str): Fortran expression
+
+    Returns:
+        tree (tuple): expression tree (see the documentation at the top of this script)
+    """
+
+    tokens = tokenise(expression)
+    tree, pos = parse_sum(tokens, 0, expression)
+    if pos != len(tokens):
+        raise ExpressionError('Unexpected "' + tokens[pos][1] + '" in rate expression "' \
+                              + expression + '"')
+    return tree
+
+def parse_sum(tokens, pos, expression):
+    """
+    Parse a sum or difference of terms, with an optional leading sign.
+    See parse() for the arguments.
+    """
+
+    if pos < len(tokens) and tokens[pos] in (('op', '-'), ('op', '+')):
+        sign = 'neg' if tokens[pos][1] == '-' else 'pos'
+        term, pos = parse_term(tokens, pos + 1, expression)
+        tree = (sign, term)
+    else:
+        tree, pos = parse_term(tokens, pos, expression)
+    while pos < len(tokens) and tokens[pos] in (('op', '+'), ('op', '-')):
+        op = tokens[pos][1]
+        term, pos = parse_term(tokens, pos + 1, expression)
+        tree = (op, tree, term)
+    return tree, pos
+
+def parse_term(tokens, pos, expression):
+    """
+    Parse a product or quotient of factors. See parse() for the arguments.
+    """
+
+    tree, pos = parse_factor(tokens, pos, expression)
+    while pos < len(tokens) and tokens[pos] in (('op', '*'), ('op', '/')):
+        op = tokens[pos][1]
+        factor, pos = parse_factor(tokens, pos + 1, expression)
+        tree = (op, tree, factor)
+    return tree, pos
+
+def parse_factor(tokens, pos, expression):
+    """
+    Parse a power (right associative). See parse() for the arguments.
+    """
+
+    tree, pos = parse_primary(tokens, pos, expression)
+    if pos < len(tokens) and tokens[pos] == ('op', '**'):
+        exponent, pos = parse_factor(tokens, pos + 1, expression)
+        tree = ('**', tree, exponent)
+    return tree, pos
+
+def parse_primary(tokens, pos, expression):
+    """
+    Parse a number, a variable, a function call or an expression in
+    brackets. See parse() for the arguments.
+    """
+
+    if pos >= len(tokens):
+        raise ExpressionError('Unexpected end of rate expression "' + expression + '"')
+    kind, text = tokens[pos]
+    if kind == 'num':
+        return ('num', text), pos + 1
+    if kind == 'name':
+        if pos + 1 < len(tokens) and tokens[pos + 1] == ('op', '('):
+            args = []
+            pos += 2
+            while True:
+                arg, pos = parse_sum(tokens, pos, expression)
+                args.append(arg)
+                if pos < len(tokens) and tokens[pos] == ('op', ','):
+                    pos += 1
+                    continue
+                break
+            if pos >= len(tokens) or tokens[pos] != ('op', ')'):
+                raise ExpressionError('Missing ")" in rate expression "' + expression + '"')
+            return ('call', text, tuple(args)), pos + 1
+        return ('var', text), pos + 1
+    if (kind, text) == ('op', '('):
+        tree, pos = parse_sum(tokens, pos + 1, expression)
+        if pos >= len(tokens) or tokens[pos] != ('op', ')'):
+            raise ExpressionError('Missing ")" in rate expression "' + expression + '"')
+        return tree, pos + 1
+    raise ExpressionError('Unexpected "' + text + '" in rate expression "' + expression + '"')
+
+# ------------------------------------------------------------ #
+
+def node_precedence(tree):
+    """
+    Return the binding strength of the top node of an expression tree.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        prec (int): precedence of the node
+    """
+
+    return precedence.get(tree[0], atomPrecedence)
+
+def to_fortran(tree):
+    """
+    Write an expression tree as a Fortran expression. Brackets are
+    added wherever they are needed to preserve the order of evaluation
+    of the tree.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        expression (str): Fortran expression
+    """
+
+    kind = tree[0]
+    if kind in ('num', 'var'):
+        return tree[1]
+    if kind == 'call':
+        return tree[1] + '(' + ','.join(to_fortran(arg) for arg in tree[2]) + ')'
+    if kind in ('neg', 'pos'):
+        operand = to_fortran(tree[1])
+        if node_precedence(tree[1]) <= precedence['neg']:
+            operand = '(' + operand + ')'
+        return ('-' if kind == 'neg' else '+') + operand
+
+    op, left, right = tree
+    prec = precedence[op]
+    left_str = to_fortran(left)
+    right_str = to_fortran(right)
+    # '**' is right associative, so its left operand needs brackets if it is
+    # also a power; the other operators are left associative, so their right
+    # operand needs brackets if it has the same precedence. A signed operand
+    # always needs brackets, except at the start of a sum.
+    left_prec = node_precedence(left)
+    if left_prec < prec or (op == '**' and left_prec == prec) \
+       or (left[0] in ('neg', 'pos') and op not in ('+', '-')):
+        left_str = '(' + left_str + ')'
+    right_prec = node_precedence(right)
+    if right_prec < prec or (op != '**' and right_prec == prec) or right[0] in ('neg', 'pos'):
+        right_str = '(' + right_str + ')'
+    return left_str + op + right_str
+
+# ------------------------------------------------------------ #
+
+def is_leaf(tree):
+    """
+    Check whether an expression tree is a number, a variable or an
+    element of one of the mechanism arrays (q, J).
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        leaf (bool): True if the tree is a leaf
+    """
+
+    return tree[0] in ('num', 'var') or (tree[0] == 'call' and tree[1] in arrayNames)
+
+def children(tree):
+    """
+    Return the operands (or the arguments) of the top node of an
+    expression tree.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        operands (tuple): expression trees of the operands
+    """
+
+    if is_leaf(tree):
+        return ()
+    if tree[0] == 'call':
+        return tree[2]
+    return tree[1:]
+
+def is_movable(tree):
+    """
+    Check whether an expression tree only calls intrinsic functions,
+    so that it can be evaluated once and reused.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        movable (bool): True if the tree only calls intrinsic functions
+    """
+
+    if tree[0] == 'call' and not is_leaf(tree) and tree[1].upper() not in intrinsicFunctions:
+        return False
+    return all(is_movable(child) for child in children(tree))
+
+def is_constant(tree):
+    """
+    Check whether an expression tree only contains numeric literals.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        constant (bool): True if the tree contains no variables
+    """
+
+    if tree[0] == 'var' or (tree[0] == 'call' and tree[1] in arrayNames):
+        return False
+    return all(is_constant(child) for child in children(tree))
+
+def count_costly_operations(tree):
+    """
+    Count the exponentials and the powers in an expression tree, which
+    are the most expensive operations in the rate expressions.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        n_exp (int): number of calls to EXP
+        n_pow (int): number of '**' operations
+    """
+
+    n_exp = 1 if tree[0] == 'call' and tree[1].upper() == 'EXP' else 0
+    n_pow = 1 if tree[0] == '**' else 0
+    for child in children(tree):
+        child_exp, child_pow = count_costly_operations(child)
+        n_exp += child_exp
+        n_pow += child_pow
+    return n_exp, n_pow
+
+# ------------------------------------------------------------ #
+
+def literal_value(text):
+    """
+    Return the value and the kind of a numeric literal. Integers
+    are of the default integer kind, reals with a 'D' exponent or
+    with the '_DP' kind parameter are double precision, and all
+    the other reals are single precision (the default real kind).
+
+    Args:
+        text (str): numeric literal (e.g. '2', '0.917', '2.7D-12', '1.0e-31_DP')
+
+    Returns:
+        literal (tuple): value and kind (INTEGER, SINGLE or DOUBLE) of the literal,
+                         or None if the kind is not known
+    """
+
+    match = literal_regex.match(text)
+    if match is None:
+        return None
+    mantissa, letter, exponent, kind = match.group('mantissa', 'letter', 'exponent', 'kind')
+    is_real = '.' in mantissa or letter is not None
+    if kind is not None:
+        # Only the DP kind parameter of mechanism.f90 is known.
+        if kind != 'DP' or not is_real:
+            return None
+        literal_kind = DOUBLE
+    elif letter in ('d', 'D'):
+        literal_kind = DOUBLE
+    elif is_real:
+        literal_kind = SINGLE
+    else:
+        return int(mantissa), INTEGER
+    value = float(mantissa + ('e' + exponent if exponent else ''))
+    if literal_kind == SINGLE:
+        value = to_single(value)
+    return value, literal_kind
+
+def to_single(value):
+    """
+    Round a number to the nearest single precision number.
+
+    Args:
+        value (float): number
+
+    Returns:
+        single (float): the nearest single precision number, or None
+                        if it is out of range
+    """
+
+    try:
+        return struct.unpack('f', struct.pack('f', value))[0]
+    except OverflowError:
+        return None
+
+def make_literal(value, kind):
+    """
+    Write a number as the shortest Fortran literal of the given kind
+    which has exactly the same value. Double precision literals use
+    the '_DP' kind parameter (e.g. '5.0e-12_DP').
+
+    Args:
+        value (float or int): number
+        kind (int): INTEGER, SINGLE or DOUBLE
+
+    Returns:
+        tree (tuple): expression tree of the literal (with a unary minus if
+                      the number is negative)
+    """
+
+    magnitude = abs(value)
+    if kind == INTEGER:
+        text = str(magnitude)
+    else:
+        # Find the smallest number of significant digits which gives back the
+        # same number, then use the shorter of the plain and scientific notations.
+        rounding = float if kind == DOUBLE else to_single
+        for digits in range(17):
+            scientific = '%.*e' % (digits, magnitude)
+            if rounding(float(scientific)) == magnitude:
+                break
+        mantissa, _, exponent = scientific.partition('e')
+        if '.' not in mantissa:
+            mantissa += '.0'
+        scientific = mantissa + 'e' + str(int(exponent))
+        plain = '%.*f' % (max(digits - int(exponent), 1), magnitude)
+        text = plain if len(plain) <= len(scientific) else scientific
+        if kind == DOUBLE:
+            text += '_DP'
+    tree = ('num', text)
+    return ('neg', tree) if value < 0 or (value == 0 and math.copysign(1, value) < 0) else tree
+
+def constant_value(tree):
+    """
+    Return the value and the kind of an expression tree, if it is a
+    (possibly signed) numeric literal.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        literal (tuple): value and kind of the literal, or None
+    """
+
+    if tree[0] == 'num':
+        return literal_value(tree[1])
+    if tree[0] in ('neg', 'pos') and tree[1][0] == 'num':
+        literal = literal_value(tree[1][1])
+        if literal is not None and tree[0] == 'neg':
+            literal = (-literal[0], literal[1])
+        return literal
+    return None
+
+def evaluate_operation(op, left, right):
+    """
+    Evaluate a binary operation between two numeric literals, with the
+    rules of Fortran: the operand of the lower kind is converted to
+    the kind of the other operand, and the result is rounded to that
+    kind. Integer division truncates towards zero.
+
+    The operations whose result could differ from the result of the
+    Fortran compiler are not evaluated: powers of real numbers, integer
+    overflows, divisions by zero, and results out of range.
+
+    Args:
+        op (str): '+', '-', '*', '/' or '**'
+        left (tuple): value and kind of the left operand
+        right (tuple): value and kind of the right operand
+
+    Returns:
+        result (tuple): value and kind of the result, or None if the
+                        operation is not evaluated
+    """
+
+    (a, a_kind), (b, b_kind) = left, right
+    kind = max(a_kind, b_kind)
+    if kind == INTEGER:
+        if op == '+':
+            value = a + b
+        elif op == '-':
+            value = a - b
+        elif op == '*':
+            value = a * b
+        elif op == '/' and b != 0:
+            value = abs(a) // abs(b) * (1 if (a < 0) == (b < 0) else -1)
+        elif op == '**' and 0 <= b <= 64:
+            value = a ** b
+        else:
+            return None
+        return (value, kind) if abs(value) <= maxInteger else None
+
+    a, b = float(a), float(b)
+    if kind == SINGLE:
+        a, b = to_single(a), to_single(b)
+    if op == '+':
+        value = a + b
+    elif op == '-':
+        value = a - b
+    elif op == '*':
+        value = a * b
+    elif op == '/' and b != 0:
+        value = a / b
+    else:
+        return None
+    # An operation in double precision, rounded to single precision, gives
+    # the correctly rounded result in single precision.
+    if kind == SINGLE:
+        value = to_single(value)
+    if value is None or math.isinf(value) or math.isnan(value) \
+       or (value != 0 and abs(value) < (1.1754943508222875e-38 if kind == SINGLE else 2.2250738585072014e-308)):
+        return None
+    return value, kind
+
+def fold_constants(tree):
+    """
+    Evaluate the operations between numeric literals in an expression
+    tree, and write all the double precision literals in the canonical
+    form given by make_literal(). The order of evaluation of the tree
+    is preserved: e.g. '1.0D-11*0.5*TEMP' is folded to '5.0e-12_DP*TEMP',
+    but 'TEMP*1.0D-11*0.5' is not changed.
+
+    Args:
+        tree (tuple): expression tree
+
+    Returns:
+        new_tree (tuple): expression tree with the constants folded
+        n_folded (int): number of operations which have been evaluated
+    """
+
+    kind = tree[0]
+    if kind == 'num':
+        literal = literal_value(tree[1])
+        if literal is not None and literal[1] == DOUBLE:
+            return make_literal(*literal), 0
+        return tree, 0
+    if kind == 'var' or is_leaf(tree):
+        return tree, 0
+
+    n_folded = 0
+    new_children = []
+    for child in children(tree):
+        new_child, n_child = fold_constants(child)
+        new_children.append(new_child)
+        n_folded += n_child
+    if kind == 'call':
+        return ('call', tree[1], tuple(new_children)), n_folded
+    new_tree = (kind,) + tuple(new_children)
+
+    if kind in ('+', '-', '*', '/', '**'):
+        left, right = (constant_value(child) for child in new_children)
+        if left is not None and right is not None:
+            result = evaluate_operation(kind, left, right)
+            if result is not None:
+                return make_literal(*result), n_folded + 1
+    return new_tree, n_folded
+
+def fold_rate_expression(expression):
+    """
+    Apply fold_constants() to a rate expression in Fortran syntax. The
+    expression is returned unchanged if it cannot be parsed, or if
+    nothing has been folded or rewritten.
+
+    Args:
+        expression (str): Fortran expression
+
+    Returns:
+        new_expression (str): Fortran expression with the constants folded
+        n_folded (int): number of operations which have been evaluated
+    """
+
+    try:
+        tree = parse(expression)
+    except ExpressionError:
+        return expression, 0
+    new_tree, n_folded = fold_constants(tree)
+    if new_tree == tree:
+        return expression, 0
+    return to_fortran(new_tree), n_folded
+
+# ------------------------------------------------------------ #
+
+def eliminate_common_subexpressions(trees, first_index):
+    """
+    Find the subexpressions which appear more than once in a list of
+    expression trees, and replace them with elements of the vector q,
+    starting from q(first_index). Each subexpression is then evaluated
+    once, instead of once per occurrence.
+
+    Only subexpressions containing at least one operation and one
+    variable, and calling only intrinsic functions, are replaced:
+    constant subexpressions are evaluated by the compiler, and their
+    type (e.g. integer) must be preserved. The largest repeated
+    subexpressions are replaced first, so a subexpression which only
+    appears inside a larger replaced subexpression is not replaced
+    on its own.
+
+    Args:
+        trees (list): expression trees
+        first_index (int): index of the first element of q to use
+
+    Returns:
+        temporaries (list): list of tuples (index, tree), where tree is the
+                            subexpression to be assigned to q(index), in an
+                            order such that each one only refers to the previous ones
+        new_trees (list): expression trees, with the repeated subexpressions
+                          replaced by elements of q
+    """
+
+    # Count the occurrences of each subexpression, and remember their size
+    # and the order in which they first appear.
+    counts = {}
+    sizes = {}
+    first_seen = {}
+
+    def visit(tree):
+        counts[tree] = counts.get(tree, 0) + 1
+        if tree not in sizes:
+            first_seen[tree] = len(first_seen)
+            sizes[tree] = 1 + sum(visit(child) for child in children(tree))
+        else:
+            for child in children(tree):
+                visit(child)
+        return sizes[tree]
+
+    for tree in trees:
+        visit(tree)
+
+    # Visit the candidates from the largest to the smallest. When a
+    # subexpression is replaced, it is evaluated only once, so each of its
+    # own subexpressions loses (count - 1) occurrences per appearance in it.
+    candidates = sorted((t for t in counts if counts[t] > 1 and not is_leaf(t)),
+                        key=lambda t: (-sizes[t], first_seen[t]))
+    chosen = set()
+
+    def discount(tree, n):
+        for child in children(tree):
+            counts[child] -= n
+            discount(child, n)
+
+    for tree in candidates:
+        if counts[tree] > 1 and is_movable(tree) and not is_constant(tree):
+            chosen.add(tree)
+            discount(tree, counts[tree] - 1)
+
+    # Assign the elements of q, from the smallest to the largest
+    # subexpression, so that each one is defined before it is used.
+    indices = {}
+    for tree in sorted(chosen, key=lambda t: (sizes[t], first_seen[t])):
+        indices[tree] = first_index + len(indices)
+
+    def replace(tree, top=False):
+        if not top and tree in indices:
+            return ('call', 'q', (('num', str(indices[tree])),))
+        if is_leaf(tree):
+            return tree
+        if tree[0] == 'call':
+            return ('call', tree[1], tuple(replace(arg) for arg in tree[2]))
+        return (tree[0],) + tuple(replace(child) for child in tree[1:])
+
+    temporaries = [(index, replace(tree, top=True)) for tree, index in indices.items()]
+    new_trees = [replace(tree) for tree in trees]
+    return temporaries, new_trees
+
+def eliminate_rate_subexpressions(rates, first_index):
+    """
+    Apply eliminate_common_subexpressions() to the reaction rates of a
+    chemical mechanism, in Fortran syntax. Rates which cannot be parsed
+    are left unchanged.
+
+    Args:
+        rates (list): reaction rates, as Fortran expressions
+        first_index (int): index of the first element of q to use
+
+    Returns:
+        temporaries (list): list of tuples (index, expression), where expression
+                            is the Fortran expression to be assigned to q(index)
+        new_rates (list): reaction rates, with the repeated subexpressions replaced
+                          by elements of q
+        n_costly (tuple): number of calls to EXP and of '**' operations, before
+                          and after the elimination (exp_before, pow_before,
+                          exp_after, pow_after)
+    """
+
+    trees = []
+    for rate in rates:
+        try:
+            trees.append(parse(rate))
+        except ExpressionError:
+            trees.append(None)
+    parsed = [tree for tree in trees if tree is not None]
+
+    temporaries, new_parsed = eliminate_common_subexpressions(parsed, first_index)
+
+    exp_before = pow_before = exp_after = pow_after = 0
+    for tree in parsed:
+        n_exp, n_pow = count_costly_operations(tree)
+        exp_before += n_exp
+        pow_before += n_pow
+    for tree in new_parsed + [t for _, t in temporaries]:
+        n_exp, n_pow = count_costly_operations(tree)
+        exp_after += n_exp
+        pow_after += n_pow
+
+    # Only rewrite the rates which have changed, to keep the original formatting.
+    new_rates = []
+    new_trees = iter(new_parsed)
+    for rate, tree in zip(rates, trees):
+        if tree is None:
+            new_rates.append(rate)
+        else:
+            new_tree = next(new_trees)
+            new_rates.append(rate if new_tree == tree else to_fortran(new_tree))
+
+    return ([(index, to_fortran(tree)) for index, tree in temporaries], new_rates,
+            (exp_before, pow_before, exp_after, pow_after))
@@ -0,0 +1,197 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script contains the functions used by mech_converter.py to
+# renumber the species of a chemical mechanism, so that the nonzero
+# elements of the Jacobian matrix of the chemical system are close to
+# the diagonal.
+#
+# The element (i, j) of the Jacobian matrix -- the derivative of the
+# rate of change of species i with respect to the concentration of
+# species j -- is nonzero if species j is a reactant of a reaction
+# which consumes or produces species i. The species are renumbered
+# with the Reverse Cuthill-McKee (RCM) algorithm on the coupling graph
+# of the species, i.e. the symmetric sparsity pattern of the Jacobian
+# matrix.
+#
+# The upper and lower bandwidths of the Jacobian matrix are the
+# smallest values of `banded preconditioner upper bandwidth` and
+# `banded preconditioner lower bandwidth` in solver.parameters for
+# which the banded preconditioner of the solver (solver type 2)
+# includes all the nonzero elements of the Jacobian matrix.
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def read_reactions(mech_reac_file, mech_prod_file):
+    """
+    Read the reactants and the products of each reaction from the lines
+    of mechanism.reac and mechanism.prod (without the first line). The
+    stoichiometric coefficients of a species which appears more than
+    once on the same side of a reaction are added up.
+
+    Args:
+        mech_reac_file (file): lines of mechanism.reac, open for reading
+        mech_prod_file (file): lines of mechanism.prod, open for reading
+
+    Returns:
+        reactions (dict): reaction number -> (reactants, products), where
+                          reactants and products map each species number to
+                          its stoichiometric coefficient
+    """
+
+    reactions = {}
+    for position, body_file in enumerate([mech_reac_file, mech_prod_file]):
+        body_file.seek(0)
+        for line in body_file:
+            reaction, species, coeff = line.split()
+            side = reactions.setdefault(int(reaction), ({}, {}))[position]
+            side[int(species)] = side.get(int(species), 0.0) + float(coeff)
+    return reactions
+
+def renumber_reactions(reactions, new_number):
+    """
+    Renumber the species of the reactions.
+
+    Args:
+        reactions (dict): reaction number -> (reactants, products)
+        new_number (list): new number of each species
+
+    Returns:
+        reactions (dict): reaction number -> (reactants, products), with the
+                          new species numbers
+    """
+
+    return {reaction: tuple({new_number[x]: coeff for x, coeff in side.items()} for side in sides)
+            for reaction, sides in reactions.items()}
+
+def coupling_graph(number_of_species, reactions):
+    """
+    Build the coupling graph of the species: species i and j are
+    neighbours if the element (i, j) or the element (j, i) of the
+    Jacobian matrix is nonzero.
+
+    Args:
+        number_of_species (int): number of species, numbered from 1
+        reactions (dict): reaction number -> (reactants, products)
+
+    Returns:
+        neighbours (list): set of neighbours of each species (index 0 is unused)
+    """
+
+    neighbours = [set() for _ in range(number_of_species + 1)]
+    for reactants, products in reactions.values():
+        for j in reactants:
+            for i in reactants.keys() | products.keys():
+                if i != j:
+                    neighbours[i].add(j)
+                    neighbours[j].add(i)
+    return neighbours
+
+def bandwidths(reactions):
+    """
+    Calculate the upper and lower bandwidths of the Jacobian matrix.
+
+    Args:
+        reactions (dict): reaction number -> (reactants, products)
+
+    Returns:
+        upper (int): largest j - i of the nonzero elements (i, j)
+        lower (int): largest i - j of the nonzero elements (i, j)
+    """
+
+    upper = 0
+    lower = 0
+    for reactants, products in reactions.values():
+        # A reaction without reactants does not contribute to the Jacobian matrix.
+        if not reactants:
+            continue
+        rows = list(reactants) + list(products)
+        upper = max(upper, max(reactants) - min(rows))
+        lower = max(lower, max(rows) - min(reactants))
+    return upper, lower
+
+def breadth_first_search(start, neighbours, visited):
+    """
+    Breadth-first search of the coupling graph of the species, visiting
+    the neighbours of each species in order of increasing degree (then
+    in order of species number).
+
+    Args:
+        start (int): number of the first species
+        neighbours (list): set of neighbours of each species
+        visited (list): True for the species which must not be visited
+
+    Returns:
+        order (list): species in the order they are visited
+        last_level (list): species farthest from start
+        depth (int): number of levels of the search
+    """
+
+    seen = set([start])
+    order = [start]
+    level = [start]
+    depth = 0
+    while level:
+        last_level = level
+        depth += 1
+        level = []
+        for x in last_level:
+            for y in sorted(neighbours[x], key=lambda y: (len(neighbours[y]), y)):
+                if y not in seen and not visited[y]:
+                    seen.add(y)
+                    level.append(y)
+        order.extend(level)
+    return order, last_level, depth
+
+def reverse_cuthill_mckee(number_of_species, neighbours):
+    """
+    Order the species with the Reverse Cuthill-McKee algorithm. Each
+    connected component of the coupling graph is ordered from a
+    pseudo-peripheral species, found by repeated breadth-first
+    searches from a species of minimum degree. The ordering is
+    deterministic: ties are broken by the current species numbers.
+
+    Args:
+        number_of_species (int): number of species, numbered from 1
+        neighbours (list): set of neighbours of each species
+
+    Returns:
+        new_number (list): new number of each species (index 0 is unused)
+    """
+
+    visited = [False] * (number_of_species + 1)
+    ordering = []
+    for first in sorted(range(1, number_of_species + 1), key=lambda x: (len(neighbours[x]), x)):
+        if visited[first]:
+            continue
+        # Move the start to the farthest species of minimum degree, while this
+        # increases the number of levels of the search.
+        order, last_level, depth = breadth_first_search(first, neighbours, visited)
+        while True:
+            candidate = min(last_level, key=lambda x: (len(neighbours[x]), x))
+            candidate_search = breadth_first_search(candidate, neighbours, visited)
+            if candidate_search[2] <= depth:
+                break
+            order, last_level, depth = candidate_search
+        for x in order:
+            visited[x] = True
+        ordering.extend(order)
+    ordering.reverse()
+
+    new_number = [0] * (number_of_species + 1)
+    for position, x in enumerate(ordering, 1):
+        new_number[x] = position
+    return new_number
@@ -26,7 +26,7 @@ module argparse_mod
   end type flag
 
   ! Arguments for the atchem2 executable
-  type(flag), parameter :: valid_flags(10) = &
+  type(flag), parameter :: valid_flags(12) = &
               [ flag('--help', 'Displays this help message.'), &
                 flag('--model', 'The base directory of the model.'), &
                 flag('--output', 'The destination directory for output.'), &
@@ -38,7 +38,11 @@ module argparse_mod
                 flag('--spec_constraints', 'The directory containing species constraints data.'), &
                 flag('--mcm', 'The directory containing the MCM data files.'), &
                 flag('--shared_lib', 'The full path to the mechanism.so shared library ' // &
-                                     '(generated by ./build/build_atchem2.sh).') ]
+                                     '(generated by ./build/build_atchem2.sh).'), &
+                flag('--scenarios', 'The file with the names of the scenarios to run in sequence. Each scenario ' // &
+                                    'reads its input files from the directory of the same name next to this file.'), &
+                flag('--restart', 'The checkpoint file to restart the model run from ' // &
+                                  '(written in the output directory, see model.parameters).') ]
 
 contains
 
@@ -280,6 +284,10 @@ contains
     spec_constraints_dir  = read_value_or_default( valid_flags(8)%flag_switch, trim(constraints_dir)//'/species', names, values )
     mcm_dir               = read_value_or_default( valid_flags(9)%flag_switch, 'mcm', names, values )
     shared_library        = read_value_or_default( valid_flags(10)%flag_switch, 'model/configuration/mechanism.so', names, values )
+    scenarios_list        = read_value_or_default( valid_flags(11)%flag_switch, '', names, values )
+    restart_checkpoint    = read_value_or_default( valid_flags(12)%flag_switch, '', names, values )
+    scenario_dir          = ''
+    scenario_output_dir   = output_dir
 
     write (*, '(2A)') ' Model directory is: ', trim( model_dir )
     write (*, '(2A)') ' Output directory is: ', trim( output_dir )
@@ -291,7 +299,42 @@ contains
     write (*, '(2A)') ' Species Constraints directory is: ', trim( spec_constraints_dir )
     write (*, '(2A)') ' MCM directory is: ', trim( mcm_dir )
     write (*, '(2A)') ' Shared library is: ', trim( shared_library )
+    if ( len_trim( scenarios_list ) > 0 ) then
+      write (*, '(2A)') ' Scenarios file is: ', trim( scenarios_list )
+    end if
+    if ( len_trim( restart_checkpoint ) > 0 ) then
+      write (*, '(2A)') ' Restart checkpoint is: ', trim( restart_checkpoint )
+    end if
 
   end subroutine get_and_set_directories_from_command_arguments
 
+  ! -----------------------------------------------------------------
+  ! Set the directories of the scenario scenario_name (see the
+  ! --scenarios flag): its input files are read from the directory
+  ! scenario_name next to the scenarios file, and its output is written
+  ! to the directory scenario_name in the output directory, which is
+  ! created if needed.
+  subroutine set_scenario_directories( scenario_name )
+    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
+    use directories_mod
+
+    character(len=*), intent(in) :: scenario_name
+    integer :: slash, exit_status
+
+    slash = index( scenarios_list, '/', back=.true. )
+    scenario_dir = scenarios_list(1:slash) // trim( scenario_name )
+    scenario_output_dir = trim( output_dir ) // '/' // trim( scenario_name )
+    reactionRates_dir = trim( scenario_output_dir ) // '/reactionRates'
+
+    call execute_command_line( 'mkdir -p ' // trim( reactionRates_dir ), exitstat=exit_status )
+    if ( exit_status /= 0 ) then
+      write (stderr, '(2A)') 'Unable to create the output directory ', trim( reactionRates_dir )
+      stop
+    end if
+
+    write (*, '(2A)') ' Scenario directory is: ', trim( scenario_dir )
+    write (*, '(2A)') ' Scenario output directory is: ', trim( scenario_output_dir )
+
+  end subroutine set_scenario_directories
+
 end module argparse_mod
@@ -31,7 +31,8 @@ PROGRAM ATCHEM2
   use reaction_rates_mod
   use env_vars_mod
   use date_mod, only : calcInitialDateParameters, calcCurrentDateParameters
-  use directories_mod, only : output_dir, configuration_dir, shared_library
+  use zenith_data_mod, only : lha, sinld, cosld, cosx, secx, eqtime
+  use directories_mod, only : configuration_dir, shared_library, scenarios_list, restart_checkpoint
   use storage_mod, only : maxSpecLength, maxPhotoRateNameLength, maxFilepathLength
   use solver_params_mod
   use model_params_mod
@@ -39,8 +40,13 @@ PROGRAM ATCHEM2
   use input_functions_mod
   use config_functions_mod
   use output_functions_mod
-  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
-  use solver_functions_mod, only : jfy, proc
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec, setEnvVarNums
+  use interpolation_functions_mod, only : resetInterpolationCaches
+  use solver_functions_mod, only : jfy, proc, procConstant, procEnv, procJ, procRO2, useRateGroups, &
+                                   jacobian_size_proc, jacobian_pattern_proc, jacobianValues, useJacobian, &
+                                   jacRowStart, jacColumns, setSparsePattern, sparseColumns, numberOfColours, &
+                                   sparseJacobianRhsEvaluations, setStoichiometry, calcReactionRates
+  use sparse_solver_mod, only : initSparseSolver
   implicit none
 
   ! interface to linux API
@@ -86,6 +92,19 @@ PROGRAM ATCHEM2
   integer(kind=QI) :: runStart, runEnd, runTime, clockRate
   ! Number of species and reactions
   integer(kind=NPI) :: numSpec, numReac
+  ! Scenarios (see the --scenarios flag)
+  logical :: useScenarios, sameConstrainedSpecies
+  character(len=maxSpecLength), allocatable :: scenarioNames(:)
+  integer(kind=NPI) :: numberOfScenarios, scenario
+  integer(kind=NPI), allocatable :: firstConstrainedSpecies(:)
+  ! Restart from a checkpoint (see the --restart flag): the counters of
+  ! the solver statistics at the checkpoint, added to those of CVODE
+  ! (which start again from zero), and the size of the output files at
+  ! the checkpoint
+  logical :: useRestart
+  integer(kind=NPI) :: restartCounters(21), checkpointIout(21), solverStatistics(21)
+  integer(kind=NPI), parameter :: ioutCounters(14) = [3, 4, 5, 6, 7, 8, 11, 12, 16, 17, 18, 19, 20, 21]
+  integer(kind=LONG) :: outputOffsets(size( outputUnits ))
 
   ! Declarations for detailed rates output
   type(reaction_frequency_pair) :: invalid_reaction_frequency_pair
@@ -109,6 +128,9 @@ PROGRAM ATCHEM2
   integer :: closure
   integer(c_int), parameter :: rtld_lazy=1 ! value extracted from the C header file
   integer(c_int), parameter :: rtld_now=2 ! value extracted from the C header file
+  procedure(jacobian_size_proc), pointer :: jacobianSize
+  procedure(jacobian_pattern_proc), pointer :: jacobianPattern
+  integer(c_int) :: jacNumberOfSpecies, jacNumberOfNonZeros
 
   ! *****************************************************************
   ! Explicit declaration of FCVFUN() interface, which is a
@@ -158,17 +180,40 @@ PROGRAM ATCHEM2
   call get_and_set_directories_from_command_arguments()
   write (*,*)
 
+  ! Read in the names of the scenarios, if any (see the --scenarios
+  ! flag), and set the directories of the first one
+  useScenarios = ( len_trim( scenarios_list ) > 0 )
+  if ( useScenarios .eqv. .true. ) then
+    write (*, '(A)') '-----------'
+    write (*, '(A)') ' Scenarios'
+    write (*, '(A)') '-----------'
+    scenarioNames = readScenarios()
+    numberOfScenarios = size( scenarioNames )
+    if ( numberOfScenarios == 0 ) then
+      write (stderr, '(2A)') 'No scenarios in ', trim( scenarios_list )
+      stop
+    end if
+    call set_scenario_directories( scenarioNames(1) )
+    write (*,*)
+  else
+    ! Without scenarios, the model is run once, as a single scenario with
+    ! no name
+    allocate (scenarioNames(1))
+    scenarioNames(1) = ''
+    numberOfScenarios = 1
+  end if
+
+  ! When restarting from a checkpoint, the output of the model run is
+  ! kept until the checkpoint is read (see truncateOutputFiles())
+  useRestart = ( len_trim( restart_checkpoint ) > 0 )
+  restartCounters(:) = 0_NPI
+  if ( ( useRestart .eqv. .true. ) .and. ( useScenarios .eqv. .true. ) ) then
+    write (stderr, '(A)') 'The --restart and --scenarios flags cannot be used together.'
+    stop
+  end if
+
   ! Open files for output
-  open (unit=50, file=trim( output_dir ) // "/speciesConcentrations.output")
-  open (unit=51, file=trim( output_dir ) // "/errors.output")
-  open (unit=52, file=trim( output_dir ) // "/environmentVariables.output")
-  open (unit=53, file=trim( output_dir ) // "/finalModelState.output")
-  open (unit=55, file=trim( output_dir ) // "/jacobian.output")
-  open (unit=56, file=trim( output_dir ) // "/lossRates.output")
-  open (unit=57, file=trim( output_dir ) // "/mainSolverParameters.output")
-  open (unit=58, file=trim( output_dir ) // "/photolysisRates.output")
-  open (unit=59, file=trim( output_dir ) // "/photolysisRatesParameters.output")
-  open (unit=60, file=trim( output_dir ) // "/productionRates.output")
+  call openOutputFiles( append=useRestart )
   flush(6)
 
   library = trim( shared_library )
@@ -185,6 +230,30 @@ PROGRAM ATCHEM2
   end if
   call c_f_procpointer( proc_addr, proc )
 
+  ! Load the subroutines of the groups of rates, if the chemical mechanism has
+  ! been converted with them (see the --groups option of build/mech_converter.py)
+  proc_addr = dlsym( handle, "update_p_constant"//c_null_char )
+  if ( c_associated( proc_addr ) ) then
+    call c_f_procpointer( proc_addr, procConstant )
+    call c_f_procpointer( dlsym( handle, "update_p_env"//c_null_char ), procEnv )
+    call c_f_procpointer( dlsym( handle, "update_p_j"//c_null_char ), procJ )
+    call c_f_procpointer( dlsym( handle, "update_p_ro2"//c_null_char ), procRO2 )
+    useRateGroups = .true.
+  end if
+
+  ! Load the analytic Jacobian matrix, if the chemical mechanism has been
+  ! converted with it (see the --jacobian option of build/mech_converter.py)
+  proc_addr = dlsym( handle, "jacobian_values"//c_null_char )
+  if ( c_associated( proc_addr ) ) then
+    call c_f_procpointer( proc_addr, jacobianValues )
+    call c_f_procpointer( dlsym( handle, "jacobian_size"//c_null_char ), jacobianSize )
+    call c_f_procpointer( dlsym( handle, "jacobian_pattern"//c_null_char ), jacobianPattern )
+    call jacobianSize( jacNumberOfSpecies, jacNumberOfNonZeros )
+    allocate (jacRowStart(jacNumberOfSpecies + 1), jacColumns(jacNumberOfNonZeros))
+    call jacobianPattern( jacRowStart, jacColumns )
+    useJacobian = .true.
+  end if
+
   write (*, '(A)') '-----------------------'
   write (*, '(A)') ' Species and reactions'
   write (*, '(A)') '-----------------------'
@@ -197,9 +266,11 @@ PROGRAM ATCHEM2
   allocate (speciesConcs(numSpec), z(numSpec))
   ! Set array size = number of reactions
   allocate (reactionRates(numReac))
+  reactionRates(:) = 0.0_DP
 
   ! Read in reactions
   call readReactions()
+  call setStoichiometry( numReac, numSpec, clhs, clcoeff, crhs, crcoeff )
   write (*,*)
   neq = numSpec
 
@@ -208,9 +279,12 @@ PROGRAM ATCHEM2
   write (*,*)
 
   ! Set initial concentrations for all species for which this info is
-  ! provided, 0.0 for any unspecified.
-  call readAndSetInitialConcentrations( speciesConcs )
-  write (*,*)
+  ! provided, 0.0 for any unspecified. With the --scenarios flag, they
+  ! are read by each scenario instead.
+  if ( useScenarios .eqv. .false. ) then
+    call readAndSetInitialConcentrations( speciesConcs )
+    write (*,*)
+  end if
 
   write (*, '(A)') '----------------------------------------'
   write (*, '(A)') ' Species requiring detailed rate output'
@@ -266,9 +340,6 @@ PROGRAM ATCHEM2
   call calcInitialDateParameters()
 
   ! Hard coded solver parameters
-  t = modelStartTime
-  call calcCurrentDateParameters( t )
-  tout = timestepSize + t
   ! Parameters for FCVMALLOC(). (Comments from cvode guide) meth
   ! specifies the basic integration: 1 for Adams (nonstiff) or 2 for
   ! BDF stiff)
@@ -288,11 +359,6 @@ PROGRAM ATCHEM2
   ! internal step taken)
   itask = 1
 
-  ! currentNumTimestep counts the number of iterative steps. Set to
-  ! zero. Calculation will terminate when
-  ! currentNumTimestep>=maxNumTimesteps.
-  currentNumTimestep = 0
-
   ! fill speciesOfInterest with the names of species to output to
   ! concentration.output
   write (*, '(A)') '---------------------'
@@ -313,207 +379,363 @@ PROGRAM ATCHEM2
   call readPhotoRates()
   write (*,*)
 
-  ! Read in environment variables (FIXED, CONSTRAINED, CALC or
-  ! NOTUSED, see environmentVariables.config)
-  write (*, '(A)') '-----------------------'
-  write (*, '(A)') ' Environment variables'
-  write (*, '(A)') '-----------------------'
-  call readEnvVar()
-  write (*,*)
-
   ! *****************************************************************
-  ! SET CONSTRAINTS
+  ! RUN THE SCENARIOS
   ! *****************************************************************
 
-  write (*, '(A)') '-------------'
-  write (*, '(A)') ' Constraints'
-  write (*, '(A)') '-------------'
-  call readSpeciesConstraints( t, speciesConcs )
-  write (*,*)
+  ! The chemical mechanism, the photolysis rates and the solver are set
+  ! up once. Each scenario reads its initial concentrations, environment
+  ! variables and constraints, and is run from the model start time.
+  ! Without scenarios, the model is run once, and its initial
+  ! concentrations are read with the species above. From the second scenario, the
+  ! solver is re-initialised with FCVREINIT() instead of being set up
+  ! again.
+  do scenario = 1, numberOfScenarios
+
+    if ( useScenarios .eqv. .true. ) then
+      write (*, '(A)') '----------'
+      write (*, '(A)') ' Scenario'
+      write (*, '(A)') '----------'
+      write (*, '(A, I0, 3A)') ' Scenario ', scenario, ': ', trim( scenarioNames(scenario) ), '...'
+      if ( scenario > 1 ) then
+        call closeOutputFiles()
+        call set_scenario_directories( scenarioNames(scenario) )
+        call openOutputFiles()
+        call resetInterpolationCaches()
+        sparseJacobianRhsEvaluations = 0
+        ! The solar parameters are output at the model start time, before
+        ! they are calculated: start from zero, as in the first scenario
+        lha = 0.0_DP
+        sinld = 0.0_DP
+        cosld = 0.0_DP
+        cosx = 0.0_DP
+        secx = 0.0_DP
+        eqtime = 0.0_DP
+      end if
+      write (*,*)
+    end if
 
-  call outputSpeciesOfInterest( t, speciesOfInterest, speciesConcs )
+    t = modelStartTime
+    call calcCurrentDateParameters( t )
+    tout = timestepSize + t
+
+    ! currentNumTimestep counts the number of iterative steps. Set to
+    ! zero. Calculation will terminate when
+    ! currentNumTimestep>=maxNumTimesteps.
+    currentNumTimestep = 0
+
+    if ( useScenarios .eqv. .true. ) then
+      write (*, '(A)') '------------------------'
+      write (*, '(A)') ' Initial concentrations'
+      write (*, '(A)') '------------------------'
+      call readAndSetInitialConcentrations( speciesConcs )
+      write (*,*)
+    end if
 
-  ! This outputs z, which is speciesConcs with all the constrained
-  ! species removed.
-  call removeConstrainedSpeciesFromProbSpec( speciesConcs, getConstrainedSpecies(), z )
+    ! Read in environment variables (FIXED, CONSTRAINED, CALC or
+    ! NOTUSED, see environmentVariables.config)
+    write (*, '(A)') '-----------------------'
+    write (*, '(A)') ' Environment variables'
+    write (*, '(A)') '-----------------------'
+    call readEnvVar()
+    call setEnvVarNums()
+    write (*,*)
+
+    ! *****************************************************************
+    ! SET CONSTRAINTS
+    ! *****************************************************************
+
+    write (*, '(A)') '-------------'
+    write (*, '(A)') ' Constraints'
+    write (*, '(A)') '-------------'
+    call readSpeciesConstraints( t, speciesConcs )
+    write (*,*)
 
-  ! ADJUST PROBLEM SPECIFICATION TO GIVE NUMBER OF SPECIES TO BE
-  ! SOLVED FOR (N - C = M)
-  neq = numSpec - getNumberOfConstrainedSpecies()
-  write (*, '(A)') '---------------'
-  write (*, '(A)') ' Problem stats'
-  write (*, '(A)') '---------------'
-  write (*, '(A30, I0) ') ' neq = ', neq
-  write (*, '(A30, I0) ') ' numberOfConstrainedSpecies = ', getNumberOfConstrainedSpecies()
+    call outputSpeciesOfInterest( t, speciesOfInterest, speciesConcs )
 
-  flush(stderr)
+    ! This outputs z, which is speciesConcs with all the constrained
+    ! species removed.
+    call removeConstrainedSpeciesFromProbSpec( speciesConcs, z )
+
+    ! ADJUST PROBLEM SPECIFICATION TO GIVE NUMBER OF SPECIES TO BE
+    ! SOLVED FOR (N - C = M)
+    neq = numSpec - getNumberOfConstrainedSpecies()
+    write (*, '(A)') '---------------'
+    write (*, '(A)') ' Problem stats'
+    write (*, '(A)') '---------------'
+    write (*, '(A30, I0) ') ' neq = ', neq
+    write (*, '(A30, I0) ') ' numberOfConstrainedSpecies = ', getNumberOfConstrainedSpecies()
+
+    ! Restart the model run from the checkpoint (see the --restart
+    ! flag): its time and concentrations replace the model start time
+    ! and the initial concentrations.
+    if ( useRestart .eqv. .true. ) then
+      write (*,*)
+      write (*, '(A)') '---------'
+      write (*, '(A)') ' Restart'
+      write (*, '(A)') '---------'
+      call readCheckpoint( restart_checkpoint, t, tout, currentNumTimestep, speciesConcs, z(1:neq), checkpointIout, &
+                           rout, sparseJacobianRhsEvaluations, outputOffsets )
+      restartCounters(ioutCounters) = checkpointIout(ioutCounters)
+    end if
 
-  ! *****************************************************************
-  ! CONFIGURE SOLVER
-  ! *****************************************************************
+    flush(stderr)
 
-  ipar(1) = neq
-  ipar(2) = numReac
+    ! *****************************************************************
+    ! CONFIGURE SOLVER
+    ! *****************************************************************
 
-  call FNVINITS( 1, neq, ier )
-  if ( ier /= 0 ) then
-    write (stderr, 20) ier
-    20   format (///' SUNDIALS_ERROR: FNVINITS() returned ier = ', I5)
-    stop
-  end if
+    if ( scenario == 1 ) then
+      ipar(1) = neq
+      ipar(2) = numReac
 
-  write (*, '(A30, 1P e15.3) ') ' t0 = ', t
-  write (*,*)
-  call FCVMALLOC( t, z, meth, itmeth, iatol, rtol, atol, &
-                  iout, rout, ipar, rpar, ier )
-  if ( ier /= 0 ) then
-    write (stderr, 30) ier
-    30   format (///' SUNDIALS_ERROR: FCVMALLOC() returned ier = ', I5)
-    stop
-  end if
+      call FNVINITS( 1, neq, ier )
+      if ( ier /= 0 ) then
+        write (stderr, 20) ier
+        20   format (///' SUNDIALS_ERROR: FNVINITS() returned ier = ', I5)
+        stop
+      end if
 
-  call FCVSETIIN( 'MAX_NSTEPS', maxNumInternalSteps, ier )
-  write (*, '(A, I0)') ' setting maxnumsteps ier = ', ier
+      write (*, '(A30, 1P e15.3) ') ' t0 = ', t
+      write (*,*)
+      call FCVMALLOC( t, z, meth, itmeth, iatol, rtol, atol, &
+                      iout, rout, ipar, rpar, ier )
+      if ( ier /= 0 ) then
+        write (stderr, 30) ier
+        30   format (///' SUNDIALS_ERROR: FCVMALLOC() returned ier = ', I5)
+        stop
+      end if
 
-  call FCVSETRIN( 'MAX_STEP', maxStep, ier )
-  write (*, '(A, I0)') ' setting maxstep ier = ', ier
-  write (*,*)
+      call FCVSETIIN( 'MAX_NSTEPS', maxNumInternalSteps, ier )
+      write (*, '(A, I0)') ' setting maxnumsteps ier = ', ier
 
-  ! SELECT SOLVER TYPE ACCORDING TO FILE INPUT
-  ! SPGMR SOLVER
-  if ( solverType == 1 ) then
-    call FCVSPGMR( 0, 1, lookBack, deltaMain, ier )
-    ! SPGMR SOLVER WITH BANDED PRECONDITIONER
-  else if ( solverType == 2 ) then
-    call FCVSPGMR( 1, 1, lookBack, deltaMain, ier )
-    call FCVBPINIT( neq, preconBandUpper, preconBandLower, ier )
-    if ( ier /= 0 ) then
-      write (stderr,*) 'SUNDIALS_ERROR: preconditioner returned ier = ', ier ;
-      call FCVFREE()
-      stop
+      call FCVSETRIN( 'MAX_STEP', maxStep, ier )
+      write (*, '(A, I0)') ' setting maxstep ier = ', ier
+
+      ! When restarting, the solver starts with the step size of the
+      ! checkpoint
+      if ( useRestart .eqv. .true. ) then
+        call FCVSETRIN( 'INIT_STEP', rout(3), ier )
+        write (*, '(A, I0)') ' setting initstep ier = ', ier
+      end if
+      write (*,*)
+
+      ! SELECT SOLVER TYPE ACCORDING TO FILE INPUT
+      ! SPGMR SOLVER
+      if ( solverType == 1 ) then
+        call FCVSPGMR( 0, 1, lookBack, deltaMain, ier )
+        ! SPGMR SOLVER WITH BANDED PRECONDITIONER
+      else if ( solverType == 2 ) then
+        call FCVSPGMR( 1, 1, lookBack, deltaMain, ier )
+        call FCVBPINIT( neq, preconBandUpper, preconBandLower, ier )
+        if ( ier /= 0 ) then
+          write (stderr,*) 'SUNDIALS_ERROR: preconditioner returned ier = ', ier ;
+          call FCVFREE()
+          stop
+        end if
+        ! DENSE SOLVER
+      else if ( solverType == 3 ) then
+        call FCVDENSE( neq, ier )
+        ! Use the analytic Jacobian matrix (FCVDJAC()), if available
+        if ( useJacobian .and. ier == 0 ) then
+          call FCVDENSESETJAC( 1, ier )
+        end if
+        ! SPARSE DIRECT SOLVER (KLU)
+      else if ( solverType == 4 ) then
+        call setSparsePattern( numReac, numSpec, getConstrainedSpecies() )
+        write (*, '(A30, I0) ') ' Jacobian nonzero elements = ', size( sparseColumns )
+        if ( useJacobian .eqv. .false. ) then
+          write (*, '(A30, I0) ') ' Jacobian column colours = ', numberOfColours
+        end if
+        write (*,*)
+        call initSparseSolver( neq, int( size( sparseColumns ), NPI ), ier )
+        ! UNEXPECTED SOLVER TYPE
+      else
+        write (stderr,*) 'Error with solverType input, input = ', solverType
+        write (stderr,*) 'Available options are 1, 2, 3, 4.'
+        stop
+      end if
+      ! ERROR HANDLING
+      if ( ier /= 0 ) then
+        write (stderr,*) ' SUNDIALS_ERROR: SOLVER returned ier = ', ier
+        call FCVFREE()
+        stop
+      end if
+
+      if ( ier /= 0 ) then
+        write (stderr, 40) ier
+        40   format (///' SUNDIALS_ERROR: FCVDENSE() returned ier = ', I5)
+        call FCVFREE()
+        stop
+      end if
+      firstConstrainedSpecies = getConstrainedSpecies()
+    else
+      ! The problem must have the same size and the same unconstrained
+      ! species as the first scenario, to re-initialise the solver.
+      sameConstrainedSpecies = ( size( firstConstrainedSpecies ) == getNumberOfConstrainedSpecies() )
+      if ( sameConstrainedSpecies .eqv. .true. ) then
+        sameConstrainedSpecies = all( firstConstrainedSpecies == getConstrainedSpecies() )
+      end if
+      if ( sameConstrainedSpecies .eqv. .false. ) then
+        write (stderr, '(3A)') ' Scenario ', trim( scenarioNames(scenario) ), &
+                               ' does not have the same constrained species as the first scenario.'
+        stop
+      end if
+      write (*, '(A30, 1P e15.3) ') ' t0 = ', t
+      write (*,*)
+      call FCVREINIT( t, z, iatol, rtol, atol, ier )
+      if ( ier /= 0 ) then
+        write (stderr, 50) ier
+        50     format (///' SUNDIALS_ERROR: FCVREINIT() returned ier = ', I5)
+        call FCVFREE()
+        stop
+      end if
     end if
-    ! DENSE SOLVER
-  else if ( solverType == 3 ) then
-    call FCVDENSE( neq, ier )
-    ! UNEXPECTED SOLVER TYPE
-  else
-    write (stderr,*) 'Error with solverType input, input = ', solverType
-    write (stderr,*) 'Available options are 1, 2, 3.'
-    stop
-  end if
-  ! ERROR HANDLING
-  if ( ier /= 0 ) then
-    write (stderr,*) ' SUNDIALS_ERROR: SOLVER returned ier = ', ier
-    call FCVFREE()
-    stop
-  end if
 
-  if ( ier /= 0 ) then
-    write (stderr, 40) ier
-    40   format (///' SUNDIALS_ERROR: FCVDENSE() returned ier = ', I5)
-    call FCVFREE()
-    stop
-  end if
+    ! *****************************************************************
+    ! RUN MODEL
+    ! *****************************************************************
 
-  ! *****************************************************************
-  ! RUN MODEL
-  ! *****************************************************************
+    write (*, '(A)') '-----------'
+    write (*, '(A)') ' Model run'
+    write (*, '(A)') '-----------'
 
-  write (*, '(A)') '-----------'
-  write (*, '(A)') ' Model run'
-  write (*, '(A)') '-----------'
+    ! Discard the output written after the checkpoint (and by the setup
+    ! of the model above)
+    if ( useRestart .eqv. .true. ) then
+      call truncateOutputFiles( outputOffsets )
+    end if
 
-  elapsed = int( t - modelStartTime )
+    elapsed = int( t - modelStartTime )
 
-  do while ( currentNumTimestep < maxNumTimesteps )
+    do while ( currentNumTimestep < maxNumTimesteps )
 
-    call calcCurrentDateParameters( t )
+      call calcCurrentDateParameters( t )
 
-    call outputPhotoRateCalcParameters( t )
+      call outputPhotoRateCalcParameters( t )
 
-    ! Output Jacobian matrix (output frequency set in
-    ! model.parameters)
-    if ( outputJacobian .eqv. .true. ) then
-      if ( mod( elapsed, jacobianOutputStepSize ) == 0 ) then
-        call jfy( numReac, speciesConcs, t )
+      ! Output Jacobian matrix (output frequency set in
+      ! model.parameters)
+      if ( outputJacobian .eqv. .true. ) then
+        if ( mod( elapsed, jacobianOutputStepSize ) == 0 ) then
+          call jfy( numReac, speciesConcs, t )
+        end if
       end if
-    end if
 
-    ! Get concentrations for unconstrained species
-    call FCVODE( tout, t, z, itask, ier )
-    if ( ier /= 0 ) then
-      write (*, '(A, I0)') ' ier POST FCVODE()= ', ier
-    end if
-    flush(6)
+      ! Get concentrations for unconstrained species
+      call FCVODE( tout, t, z, itask, ier )
+      if ( ier /= 0 ) then
+        write (*, '(A, I0)') ' ier POST FCVODE()= ', ier
+      end if
+      flush(6)
+      solverStatistics(:) = iout(:) + restartCounters(:)
 
-    time = nint( t )
-    elapsed = time - modelStartTime
+      time = nint( t )
+      elapsed = time - modelStartTime
 
-    write (*, '(A, I0)') ' time = ', time
+      write (*, '(A, I0)') ' time = ', time
 
-    ! Get concentrations for constrained species and add to array for
-    ! output
-    call addConstrainedSpeciesToProbSpec( z, getConstrainedConcs(), getConstrainedSpecies(), speciesConcs )
+      ! Get concentrations for constrained species and add to array for
+      ! output
+      call addConstrainedSpeciesToProbSpec( z, getConstrainedConcs(), speciesConcs )
 
-    ! Output rates of production and loss (output frequency set in
-    ! model.parameters)
-    if ( mod( elapsed, ratesOutputStepSize ) == 0 ) then
-      call outputRates( detailedRatesSpecies, prodDetailedRatesSpecies, prodDetailedRatesSpeciesLengths, t, reactionRates, 1_SI )
-      call outputRates( detailedRatesSpecies, reacDetailedRatesSpecies, reacDetailedRatesSpeciesLengths, t, reactionRates, 0_SI )
-    end if
+      ! Calculate the reaction rates for the output, if they are not
+      ! stored at each evaluation of the right-hand side
+      if ( storeReactionRates .eqv. .false. ) then
+        if ( mod( elapsed, ratesOutputStepSize ) == 0 .or. mod( elapsed, irOutStepSize ) == 0 ) then
+          call calcReactionRates( numReac, t, speciesConcs )
+        end if
+      end if
 
-    call outputSpeciesOfInterest( t, speciesOfInterest, speciesConcs )
-    call outputPhotolysisRates( t )
+      ! Output rates of production and loss (output frequency set in
+      ! model.parameters)
+      if ( mod( elapsed, ratesOutputStepSize ) == 0 ) then
+        call outputRates( detailedRatesSpecies, prodDetailedRatesSpecies, prodDetailedRatesSpeciesLengths, t, reactionRates, 1_SI )
+        call outputRates( detailedRatesSpecies, reacDetailedRatesSpecies, reacDetailedRatesSpeciesLengths, t, reactionRates, 0_SI )
+      end if
 
-    ! Output reaction rates
-    if ( mod( elapsed, irOutStepSize ) == 0 ) then
-      call outputreactionRates( time )
-    end if
+      call outputSpeciesOfInterest( t, speciesOfInterest, speciesConcs )
+      call outputPhotolysisRates( t )
 
-    ! Output CVODE solver parameters and timestep sizes
-    call outputSolverParameters( t, rout(3), rout(2), iout, solverType )
+      ! Output reaction rates
+      if ( mod( elapsed, irOutStepSize ) == 0 ) then
+        call outputreactionRates( time )
+      end if
 
-    ! Output envVar values
-    ro2 = ro2sum( speciesConcs )
-    call outputEnvVar( t )
+      ! Output CVODE solver parameters and timestep sizes
+      call outputSolverParameters( t, rout(3), rout(2), solverStatistics, solverType )
 
-    ! Error handling
-    if ( ier < 0 ) then
-      fmt = "(///' SUNDIALS_ERROR: FCVODE() returned ier = ', I5, /, 'Linear Solver returned ier = ', I5) "
-      write (stderr, fmt) ier, iout (15)
-      ! free memory
-      call FCVFREE()
-      stop
-    end if
+      ! Output envVar values
+      ro2 = ro2sum( speciesConcs )
+      call outputEnvVar( t )
 
-    ! increment time
-    tout = tout + timestepSize
-    currentNumTimestep = currentNumTimestep + 1
+      ! Error handling
+      if ( ier < 0 ) then
+        fmt = "(///' SUNDIALS_ERROR: FCVODE() returned ier = ', I5, /, 'Linear Solver returned ier = ', I5) "
+        write (stderr, fmt) ier, iout (15)
+        ! free memory
+        call FCVFREE()
+        stop
+      end if
 
-  end do
+      ! increment time
+      tout = tout + timestepSize
+      currentNumTimestep = currentNumTimestep + 1
+
+      ! Write the checkpoint of the model run (frequency set in
+      ! model.parameters)
+      if ( checkpointStepSize > 0 ) then
+        if ( mod( elapsed, checkpointStepSize ) == 0 ) then
+          call writeCheckpoint( t, tout, currentNumTimestep, speciesConcs, z(1:neq), solverStatistics, rout, &
+                                sparseJacobianRhsEvaluations )
+        end if
+      end if
 
-  ! Output final model concentrations, in a usable format for model
-  ! restart
-  call outputFinalModelState( getSpeciesList(), speciesConcs )
-  write (*,*)
+    end do
+
+    ! Output final model concentrations, in a usable format for model
+    ! restart
+    call outputFinalModelState( getSpeciesList(), speciesConcs )
+    write (*,*)
+
+    write (*, '(A)') '------------------'
+    write (*, '(A)') ' Final statistics'
+    write (*, '(A)') '------------------'
+
+    ! Final on-screen output
+    fmt = "(' No. steps = ', I0, '   No. f-s = ', I0, " // &
+          "'   No. J-s = ', I0, '   No. LU-s = ', I0/" // &
+          "' No. nonlinear iterations = ', I0/" // &
+          "' No. nonlinear convergence failures = ', I0/" // &
+          "' No. error test failures = ', I0/) "
+
+    solverStatistics(:) = iout(:) + restartCounters(:)
+    write (*, fmt) solverStatistics(3), solverStatistics(4), solverStatistics(17), solverStatistics(8), &
+                   solverStatistics(7), solverStatistics(6), solverStatistics(5)
+    if ( ( solverType == 4 ) .and. ( useJacobian .eqv. .false. ) ) then
+      write (*, '(A, I0)') ' No. f-s for the sparse Jacobian = ', sparseJacobianRhsEvaluations
+    end if
 
-  write (*, '(A)') '------------------'
-  write (*, '(A)') ' Final statistics'
-  write (*, '(A)') '------------------'
+    call SYSTEM_CLOCK( runEnd, clockRate )
+    runTime = ( runEnd - runStart ) / clockRate
+    write (*, '(A, I0)') ' Runtime = ', runTime
+    if ( useScenarios .eqv. .true. ) then
+      write (*,*)
+    end if
+
+    ! deallocate the data of the scenario
+    ! deallocate arrays from module constraints_mod
+    call deallocateConstrainedConcs()
+    call deallocateConstrainedSpecies()
+    deallocate (dataX, dataY, dataFixedY)
+    deallocate (speciesNumberOfPoints)
 
-  ! Final on-screen output
-  fmt = "(' No. steps = ', I0, '   No. f-s = ', I0, " // &
-        "'   No. J-s = ', I0, '   No. LU-s = ', I0/" // &
-        "' No. nonlinear iterations = ', I0/" // &
-        "' No. nonlinear convergence failures = ', I0/" // &
-        "' No. error test failures = ', I0/) "
+    ! deallocate arrays from module env_vars_mod
+    deallocate (envVarTypesNum, envVarNames, envVarTypes, envVarFixedValues)
+    deallocate (envVarX, envVarY, envVarNumberOfPoints, currentEnvVarValues)
 
-  write (*, fmt) iout (3), iout (4), iout (17), iout (8), &
-                 iout (7), iout (6), iout (5)
+  end do
 
-  call SYSTEM_CLOCK( runEnd, clockRate )
-  runTime = ( runEnd - runStart ) / clockRate
-  write (*, '(A, I0)') ' Runtime = ', runTime
   write (*, '(A)') ' Deallocating memory.'
 
   ! *****************************************************************
@@ -530,35 +752,16 @@ PROGRAM ATCHEM2
   deallocate (reacDetailedRatesSpeciesLengths, prodDetailedRatesSpeciesLengths)
 
   ! deallocate data allocated in inputFunctions.f90
-  ! deallocate arrays from module constraints_mod
-  call deallocateConstrainedConcs()
-  call deallocateConstrainedSpecies()
-  deallocate (dataX, dataY, dataFixedY)
-  deallocate (speciesNumberOfPoints)
-
   ! deallocate arrays from module species_mod
   call deallocateSpeciesList()
 
-  ! deallocate arrays from module env_vars_mod
-  deallocate (envVarTypesNum, envVarNames, envVarTypes, envVarFixedValues)
-  deallocate (envVarX, envVarY, envVarNumberOfPoints)
-
   ! deallocate arrays from module photolysis_rates_mod
   if ( PR_type == 2 .or. PR_type == 3) then
     deallocate (photoX, photoY, photoNumberOfPoints)
   end if
 
   ! Close output files and end program
-  close (50)
-  close (51)
-  close (52)
-  close (53)
-  close (55)
-  close (56)
-  close (57)
-  close (58)
-  close (59)
-  close (60)
+  call closeOutputFiles()
   closure=dlclose(handle)
 
   stop
@@ -576,8 +779,7 @@ END PROGRAM ATCHEM2
 subroutine FCVFUN( t, y, ydot, ipar, rpar, ier )
   use types_mod
   use constraints_mod, only : getNumberOfConstrainedSpecies, numberOfVariableConstrainedSpecies, dataFixedY, &
-                              getConstrainedSpecies, setConstrainedConcs
-  use reaction_structure_mod, only : clhs, clcoeff, crhs, crcoeff
+                              setConstrainedConcs
   use interpolation_method_mod, only : getSpeciesInterpMethod
   use interpolation_functions_mod, only : getVariableConstrainedSpeciesConcentrationAtT, getConstrainedPhotoRatesAtT
   use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
@@ -613,11 +815,11 @@ subroutine FCVFUN( t, y, ydot, ipar, rpar, ier )
 
   call setConstrainedConcs( constrainedConcs )
 
-  call addConstrainedSpeciesToProbSpec( y, constrainedConcs, getConstrainedSpecies(), z )
+  call addConstrainedSpeciesToProbSpec( y, constrainedConcs, z )
 
-  call resid( numReac, t, z, dy, clhs, clcoeff, crhs, crcoeff )
+  call resid( numReac, t, z, dy )
 
-  call removeConstrainedSpeciesFromProbSpec( dy, getConstrainedSpecies(), ydot )
+  call removeConstrainedSpeciesFromProbSpec( dy, ydot )
 
   deallocate (dy, z)
   ier = 0
@@ -626,3 +828,116 @@ subroutine FCVFUN( t, y, ydot, ipar, rpar, ier )
 end subroutine FCVFUN
 
 ! ******************************************************************** !
+
+! -------------------------------------------------------- !
+! Fortran routine for the dense Jacobian matrix, used by the dense
+! solver if the chemical mechanism has the analytic Jacobian matrix
+! (see the --jacobian option of build/mech_converter.py).
+subroutine FCVDJAC( neq, t, y, fy, djac, h, ipar, rpar, wk1, wk2, wk3, ier )
+  use types_mod
+  use constraints_mod, only : getNumberOfConstrainedSpecies, getConstrainedConcs, getConstrainedSpecies
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec
+  use solver_functions_mod, only : sparseJacobian, jacRowStart, jacColumns
+  implicit none
+
+  integer(kind=NPI), intent(in) :: neq
+  real(kind=DP), intent(in) :: t, y(*), fy(*), h
+  real(kind=DP), intent(out) :: djac(neq, neq)
+  integer(kind=NPI), intent(in) :: ipar(*)
+  real(kind=DP), intent(in) :: rpar(*)
+  real(kind=DP) :: wk1(*), wk2(*), wk3(*)
+  integer(kind=QI), intent(out) :: ier
+  integer(kind=NPI) :: np, numReac, i, k, z_index
+  integer(kind=NPI), allocatable :: solverIndex(:)
+  real(kind=DP) :: dummy
+  real(kind=DP), allocatable :: z(:), jac(:)
+
+  np = neq + getNumberOfConstrainedSpecies()
+  numReac = ipar(2)
+  ! fy, h, rpar and the work arrays are not used
+  dummy = fy(1)
+  dummy = h
+  dummy = rpar(1)
+  dummy = wk1(1)
+  dummy = wk2(1)
+  dummy = wk3(1)
+  allocate (z(np), jac(size( jacColumns )), solverIndex(np))
+
+  ! CVODE has just called FCVFUN() at (t, y), which has set the
+  ! concentrations of the constrained species
+  call addConstrainedSpeciesToProbSpec( y, getConstrainedConcs(), z )
+  call sparseJacobian( numReac, t, z, jac )
+
+  ! solverIndex holds the position of each species in y, or 0 for the
+  ! constrained species
+  solverIndex(:) = 1_NPI
+  solverIndex(getConstrainedSpecies()) = 0_NPI
+  z_index = 0_NPI
+  do i = 1, np
+    if ( solverIndex(i) > 0 ) then
+      z_index = z_index + 1
+      solverIndex(i) = z_index
+    end if
+  end do
+
+  djac(1:neq, 1:neq) = 0.0_DP
+  do i = 1, np
+    if ( solverIndex(i) > 0 ) then
+      do k = jacRowStart(i), jacRowStart(i + 1) - 1
+        if ( solverIndex(jacColumns(k)) > 0 ) then
+          djac(solverIndex(i), solverIndex(jacColumns(k))) = jac(k)
+        end if
+      end do
+    end if
+  end do
+
+  deallocate (z, jac, solverIndex)
+  ier = 0
+
+  return
+end subroutine FCVDJAC
+
+! -------------------------------------------------------- !
+! Fortran routine for the sparse Jacobian matrix, used by the sparse
+! direct solver (solver type 4). The sparsity pattern has been set by
+! setSparsePattern(), in compressed sparse row format: jcptrs holds
+! the start of each row and jrvals the column of each element.
+subroutine FCVSPJAC( t, y, fy, n, nnz, jdata, jrvals, jcptrs, h, ipar, rpar, wk1, wk2, wk3, ier )
+  use types_mod
+  use constraints_mod, only : getNumberOfConstrainedSpecies, getConstrainedConcs
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec
+  use solver_functions_mod, only : sparseSolverJacobian, sparseRowStart, sparseColumns
+  use solver_params_mod, only : atol
+  implicit none
+
+  integer(kind=QI), intent(in) :: n, nnz
+  real(kind=DP), intent(in) :: t, y(*), fy(n), h
+  real(kind=DP), intent(out) :: jdata(nnz)
+  integer(kind=QI), intent(out) :: jrvals(nnz), jcptrs(n + 1)
+  integer(kind=NPI), intent(in) :: ipar(*)
+  real(kind=DP), intent(in) :: rpar(*)
+  real(kind=DP) :: wk1(*), wk2(*), wk3(*)
+  integer(kind=QI), intent(out) :: ier
+  real(kind=DP) :: dummy
+  real(kind=DP), allocatable :: z(:)
+
+  ! h, rpar and the work arrays are not used
+  dummy = h
+  dummy = rpar(1)
+  dummy = wk1(1)
+  dummy = wk2(1)
+  dummy = wk3(1)
+  allocate (z(n + getNumberOfConstrainedSpecies()))
+
+  ! CVODE has just called FCVFUN() at (t, y), which has set the
+  ! concentrations of the constrained species
+  call addConstrainedSpeciesToProbSpec( y, getConstrainedConcs(), z )
+  call sparseSolverJacobian( ipar(2), t, z, fy, atol, jdata )
+  jcptrs(:) = sparseRowStart(:)
+  jrvals(:) = sparseColumns(:)
+
+  deallocate (z)
+  ier = 0
+
+  return
+end subroutine FCVSPJAC
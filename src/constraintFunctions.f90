@@ -22,8 +22,23 @@
 ! number of the environment variable using the name as a key.
 ! ******************************************************************** !
 module constraint_functions_mod
+  use types_mod, only : SI
   implicit none
 
+  ! Names of the environment variables, in the order in which they are
+  ! calculated by getEnvVarsAtT().
+  character(len=8), parameter :: orderedEnvVarNames(11) = [ character(len=8) :: 'PRESS', 'TEMP', 'M', 'RH', 'H2O', &
+                                                            'BLHEIGHT', 'DEC', 'JFAC', 'DILUTE', 'ROOF', 'ASA' ]
+  ! Positions of the environment variables in orderedEnvVarNames.
+  integer(kind=SI), parameter :: orderedPress = 1_SI, orderedTemp = 2_SI, orderedM = 3_SI, orderedRH = 4_SI, &
+                                 orderedH2O = 5_SI, orderedBlheight = 6_SI, orderedDec = 7_SI, orderedJfac = 8_SI, &
+                                 orderedDilute = 9_SI, orderedRoof = 10_SI, orderedAsa = 11_SI
+
+  ! Numbers of the environment variables of orderedEnvVarNames, given by
+  ! getEnvVarNum(). They are set once by setEnvVarNums(), so that no names
+  ! are compared at each call of getEnvVarsAtT() and of the mechanism rates.
+  integer(kind=SI), allocatable :: orderedEnvVarNums(:)
+
 contains
 
   ! -----------------------------------------------------------------
@@ -117,44 +132,31 @@ contains
     return
   end subroutine calcJFac
 
-  !TODO: As the numbers of the constrained species will be constant, it may be possible
-  !      to speed this up by computing a vector of bools once then apply this as a mask
-  !      each time. Same for the removal.
   ! -----------------------------------------------------------------
   ! Take in z, the vector of concentrations of unconstrained species,
   ! and add the concentrations of the constrained species. Return this
   ! in vector x.
-  subroutine addConstrainedSpeciesToProbSpec( z, constrainedConcentrations, constrainedSpecs, x )
+  subroutine addConstrainedSpeciesToProbSpec( z, constrainedConcentrations, x )
     use types_mod
+    use constraints_mod, only : getNumberOfConstrainedSpecies, getOneConstrainedSpecies, unconstrainedSpecies
 
     real(kind=DP), intent(in) :: z(*), constrainedConcentrations(:)
-    integer(kind=NPI), intent(in) :: constrainedSpecs(:)
     real(kind=DP), intent(out) :: x(:)
-    integer(kind=NPI) :: zCounter, i, j, speciesConstrained
+    integer(kind=NPI) :: i
 
     ! This fills x with the contents of z, plus the contents of
-    ! constrainedConcentrations, using constrainedSpecs as the key to
-    ! which species are constrained.
-    if ( size( constrainedConcentrations ) /= size( constrainedSpecs ) ) then
-      stop 'size( constrainedConcentrations ) /= size( constrainedSpecs ) in addConstrainedSpeciesToProbSpec().'
+    ! constrainedConcentrations, using the numbers of the unconstrained
+    ! and of the constrained species as the key.
+    if ( size( constrainedConcentrations ) /= getNumberOfConstrainedSpecies() ) then
+      stop 'size( constrainedConcentrations ) /= getNumberOfConstrainedSpecies() in addConstrainedSpeciesToProbSpec().'
     end if
-    zCounter = 1
-    do i = 1, size( x )
-      speciesConstrained = 0
-      do j = 1, size( constrainedSpecs )
-        if ( i == constrainedSpecs(j) ) then
-          speciesConstrained = j
-          exit
-        end if
-      end do
-      if ( speciesConstrained > 0 ) then
-        x(i) = constrainedConcentrations(speciesConstrained)
-      else if ( speciesConstrained == 0 ) then
-        x(i) = z(zCounter)
-        zCounter = zCounter + 1
-      else
-        stop 'Error adding constrained values to measured values'
-      end if
+    do i = 1, size( unconstrainedSpecies )
+      x(unconstrainedSpecies(i)) = z(i)
+    end do
+    ! In reverse order, so that the first value is kept if a species is
+    ! constrained twice.
+    do i = size( constrainedConcentrations ), 1, -1
+      x(getOneConstrainedSpecies( i )) = constrainedConcentrations(i)
     end do
     return
   end subroutine addConstrainedSpeciesToProbSpec
@@ -163,31 +165,16 @@ contains
   ! Take in x, the vector of concentrations of all species, and remove
   ! the concentrations of the constrained species. Return the remainder
   ! in vector z.
-  subroutine removeConstrainedSpeciesFromProbSpec( x, constrainedSpecs, z )
+  subroutine removeConstrainedSpeciesFromProbSpec( x, z )
     use types_mod
+    use constraints_mod, only : unconstrainedSpecies
 
     real(kind=DP), intent(in) :: x(:)
-    integer(kind=NPI), intent(in) :: constrainedSpecs(:)
     real(kind=DP), intent(inout) :: z(*)
-    integer(kind=NPI) :: zCounter, i, k
-    logical :: speciesConstrained
-
-    zCounter = 1
-    ! loop through x(), check if its items are in constrainedSpecs
-    do i = 1, size( x )
-      speciesConstrained = .false.
-      do k = 1, size( constrainedSpecs )
-        if ( i == constrainedSpecs(k) ) then
-          ! exit loop if in constrainedSpecs
-          speciesConstrained = .true.
-          exit
-        end if
-      end do
-      ! if item is not in constrainedSpecs, then add species to z
-      if ( speciesConstrained .eqv. .false. ) then
-        z(zCounter) = x(i)
-        zCounter = zCounter + 1
-      end if
+    integer(kind=NPI) :: i
+
+    do i = 1, size( unconstrainedSpecies )
+      z(i) = x(unconstrainedSpecies(i))
     end do
     return
   end subroutine removeConstrainedSpeciesFromProbSpec
@@ -211,7 +198,7 @@ contains
     real(kind=DP), intent(in) :: t
     real(kind=DP) :: this_env_val
     integer(kind=NPI) :: envVarNum, orderedEnvVarNum
-    character(len=maxEnvVarNameLength) :: this_env_var_name, orderedEnvVarNames(size( envVarNames ))
+    character(len=maxEnvVarNameLength) :: this_env_var_name
     logical :: pressure_set, rh_set, temp_set
 
     ! loop over each environment variable, in a defined order, rather
@@ -226,33 +213,25 @@ contains
     !
     ! To add another environment variable, the user would need to add
     ! that line to environmentVariables.config, and then add this as
-    ! element 12 in the orderedEnvVarNames initialisation below.  Its
+    ! element 12 of orderedEnvVarNames (at the top of this module).  Its
     ! treatment needs defining in each of cases 1-3 and default below.
 
     if ( size( envVarNames ) /= 11 ) then
       write(stderr,*) 'size( envVarNames ) /= 11 in getEnvVarsAtT().'
     end if
-    orderedEnvVarNames(1) = 'PRESS'
-    orderedEnvVarNames(2) = 'TEMP'
-    orderedEnvVarNames(3) = 'M'
-    orderedEnvVarNames(4) = 'RH'
-    orderedEnvVarNames(5) = 'H2O'
-    orderedEnvVarNames(6) = 'BLHEIGHT'
-    orderedEnvVarNames(7) = 'DEC'
-    orderedEnvVarNames(8) = 'JFAC'
-    orderedEnvVarNames(9) = 'DILUTE'
-    orderedEnvVarNames(10) = 'ROOF'
-    orderedEnvVarNames(11) = 'ASA'
+    if ( .not. allocated( orderedEnvVarNums ) ) then
+      call setEnvVarNums()
+    end if
 
     pressure_set = .false.
     rh_set = .false.
     temp_set = .false.
 
-    do orderedEnvVarNum = 1, size( envVarNames )
+    do orderedEnvVarNum = 1, size( orderedEnvVarNames )
       ! loop over in a defined order, then find which number that is
       ! in the unordered list that comes from the input file
       this_env_var_name = orderedEnvVarNames(orderedEnvVarNum)
-      envVarNum = getEnvVarNum( trim( this_env_var_name ) )
+      envVarNum = orderedEnvVarNums(orderedEnvVarNum)
 
       ! Find which type it is (calc, constrained, fixed, other)
       select case ( envVarTypesNum(envVarNum) )
@@ -263,17 +242,17 @@ contains
               stop
             case ( 'M' )
               if ( ( temp_set .eqv. .true. ) .and. ( pressure_set .eqv. .true. ) ) then
-                this_env_val = calcAirDensity( currentEnvVarValues( getEnvVarNum( 'PRESS' ) ), &
-                                               currentEnvVarValues( getEnvVarNum( 'TEMP' ) ) )
+                this_env_val = calcAirDensity( currentEnvVarValues( orderedEnvVarNums(orderedPress) ), &
+                                               currentEnvVarValues( orderedEnvVarNums(orderedTemp) ) )
               else
                 write (stderr,*) 'getEnvVarsAtT(): calcAirDensity() called, but no value is yet given to either TEMP, or PRESS.'
                 stop
               end if
             case ( 'H2O' )
               if ( ( rh_set .eqv. .true. ) .and. ( temp_set .eqv. .true. ) .and. ( pressure_set .eqv. .true. ) ) then
-                this_env_val = convertRHtoH2O( currentEnvVarValues( getEnvVarNum( 'RH' ) ), &
-                                               currentEnvVarValues( getEnvVarNum( 'TEMP' ) ), &
-                                               currentEnvVarValues( getEnvVarNum( 'PRESS' ) ) )
+                this_env_val = convertRHtoH2O( currentEnvVarValues( orderedEnvVarNums(orderedRH) ), &
+                                               currentEnvVarValues( orderedEnvVarNums(orderedTemp) ), &
+                                               currentEnvVarValues( orderedEnvVarNums(orderedPress) ) )
               else
                 write (stderr,*) 'getEnvVarsAtT(): convertRHtoH2O() called, but no value is yet given to either RH, TEMP, or PRESS.'
                 stop
@@ -372,4 +351,23 @@ contains
     return
   end function getEnvVarNum
 
+  ! -----------------------------------------------------------------
+  ! Set orderedEnvVarNums, the numbers of the environment variables of
+  ! orderedEnvVarNames, once the environment variables have been read.
+  subroutine setEnvVarNums()
+    use types_mod
+
+    integer(kind=SI) :: i
+
+    if ( allocated( orderedEnvVarNums ) ) then
+      deallocate (orderedEnvVarNums)
+    end if
+    allocate (orderedEnvVarNums(size( orderedEnvVarNames )))
+    do i = 1, int( size( orderedEnvVarNames ), SI )
+      orderedEnvVarNums(i) = getEnvVarNum( trim( orderedEnvVarNames(i) ) )
+    end do
+
+    return
+  end subroutine setEnvVarNums
+
 end module constraint_functions_mod
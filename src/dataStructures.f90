@@ -96,6 +96,14 @@ module directories_mod
                                       configuration_dir, mcm_dir, shared_library, &
                                       constraints_dir, spec_constraints_dir, &
                                       env_constraints_dir, photo_constraints_dir
+  ! Scenarios (see the --scenarios flag of atchem2): the file with the
+  ! names of the scenarios, and the input and output directories of the
+  ! current scenario. Without scenarios, scenario_dir is empty and the
+  ! output is written to output_dir.
+  character(len=maxFilepathLength) :: scenarios_list = '', scenario_dir = '', scenario_output_dir = ''
+  ! Checkpoint file to restart the model run from (see the --restart
+  ! flag of atchem2). Empty if the model is run from the start time.
+  character(len=maxFilepathLength) :: restart_checkpoint = ''
 
 end module directories_mod
 
@@ -268,6 +276,7 @@ module constraints_mod
   public :: getConstrainedConcs, setConstrainedConcs, deallocateConstrainedConcs
   public :: getConstrainedSpecies, setConstrainedSpecies
   public :: deallocateConstrainedSpecies, getOneConstrainedSpecies
+  public :: setUnconstrainedSpecies
 
   integer(kind=NPI) :: numberOfConstrainedSpecies
   integer(kind=NPI) :: numberOfFixedConstrainedSpecies, numberOfVariableConstrainedSpecies
@@ -276,6 +285,10 @@ module constraints_mod
   integer(kind=NPI), allocatable :: constrainedSpecies(:)
   integer(kind=NPI) :: maxNumberOfConstraintDataPoints, maxNumberOfEnvVarDataPoints
   integer(kind=NPI), allocatable :: speciesNumberOfPoints(:)
+  ! Numbers of the unconstrained species, in increasing order: element i of
+  ! the vector of concentrations of the solver is the concentration of species
+  ! unconstrainedSpecies(i) (see setUnconstrainedSpecies).
+  integer(kind=NPI), allocatable :: unconstrainedSpecies(:)
 
 contains
 
@@ -331,6 +344,23 @@ contains
     deallocate (constrainedSpecies)
   end subroutine deallocateConstrainedSpecies
 
+  ! -----------------------------------------------------------------
+  ! Method for unconstrained species: set unconstrainedSpecies from the
+  ! constrained species, once they have all been set.
+  subroutine setUnconstrainedSpecies( numberOfSpecies )
+    integer(kind=NPI), intent(in) :: numberOfSpecies
+    logical :: constrained(numberOfSpecies)
+    integer(kind=NPI) :: i
+
+    constrained(:) = .false.
+    constrained(constrainedSpecies) = .true.
+    if ( allocated( unconstrainedSpecies ) ) then
+      deallocate (unconstrainedSpecies)
+    end if
+    allocate (unconstrainedSpecies(count( .not. constrained )))
+    unconstrainedSpecies(:) = pack( [(i, i = 1, numberOfSpecies)], .not. constrained )
+  end subroutine setUnconstrainedSpecies
+
 end module constraints_mod
 
 ! ******************************************************************** !
@@ -578,5 +608,51 @@ module reaction_rates_mod
   save
 
   real(kind=DP), allocatable :: reactionRates(:)
+  ! If false, the reaction rates are not stored at each evaluation of the
+  ! right-hand side, but calculated at the output times only (set in
+  ! model.parameters).
+  logical :: storeReactionRates = .true.
 
 end module reaction_rates_mod
+
+! ******************************************************************** !
+! MODULE threads_mod
+! Define the number of threads of the parallel loops, which are only
+! run in parallel if AtChem2 is compiled with OpenMP (see $OPENMP in
+! the Makefile).
+! ******************************************************************** !
+module threads_mod
+  use types_mod
+  !$ use omp_lib, only : omp_set_num_threads, omp_get_max_threads
+  implicit none
+  save
+
+  ! The loops with fewer iterations are not run in parallel, as the cost
+  ! of starting the threads would be higher than the gain.
+  integer(kind=NPI), parameter :: minParallelLoopSize = 2000_NPI
+
+contains
+
+  ! -----------------------------------------------------------------
+  ! Set the number of threads of the parallel loops (set in
+  ! model.parameters). If n is 0, the number of threads is set by OpenMP
+  ! (the environment variable OMP_NUM_THREADS, or the number of cores).
+  subroutine setNumberOfThreads( n )
+    integer(kind=QI), intent(in) :: n
+
+    if ( n > 0 ) then
+      !$ call omp_set_num_threads( n )
+    end if
+  end subroutine setNumberOfThreads
+
+  ! -----------------------------------------------------------------
+  ! Return the number of threads of the parallel loops (1 if AtChem2 is
+  ! not compiled with OpenMP).
+  function getNumberOfThreads() result ( n )
+    integer(kind=QI) :: n
+
+    n = 1_QI
+    !$ n = omp_get_max_threads()
+  end function getNumberOfThreads
+
+end module threads_mod
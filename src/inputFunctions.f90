@@ -164,13 +164,13 @@ contains
     real(kind=DP), allocatable :: concentration(:)
     character(len=maxSpecLength), allocatable :: concSpeciesNames(:)
     character(len=maxSpecLength) :: k
-    character(len=maxFilepathLength) :: filename
+    character(len=maxFilepathLength+maxSpecLength) :: filename
     real(kind=DP) :: l
     integer(kind=NPI) :: numLines, i, nsp
     integer(kind=IntErr) :: ierr
 
     write (*, '(A)') ' Reading initial concentrations...'
-    filename = trim( configuration_dir ) // '/initialConcentrations.config'
+    filename = getInputFileLocation( configuration_dir, '', 'initialConcentrations.config' )
     ! Count lines in file, allocate appropriately
     numLines = count_lines_in_file( trim( filename ), .false. )
     nsp = getNumberOfSpecies()
@@ -766,7 +766,7 @@ contains
     use env_vars_mod
     use directories_mod, only : configuration_dir, env_constraints_dir, photo_constraints_dir
     use constraints_mod, only : maxNumberOfEnvVarDataPoints
-    use storage_mod, only : maxFilepathLength, maxEnvVarNameLength
+    use storage_mod, only : maxFilepathLength, maxSpecLength
     use photolysis_rates_mod, only : jFacSpecies, jFacSpeciesFound
 
     integer(kind=NPI) :: k
@@ -774,8 +774,7 @@ contains
     integer(kind=IntErr) :: ierr
     real(kind=DP) :: input1, input2
     character(len=10) :: dummy
-    character(len=maxFilepathLength) :: fileLocationPrefix
-    character(len=maxFilepathLength+maxEnvVarNameLength) :: fileLocation
+    character(len=maxFilepathLength+maxSpecLength) :: fileLocation
 
     write (*, '(A)') ' Reading environment variables...'
 
@@ -783,7 +782,8 @@ contains
     ! file, and then adding 1 to account for M, which should be
     ! omitted from the config file since it is always calculated from
     ! temperature and pressure
-    numEnvVars = int( count_lines_in_file( trim( configuration_dir ) // '/environmentVariables.config' ), SI ) + 1_SI
+    fileLocation = getInputFileLocation( configuration_dir, '', 'environmentVariables.config' )
+    numEnvVars = int( count_lines_in_file( trim( fileLocation ) ), SI ) + 1_SI
 
     ! Allocate storage for current values of env vars used for output
     allocate (currentEnvVarValues(numEnvVars))
@@ -796,7 +796,6 @@ contains
     envVarTypes(1) = 'CALC'
     envVarTypesNum(1) = 1_SI
 
-    fileLocation = trim( configuration_dir ) // '/environmentVariables.config'
     call inquire_or_abort( fileLocation, 'readEnvVar()')
     open (10, file=fileLocation, status='old') ! input file
     ! Read in environment variables
@@ -867,8 +866,6 @@ contains
     write (*, '(A)') ' Finished reading environment variables.'
     write (*,*)
 
-    !TODO: convert this to a command line input argument
-    fileLocationPrefix = trim( env_constraints_dir ) // "/"
     ! If environment variable is constrained, read in constraint data
     write (*, '(A)') ' Checking for constrained environment variables...'
     maxNumberOfEnvVarDataPoints = 0_NPI
@@ -876,9 +873,9 @@ contains
     do i = 1, numEnvVars
       if ( envVarTypes(i) == 'CONSTRAINED' ) then
         if ( trim( envVarNames(i) ) == 'JFAC' ) then
-          fileLocation = trim( photo_constraints_dir ) // "/" // trim( envVarNames(i) )
+          fileLocation = getInputFileLocation( photo_constraints_dir, 'photolysis', envVarNames(i) )
         else
-          fileLocation = trim( fileLocationPrefix ) // trim( envVarNames(i) )
+          fileLocation = getInputFileLocation( env_constraints_dir, 'environment', envVarNames(i) )
         end if
         call inquire_or_abort( fileLocation, 'readEnvVar()')
         maxNumberOfEnvVarDataPoints = max( maxNumberOfEnvVarDataPoints, count_lines_in_file( fileLocation ) )
@@ -901,9 +898,9 @@ contains
         write (*, '(2A)') ' Reading constraint data for ', trim( envVarNames(i) )
 
         if ( trim( envVarNames(i) ) == 'JFAC' ) then
-          fileLocation = trim( photo_constraints_dir ) // "/" // trim( envVarNames(i) )
+          fileLocation = getInputFileLocation( photo_constraints_dir, 'photolysis', envVarNames(i) )
         else
-          fileLocation = trim( fileLocationPrefix ) // trim( envVarNames(i) )
+          fileLocation = getInputFileLocation( env_constraints_dir, 'environment', envVarNames(i) )
         end if
         call inquire_or_abort( fileLocation, 'readEnvVar()')
         open (11, file=fileLocation, status='old')
@@ -1062,7 +1059,8 @@ contains
     use species_mod, only : getSpeciesList, getNumberOfSpecies
     use constraints_mod, only : maxNumberOfConstraintDataPoints, speciesNumberOfPoints, numberOfVariableConstrainedSpecies, &
                                 numberOfFixedConstrainedSpecies, setNumberOfConstrainedSpecies, setConstrainedConcs, &
-                                setConstrainedSpecies, getOneConstrainedSpecies, dataX, dataY, dataFixedY
+                                setConstrainedSpecies, getOneConstrainedSpecies, setUnconstrainedSpecies, &
+                                dataX, dataY, dataFixedY
     use directories_mod, only : configuration_dir, spec_constraints_dir
     use storage_mod, only : maxSpecLength, maxFilepathLength
     use config_functions_mod, only : getIndexWithinList
@@ -1088,7 +1086,8 @@ contains
 
     ! read in number of fixed-concentration constrained species
     write (*, '(A)') ' Counting the fixed-concentration species to be constrained (in file speciesConstant.config)...'
-    numberOfFixedConstrainedSpecies = count_lines_in_file( trim( configuration_dir ) // '/speciesConstant.config' )
+    numberOfFixedConstrainedSpecies = count_lines_in_file( getInputFileLocation( configuration_dir, '', &
+                                                                                 'speciesConstant.config' ) )
     write (*, '(A)') ' Finished counting the names of fixed-concentration constrained species.'
     write (*, '(A, I0)') ' Number of names of fixed-concentration constrained species: ', numberOfFixedConstrainedSpecies
 
@@ -1131,7 +1130,7 @@ contains
     maxNumberOfConstraintDataPoints = 0_NPI
     if ( numberOfVariableConstrainedSpecies > 0 ) then
       do i = 1, numberOfVariableConstrainedSpecies
-        fileLocation = trim( spec_constraints_dir ) // '/' // trim( constrainedNames(i) )
+        fileLocation = getInputFileLocation( spec_constraints_dir, 'species', constrainedNames(i) )
         ! Count lines in file
         maxNumberOfConstraintDataPoints = max( count_lines_in_file( fileLocation ), maxNumberOfConstraintDataPoints )
       end do
@@ -1152,7 +1151,7 @@ contains
           if ( i == 2 ) write (*, '(A)') ' ...'
         end if
 
-        fileLocation = trim( spec_constraints_dir ) // '/' // trim( constrainedNames(i) )
+        fileLocation = getInputFileLocation( spec_constraints_dir, 'species', constrainedNames(i) )
         ! Count lines in file
         dataNumberOfPoints = count_lines_in_file( fileLocation )
         if ( dataNumberOfPoints > maxNumberOfConstraintDataPoints ) then
@@ -1172,7 +1171,7 @@ contains
 
     ! Read in names and concentration data for fixed constrained species
     allocate (dataFixedY(numberOfFixedConstrainedSpecies))
-    fileLocation = trim( configuration_dir ) // '/speciesConstant.config'
+    fileLocation = getInputFileLocation( configuration_dir, '', 'speciesConstant.config' )
     write (*, '(A)') ' Reading in the names and concentration of the fixed constrained species ' // &
                 '(in file speciesConstant.config)...'
     call inquire_or_abort( fileLocation, 'readSpeciesConstraints()')
@@ -1220,6 +1219,7 @@ contains
       write (51, '(A, I0)') "number of species = ", numberOfSpecies
       stop 2
     end if
+    call setUnconstrainedSpecies( numberOfSpecies )
 
     write (*, '(A)') ' Finished reading constrained species.'
 
@@ -1273,6 +1273,58 @@ contains
     return
   end subroutine readRO2species
 
+  ! -----------------------------------------------------------------
+  ! Read in the names of the scenarios from the scenarios file (see the
+  ! --scenarios flag of atchem2), one name per line.
+  function readScenarios() result ( r )
+    use types_mod
+    use directories_mod, only : scenarios_list
+    use storage_mod, only : maxSpecLength
+
+    character(len=maxSpecLength), allocatable :: r(:)
+    integer(kind=NPI) :: length, i
+
+    write (*, '(A)') ' Reading the names of the scenarios...'
+    length = count_lines_in_file( trim( scenarios_list ) )
+    allocate (r(length))
+    call read_in_single_column_string_file( trim( scenarios_list ), r )
+    do i = 1, length
+      write (*, '(I7, A, A)') i, ' ', r(i)
+    end do
+    write (*, '(A, I0)') ' Number of scenarios: ', length
+
+    return
+  end function readScenarios
+
+  ! -----------------------------------------------------------------
+  ! Return the location of the input file filename: in the subdirectory
+  ! subdirectory of the directory of the current scenario (see the
+  ! --scenarios flag of atchem2), if the file is there, and otherwise
+  ! in directory. Without scenarios, this is always directory/filename.
+  function getInputFileLocation( directory, subdirectory, filename ) result ( fileLocation )
+    use directories_mod, only : scenario_dir
+    use storage_mod, only : maxFilepathLength, maxSpecLength
+
+    character(len=*), intent(in) :: directory, subdirectory, filename
+    character(len=maxFilepathLength+maxSpecLength) :: fileLocation
+    logical :: file_exists
+
+    if ( len_trim( scenario_dir ) > 0 ) then
+      if ( len_trim( subdirectory ) > 0 ) then
+        fileLocation = trim( scenario_dir ) // '/' // trim( subdirectory ) // '/' // trim( filename )
+      else
+        fileLocation = trim( scenario_dir ) // '/' // trim( filename )
+      end if
+      inquire(file=fileLocation, exist=file_exists)
+      if ( file_exists .eqv. .true. ) then
+        return
+      end if
+    end if
+    fileLocation = trim( directory ) // '/' // trim( filename )
+
+    return
+  end function getInputFileLocation
+
   ! -----------------------------------------------------------------
   ! Given a filename, count the number of lines. Optional argument
   ! skip_first_line_in ignores the first line if it exists.
@@ -15,11 +15,31 @@
 ! ******************************************************************** !
 ! ATCHEM2 -- MODULE interpolationFunctions
 !
-! This module contains just the getConstrainedQuantAtT() method.
+! This module contains the getConstrainedQuantAtT() method, and the
+! lookup of the interval of the constraint data in which t sits.
 ! ******************************************************************** !
 module interpolation_functions_mod
+  use types_mod, only : DP, NPI
   implicit none
 
+  ! Cache of the interpolation of a set of constrained quantities (one series
+  ! per row of x and y): the interval of the last lookup of each series
+  ! (cursor), which is checked first, together with the next and the previous
+  ! intervals, before a binary search of the data points; and the slope and
+  ! the intercept of the linear interpolation on each interval. The cursor of
+  ! a series is 0 until its first lookup, which fills the cache of the series
+  ! and checks that its times are in increasing order (sorted): the unsorted
+  ! series are scanned from the first data point at each lookup.
+  type interpolation_cache
+    integer(kind=NPI), allocatable :: cursor(:)
+    logical, allocatable :: sorted(:)
+    real(kind=DP), allocatable :: slope(:,:), intercept(:,:)
+  end type interpolation_cache
+
+  ! Caches of the constrained species, photolysis rates and environment
+  ! variables.
+  type(interpolation_cache) :: speciesCache, photoCache, envVarCache
+
 contains
 
   ! -----------------------------------------------------------------
@@ -36,7 +56,8 @@ contains
     integer(kind=NPI) :: ind
     real(kind=DP), intent(inout) :: concAtT
 
-    call getConstrainedQuantAtT( t, dataX, dataY, speciesNumberOfPoints(ind), getSpeciesInterpMethod(), ind, concAtT )
+    call getConstrainedQuantAtT( t, dataX, dataY, speciesNumberOfPoints(ind), getSpeciesInterpMethod(), ind, concAtT, &
+                                 speciesCache )
 
   end subroutine getVariableConstrainedSpeciesConcentrationAtT
 
@@ -53,7 +74,8 @@ contains
     integer(kind=NPI) :: ind
     real(kind=DP), intent(inout) :: photoRateAtT
 
-    call getConstrainedQuantAtT( t, photoX, photoY, photoNumberOfPoints(ind), getConditionsInterpMethod(), ind, photoRateAtT )
+    call getConstrainedQuantAtT( t, photoX, photoY, photoNumberOfPoints(ind), getConditionsInterpMethod(), ind, photoRateAtT, &
+                                 photoCache )
 
   end subroutine getConstrainedPhotoRatesAtT
 
@@ -70,27 +92,28 @@ contains
     integer(kind=NPI) :: ind
     real(kind=DP), intent(inout) :: envVarAtT
 
-    call getConstrainedQuantAtT( t, envVarX, envVarY, envVarNumberOfPoints(ind), getConditionsInterpMethod(), ind, envVarAtT )
+    call getConstrainedQuantAtT( t, envVarX, envVarY, envVarNumberOfPoints(ind), getConditionsInterpMethod(), ind, envVarAtT, &
+                                 envVarCache )
 
   end subroutine getConstrainedEnvVarAtT
 
   ! -----------------------------------------------------------------
   ! This routine returns in concAtT the value of the requested
   ! quantity (referenced by the ind-th line of x, y) based upon
-  ! the constraint data given and interpolation method given
-  subroutine getConstrainedQuantAtT( t, x, y, dataNumberOfPoints, interpMethod, ind, concAtT )
+  ! the constraint data given and interpolation method given. The
+  ! interval in which t sits, and the slope and intercept of the linear
+  ! interpolation, are taken from the cache of the data.
+  subroutine getConstrainedQuantAtT( t, x, y, dataNumberOfPoints, interpMethod, ind, concAtT, cache )
     use, intrinsic :: iso_fortran_env, only : stderr => error_unit
     use types_mod
-    use interpolation_method_mod, only : getSpeciesInterpMethod, getConditionsInterpMethod, &
-                                         setSpeciesInterpMethod, setConditionsInterpMethod
 
     real(kind=DP), intent(in) :: t, x(:,:), y(:,:)
     integer(kind=NPI), intent(in) :: dataNumberOfPoints
     integer(kind=SI), intent(in) :: interpMethod
     integer(kind=NPI), intent(in) :: ind
     real(kind=DP), intent(out) :: concAtT
-    real(kind=DP) :: xBefore, xAfter, yBefore, yAfter, m, c
-    integer(kind=NPI) :: i, indexBefore
+    type(interpolation_cache), intent(inout) :: cache
+    integer(kind=NPI) :: indexBefore
     logical :: interp_success
 
     ! Sanity checks on sizes of x and y.
@@ -108,14 +131,8 @@ contains
     end if
 
     ! Find the interval in which t sits
-    interp_success = .false.
-    do i = 1, dataNumberOfPoints - 1
-      if ( ( t >= x(ind, i) ) .and. ( t < x(ind, i+1) ) ) then
-        indexBefore = i
-        interp_success = .true.
-        exit
-      end if
-    end do
+    indexBefore = findInterval( t, x, y, dataNumberOfPoints, ind, cache )
+    interp_success = ( indexBefore > 0 )
 
     select case ( interpMethod )
       ! left-sided piecewise constant interpolation
@@ -134,15 +151,8 @@ contains
           concAtT = y(ind, dataNumberOfPoints)
           write (*, '(1P e15.7, A, I0, 1P e15.7)') t, ' ', dataNumberOfPoints, concAtT
         else
-          ! Identify coordinates of enclosing data points
-          xBefore = x(ind, indexBefore)
-          yBefore = y(ind, indexBefore)
-          xAfter = x(ind, indexBefore + 1)
-          yAfter = y(ind, indexBefore + 1)
           ! Do linear interpolation (Y = MX + C)
-          m = ( yAfter - yBefore ) / ( xAfter - xBefore )
-          c = yAfter - ( m * xAfter )
-          concAtT = m * t + c
+          concAtT = cache%slope(ind, indexBefore) * t + cache%intercept(ind, indexBefore)
         end if
       case default
         write (stderr,*) 'ERROR: Interpolation method not set, interpMethod = ', interpMethod
@@ -152,4 +162,167 @@ contains
     return
   end subroutine getConstrainedQuantAtT
 
+  ! -----------------------------------------------------------------
+  ! Return the interval of the ind-th line of x in which t sits (i.e.
+  ! x(ind, i) <= t < x(ind, i+1)), or 0 if t is outside the data,
+  ! by scanning the data points from the first one.
+  pure function findIntervalByScan( t, x, dataNumberOfPoints, ind ) result ( indexBefore )
+    use types_mod
+
+    real(kind=DP), intent(in) :: t, x(:,:)
+    integer(kind=NPI), intent(in) :: dataNumberOfPoints, ind
+    integer(kind=NPI) :: indexBefore, i
+
+    indexBefore = 0
+    do i = 1, dataNumberOfPoints - 1
+      if ( ( t >= x(ind, i) ) .and. ( t < x(ind, i+1) ) ) then
+        indexBefore = i
+        exit
+      end if
+    end do
+
+  end function findIntervalByScan
+
+  ! -----------------------------------------------------------------
+  ! Return the interval of the ind-th line of x in which t sits (i.e.
+  ! x(ind, i) <= t < x(ind, i+1)), or 0 if t is outside the data. The
+  ! interval of the previous lookup of the same line, and the next and
+  ! the previous intervals, are checked first, then the interval is found
+  ! by binary search. The result is the same as findIntervalByScan().
+  function findInterval( t, x, y, dataNumberOfPoints, ind, cache ) result ( indexBefore )
+    use types_mod
+
+    real(kind=DP), intent(in) :: t, x(:,:), y(:,:)
+    integer(kind=NPI), intent(in) :: dataNumberOfPoints, ind
+    type(interpolation_cache), intent(inout) :: cache
+    integer(kind=NPI) :: indexBefore, i, lower, upper, middle
+
+    call fillInterpolationCache( x, y, dataNumberOfPoints, ind, cache )
+    if ( .not. cache%sorted(ind) ) then
+      indexBefore = findIntervalByScan( t, x, dataNumberOfPoints, ind )
+      return
+    end if
+
+    ! Check the interval of the previous lookup, then the next and the
+    ! previous intervals.
+    i = cache%cursor(ind)
+    if ( i < dataNumberOfPoints ) then
+      if ( ( t >= x(ind, i) ) .and. ( t < x(ind, i+1) ) ) then
+        indexBefore = i
+        return
+      end if
+      if ( i + 1 < dataNumberOfPoints ) then
+        if ( ( t >= x(ind, i+1) ) .and. ( t < x(ind, i+2) ) ) then
+          indexBefore = i + 1
+          cache%cursor(ind) = indexBefore
+          return
+        end if
+      end if
+      if ( i > 1 ) then
+        if ( ( t >= x(ind, i-1) ) .and. ( t < x(ind, i) ) ) then
+          indexBefore = i - 1
+          cache%cursor(ind) = indexBefore
+          return
+        end if
+      end if
+    end if
+
+    ! Binary search, with x(ind, lower) <= t < x(ind, upper).
+    indexBefore = 0
+    if ( dataNumberOfPoints < 2 ) then
+      return
+    end if
+    if ( .not. ( ( t >= x(ind, 1) ) .and. ( t < x(ind, dataNumberOfPoints) ) ) ) then
+      return
+    end if
+    lower = 1
+    upper = dataNumberOfPoints
+    do while ( upper - lower > 1 )
+      middle = ( lower + upper ) / 2
+      if ( t >= x(ind, middle) ) then
+        lower = middle
+      else
+        upper = middle
+      end if
+    end do
+    indexBefore = lower
+    cache%cursor(ind) = indexBefore
+
+  end function findInterval
+
+  ! -----------------------------------------------------------------
+  ! Fill the cache of the ind-th line of x and y at its first lookup: check
+  ! that the times are in increasing order, and calculate the slope and the
+  ! intercept of the linear interpolation on each interval. The cache is
+  ! allocated at the first lookup of any line, with the size of x.
+  subroutine fillInterpolationCache( x, y, dataNumberOfPoints, ind, cache )
+    use types_mod
+
+    real(kind=DP), intent(in) :: x(:,:), y(:,:)
+    integer(kind=NPI), intent(in) :: dataNumberOfPoints, ind
+    type(interpolation_cache), intent(inout) :: cache
+    real(kind=DP) :: xBefore, xAfter, yBefore, yAfter, m
+    integer(kind=NPI) :: i
+
+    if ( allocated( cache%cursor ) ) then
+      if ( ( size( cache%slope, 1 ) /= size( x, 1 ) ) .or. ( size( cache%slope, 2 ) /= size( x, 2 ) ) ) then
+        call resetInterpolationCache( cache )
+      end if
+    end if
+    if ( .not. allocated( cache%cursor ) ) then
+      allocate (cache%cursor(size( x, 1 )), cache%sorted(size( x, 1 )), &
+                cache%slope(size( x, 1 ), size( x, 2 )), cache%intercept(size( x, 1 ), size( x, 2 )))
+      cache%cursor(:) = 0_NPI
+    end if
+    if ( cache%cursor(ind) > 0 ) then
+      return
+    end if
+
+    cache%sorted(ind) = .true.
+    cache%slope(ind,:) = 0.0_DP
+    cache%intercept(ind,:) = 0.0_DP
+    do i = 1, dataNumberOfPoints - 1
+      ! Identify coordinates of enclosing data points
+      xBefore = x(ind, i)
+      yBefore = y(ind, i)
+      xAfter = x(ind, i + 1)
+      yAfter = y(ind, i + 1)
+      if ( xAfter < xBefore ) then
+        cache%sorted(ind) = .false.
+      end if
+      ! No value of t sits in an empty interval.
+      if ( xAfter > xBefore ) then
+        m = ( yAfter - yBefore ) / ( xAfter - xBefore )
+        cache%slope(ind, i) = m
+        cache%intercept(ind, i) = yAfter - ( m * xAfter )
+      end if
+    end do
+    cache%cursor(ind) = 1_NPI
+
+  end subroutine fillInterpolationCache
+
+  ! -----------------------------------------------------------------
+  ! Empty the cache of a set of constrained quantities, which is filled
+  ! again at the next lookup (e.g. after the constraint data have been
+  ! read again).
+  subroutine resetInterpolationCache( cache )
+    type(interpolation_cache), intent(inout) :: cache
+
+    if ( allocated( cache%cursor ) ) then
+      deallocate (cache%cursor, cache%sorted, cache%slope, cache%intercept)
+    end if
+
+  end subroutine resetInterpolationCache
+
+  ! -----------------------------------------------------------------
+  ! Empty the caches of the constrained species, photolysis rates and
+  ! environment variables.
+  subroutine resetInterpolationCaches()
+
+    call resetInterpolationCache( speciesCache )
+    call resetInterpolationCache( photoCache )
+    call resetInterpolationCache( envVarCache )
+
+  end subroutine resetInterpolationCaches
+
 end module interpolation_functions_mod
@@ -18,15 +18,111 @@
 ! This module contains functions that control output to file.
 ! ******************************************************************** !
 module output_functions_mod
+  use types_mod, only : LONG
   implicit none
 
+  ! Units and names of the output files (see openOutputFiles()).
+  integer, parameter :: outputUnits(10) = [50, 51, 52, 53, 55, 56, 57, 58, 59, 60]
+  character(len=36), parameter :: outputFileNames(10) = &
+                                  [character(len=36) :: 'speciesConcentrations.output', 'errors.output', &
+                                                        'environmentVariables.output', 'finalModelState.output', &
+                                                        'jacobian.output', 'lossRates.output', &
+                                                        'mainSolverParameters.output', 'photolysisRates.output', &
+                                                        'photolysisRatesParameters.output', 'productionRates.output']
+  ! Whether the header of each output file, by unit, is still to be
+  ! written (at the first output after the file is opened).
+  logical, private :: writeHeader(50:60) = .true.
+  ! Version of the format of the checkpoint files (see writeCheckpoint()).
+  integer(kind=LONG), parameter :: checkpointVersion = 1
+
 contains
 
   ! -----------------------------------------------------------------
-  ! Returns the sum of all ro2 concentrations.
-  pure function ro2Sum( y ) result ( ro2 )
+  ! Open the output files in the output directory of the current
+  ! scenario (the output directory, if there are no scenarios). If
+  ! append is true, the output is appended to the existing files (to
+  ! restart the model run, see truncateOutputFiles()).
+  subroutine openOutputFiles( append )
+    use directories_mod, only : scenario_output_dir
+
+    logical, intent(in), optional :: append
+    character(len=6) :: filePosition
+    integer :: i
+
+    filePosition = 'asis'
+    if ( present( append ) ) then
+      if ( append .eqv. .true. ) then
+        filePosition = 'append'
+      end if
+    end if
+    do i = 1, size( outputUnits )
+      open (unit=outputUnits(i), file=trim( scenario_output_dir ) // '/' // trim( outputFileNames(i) ), &
+            position=trim( filePosition ))
+    end do
+    writeHeader(:) = .true.
+
+    return
+  end subroutine openOutputFiles
+
+  ! -----------------------------------------------------------------
+  ! Truncate the output files to their size at the checkpoint of the
+  ! model run (see readCheckpoint()), which discards the output written
+  ! after the checkpoint, and reopen them to append the output of the
+  ! restarted model run.
+  subroutine truncateOutputFiles( offsets )
+    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
+    use directories_mod, only : scenario_output_dir
+    use storage_mod, only : maxFilepathLength
+
+    integer(kind=LONG), intent(in) :: offsets(:)
+    character(len=maxFilepathLength+36) :: fileLocation
+    integer(kind=LONG) :: fileSize
+    character :: lastByte
+    integer :: i
+
+    do i = 1, size( outputUnits )
+      close (outputUnits(i))
+      fileLocation = trim( scenario_output_dir ) // '/' // trim( outputFileNames(i) )
+      inquire (file=fileLocation, size=fileSize)
+      if ( fileSize < offsets(i) ) then
+        write (stderr, '(3A)') ' The output file ', trim( fileLocation ), ' is shorter than at the checkpoint.'
+        stop
+      end if
+      ! Position the file after its last byte at the checkpoint, and
+      ! truncate it there.
+      open (unit=outputUnits(i), file=fileLocation, access='stream', form='unformatted', status='old')
+      if ( offsets(i) > 0 ) then
+        read (outputUnits(i), pos=offsets(i)) lastByte
+      end if
+      if ( fileSize > offsets(i) ) endfile (outputUnits(i))
+      close (outputUnits(i))
+      open (unit=outputUnits(i), file=fileLocation, position='append')
+      writeHeader(outputUnits(i)) = ( offsets(i) == 0 )
+    end do
+
+    return
+  end subroutine truncateOutputFiles
+
+  ! -----------------------------------------------------------------
+  ! Close the output files.
+  subroutine closeOutputFiles()
+    integer :: i
+
+    do i = 1, size( outputUnits )
+      close (outputUnits(i))
+    end do
+
+    return
+  end subroutine closeOutputFiles
+
+  ! -----------------------------------------------------------------
+  ! Returns the sum of all ro2 concentrations. If AtChem2 is compiled
+  ! with OpenMP, the sum is shared between the threads, so the last
+  ! digits may depend on the number of threads.
+  function ro2Sum( y ) result ( ro2 )
     use types_mod
     use env_vars_mod, only : ro2Numbers
+    use threads_mod, only : minParallelLoopSize
 
     real(kind=DP), intent(in) :: y(*)
     real(kind=DP) :: ro2
@@ -34,9 +130,11 @@ contains
 
     ro2 = 0.0_DP
     if ( size( ro2Numbers ) > 0 ) then
+      !$omp parallel do reduction( + : ro2 ) schedule( static ) if ( size( ro2Numbers ) >= minParallelLoopSize )
       do i = 1, size( ro2Numbers )
         ro2 = ro2 + y(ro2Numbers(i))
       end do
+      !$omp end parallel do
     end if
     return
   end function ro2Sum
@@ -49,11 +147,10 @@ contains
 
     real(kind=DP), intent(in) :: t
     integer(kind=NPI) :: i
-    logical :: first_time = .true.
 
-    if ( first_time .eqv. .true. ) then
+    if ( writeHeader(52) .eqv. .true. ) then
       write (52, '(100A15) ') 't', (trim( envVarNames(i) ), i = 1, numEnvVars), 'RO2'
-      first_time = .false.
+      writeHeader(52) = .false.
     end if
 
     if ( ro2 < 0 ) ro2 = 0.0
@@ -73,31 +170,30 @@ contains
     integer(kind=NPI), intent(in) :: array(:)
     integer(kind=SI), intent(in) :: solver_type
     integer(kind=SI) :: i
-    logical :: first_time = .true.
 
     if ( ( solver_type == 1 ) .or. ( solver_type == 2 ) ) then
       ! CVSPILS type solver
-      if ( first_time .eqv. .true. ) then
+      if ( writeHeader(57) .eqv. .true. ) then
         write (57, '(A9, 2A17, 20A9) ') 't', 'currentStepSize', 'previousStepSize', 'LENRW', 'LENIW', 'NST', 'NFE', &
                                         'NETF', 'NCFN', 'NNI', 'NSETUPS', 'QU', 'QCUR', 'NOR', 'LENRWLS', 'LENIWLS', &
                                         'LS_FLAG', 'NFELS', 'NJTV', 'NPE', 'NPS', 'NLI', 'NCFL'
-        first_time = .false.
+        writeHeader(57) = .false.
       end if
       write (57, '(1P e9.2, 2 (ES17.8E3), 20I9) ') t, prev, this, (array(i), i = 1, 11), (array(i), i = 13, 21)
 
-    else if ( solver_type == 3 ) then
-      ! CVDLS type solver
-      if ( first_time .eqv. .true. ) then
+    else if ( ( solver_type == 3 ) .or. ( solver_type == 4 ) ) then
+      ! CVDLS or CVSLS type solver
+      if ( writeHeader(57) .eqv. .true. ) then
         write (57, '(A9, 2A17, 16A9) ') 't', 'currentStepSize', 'previousStepSize', 'LENRW', 'LENIW', 'NST', 'NFE', &
                                         'NETF', 'NCFN', 'NNI', 'NSETUPS', 'QU', 'QCUR', 'NOR', 'LENRWLS', 'LENIWLS', &
                                         'LS_FLAG', 'NFELS', 'NJE'
-        first_time = .false.
+        writeHeader(57) = .false.
       end if
       write (57, '(1P e9.2, 2 (ES17.8E3), 16I9) ') t, prev, this, (array(i), i = 1, 11), (array(i), i = 13, 17)
 
     else
       write (stderr,*) 'outputSolverParameters(): Error with solver_type = ', solver_type
-      write (stderr,*) 'Available options are 1, 2, 3.'
+      write (stderr,*) 'Available options are 1, 2, 3, 4.'
       stop
     end if
 
@@ -112,11 +208,10 @@ contains
                                 cosld, eqtime
 
     real(kind=DP), intent(in) :: t
-    logical :: first_time = .true.
 
-    if ( first_time .eqv. .true. ) then
+    if ( writeHeader(59) .eqv. .true. ) then
       write (59, '(100A15) ') 't', 'latitude', 'longitude', 'secx', 'cosx', 'lha', 'sinld', 'cosld', 'eqtime'
-      first_time = .false.
+      writeHeader(59) = .false.
     end if
 
     write (59, '(100 (ES15.6E3)) ') t, latitude, longitude, secx, cosx, lha, sinld, cosld, eqtime
@@ -135,38 +230,37 @@ contains
 
     real(kind=DP), intent(in) :: t
     integer(kind=NPI) :: i
-    logical :: firstTime = .true.
 
     ! Output constant photolysis rates if any.
     ! Otherwise, output constrained (if any), then unconstrained (if any).
     select case ( PR_type )
       case ( 1_SI )
-        if ( firstTime .eqv. .true. ) then
+        if ( writeHeader(58) .eqv. .true. ) then
           write (58, '(100A15) ') 't', (trim( constantPhotoNames(i) ), i = 1_NPI, numConstantPhotoRates)
-          firstTime = .false.
+          writeHeader(58) = .false.
         end if
         write (58, '(100 (ES15.6E3)) ') t, (j(constantPhotoNumbers(i)), i = 1_NPI, numConstantPhotoRates)
 
       case ( 2_SI )
-        if ( firstTime .eqv. .true. ) then
+        if ( writeHeader(58) .eqv. .true. ) then
           write (58, '(100A15) ') 't', (trim( constrainedPhotoNames(i) ), i = 1_NPI, numConstrainedPhotoRates)
-          firstTime = .false.
+          writeHeader(58) = .false.
         end if
         write (58, '(100 (ES15.6E3)) ') t, (j(constrainedPhotoNumbers(i)), i = 1_NPI, numConstrainedPhotoRates)
 
       case ( 3_SI )
-        if ( firstTime .eqv. .true. ) then
+        if ( writeHeader(58) .eqv. .true. ) then
           write (58, '(100A15) ') 't', (trim( unconstrainedPhotoNames(i) ), i = 1_NPI, numUnconstrainedPhotoRates), &
                                   (trim( constrainedPhotoNames(i) ), i = 1_NPI, numConstrainedPhotoRates)
-          firstTime = .false.
+          writeHeader(58) = .false.
         end if
         write (58, '(100 (ES15.6E3)) ') t, (j(ck(i)), i = 1_NPI, numUnconstrainedPhotoRates), &
                                         (j(constrainedPhotoNumbers(i)), i = 1_NPI, numConstrainedPhotoRates)
 
       case ( 4_SI )
-        if ( firstTime .eqv. .true. ) then
+        if ( writeHeader(58) .eqv. .true. ) then
           write (58, '(100A15) ') 't', (trim( unconstrainedPhotoNames(i) ), i = 1_NPI, numUnconstrainedPhotoRates)
-          firstTime = .false.
+          writeHeader(58) = .false.
         end if
         write (58, '(100 (ES15.6E3)) ') t, (j(ck(i)), i = 1_NPI, numUnconstrainedPhotoRates)
 
@@ -274,17 +368,16 @@ contains
     integer(kind=NPI) :: i, j, output_file_number
     character(len=maxReactionStringLength) :: reaction
     character(len=maxReactionStringLength) :: header
-    logical :: first_time = .true.
 
     if ( size( r, 1 ) /= size( arrayLen ) ) then
       stop "size( r, 1 ) /= size( arrayLen ) in outputRates()."
     end if
     ! Add headers at the first call
-    if ( first_time .eqv. .true. ) then
+    if ( writeHeader(56) .eqv. .true. ) then
       header = "          time speciesNumber speciesName reactionNumber           rate  reaction"
       write (56,*) header
       write (60,*) header
-      first_time = .false.
+      writeHeader(56) = .false.
     end if
 
     speciesNames = getSpeciesList()
@@ -365,16 +458,15 @@ contains
     real(kind=DP), intent(in) :: allSpeciesConcs(:)
     real(kind=DP), allocatable :: arrayOfConcs(:)
     integer(kind=NPI) :: i
-    logical :: first_time = .true.
 
     arrayOfConcs = getSubsetOfConcs( allSpeciesConcs, specOutReqNames )
     if ( size( specOutReqNames ) /= size( arrayOfConcs ) ) then
       stop "size( specOutReqNames ) /= size( arrayOfConcs ) in outputSpeciesOfInterest()."
     end if
 
-    if ( first_time .eqv. .true. ) then
+    if ( writeHeader(50) .eqv. .true. ) then
       write (50, '(1000A50) ') 't', (trim( specOutReqNames(i) ), i = 1, size( specOutReqNames ))
-      first_time = .false.
+      writeHeader(50) = .false.
     end if
 
     do i = 1, size( arrayOfConcs )
@@ -407,4 +499,98 @@ contains
     return
   end subroutine outputFinalModelState
 
+  ! -----------------------------------------------------------------
+  ! Write the checkpoint of the model run at time t to the file
+  ! checkpoint.bin in the output directory, to restart the model run
+  ! from it with the --restart flag (see readCheckpoint()). The
+  ! checkpoint holds the time, the concentrations of all the species
+  ! and of the unconstrained species (z), the solver statistics, the
+  ! solar parameters and the size of the output files. It is written
+  ! to a temporary file, which then replaces the previous checkpoint.
+  subroutine writeCheckpoint( t, tout, currentNumTimestep, speciesConcs, z, iout, rout, rhsEvaluations )
+    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
+    use types_mod
+    use directories_mod, only : scenario_output_dir
+    use storage_mod, only : maxFilepathLength
+    use zenith_data_mod, only : lha, sinld, cosld, cosx, secx, eqtime, cosx_below_threshold
+
+    real(kind=DP), intent(in) :: t, tout, speciesConcs(:), z(:), rout(:)
+    integer, intent(in) :: currentNumTimestep
+    integer(kind=NPI), intent(in) :: iout(:), rhsEvaluations
+    integer(kind=LONG) :: offsets(size( outputUnits ))
+    character(len=maxFilepathLength+16) :: checkpointLocation
+    integer :: i, exit_status
+
+    do i = 1, size( outputUnits )
+      flush (outputUnits(i))
+      inquire (unit=outputUnits(i), size=offsets(i))
+    end do
+
+    checkpointLocation = trim( scenario_output_dir ) // '/checkpoint.bin'
+    open (10, file=trim( checkpointLocation ) // '.tmp', access='stream', form='unformatted', status='replace')
+    write (10) checkpointVersion, size( speciesConcs, kind=LONG ), size( z, kind=LONG ), size( offsets, kind=LONG )
+    write (10) t, tout, currentNumTimestep
+    write (10) speciesConcs, z, iout, rout, rhsEvaluations
+    write (10) lha, sinld, cosld, cosx, secx, eqtime, cosx_below_threshold
+    write (10) offsets
+    close (10)
+
+    call execute_command_line( 'mv -f ' // trim( checkpointLocation ) // '.tmp ' // trim( checkpointLocation ), &
+                               exitstat=exit_status )
+    if ( exit_status /= 0 ) then
+      write (stderr, '(2A)') ' Unable to write the checkpoint ', trim( checkpointLocation )
+      stop
+    end if
+
+    return
+  end subroutine writeCheckpoint
+
+  ! -----------------------------------------------------------------
+  ! Read the checkpoint of a model run written by writeCheckpoint(),
+  ! to restart the model run from it (see the --restart flag). The
+  ! checkpoint must be of the same chemical mechanism, with the same
+  ! number of constrained species. The size of the output files at the
+  ! checkpoint is returned in offsets (see truncateOutputFiles()).
+  subroutine readCheckpoint( checkpointLocation, t, tout, currentNumTimestep, speciesConcs, z, iout, rout, &
+                             rhsEvaluations, offsets )
+    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
+    use types_mod
+    use zenith_data_mod, only : lha, sinld, cosld, cosx, secx, eqtime, cosx_below_threshold
+
+    character(len=*), intent(in) :: checkpointLocation
+    real(kind=DP), intent(out) :: t, tout, speciesConcs(:), z(:), rout(:)
+    integer, intent(out) :: currentNumTimestep
+    integer(kind=NPI), intent(out) :: iout(:), rhsEvaluations
+    integer(kind=LONG), intent(out) :: offsets(:)
+    integer(kind=LONG) :: version, numberOfSpecies, numberOfUnconstrainedSpecies, numberOfFiles
+    integer :: ierr
+    logical :: sameModel
+
+    open (10, file=checkpointLocation, access='stream', form='unformatted', status='old', action='read', iostat=ierr)
+    if ( ierr /= 0 ) then
+      write (stderr, '(2A)') ' Unable to open the checkpoint ', trim( checkpointLocation )
+      stop
+    end if
+    read (10, iostat=ierr) version, numberOfSpecies, numberOfUnconstrainedSpecies, numberOfFiles
+    sameModel = ( ierr == 0 ) .and. ( version == checkpointVersion ) .and. ( numberOfSpecies == size( speciesConcs ) ) &
+                .and. ( numberOfUnconstrainedSpecies == size( z ) ) .and. ( numberOfFiles == size( offsets ) )
+    if ( sameModel .eqv. .false. ) then
+      write (stderr, '(3A)') ' The checkpoint ', trim( checkpointLocation ), &
+                             ' is not from this chemical mechanism and constrained species.'
+      stop
+    end if
+    read (10, iostat=ierr) t, tout, currentNumTimestep, speciesConcs, z, iout, rout, rhsEvaluations, &
+                           lha, sinld, cosld, cosx, secx, eqtime, cosx_below_threshold, offsets
+    if ( ierr /= 0 ) then
+      write (stderr, '(3A)') ' The checkpoint ', trim( checkpointLocation ), ' is incomplete.'
+      stop
+    end if
+    close (10)
+
+    write (*, '(2A)') ' Restarting from the checkpoint ', trim( checkpointLocation )
+    write (*, '(A, I0, A, I0)') ' at t = ', nint( t ), ', step ', currentNumTimestep
+
+    return
+  end subroutine readCheckpoint
+
 end module output_functions_mod
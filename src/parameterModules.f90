@@ -37,7 +37,7 @@ module solver_params_mod
   integer(kind=NPI) :: maxNumInternalSteps
   integer(kind=SI) :: solverType
   integer(kind=NPI) :: preconBandUpper, preconBandLower
-  character(len=30) :: solverTypeName(3)
+  character(len=30) :: solverTypeName(4)
 
 contains
 
@@ -53,6 +53,7 @@ contains
     solverTypeName(1) = 'SPGMR'
     solverTypeName(2) = 'SPGMR + Banded Preconditioner'
     solverTypeName(3) = 'Dense'
+    solverTypeName(4) = 'Sparse (KLU)'
 
     ! Used in FCVMALLOC(): ATOL is the absolute tolerance (scalar or
     ! array).
@@ -76,6 +77,7 @@ contains
     ! 1: SPGMR
     ! 2: SPGMR + Banded preconditioner
     ! 3: Dense solver
+    ! 4: Sparse direct solver (KLU)
     ! otherwise: error
     solverType = nint( input_parameters(7), SI )
     ! From CVODE docs: MU (preconBandUpper) and ML (preconBandLower)
@@ -121,8 +123,9 @@ module model_params_mod
   real(kind=DP) :: timestepSize
   integer(kind=SI) :: speciesInterpolationMethod, conditionsInterpolationMethod
   integer(kind=QI) :: ratesOutputStepSize, modelStartTime, jacobianOutputStepSize, irOutStepSize
+  integer(kind=QI) :: numberOfThreads, checkpointStepSize
   character(len=20) :: interpolationMethodName(2)
-  logical :: outputJacobian
+  logical :: outputJacobian, reactionRatesAtOutputOnly
 
 contains
 
@@ -134,8 +137,10 @@ contains
     use zenith_data_mod, only : latitude, longitude
     use date_mod, only : startDay, startMonth, startYear
     use interpolation_method_mod, only : setSpeciesInterpMethod, setConditionsInterpMethod
+    use reaction_rates_mod, only : storeReactionRates
+    use threads_mod, only : setNumberOfThreads, getNumberOfThreads
 
-    real(kind=DP) :: input_parameters(*)
+    real(kind=DP) :: input_parameters(:)
 
     write (*, '(A)') ' Reading model parameters from file...'
     interpolationMethodName(1) = 'piecewise constant'
@@ -180,6 +185,28 @@ contains
     startYear = nint( input_parameters(12), DI )
     ! Frequency at which to output reaction rates
     irOutStepSize = nint( input_parameters(13), QI )
+    ! Calculate the reaction rates at the output times only (1), or at
+    ! each evaluation of the right-hand side (0, default). This line is
+    ! optional.
+    reactionRatesAtOutputOnly = .false.
+    if ( size( input_parameters ) >= 14 ) then
+      reactionRatesAtOutputOnly = ( nint( input_parameters(14) ) == 1 )
+    end if
+    storeReactionRates = .not. reactionRatesAtOutputOnly
+    ! Number of threads of the parallel loops, if AtChem2 is compiled
+    ! with OpenMP (0, default: set by OpenMP). This line is optional.
+    numberOfThreads = 0_QI
+    if ( size( input_parameters ) >= 15 ) then
+      numberOfThreads = nint( input_parameters(15), QI )
+    end if
+    call setNumberOfThreads( numberOfThreads )
+    ! Frequency at which to write the checkpoint of the model run, to
+    ! restart it with the --restart flag (0, default: no checkpoints).
+    ! This line is optional.
+    checkpointStepSize = 0_QI
+    if ( size( input_parameters ) >= 16 ) then
+      checkpointStepSize = nint( input_parameters(16), QI )
+    end if
 
     ! float format
     300 format (A52, E11.3)
@@ -200,6 +227,17 @@ contains
     write (*, 300) 'latitude: ', latitude
     write (*, 300) 'longitude: ', longitude
     write (*, 400) 'reaction rates output step size: ', irOutStepSize
+    ! The optional parameters are only written out if they are given, so
+    ! that the output of the model.parameters without them is unchanged.
+    if ( size( input_parameters ) >= 14 ) then
+      write (*, 500) 'reaction rates at output times only: ', merge( 'yes', 'no ', reactionRatesAtOutputOnly )
+    end if
+    if ( size( input_parameters ) >= 15 ) then
+      write (*, 400) 'number of threads: ', getNumberOfThreads()
+    end if
+    if ( size( input_parameters ) >= 16 ) then
+      write (*, 400) 'checkpoint step size: ', checkpointStepSize
+    end if
     write (*, '(A52, I3, A, I2, A, I4) ') 'day/month/year: ', startDay, '/', startMonth, '/', startYear
     write (*, '(A)') ' -----------------'
     write (*,*)
@@ -19,6 +19,8 @@
 ! and manipulate the rate information towards solving the system.
 ! ******************************************************************** !
 module solver_functions_mod
+  use, intrinsic :: iso_c_binding, only : c_int
+  use types_mod, only : SI, DP, NPI
   implicit none
 
   ! Define interface of call-back routine.
@@ -28,77 +30,610 @@ module solver_functions_mod
       real(c_double), intent(inout) :: i(*), i2(*)
       real(c_double), intent(in) :: i3, i4, i5, i6, i7, i8, i9, i10, i11, i12, i13, i14, i15, i16(*), i17
     end subroutine called_proc
+
+    subroutine jacobian_size_proc( numberOfSpecies, numberOfNonZeros ) bind ( c )
+      use, intrinsic :: iso_c_binding
+      integer(c_int), intent(out) :: numberOfSpecies, numberOfNonZeros
+    end subroutine jacobian_size_proc
+
+    subroutine jacobian_pattern_proc( rowStart, columns ) bind ( c )
+      use, intrinsic :: iso_c_binding
+      integer(c_int), intent(out) :: rowStart(*), columns(*)
+    end subroutine jacobian_pattern_proc
+
+    subroutine jacobian_values_proc( p, y, jac ) bind ( c )
+      use, intrinsic :: iso_c_binding
+      real(c_double), intent(in) :: p(*), y(*)
+      real(c_double), intent(out) :: jac(*)
+    end subroutine jacobian_values_proc
   end interface
 
   procedure(called_proc), pointer :: proc
 
+  ! Subroutines of the groups of rates of the chemical mechanism, which are
+  ! only available if the mechanism has been converted with the --groups
+  ! option of build/mech_converter.py: the rates of each group are recomputed
+  ! only when the inputs of the group have changed.
+  procedure(called_proc), pointer :: procConstant => null(), procEnv => null(), procJ => null(), procRO2 => null()
+  logical :: useRateGroups = .false.
+
+  ! Rates and rate coefficients calculated by the groups, and the inputs of
+  ! the groups at the previous call of mechanism_rates().
+  real(kind=DP), allocatable :: groupRates(:), groupCoeffs(:), lastJ(:)
+  real(kind=DP) :: lastEnvVars(12), lastRO2, lastT
+
+  ! Subroutine of the analytic Jacobian matrix of the chemical mechanism, which
+  ! is only available if the mechanism has been converted with the --jacobian
+  ! option of build/mech_converter.py. The nonzero elements of the Jacobian
+  ! matrix are in compressed sparse row format: the elements of row i are in
+  ! positions jacRowStart(i) to jacRowStart(i+1)-1, and jacColumns holds their
+  ! column numbers.
+  procedure(jacobian_values_proc), pointer :: jacobianValues => null()
+  logical :: useJacobian = .false.
+  integer(c_int), allocatable :: jacRowStart(:), jacColumns(:)
+
+  ! Sparsity pattern of the Jacobian matrix of the unconstrained species, used
+  ! by the sparse direct solver (solver type 4), in compressed sparse row
+  ! format with the 0-based indices required by CVODE. solverSpecies holds the
+  ! species number of each unconstrained species.
+  integer(c_int), allocatable :: sparseRowStart(:), sparseColumns(:)
+  integer(kind=NPI), allocatable :: solverSpecies(:)
+
+  ! Colouring of the columns of the Jacobian matrix: the columns of the same
+  ! colour have no nonzero elements in the same row, so they are perturbed
+  ! together in the finite-difference estimate of the Jacobian matrix. The
+  ! columns of colour c are colourColumns(colourStart(c):colourStart(c+1)-1).
+  ! The rows of column j are columnRows(columnStart(j):columnStart(j+1)-1), and
+  ! columnPositions holds the positions of these elements in sparseColumns.
+  integer(kind=NPI), allocatable :: colourStart(:), colourColumns(:)
+  integer(kind=NPI), allocatable :: columnStart(:), columnRows(:), columnPositions(:)
+  integer(kind=NPI) :: numberOfColours
+
+  ! Position in sparseColumns of each nonzero element of the analytic
+  ! Jacobian matrix (0 if its row or column is a constrained species).
+  integer(kind=NPI), allocatable :: analyticPositions(:)
+
+  ! Number of evaluations of the right-hand side for the finite-difference
+  ! estimate of the sparse Jacobian matrix (not counted by CVODE)
+  integer(kind=NPI) :: sparseJacobianRhsEvaluations = 0
+
+  ! Stoichiometry of the chemical mechanism, set by setStoichiometry() from
+  ! the reactants and the products of each reaction. The reactants of
+  ! reaction j are rateReactants(rateReactantStart(j):rateReactantStart(j+1)-1),
+  ! with their exponents in rateExponents if they are small positive integers,
+  ! or in rateCoeffs (and 0 in rateExponents) otherwise. The rate of change of
+  ! species i is the sum of the rates of the reactions
+  ! speciesTermReactions(speciesTermStart(i):speciesTermStart(i+1)-1),
+  ! multiplied by speciesTermCoeffs (negative for the reactants, positive for
+  ! the products).
+  integer(kind=NPI), allocatable :: rateReactantStart(:), rateReactants(:)
+  integer(kind=SI), allocatable :: rateExponents(:)
+  real(kind=DP), allocatable :: rateCoeffs(:)
+  integer(kind=NPI), allocatable :: speciesTermStart(:), speciesTermReactions(:)
+  real(kind=DP), allocatable :: speciesTermCoeffs(:)
+
 contains
 
   ! ----------------------------------------------------------------- !
   ! Calculates the system residual
-  subroutine resid( nr, time, y, dy, lhs, lcoeff, rhs, rcoeff )
+  subroutine resid( nr, time, y, dy )
     use types_mod
-    use reaction_rates_mod, only : reactionRates
+    use reaction_rates_mod, only : storeReactionRates
 
     integer(kind=NPI), intent(in) :: nr ! number of reactions
     real(kind=DP), intent(in) :: time, y(:) ! concentration array
     real(kind=DP), contiguous, intent(out) :: dy(:) ! array to hold value of rate equations
-    integer(kind=NPI), intent(in) :: lhs(:,:), rhs(:,:)
-    real(kind=DP), intent(in) :: lcoeff(:), rcoeff(:) ! coeff term of rhs
     real(kind=DP) :: r(nr) ! working array
-    integer(kind=NPI) :: i
+
+    ! get values of reactions rates
+    call mechanism_rates( time, y, r )
+
+    ! multiply the rate coefficient of each reaction by the concentration
+    ! of each reactant, giving the reaction rate of the reaction.
+    call multiplyByReactants( r, y )
+
+    ! the reaction rates are only needed at the output times: if
+    ! storeReactionRates is false, they are calculated there by
+    ! calcReactionRates() instead
+    if ( storeReactionRates .eqv. .true. ) then
+      call storeRates( r )
+    end if
 
     ! calculate rhs of rate eqn dy()
+    call sumStoichiometry( r, dy )
+
+    return
+  end subroutine resid
+
+  ! ----------------------------------------------------------------- !
+  ! Calculates the reaction rates at (t, y), and stores them in
+  ! reactionRates for the output.
+  subroutine calcReactionRates( nr, t, y )
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: nr
+    real(kind=DP), intent(in) :: t, y(:)
+    real(kind=DP) :: r(nr)
+
+    call mechanism_rates( t, y, r )
+    call multiplyByReactants( r, y )
+    call storeRates( r )
+
+    return
+  end subroutine calcReactionRates
+
+  ! ----------------------------------------------------------------- !
+  ! Stores the reaction rates r in reactionRates for the output. The
+  ! reactions without reactants are left out, so their reaction rate is
+  ! written out as zero.
+  subroutine storeRates( r )
+    use types_mod
+    use reaction_rates_mod, only : reactionRates
+
+    real(kind=DP), intent(in) :: r(:)
+    integer(kind=NPI) :: j
+
+    do j = 1, size( r )
+      if ( rateReactantStart(j + 1) > rateReactantStart(j) ) then
+        reactionRates(j) = r(j)
+      end if
+    end do
+
+    return
+  end subroutine storeRates
+
+  ! ----------------------------------------------------------------- !
+  ! Multiplies the rate coefficient of each reaction by the concentration
+  ! of each reactant, raised to its stoichiometric coefficient, giving the
+  ! reaction rate of the reaction.
+  ! As an example, if we have reaction 1 as A+A+B -> C +C + D with rate k, then
+  ! r(1) is updated to kAAB.
+  ! The reactions are independent, so they are shared between the threads
+  ! if AtChem2 is compiled with OpenMP.
+  subroutine multiplyByReactants( r, y )
+    use types_mod
+    use threads_mod, only : minParallelLoopSize
+
+    real(kind=DP), intent(inout) :: r(:)
+    real(kind=DP), intent(in) :: y(:)
+    real(kind=DP) :: rate
+    integer(kind=NPI) :: j, k
+
+    !$omp parallel do private( rate, k ) schedule( static ) if ( size( r ) >= minParallelLoopSize )
+    do j = 1, size( r )
+      rate = r(j)
+      do k = rateReactantStart(j), rateReactantStart(j + 1) - 1
+        select case ( rateExponents(k) )
+          case ( 1_SI )
+            rate = rate * y(rateReactants(k))
+          case ( 0_SI )
+            rate = rate * y(rateReactants(k)) ** rateCoeffs(k)
+          case default
+            rate = rate * y(rateReactants(k)) ** rateExponents(k)
+        end select
+      end do
+      r(j) = rate
+    end do
+    !$omp end parallel do
+
+    return
+  end subroutine multiplyByReactants
+
+  ! ----------------------------------------------------------------- !
+  ! Calculates the rate of change of each species, dy, from the reaction
+  ! rates r: each reaction decreases the concentration of each of its
+  ! reactants, and increases the concentration of each of its products,
+  ! by its reaction rate times the stoichiometric coefficient.
+  ! Continuing the example above, dy(A) = -2kAAB, dy(B) = -kAAB,
+  ! dy(C) = 2kAAB and dy(D) = kAAB.
+  ! Each species is summed by one thread, in the same order, so the result
+  ! does not depend on the number of threads if AtChem2 is compiled with
+  ! OpenMP.
+  subroutine sumStoichiometry( r, dy )
+    use types_mod
+    use threads_mod, only : minParallelLoopSize
+
+    real(kind=DP), intent(in) :: r(:)
+    real(kind=DP), intent(out) :: dy(:)
+    real(kind=DP) :: rate
+    integer(kind=NPI) :: i, k
+
+    !$omp parallel do private( rate, k ) schedule( static ) if ( size( speciesTermStart ) > minParallelLoopSize )
+    do i = 1, size( speciesTermStart ) - 1
+      rate = 0.0_DP
+      do k = speciesTermStart(i), speciesTermStart(i + 1) - 1
+        rate = rate + speciesTermCoeffs(k) * r(speciesTermReactions(k))
+      end do
+      dy(i) = rate
+    end do
+    !$omp end parallel do
+
+    return
+  end subroutine sumStoichiometry
+
+  ! ----------------------------------------------------------------- !
+  ! Sets the stoichiometry of the chemical mechanism used by resid(), from
+  ! the reactants (lhs and lcoeff) and the products (rhs and rcoeff) of
+  ! each reaction: the reactants of each reaction, and the reactions which
+  ! consume or produce each species, in compressed sparse row format. The
+  ! terms of each species keep the order of lhs and rhs, so that the sums
+  ! are the same as summing over lhs then rhs.
+  subroutine setStoichiometry( nr, np, lhs, lcoeff, rhs, rcoeff )
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: nr, np
+    integer(kind=NPI), intent(in) :: lhs(:,:), rhs(:,:)
+    real(kind=DP), intent(in) :: lcoeff(:), rcoeff(:) ! coeff term of rhs
+    integer(kind=NPI), allocatable :: counter(:)
+    integer(kind=NPI) :: i, j, k
+
     if ( size( lhs, 1 ) /= 2 ) then
-      stop 'size( lhs, 1 ) /= 2 in resid()'
+      stop 'size( lhs, 1 ) /= 2 in setStoichiometry()'
     end if
     if ( size( rhs, 1 ) /= 2 ) then
-      stop 'size( rhs, 1 ) /= 2 in resid()'
+      stop 'size( rhs, 1 ) /= 2 in setStoichiometry()'
     end if
     if ( size( lhs, 2 ) /= size( lcoeff ) ) then
-      stop 'size( lhs, 2 ) /= lcoeff in resid()'
+      stop 'size( lhs, 2 ) /= lcoeff in setStoichiometry()'
     end if
     if ( size( rhs, 2 ) /= size( rcoeff ) ) then
-      stop 'size( rhs, 2 ) /= rcoeff in resid()'
+      stop 'size( rhs, 2 ) /= rcoeff in setStoichiometry()'
     end if
 
-    ! set rate eqn to zero
-    dy(:) = 0
+    if ( allocated( rateReactantStart ) ) then
+      deallocate (rateReactantStart, rateReactants, rateExponents, rateCoeffs, &
+                  speciesTermStart, speciesTermReactions, speciesTermCoeffs)
+    end if
+    allocate (rateReactantStart(nr + 1), rateReactants(size( lhs, 2 )), rateExponents(size( lhs, 2 )), &
+              rateCoeffs(size( lhs, 2 )), speciesTermStart(np + 1), &
+              speciesTermReactions(size( lhs, 2 ) + size( rhs, 2 )), &
+              speciesTermCoeffs(size( lhs, 2 ) + size( rhs, 2 )), counter(max( nr, np )))
+
+    ! Reactants of each reaction
+    rateReactantStart(:) = 0_NPI
+    do k = 1, size( lhs, 2 )
+      rateReactantStart(lhs(1, k) + 1) = rateReactantStart(lhs(1, k) + 1) + 1
+    end do
+    rateReactantStart(1) = 1_NPI
+    do j = 1, nr
+      rateReactantStart(j + 1) = rateReactantStart(j + 1) + rateReactantStart(j)
+    end do
+    counter(1:nr) = rateReactantStart(1:nr)
+    do k = 1, size( lhs, 2 )
+      j = lhs(1, k)
+      rateReactants(counter(j)) = lhs(2, k)
+      rateCoeffs(counter(j)) = lcoeff(k)
+      ! the integer exponents are calculated by multiplication, instead of
+      ! the general power function
+      if ( lcoeff(k) >= 1.0_DP .and. lcoeff(k) <= 4.0_DP .and. lcoeff(k) == aint( lcoeff(k) ) ) then
+        rateExponents(counter(j)) = nint( lcoeff(k), SI )
+      else
+        rateExponents(counter(j)) = 0_SI
+      end if
+      counter(j) = counter(j) + 1
+    end do
 
-    ! get values of reactions rates
-    call mechanism_rates( time, y, r )
+    ! Reactions which consume (lhs) or produce (rhs) each species
+    speciesTermStart(:) = 0_NPI
+    do k = 1, size( lhs, 2 )
+      speciesTermStart(lhs(2, k) + 1) = speciesTermStart(lhs(2, k) + 1) + 1
+    end do
+    do k = 1, size( rhs, 2 )
+      speciesTermStart(rhs(2, k) + 1) = speciesTermStart(rhs(2, k) + 1) + 1
+    end do
+    speciesTermStart(1) = 1_NPI
+    do i = 1, np
+      speciesTermStart(i + 1) = speciesTermStart(i + 1) + speciesTermStart(i)
+    end do
+    counter(1:np) = speciesTermStart(1:np)
+    do k = 1, size( lhs, 2 )
+      i = lhs(2, k)
+      speciesTermReactions(counter(i)) = lhs(1, k)
+      speciesTermCoeffs(counter(i)) = -lcoeff(k)
+      counter(i) = counter(i) + 1
+    end do
+    do k = 1, size( rhs, 2 )
+      i = rhs(2, k)
+      speciesTermReactions(counter(i)) = rhs(1, k)
+      speciesTermCoeffs(counter(i)) = rcoeff(k)
+      counter(i) = counter(i) + 1
+    end do
 
-    ! r is of length #reactions. This loop multiplies the reaction coefficient of
-    ! the reaction by the concentration of each reactant, giving the
-    ! reaction rate of the reaction.
-    ! As an example, if we have reaction 1 as A+A+B -> C +C + D with rate k, then this
-    ! loop will update r(1) to kAAB.
-    do i = 1, size( lhs, 2 )
-      r(lhs(1, i)) = r(lhs(1, i)) * y(lhs(2, i)) ** lcoeff(i)
-      reactionRates(lhs(1, i)) = r(lhs(1, i))
+    deallocate (counter)
+
+    return
+  end subroutine setStoichiometry
+
+  ! ----------------------------------------------------------------- !
+  ! Calculates the nonzero elements of the analytic Jacobian matrix of
+  ! the system, in compressed sparse row format (see jacRowStart and
+  ! jacColumns)
+  subroutine sparseJacobian( nr, t, y, jac )
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: nr
+    real(kind=DP), intent(in) :: t, y(:)
+    real(kind=DP), intent(out) :: jac(:)
+    real(kind=DP) :: p(nr)
+
+    call mechanism_rates( t, y, p )
+    call jacobianValues( p, y, jac )
+
+    return
+  end subroutine sparseJacobian
+
+  ! ----------------------------------------------------------------- !
+  ! Sets the sparsity pattern of the Jacobian matrix of the unconstrained
+  ! species, from the reactants and the products of each reaction: the
+  ! element (i, j) is nonzero if species j is a reactant of a reaction
+  ! which consumes or produces species i. The diagonal elements are always
+  ! included. Then colour the columns of the Jacobian matrix, for the
+  ! finite-difference estimate, and map the nonzero elements of the analytic
+  ! Jacobian matrix, if available, to the sparsity pattern.
+  subroutine setSparsePattern( nr, np, constrainedSpecies )
+    use types_mod
+    use reaction_structure_mod ! access crhs, clhs
+
+    integer(kind=NPI), intent(in) :: nr, np, constrainedSpecies(:)
+    integer(kind=NPI), allocatable :: solverIndex(:), reactantStart(:), reactants(:), speciesStart(:), &
+                                      speciesReactions(:), marker(:), rowLength(:), columnColour(:), &
+                                      forbidden(:), counter(:)
+    integer(kind=NPI) :: neq, nnz, i, j, k, l, m, r, c, pass
+
+    ! solverIndex holds the position of each species in the solver, or 0 for
+    ! the constrained species
+    allocate (solverIndex(np))
+    solverIndex(:) = 1_NPI
+    solverIndex(constrainedSpecies) = 0_NPI
+    neq = 0_NPI
+    do i = 1, np
+      if ( solverIndex(i) > 0 ) then
+        neq = neq + 1
+        solverIndex(i) = neq
+      end if
+    end do
+    if ( allocated( solverSpecies ) ) then
+      deallocate (solverSpecies, sparseRowStart, sparseColumns, colourStart, colourColumns, &
+                  columnStart, columnRows, columnPositions)
+    end if
+    allocate (solverSpecies(neq))
+    do i = 1, np
+      if ( solverIndex(i) > 0 ) then
+        solverSpecies(solverIndex(i)) = i
+      end if
+    end do
+
+    ! Reactants of each reaction, and reactions of each species
+    allocate (reactantStart(nr + 1), reactants(size( clhs, 2 )), speciesStart(np + 1), &
+              speciesReactions(size( clhs, 2 ) + size( crhs, 2 )), counter(max( nr, np )))
+    reactantStart(:) = 0_NPI
+    speciesStart(:) = 0_NPI
+    do k = 1, size( clhs, 2 )
+      reactantStart(clhs(1, k) + 1) = reactantStart(clhs(1, k) + 1) + 1
+      speciesStart(clhs(2, k) + 1) = speciesStart(clhs(2, k) + 1) + 1
+    end do
+    do k = 1, size( crhs, 2 )
+      speciesStart(crhs(2, k) + 1) = speciesStart(crhs(2, k) + 1) + 1
+    end do
+    reactantStart(1) = 1_NPI
+    do r = 1, nr
+      reactantStart(r + 1) = reactantStart(r + 1) + reactantStart(r)
+    end do
+    speciesStart(1) = 1_NPI
+    do i = 1, np
+      speciesStart(i + 1) = speciesStart(i + 1) + speciesStart(i)
+    end do
+    counter(1:nr) = reactantStart(1:nr)
+    do k = 1, size( clhs, 2 )
+      reactants(counter(clhs(1, k))) = clhs(2, k)
+      counter(clhs(1, k)) = counter(clhs(1, k)) + 1
+    end do
+    counter(1:np) = speciesStart(1:np)
+    do k = 1, size( clhs, 2 )
+      speciesReactions(counter(clhs(2, k))) = clhs(1, k)
+      counter(clhs(2, k)) = counter(clhs(2, k)) + 1
+    end do
+    do k = 1, size( crhs, 2 )
+      speciesReactions(counter(crhs(2, k))) = crhs(1, k)
+      counter(crhs(2, k)) = counter(crhs(2, k)) + 1
     end do
 
-    ! loop over each of the species in each reaction, updating the dy (rate of change of species y)
-    ! with the reaction rate from each of the reactants in each reaction.
-    ! continuing the example from above, this loop updates dy(A) by r(1) for the first reactant A.
-    ! After that, it updates dy(A) again for the second reactant A.
-    ! Now dy(A) = -2kAAB.
-    ! Finally, it updates dy(B) by r(1) for the reactant B to set dy(B) = -kAAB.
-    do i = 1, size( lhs, 2 )
-      dy(lhs(2, i)) = dy(lhs(2, i)) - lcoeff(i) * r(lhs(1, i))
+    ! Count the nonzero elements of each row (first pass), then store their
+    ! columns (second pass). marker(j) = i if column j is already in row i.
+    allocate (marker(neq), rowLength(neq), sparseRowStart(neq + 1))
+    do pass = 1, 2
+      marker(:) = 0_NPI
+      do i = 1, neq
+        if ( pass == 2 ) then
+          sparseColumns(sparseRowStart(i) + 1) = int( i - 1, c_int )
+        end if
+        marker(i) = i
+        rowLength(i) = 1_NPI
+        do k = speciesStart(solverSpecies(i)), speciesStart(solverSpecies(i) + 1) - 1
+          r = speciesReactions(k)
+          do l = reactantStart(r), reactantStart(r + 1) - 1
+            j = solverIndex(reactants(l))
+            if ( j > 0 ) then
+              if ( marker(j) /= i ) then
+                marker(j) = i
+                if ( pass == 2 ) then
+                  sparseColumns(sparseRowStart(i) + rowLength(i) + 1) = int( j - 1, c_int )
+                end if
+                rowLength(i) = rowLength(i) + 1
+              end if
+            end if
+          end do
+        end do
+      end do
+      if ( pass == 1 ) then
+        sparseRowStart(1) = 0_c_int
+        do i = 1, neq
+          sparseRowStart(i + 1) = sparseRowStart(i) + int( rowLength(i), c_int )
+        end do
+        allocate (sparseColumns(sparseRowStart(neq + 1)))
+      end if
+    end do
+    nnz = sparseRowStart(neq + 1)
+
+    ! Sort the columns of each row
+    do i = 1, neq
+      do k = sparseRowStart(i) + 2, sparseRowStart(i + 1)
+        c = sparseColumns(k)
+        l = k - 1
+        do while ( l > sparseRowStart(i) )
+          if ( sparseColumns(l) <= c ) exit
+          sparseColumns(l + 1) = sparseColumns(l)
+          l = l - 1
+        end do
+        sparseColumns(l + 1) = int( c, c_int )
+      end do
     end do
 
-    ! This does the same as the above but updates each of the product species by
-    ! the values of the relevant elements of r.
-    ! Continuing the example above, it will update dy(C) by kAAB, then again for
-    ! the second product C, giving dy(C) = 2kAAB. Finally, update dy(D) once to
-    ! give dy(D) = kAAB.
-    do i = 1, size( rhs, 2 )
-      dy(rhs(2, i)) = dy(rhs(2, i)) + rcoeff(i) * r(rhs(1, i))
+    ! Rows of each column, and their positions in sparseColumns
+    allocate (columnStart(neq + 1), columnRows(nnz), columnPositions(nnz))
+    columnStart(:) = 0_NPI
+    do k = 1, nnz
+      columnStart(sparseColumns(k) + 2) = columnStart(sparseColumns(k) + 2) + 1
+    end do
+    columnStart(1) = 1_NPI
+    do j = 1, neq
+      columnStart(j + 1) = columnStart(j + 1) + columnStart(j)
+    end do
+    counter(1:neq) = columnStart(1:neq)
+    do i = 1, neq
+      do k = sparseRowStart(i) + 1, sparseRowStart(i + 1)
+        j = sparseColumns(k) + 1
+        columnRows(counter(j)) = i
+        columnPositions(counter(j)) = k
+        counter(j) = counter(j) + 1
+      end do
     end do
 
+    ! Greedy colouring of the columns: each column gets the smallest colour
+    ! which is not used by any column with a nonzero element in the same row.
+    ! forbidden(c) = j if colour c is used by such a column of column j.
+    allocate (columnColour(neq), forbidden(neq))
+    columnColour(:) = 0_NPI
+    forbidden(:) = 0_NPI
+    numberOfColours = 0_NPI
+    do j = 1, neq
+      do k = columnStart(j), columnStart(j + 1) - 1
+        i = columnRows(k)
+        do l = sparseRowStart(i) + 1, sparseRowStart(i + 1)
+          m = sparseColumns(l) + 1
+          if ( columnColour(m) > 0 ) then
+            forbidden(columnColour(m)) = j
+          end if
+        end do
+      end do
+      c = 1_NPI
+      do while ( forbidden(c) == j )
+        c = c + 1
+      end do
+      columnColour(j) = c
+      numberOfColours = max( numberOfColours, c )
+    end do
+    allocate (colourStart(numberOfColours + 1), colourColumns(neq))
+    colourStart(:) = 0_NPI
+    do j = 1, neq
+      colourStart(columnColour(j) + 1) = colourStart(columnColour(j) + 1) + 1
+    end do
+    colourStart(1) = 1_NPI
+    do c = 1, numberOfColours
+      colourStart(c + 1) = colourStart(c + 1) + colourStart(c)
+    end do
+    counter(1:numberOfColours) = colourStart(1:numberOfColours)
+    do j = 1, neq
+      colourColumns(counter(columnColour(j))) = j
+      counter(columnColour(j)) = counter(columnColour(j)) + 1
+    end do
+
+    ! Positions of the nonzero elements of the analytic Jacobian matrix
+    if ( useJacobian ) then
+      if ( allocated( analyticPositions ) ) then
+        deallocate (analyticPositions)
+      end if
+      allocate (analyticPositions(size( jacColumns )))
+      analyticPositions(:) = 0_NPI
+      do i = 1, np
+        if ( solverIndex(i) > 0 ) then
+          do k = jacRowStart(i), jacRowStart(i + 1) - 1
+            j = solverIndex(jacColumns(k))
+            if ( j > 0 ) then
+              do l = sparseRowStart(solverIndex(i)) + 1, sparseRowStart(solverIndex(i) + 1)
+                if ( sparseColumns(l) == j - 1 ) then
+                  analyticPositions(k) = l
+                  exit
+                end if
+              end do
+            end if
+          end do
+        end if
+      end do
+    end if
+
+    deallocate (solverIndex, reactantStart, reactants, speciesStart, speciesReactions, counter, &
+                marker, rowLength, columnColour, forbidden)
+
     return
-  end subroutine resid
+  end subroutine setSparsePattern
+
+  ! ----------------------------------------------------------------- !
+  ! Calculates the nonzero elements of the Jacobian matrix of the
+  ! unconstrained species, in the sparsity pattern set by
+  ! setSparsePattern(). y holds the concentrations of all the species,
+  ! and fy the right-hand side of the unconstrained species at (t, y).
+  ! The analytic Jacobian matrix is used if available, otherwise the
+  ! Jacobian matrix is estimated by finite differences, with one
+  ! evaluation of the right-hand side for each colour of the columns.
+  ! The increment of the concentration of species j is
+  ! sqrt( epsilon ) * max( abs( y(j) ), minIncrement ).
+  subroutine sparseSolverJacobian( nr, t, y, fy, minIncrement, jdata )
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: nr
+    real(kind=DP), intent(in) :: t, y(:), fy(:), minIncrement
+    real(kind=DP), intent(out) :: jdata(:)
+    real(kind=DP), allocatable :: jac(:), yPerturbed(:), dy(:), increment(:)
+    real(kind=DP) :: srur
+    integer(kind=NPI) :: c, j, k, l
+
+    if ( useJacobian ) then
+      allocate (jac(size( jacColumns )))
+      call sparseJacobian( nr, t, y, jac )
+      jdata(:) = 0.0_DP
+      do k = 1, size( jac )
+        if ( analyticPositions(k) > 0 ) then
+          jdata(analyticPositions(k)) = jac(k)
+        end if
+      end do
+      deallocate (jac)
+      return
+    end if
+
+    allocate (yPerturbed(size( y )), dy(size( y )), increment(size( solverSpecies )))
+    srur = sqrt( epsilon( 1.0_DP ) )
+    yPerturbed(:) = y(:)
+    do c = 1, numberOfColours
+      do l = colourStart(c), colourStart(c + 1) - 1
+        j = colourColumns(l)
+        increment(j) = srur * max( abs( y(solverSpecies(j)) ), minIncrement )
+        yPerturbed(solverSpecies(j)) = y(solverSpecies(j)) + increment(j)
+      end do
+      call resid( nr, t, yPerturbed, dy )
+      sparseJacobianRhsEvaluations = sparseJacobianRhsEvaluations + 1
+      do l = colourStart(c), colourStart(c + 1) - 1
+        j = colourColumns(l)
+        do k = columnStart(j), columnStart(j + 1) - 1
+          jdata(columnPositions(k)) = ( dy(solverSpecies(columnRows(k))) - fy(columnRows(k)) ) / increment(j)
+        end do
+        yPerturbed(solverSpecies(j)) = y(solverSpecies(j))
+      end do
+    end do
+    deallocate (yPerturbed, dy, increment)
+
+    return
+  end subroutine sparseSolverJacobian
 
   ! ----------------------------------------------------------------- !
   ! subroutine to calculate the Jacobian matrix of the system
@@ -108,10 +643,26 @@ contains
 
     integer(kind=NPI), intent(in) :: nr
     real(kind=DP), intent(in) :: y(:), t
-    real(kind=DP) :: fy(size( y ), size( y ))
-    integer(kind=NPI) :: i, j
+    real(kind=DP), allocatable :: fy(:,:), jac(:)
+    integer(kind=NPI) :: i, j, k
     real(kind=DP) :: p(nr), r(nr)
 
+    ! With the analytic Jacobian matrix, print the nonzero elements to
+    ! jacobian.output, one per line, prefixed by t and followed by the
+    ! row and column numbers
+    if ( useJacobian ) then
+      allocate (jac(size( jacColumns )))
+      call sparseJacobian( nr, t, y, jac )
+      do i = 1, size( y )
+        do k = jacRowStart(i), jacRowStart(i + 1) - 1
+          write (55, '(1P e15.7, 2I8, 1P e15.7) ') t, i, jacColumns(k), jac(k)
+        end do
+      end do
+      write (55,*) '---------------'
+      deallocate (jac)
+      return
+    end if
+
     ! nr = number of reactions
     ! for each species calculate the rhs of the rate equation
     ! for the reactants array
@@ -132,6 +683,7 @@ contains
     ! r = working array - dimension nr
 
     ! set jacobian matrix to zero
+    allocate (fy(size( y ), size( y )))
     fy(:,:) = 0.0_DP
 
     ! call routine to get reaction rates in array p. Each element of p
@@ -170,18 +722,19 @@ contains
   ! calculates rate constants from arrhenius information output p(:)
   ! contains the rate of each reaction
   subroutine mechanism_rates( t, y, p )
-    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
     use types_mod
-    use storage_mod, only : maxEnvVarNameLength, maxFilepathLength
+    use storage_mod, only : maxFilepathLength
     use photolysis_rates_mod, only : numConstantPhotoRates, constantPhotoNumbers, constantPhotoValues, &
                                      numUnconstrainedPhotoRates, numConstrainedPhotoRates, j, ck, &
                                      constrainedPhotoNumbers, usePhotolysisConstants
     use zenith_data_mod, only : cosx_below_threshold
-    use env_vars_mod, only : ro2, envVarNames, currentEnvVarValues
+    use env_vars_mod, only : ro2, currentEnvVarValues
     use interpolation_functions_mod, only : getConstrainedPhotoRatesAtT
     use interpolation_method_mod, only : getConditionsInterpMethod
     use output_functions_mod, only : ro2sum
-    use constraint_functions_mod, only : calcPhotolysis, getEnvVarsAtT, getEnvVarNum
+    use constraint_functions_mod, only : calcPhotolysis, getEnvVarsAtT, orderedEnvVarNums, orderedPress, orderedTemp, &
+                                         orderedM, orderedRH, orderedH2O, orderedBlheight, orderedDec, orderedJfac, &
+                                         orderedDilute, orderedRoof, orderedAsa
     use atmosphere_functions_mod, only : calcAtmosphere
     use species_mod, only : getNumberOfGenericComplex
 
@@ -190,9 +743,9 @@ contains
     real(kind=DP), intent(out) :: p(:)
     real(kind=DP) :: q(getNumberOfGenericComplex())
 
-    real(kind=DP) :: temp, press, dummy, this_env_val, photoRateAtT
+    real(kind=DP) :: temp, press, dummy, photoRateAtT, envVars(12)
+    logical :: envChanged, jChanged, ro2Changed
     integer(kind=NPI) :: i
-    character(len=maxEnvVarNameLength) :: this_env_var_name
     real(kind=DP) :: n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa
 
     ro2 = ro2sum( y )
@@ -200,37 +753,19 @@ contains
 
     call getEnvVarsAtT( t )
 
-    do i = 1, size( envVarNames )
-      this_env_var_name = envVarNames(i)
-      this_env_val = currentEnvVarValues(getEnvVarNum(this_env_var_name))
-      select case ( this_env_var_name )
-        case ( 'PRESS' )
-          press = this_env_val
-        case ( 'TEMP' )
-          temp = this_env_val
-        case ( 'M' )
-          m = this_env_val
-        case ( 'RH' )
-          rh = this_env_val
-        case ( 'H2O' )
-          h2o = this_env_val
-        case ( 'BLHEIGHT' )
-          blheight = this_env_val
-        case ( 'DEC' )
-          dec = this_env_val
-        case ( 'JFAC' )
-          jfac = this_env_val
-        case ( 'DILUTE' )
-          dilute = this_env_val
-        case ( 'ROOF' )
-          roofOpen = this_env_val
-        case ( 'ASA' )
-          asa = this_env_val
-        case default
-          write(stderr,*) 'getEnvVarsAtT(): invalid environment name ' // trim( this_env_var_name )
-          stop
-      end select
-    end do
+    ! The environment variables are read at the numbers set once by
+    ! setEnvVarNums(), without comparing their names
+    press = currentEnvVarValues(orderedEnvVarNums(orderedPress))
+    temp = currentEnvVarValues(orderedEnvVarNums(orderedTemp))
+    m = currentEnvVarValues(orderedEnvVarNums(orderedM))
+    rh = currentEnvVarValues(orderedEnvVarNums(orderedRH))
+    h2o = currentEnvVarValues(orderedEnvVarNums(orderedH2O))
+    blheight = currentEnvVarValues(orderedEnvVarNums(orderedBlheight))
+    dec = currentEnvVarValues(orderedEnvVarNums(orderedDec))
+    jfac = currentEnvVarValues(orderedEnvVarNums(orderedJfac))
+    dilute = currentEnvVarValues(orderedEnvVarNums(orderedDilute))
+    roofOpen = currentEnvVarValues(orderedEnvVarNums(orderedRoof))
+    asa = currentEnvVarValues(orderedEnvVarNums(orderedAsa))
 
     call calcAtmosphere( m, o2, n2 )
 
@@ -256,7 +791,43 @@ contains
     !TODO: is this necessary a second time?
     ro2 = ro2sum( y )
 
-    call proc( p, q, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+    if ( useRateGroups .eqv. .false. ) then
+      call proc( p, q, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa, j, ro2 )
+      return
+    end if
+
+    ! Recompute each group of rates only if its inputs have changed since the
+    ! previous call. Each group may depend on the inputs of the previous groups.
+    envVars = [temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, roofOpen, asa]
+    if ( .not. allocated( groupRates ) ) then
+      allocate( groupRates(size( p )), groupCoeffs(size( q )), lastJ(size( j )) )
+      call procConstant( groupRates, groupCoeffs, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, &
+                         roofOpen, asa, j, ro2 )
+      envChanged = .true.
+    else
+      envChanged = any( envVars /= lastEnvVars )
+    end if
+    jChanged = envChanged .or. any( j /= lastJ )
+    ro2Changed = jChanged .or. ( ro2 /= lastRO2 ) .or. ( t /= lastT )
+
+    if ( envChanged .eqv. .true. ) then
+      call procEnv( groupRates, groupCoeffs, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, &
+                    roofOpen, asa, j, ro2 )
+    end if
+    if ( jChanged .eqv. .true. ) then
+      call procJ( groupRates, groupCoeffs, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, &
+                  roofOpen, asa, j, ro2 )
+    end if
+    if ( ro2Changed .eqv. .true. ) then
+      call procRO2( groupRates, groupCoeffs, t, temp, n2, o2, m, rh, h2o, blheight, dec, jfac, dilute, &
+                    roofOpen, asa, j, ro2 )
+    end if
+
+    lastEnvVars = envVars
+    lastJ = j
+    lastRO2 = ro2
+    lastT = t
+    p = groupRates
 
     return
   end subroutine mechanism_rates
@@ -0,0 +1,52 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+! ATCHEM2 -- MODULE sparseSolver
+!
+! This module sets up the sparse direct solver of CVODE (solver type
+! 4), which uses the KLU library of SuiteSparse. It is compiled
+! instead of sparseSolverDisabled.f90 if $KLULIBDIR is set in the
+! Makefile, which requires CVODE to be installed with KLU (see
+! tools/install/install_cvode.sh).
+! ******************************************************************** !
+module sparse_solver_mod
+  implicit none
+
+contains
+
+  ! -----------------------------------------------------------------
+  ! Set up the KLU sparse direct solver for neq equations, with nnz
+  ! nonzero elements of the Jacobian matrix in compressed sparse row
+  ! format, and the user-supplied Jacobian matrix (FCVSPJAC()).
+  subroutine initSparseSolver( neq, nnz, ier )
+    use, intrinsic :: iso_c_binding, only : c_int
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: neq, nnz
+    integer(kind=QI), intent(out) :: ier
+    integer(c_int) :: n, nz, sparseType, ordering
+
+    n = int( neq, c_int )
+    nz = int( nnz, c_int )
+    ! sparseType: 0 for compressed sparse column, 1 for compressed sparse row
+    sparseType = 1_c_int
+    ! ordering: 0 for AMD, 1 for COLAMD
+    ordering = 1_c_int
+    call FCVKLU( n, nz, sparseType, ordering, ier )
+    if ( ier == 0 ) then
+      call FCVSPARSESETJAC( ier )
+    end if
+
+    return
+  end subroutine initSparseSolver
+
+end module sparse_solver_mod
@@ -0,0 +1,42 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+! ATCHEM2 -- MODULE sparseSolverDisabled
+!
+! This module replaces sparseSolver.f90 if $KLULIBDIR is not set in
+! the Makefile: the sparse direct solver (solver type 4) is not
+! available.
+! ******************************************************************** !
+module sparse_solver_mod
+  implicit none
+
+contains
+
+  ! -----------------------------------------------------------------
+  ! Stop with an error message: AtChem2 has been compiled without the
+  ! KLU sparse direct solver.
+  subroutine initSparseSolver( neq, nnz, ier )
+    use, intrinsic :: iso_fortran_env, only : stderr => error_unit
+    use types_mod
+
+    integer(kind=NPI), intent(in) :: neq, nnz
+    integer(kind=QI), intent(out) :: ier
+
+    ier = -1_QI
+    write (stderr, '(A, I0, A, I0, A)') ' initSparseSolver(): solver type 4 (', neq, ' equations, ', nnz, &
+                                        ' nonzero elements) requires CVODE with the KLU sparse solver.'
+    write (stderr,*) 'Set $KLULIBDIR in the Makefile and recompile AtChem2.'
+    stop
+
+  end subroutine initSparseSolver
+
+end module sparse_solver_mod
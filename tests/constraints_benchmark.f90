@@ -0,0 +1,138 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+!
+! Micro-benchmark of the scatter-gather of the concentrations of the
+! constrained species (see `make constraintsbenchmark`): compares the
+! search of each species in the list of the constrained species (the
+! previous implementation, reproduced below) to the index map of the
+! unconstrained species (addConstrainedSpeciesToProbSpec() and
+! removeConstrainedSpeciesFromProbSpec()), as done at each call of
+! FCVFUN(). The concentrations must be the same with both methods.
+!
+! ARGUMENTS:
+!   1. number of species [default: 5000]
+!   2. number of constrained species [default: 100]
+!   3. number of calls [default: 2000]
+!
+! ******************************************************************** !
+
+PROGRAM CONSTRAINTS_BENCHMARK
+
+  use types_mod
+  use constraints_mod, only : setNumberOfConstrainedSpecies, setConstrainedSpecies, getConstrainedSpecies, &
+                              setUnconstrainedSpecies
+  use constraint_functions_mod, only : addConstrainedSpeciesToProbSpec, removeConstrainedSpeciesFromProbSpec
+  implicit none
+
+  real(kind=DP), allocatable :: y(:), constrainedConcs(:), xSearch(:), xMap(:), zSearch(:), zMap(:)
+  real(kind=DP) :: searchSeconds, mapSeconds
+  integer(kind=NPI) :: numberOfSpecies, numberOfConstrainedSpecies, numberOfCalls, i, j, k
+  integer(kind=NPI) :: zCounter, speciesConstrained
+  integer(kind=NPI), allocatable :: constrainedSpecs(:)
+  integer(kind=8) :: clockStart, clockEnd, clockRate
+  logical :: same
+  character(len=32) :: arg
+
+  numberOfSpecies = 5000
+  numberOfConstrainedSpecies = 100
+  numberOfCalls = 2000
+  if ( command_argument_count() >= 1 ) then
+    call get_command_argument( 1, arg )
+    read (arg,*) numberOfSpecies
+  end if
+  if ( command_argument_count() >= 2 ) then
+    call get_command_argument( 2, arg )
+    read (arg,*) numberOfConstrainedSpecies
+  end if
+  if ( command_argument_count() >= 3 ) then
+    call get_command_argument( 3, arg )
+    read (arg,*) numberOfCalls
+  end if
+
+  ! Constrained species spread over the species, not in order.
+  call setNumberOfConstrainedSpecies( numberOfConstrainedSpecies )
+  allocate (constrainedConcs(numberOfConstrainedSpecies))
+  do j = 1, numberOfConstrainedSpecies
+    call setConstrainedSpecies( j, 1 + mod( 7919_NPI * j, numberOfSpecies ) )
+    constrainedConcs(j) = 1.0e10_DP + j
+  end do
+  call setUnconstrainedSpecies( numberOfSpecies )
+  constrainedSpecs = getConstrainedSpecies()
+
+  allocate (y(numberOfSpecies), xSearch(numberOfSpecies), xMap(numberOfSpecies), &
+            zSearch(numberOfSpecies), zMap(numberOfSpecies))
+  do i = 1, numberOfSpecies
+    y(i) = 1.0e8_DP * ( 1.0_DP + sin( real( i, DP ) ) )
+  end do
+  zSearch(:) = 0.0_DP
+  zMap(:) = 0.0_DP
+
+  ! Search of each species in the list of the constrained species.
+  call system_clock( clockStart, clockRate )
+  do k = 1, numberOfCalls
+    zCounter = 1
+    do i = 1, numberOfSpecies
+      speciesConstrained = 0
+      do j = 1, numberOfConstrainedSpecies
+        if ( i == constrainedSpecs(j) ) then
+          speciesConstrained = j
+          exit
+        end if
+      end do
+      if ( speciesConstrained > 0 ) then
+        xSearch(i) = constrainedConcs(speciesConstrained)
+      else
+        xSearch(i) = y(zCounter)
+        zCounter = zCounter + 1
+      end if
+    end do
+    zCounter = 1
+    do i = 1, numberOfSpecies
+      speciesConstrained = 0
+      do j = 1, numberOfConstrainedSpecies
+        if ( i == constrainedSpecs(j) ) then
+          speciesConstrained = j
+          exit
+        end if
+      end do
+      if ( speciesConstrained == 0 ) then
+        zSearch(zCounter) = xSearch(i)
+        zCounter = zCounter + 1
+      end if
+    end do
+  end do
+  call system_clock( clockEnd )
+  searchSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  ! Index map of the unconstrained species.
+  call system_clock( clockStart )
+  do k = 1, numberOfCalls
+    call addConstrainedSpeciesToProbSpec( y, constrainedConcs, xMap )
+    call removeConstrainedSpeciesFromProbSpec( xMap, zMap )
+  end do
+  call system_clock( clockEnd )
+  mapSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  same = all( xSearch == xMap ) .and. all( zSearch == zMap )
+
+  write (*, '(A, I0, A, I0, A, I0, A)') ' ', numberOfSpecies, ' species, ', numberOfConstrainedSpecies, &
+                                        ' constrained species, ', numberOfCalls, ' calls'
+  write (*, '(A, F10.4, A)') ' search of the constrained species: ', searchSeconds, ' s'
+  write (*, '(A, F10.4, A)') ' index map of the species:          ', mapSeconds, ' s'
+  write (*, '(A, F10.1)') ' speedup:                           ', searchSeconds / max( mapSeconds, 1.0e-9_DP )
+  if ( .not. same ) then
+    write (*, '(A)') ' ERROR: the concentrations are different'
+    stop 1
+  end if
+
+END PROGRAM CONSTRAINTS_BENCHMARK
@@ -0,0 +1,134 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+!
+! Micro-benchmark of the lookup of the constraint data (see `make
+! interpolationbenchmark`): compares the scan of the data points from
+! the first one (findIntervalByScan) to the lookup with a cursor and
+! a binary search (findInterval), on long constraint data with one data
+! point per minute. The times follow the model run, with a step back
+! every few lookups (as the solver does when a step fails). The
+! interval found and the interpolated value must be the same with both
+! lookups.
+!
+! ARGUMENTS:
+!   1. number of series [default: 50]
+!   2. number of data points of each series [default: 5760, 4 days]
+!   3. number of lookups of each series [default: 5000]
+!
+! ******************************************************************** !
+
+PROGRAM INTERPOLATION_BENCHMARK
+
+  use types_mod
+  use interpolation_functions_mod
+  implicit none
+
+  real(kind=DP), allocatable :: x(:,:), y(:,:), times(:)
+  real(kind=DP) :: scanSeconds, cursorSeconds, scanSum, cursorSum, concAtT, m, c
+  integer(kind=NPI) :: numberOfSeries, numberOfPoints, numberOfLookups, ind, i, k
+  integer(kind=NPI) :: scanIndex, cursorIndex, mismatches
+  integer(kind=8) :: clockStart, clockEnd, clockRate
+  type(interpolation_cache) :: cache
+  character(len=32) :: arg
+
+  numberOfSeries = 50
+  numberOfPoints = 5760
+  numberOfLookups = 5000
+  if ( command_argument_count() >= 1 ) then
+    call get_command_argument( 1, arg )
+    read (arg,*) numberOfSeries
+  end if
+  if ( command_argument_count() >= 2 ) then
+    call get_command_argument( 2, arg )
+    read (arg,*) numberOfPoints
+  end if
+  if ( command_argument_count() >= 3 ) then
+    call get_command_argument( 3, arg )
+    read (arg,*) numberOfLookups
+  end if
+
+  allocate (x(numberOfSeries, numberOfPoints), y(numberOfSeries, numberOfPoints), times(numberOfLookups))
+  do ind = 1, numberOfSeries
+    do i = 1, numberOfPoints
+      x(ind, i) = 60.0_DP * ( i - 1 )
+      y(ind, i) = 1.0e9_DP * ( 2.0_DP + sin( 1.0e-3_DP * i + ind ) )
+    end do
+  end do
+  ! Times of the lookups, from the start to the end of the data, with a
+  ! step back every 7 lookups.
+  do k = 1, numberOfLookups
+    times(k) = x(1, numberOfPoints) * ( k - 1 ) / numberOfLookups
+    if ( mod( k, 7_NPI ) == 0 ) then
+      times(k) = max( times(k) - 150.0_DP, 0.0_DP )
+    end if
+  end do
+
+  ! Scan of the data points from the first one, and linear interpolation.
+  scanSum = 0.0_DP
+  call system_clock( clockStart, clockRate )
+  do k = 1, numberOfLookups
+    do ind = 1, numberOfSeries
+      i = findIntervalByScan( times(k), x, numberOfPoints, ind )
+      m = ( y(ind, i+1) - y(ind, i) ) / ( x(ind, i+1) - x(ind, i) )
+      c = y(ind, i+1) - ( m * x(ind, i+1) )
+      scanSum = scanSum + ( m * times(k) + c )
+    end do
+  end do
+  call system_clock( clockEnd )
+  scanSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  ! Lookup with the cursor and the binary search, and linear interpolation.
+  cursorSum = 0.0_DP
+  call system_clock( clockStart )
+  do k = 1, numberOfLookups
+    do ind = 1, numberOfSeries
+      call getConstrainedQuantAtT( times(k), x, y, numberOfPoints, 2_SI, ind, concAtT, cache )
+      cursorSum = cursorSum + concAtT
+    end do
+  end do
+  call system_clock( clockEnd )
+  cursorSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  ! Check that both lookups find the same intervals, including outside the data.
+  mismatches = 0
+  do k = 1, numberOfLookups
+    do ind = 1, numberOfSeries
+      scanIndex = findIntervalByScan( times(k), x, numberOfPoints, ind )
+      cursorIndex = findInterval( times(k), x, y, numberOfPoints, ind, cache )
+      if ( scanIndex /= cursorIndex ) then
+        mismatches = mismatches + 1
+      end if
+    end do
+  end do
+  do ind = 1, numberOfSeries
+    if ( findInterval( -1.0_DP, x, y, numberOfPoints, ind, cache ) /= 0 .or. &
+         findInterval( x(ind, numberOfPoints), x, y, numberOfPoints, ind, cache ) /= 0 ) then
+      mismatches = mismatches + 1
+    end if
+  end do
+
+  write (*, '(A, I0, A, I0, A, I0, A)') ' ', numberOfSeries, ' series of ', numberOfPoints, ' data points, ', &
+                                        numberOfLookups, ' lookups of each series'
+  write (*, '(A, F10.4, A)') ' scan from the first data point: ', scanSeconds, ' s'
+  write (*, '(A, F10.4, A)') ' cursor and binary search:       ', cursorSeconds, ' s'
+  write (*, '(A, F10.1)') ' speedup:                        ', scanSeconds / max( cursorSeconds, 1.0e-9_DP )
+  if ( cursorSum /= scanSum ) then
+    write (*, '(A)') ' ERROR: the interpolated values are different'
+    stop 1
+  end if
+  if ( mismatches > 0 ) then
+    write (*, '(A, I0, A)') ' ERROR: ', mismatches, ' lookups found a different interval'
+    stop 1
+  end if
+
+END PROGRAM INTERPOLATION_BENCHMARK
@@ -0,0 +1,224 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+!
+! Driver of the Jacobian test (see tests/run_jacobian_test.sh): compares
+! the analytic Jacobian matrix of a chemical mechanism, written to
+! mechanism_jac.f90 by build/mech_converter.py --jacobian, with a
+! central finite difference of the rates of change of the species,
+! calculated from the reactants (mechanism.reac) and the products
+! (mechanism.prod) of each reaction and the rate coefficients given
+! by update_p, for a range of model conditions. The finite difference
+! is taken of the reaction rates, then summed over the reactions like
+! the rates of change, so that the large terms of the rates of change
+! which do not depend on the species do not cancel out.
+! The elements which differ by more than the relative tolerance, and
+! the nonzero elements of the finite difference missing from the
+! sparsity pattern, are written out, and the driver stops with a
+! nonzero exit code.
+!
+! ARGUMENTS:
+!   1. directory of the chemical mechanism
+!   2. relative tolerance [default: 1.0e-5]
+!
+! ******************************************************************** !
+
+PROGRAM JACOBIAN_TEST_DRIVER
+
+  use, intrinsic :: iso_c_binding
+  implicit none
+
+  interface
+    subroutine update_p( p, q, t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, RO2 ) &
+                         bind( c, name='update_p' )
+      use, intrinsic :: iso_c_binding
+      real(c_double), intent(inout) :: p(*), q(*)
+      real(c_double), intent(in) :: t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2
+    end subroutine update_p
+
+    subroutine jacobian_size( numberOfSpecies, numberOfNonZeros ) bind( c, name='jacobian_size' )
+      use, intrinsic :: iso_c_binding
+      integer(c_int), intent(out) :: numberOfSpecies, numberOfNonZeros
+    end subroutine jacobian_size
+
+    subroutine jacobian_pattern( rowStart, columns ) bind( c, name='jacobian_pattern' )
+      use, intrinsic :: iso_c_binding
+      integer(c_int), intent(out) :: rowStart(*), columns(*)
+    end subroutine jacobian_pattern
+
+    subroutine jacobian_values( p, y, jac ) bind( c, name='jacobian_values' )
+      use, intrinsic :: iso_c_binding
+      real(c_double), intent(in) :: p(*), y(*)
+      real(c_double), intent(out) :: jac(*)
+    end subroutine jacobian_values
+  end interface
+
+  integer, parameter :: numberOfConditions = 4, numberOfPhotoRates = 1000
+  real(c_double), parameter :: relativeStep = 1.0e-6_c_double
+  real(c_double), allocatable :: p(:), q(:), y(:), jac(:), fd(:,:), rPlus(:), rMinus(:), lcoeff(:), rcoeff(:)
+  integer, allocatable :: lhs(:,:), rhs(:,:)
+  integer(c_int), allocatable :: rowStart(:), columns(:)
+  logical, allocatable :: inPattern(:)
+  real(c_double) :: J(numberOfPhotoRates), t, TEMP, M, H2O, RO2, h, yj, scale, tolerance, error, maxError
+  integer(c_int) :: numberOfSpecies, numberOfNonZeros
+  integer :: numberOfReactions, numberOfQ, lhsSize, rhsSize, numberOfFailures, ios, i, k, l, c
+  character(len=1024) :: mechanismDir
+  character(len=32) :: arg
+
+  call get_command_argument( 1, mechanismDir )
+  tolerance = 1.0e-5_c_double
+  if ( command_argument_count() >= 2 ) then
+    call get_command_argument( 2, arg )
+    read (arg,*) tolerance
+  end if
+
+  ! Read the reactants and the products of each reaction. The first line
+  ! of mechanism.reac holds the number of species, reactions and rate
+  ! coefficients.
+  call readReactionList( trim( mechanismDir ) // '/mechanism.reac', lhs, lcoeff, lhsSize )
+  call readReactionList( trim( mechanismDir ) // '/mechanism.prod', rhs, rcoeff, rhsSize )
+  open (10, file=trim( mechanismDir ) // '/mechanism.reac', status='old')
+  read (10,*) numberOfSpecies, numberOfReactions, numberOfQ
+  close (10, status='keep')
+
+  call jacobian_size( numberOfSpecies, numberOfNonZeros )
+  allocate( rowStart(numberOfSpecies + 1), columns(numberOfNonZeros), jac(numberOfNonZeros), &
+            fd(numberOfSpecies, numberOfSpecies), inPattern(numberOfSpecies), y(numberOfSpecies), &
+            rPlus(max( numberOfReactions, 1 )), rMinus(max( numberOfReactions, 1 )), p(max( numberOfReactions, 1 )), &
+            q(max( numberOfQ, 1 )) )
+  call jacobian_pattern( rowStart, columns )
+
+  numberOfFailures = 0
+  maxError = 0.0_c_double
+  do k = 1, numberOfConditions
+    t = 3600.0_c_double * k
+    TEMP = 230.0_c_double + 25.0_c_double * k
+    M = 2.46e19_c_double * 298.0_c_double / TEMP
+    H2O = 1.0e17_c_double * k
+    RO2 = 1.0e8_c_double * k
+    do i = 1, numberOfPhotoRates
+      J(i) = 1.0e-6_c_double * k * i
+    end do
+    do i = 1, numberOfSpecies
+      y(i) = 1.0e6_c_double * k * ( 1 + mod( 7 * i, 13 ) ) * 10.0_c_double ** mod( i, 5 )
+    end do
+
+    p(:) = 0.0_c_double
+    q(:) = 0.0_c_double
+    call update_p( p, q, t, TEMP, 0.7809_c_double * M, 0.2095_c_double * M, M, 50.0_c_double, H2O, &
+                   1000.0_c_double, 0.1_c_double * k, 1.0_c_double, 1.0e-5_c_double, 1.0_c_double, &
+                   1.0e-6_c_double, J, RO2 )
+    call jacobian_values( p, y, jac )
+
+    ! Central finite difference of the rates of change, one column at a time.
+    do c = 1, numberOfSpecies
+      yj = y(c)
+      h = relativeStep * yj
+      y(c) = yj + h
+      call reactionRates( y, rPlus )
+      y(c) = yj - h
+      call reactionRates( y, rMinus )
+      y(c) = yj
+      call rateOfChange( ( rPlus(1:numberOfReactions) - rMinus(1:numberOfReactions) ) / ( 2.0_c_double * h ), fd(:, c) )
+    end do
+
+    do i = 1, numberOfSpecies
+      ! The rounding error of the finite difference is relative to the
+      ! largest element of the row.
+      scale = max( maxval( abs( fd(i, :) ) ), tiny( 1.0_c_double ) )
+      inPattern(:) = .false.
+      do l = rowStart(i), rowStart(i + 1) - 1
+        inPattern(columns(l)) = .true.
+        error = abs( jac(l) - fd(i, columns(l)) ) / max( abs( jac(l) ), 1.0e-6_c_double * scale )
+        maxError = max( maxError, error )
+        if ( error > tolerance ) then
+          numberOfFailures = numberOfFailures + 1
+          write (*, '(I3, A, 2I8, 2ES26.17E3)') k, ' jac', i, columns(l), jac(l), fd(i, columns(l))
+        end if
+      end do
+      do c = 1, numberOfSpecies
+        if ( ( inPattern(c) .eqv. .false. ) .and. ( abs( fd(i, c) ) > 1.0e-6_c_double * scale ) ) then
+          numberOfFailures = numberOfFailures + 1
+          write (*, '(I3, A, 2I8, ES26.17E3)') k, ' missing', i, c, fd(i, c)
+        end if
+      end do
+    end do
+  end do
+
+  write (*, '(A, I0, A, I0, A, ES10.3)') 'Jacobian: ', numberOfSpecies, ' species, ', numberOfNonZeros, &
+                                         ' nonzero elements, maximum relative error ', maxError
+  if ( numberOfFailures > 0 ) then
+    write (*, '(I0, A)') numberOfFailures, ' elements of the Jacobian matrix differ from the finite difference'
+    stop 1
+  end if
+
+contains
+
+  ! Reads the list of reactants (or products) of each reaction: reaction
+  ! number, species number and stoichiometric coefficient, one per line
+  ! after the first line.
+  subroutine readReactionList( fileName, list, coeffs, listSize )
+    character(len=*), intent(in) :: fileName
+    integer, allocatable, intent(out) :: list(:,:)
+    real(c_double), allocatable, intent(out) :: coeffs(:)
+    integer, intent(out) :: listSize
+    integer :: n
+
+    open (10, file=fileName, status='old')
+    read (10,*)
+    listSize = 0
+    do
+      read (10, *, iostat=ios)
+      if ( ios /= 0 ) exit
+      listSize = listSize + 1
+    end do
+    allocate( list(2, listSize), coeffs(listSize) )
+    rewind (10)
+    read (10,*)
+    do n = 1, listSize
+      read (10,*) list(1, n), list(2, n), coeffs(n)
+    end do
+    close (10, status='keep')
+  end subroutine readReactionList
+
+  ! Calculates the reaction rates, r: the rate coefficient of each reaction
+  ! is multiplied by the concentration of each reactant, raised to its
+  ! stoichiometric coefficient.
+  subroutine reactionRates( y, r )
+    real(c_double), intent(in) :: y(:)
+    real(c_double), intent(out) :: r(:)
+    integer :: n
+
+    r(:) = p(:)
+    do n = 1, lhsSize
+      r(lhs(1, n)) = r(lhs(1, n)) * y(lhs(2, n)) ** lcoeff(n)
+    end do
+  end subroutine reactionRates
+
+  ! Calculates the rates of change of the species, dy, from the reaction
+  ! rates r: each reaction decreases the reactants and increases the
+  ! products by its reaction rate times the stoichiometric coefficient.
+  subroutine rateOfChange( r, dy )
+    real(c_double), intent(in) :: r(:)
+    real(c_double), intent(out) :: dy(:)
+    integer :: n
+
+    dy(:) = 0.0_c_double
+    do n = 1, lhsSize
+      dy(lhs(2, n)) = dy(lhs(2, n)) - lcoeff(n) * r(lhs(1, n))
+    end do
+    do n = 1, rhsSize
+      dy(rhs(2, n)) = dy(rhs(2, n)) + rcoeff(n) * r(rhs(1, n))
+    end do
+  end subroutine rateOfChange
+
+END PROGRAM JACOBIAN_TEST_DRIVER
@@ -0,0 +1,109 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+!
+! Driver of the rates test (see tests/run_rates_test.sh): calls the
+! update_p subroutine of a chemical mechanism, converted by
+! build/mech_converter.py, for a range of model conditions, and
+! writes out the rate coefficients (q) and the reaction rates (p).
+! If the number of timed calls is given, the driver instead calls
+! update_p that many times, cycling over the model conditions, and
+! writes out the number of calls per second (see
+! tests/run_rates_benchmark.sh).
+!
+! ARGUMENTS:
+!   1. number of reactions
+!   2. number of elements of q to allocate
+!   3. number of elements of q to write out
+!   4. number of timed calls [default: 0, write out the rates]
+!
+! ******************************************************************** !
+
+PROGRAM RATES_TEST_DRIVER
+
+  use, intrinsic :: iso_c_binding
+  implicit none
+
+  interface
+    subroutine update_p( p, q, t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J, RO2 ) &
+                         bind( c, name='update_p' )
+      use, intrinsic :: iso_c_binding
+      real(c_double), intent(inout) :: p(*), q(*)
+      real(c_double), intent(in) :: t, TEMP, N2, O2, M, RH, H2O, BLHEIGHT, DEC, JFAC, DILUTE, ROOFOPEN, ASA, J(*), RO2
+    end subroutine update_p
+  end interface
+
+  integer, parameter :: numberOfConditions = 4, numberOfPhotoRates = 1000
+  real(c_double), allocatable :: p(:), q(:)
+  real(c_double) :: J(numberOfPhotoRates, numberOfConditions), t(numberOfConditions), TEMP(numberOfConditions), &
+                    M(numberOfConditions), H2O(numberOfConditions), RO2(numberOfConditions), seconds
+  integer :: numberOfReactions, numberOfQ, numberOfQOut, numberOfCalls, i, k, n
+  integer(kind=8) :: clockStart, clockEnd, clockRate
+  character(len=32) :: arg
+
+  call get_command_argument( 1, arg )
+  read (arg,*) numberOfReactions
+  call get_command_argument( 2, arg )
+  read (arg,*) numberOfQ
+  call get_command_argument( 3, arg )
+  read (arg,*) numberOfQOut
+  numberOfCalls = 0
+  if ( command_argument_count() >= 4 ) then
+    call get_command_argument( 4, arg )
+    read (arg,*) numberOfCalls
+  end if
+  allocate( p(max( numberOfReactions, 1 )), q(max( numberOfQ, 1 )) )
+
+  do k = 1, numberOfConditions
+    t(k) = 3600.0_c_double * k
+    TEMP(k) = 230.0_c_double + 25.0_c_double * k
+    M(k) = 2.46e19_c_double * 298.0_c_double / TEMP(k)
+    H2O(k) = 1.0e17_c_double * k
+    RO2(k) = 1.0e8_c_double * k
+    do i = 1, numberOfPhotoRates
+      J(i, k) = 1.0e-6_c_double * k * i
+    end do
+  end do
+
+  ! Timing of update_p, cycling over the model conditions.
+  if ( numberOfCalls > 0 ) then
+    p(:) = 0.0_c_double
+    q(:) = 0.0_c_double
+    call system_clock( clockStart, clockRate )
+    do n = 1, numberOfCalls
+      k = mod( n - 1, numberOfConditions ) + 1
+      call update_p( p, q, t(k), TEMP(k), 0.7809_c_double * M(k), 0.2095_c_double * M(k), M(k), 50.0_c_double, &
+                     H2O(k), 1000.0_c_double, 0.1_c_double * k, 1.0_c_double, 1.0e-5_c_double, 1.0_c_double, &
+                     1.0e-6_c_double, J(:, k), RO2(k) )
+    end do
+    call system_clock( clockEnd )
+    seconds = real( clockEnd - clockStart, c_double ) / clockRate
+    write (*, '(I0, A, F14.1, A)') numberOfCalls, ' calls of update_p: ', numberOfCalls / max( seconds, 1.0e-9_c_double ), &
+                                   ' calls/s'
+    stop
+  end if
+
+  do k = 1, numberOfConditions
+    p(:) = 0.0_c_double
+    q(:) = 0.0_c_double
+    call update_p( p, q, t(k), TEMP(k), 0.7809_c_double * M(k), 0.2095_c_double * M(k), M(k), 50.0_c_double, H2O(k), &
+                   1000.0_c_double, 0.1_c_double * k, 1.0_c_double, 1.0e-5_c_double, 1.0_c_double, &
+                   1.0e-6_c_double, J(:, k), RO2(k) )
+    do i = 1, numberOfQOut
+      write (*, '(I3, A, I8, ES26.17E3)') k, ' q', i, q(i)
+    end do
+    do i = 1, numberOfReactions
+      write (*, '(I3, A, I8, ES26.17E3)') k, ' p', i, p(i)
+    end do
+  end do
+
+END PROGRAM RATES_TEST_DRIVER
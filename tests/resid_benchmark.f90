@@ -0,0 +1,166 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+! ******************************************************************** !
+!
+! Micro-benchmark of the stoichiometry of the right-hand side (see
+! `make residbenchmark`): compares the three passes over the reactants
+! and the products of the previous implementation of resid()
+! (reproduced below) to the stoichiometry in compressed sparse row
+! format (multiplyByReactants() and sumStoichiometry()), with and
+! without storing the reaction rates, on the chemical mechanism of a
+! configuration directory (mechanism.reac and mechanism.prod, written
+! by build/mech_converter.py). The rate coefficients are not
+! calculated, so the mechanism does not need to be compiled. The
+! results are in evaluations of the right-hand side per second, and
+! the rates of change must be the same (to rounding, as the integer
+! exponents are calculated by multiplication). If compiled with OpenMP,
+! the stoichiometry without storing the reaction rates is also run
+! with 1 to N threads (built with `make residbenchmark OPENMP=1`).
+!
+! ARGUMENTS:
+!   1. path to the configuration directory [default: model/configuration]
+!   2. number of evaluations [default: 1000]
+!   3. maximum number of threads N [default: 1]
+!
+! ******************************************************************** !
+
+PROGRAM RESID_BENCHMARK
+
+  use types_mod
+  use directories_mod, only : configuration_dir
+  use species_mod, only : getNumberOfSpecies, getNumberOfReactions
+  use reaction_structure_mod, only : clhs, clcoeff, crhs, crcoeff
+  use reaction_rates_mod, only : reactionRates
+  use input_functions_mod, only : readNumberOfSpeciesAndReactions, readReactions
+  use solver_functions_mod, only : setStoichiometry, multiplyByReactants, sumStoichiometry, storeRates
+  !$ use omp_lib, only : omp_set_num_threads
+  implicit none
+
+  real(kind=DP), allocatable :: k(:), r(:), y(:), dyPasses(:), dyStoich(:)
+  real(kind=DP) :: passesSeconds, storeSeconds, noStoreSeconds, threadsSeconds, maxDeviation
+  integer(kind=NPI) :: numSpec, numReac, numberOfEvaluations, i, n
+  integer(kind=QI) :: maxThreads, threads
+  integer(kind=8) :: clockStart, clockEnd, clockRate
+  character(len=32) :: arg
+
+  configuration_dir = 'model/configuration'
+  numberOfEvaluations = 1000
+  if ( command_argument_count() >= 1 ) then
+    call get_command_argument( 1, configuration_dir )
+  end if
+  if ( command_argument_count() >= 2 ) then
+    call get_command_argument( 2, arg )
+    read (arg,*) numberOfEvaluations
+  end if
+  maxThreads = 1
+  if ( command_argument_count() >= 3 ) then
+    call get_command_argument( 3, arg )
+    read (arg,*) maxThreads
+  end if
+
+  call readNumberOfSpeciesAndReactions()
+  numSpec = getNumberOfSpecies()
+  numReac = getNumberOfReactions()
+  call readReactions()
+  call setStoichiometry( numReac, numSpec, clhs, clcoeff, crhs, crcoeff )
+  write (*,*)
+
+  allocate (k(numReac), r(numReac), y(numSpec), dyPasses(numSpec), dyStoich(numSpec), reactionRates(numReac))
+  do i = 1, numReac
+    k(i) = 1.0e-12_DP * ( 1.0_DP + 0.5_DP * sin( real( i, DP ) ) )
+  end do
+  do i = 1, numSpec
+    y(i) = 1.0e8_DP * ( 1.0_DP + 0.5_DP * cos( real( i, DP ) ) )
+  end do
+
+  ! Three passes over the reactants and the products, with the general
+  ! power function, storing the reaction rates.
+  call system_clock( clockStart, clockRate )
+  do n = 1, numberOfEvaluations
+    r(:) = k(:)
+    dyPasses(:) = 0
+    do i = 1, size( clhs, 2 )
+      r(clhs(1, i)) = r(clhs(1, i)) * y(clhs(2, i)) ** clcoeff(i)
+      reactionRates(clhs(1, i)) = r(clhs(1, i))
+    end do
+    do i = 1, size( clhs, 2 )
+      dyPasses(clhs(2, i)) = dyPasses(clhs(2, i)) - clcoeff(i) * r(clhs(1, i))
+    end do
+    do i = 1, size( crhs, 2 )
+      dyPasses(crhs(2, i)) = dyPasses(crhs(2, i)) + crcoeff(i) * r(crhs(1, i))
+    end do
+  end do
+  call system_clock( clockEnd )
+  passesSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  ! Stoichiometry in compressed sparse row format, storing the reaction rates.
+  call system_clock( clockStart )
+  do n = 1, numberOfEvaluations
+    r(:) = k(:)
+    call multiplyByReactants( r, y )
+    call storeRates( r )
+    call sumStoichiometry( r, dyStoich )
+  end do
+  call system_clock( clockEnd )
+  storeSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  ! Stoichiometry in compressed sparse row format, without storing the
+  ! reaction rates (reaction rates at the output times only).
+  call system_clock( clockStart )
+  do n = 1, numberOfEvaluations
+    r(:) = k(:)
+    call multiplyByReactants( r, y )
+    call sumStoichiometry( r, dyStoich )
+  end do
+  call system_clock( clockEnd )
+  noStoreSeconds = real( clockEnd - clockStart, DP ) / clockRate
+
+  maxDeviation = 0.0_DP
+  do i = 1, numSpec
+    if ( dyPasses(i) /= dyStoich(i) ) then
+      maxDeviation = max( maxDeviation, abs( dyPasses(i) - dyStoich(i) ) / &
+                                        max( abs( dyPasses(i) ), abs( dyStoich(i) ) ) )
+    end if
+  end do
+
+  write (*, '(A, I0, A, I0, A, I0, A)') ' ', numSpec, ' species, ', numReac, ' reactions, ', &
+                                        numberOfEvaluations, ' evaluations'
+  write (*, '(A, F14.1, A)') ' three passes over lhs and rhs:      ', numberOfEvaluations / max( passesSeconds, 1.0e-9_DP ), &
+                             ' evaluations/s'
+  write (*, '(A, F14.1, A)') ' stoichiometry, storing the rates:   ', numberOfEvaluations / max( storeSeconds, 1.0e-9_DP ), &
+                             ' evaluations/s'
+  write (*, '(A, F14.1, A)') ' stoichiometry, rates at output only:', numberOfEvaluations / max( noStoreSeconds, 1.0e-9_DP ), &
+                             ' evaluations/s'
+  write (*, '(A, ES10.2)') ' maximum relative difference of dy:  ', maxDeviation
+  if ( maxDeviation > 1.0e-12_DP ) then
+    write (*, '(A)') ' ERROR: the rates of change are different'
+    stop 1
+  end if
+
+  ! Scaling of the stoichiometry without storing the reaction rates
+  ! with the number of threads (only if compiled with OpenMP).
+  !$ do threads = 1, maxThreads
+  !$   call omp_set_num_threads( threads )
+  !$   call system_clock( clockStart )
+  !$   do n = 1, numberOfEvaluations
+  !$     r(:) = k(:)
+  !$     call multiplyByReactants( r, y )
+  !$     call sumStoichiometry( r, dyStoich )
+  !$   end do
+  !$   call system_clock( clockEnd )
+  !$   threadsSeconds = real( clockEnd - clockStart, DP ) / clockRate
+  !$   write (*, '(A, I3, A, F14.1, A, F6.2)') ' stoichiometry, ', threads, ' threads:      ', &
+  !$         numberOfEvaluations / max( threadsSeconds, 1.0e-9_DP ), ' evaluations/s, speedup ', &
+  !$         noStoreSeconds / max( threadsSeconds, 1.0e-9_DP )
+  !$ end do
+
+END PROGRAM RESID_BENCHMARK
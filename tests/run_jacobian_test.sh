@@ -0,0 +1,94 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script executes the Jacobian test on the chemical mechanisms of
+# the model tests, to ensure that the analytic Jacobian matrix written
+# by build/mech_converter.py --jacobian is correct.
+#
+# Each chemical mechanism is converted with the options being tested,
+# and compiled with tests/jacobian_test_driver.f90. The elements of
+# the analytic Jacobian matrix must be equal, within the relative
+# tolerance, to the finite difference of the rates of change of the
+# species.
+#
+# $1 is the list of model tests
+# $2 is the Fortran compiler
+# $3 are the options of mech_converter.py to test [default: --jacobian --reorder]
+# $4 is the relative tolerance [default: 1.0e-5]
+#
+# N.B.: the script MUST be run from the main directory of AtChem2.
+
+TESTS_DIR=tests/model_tests
+LOG_FILE=tests/jacobiantest.log
+FORT_COMP=$2
+OPTIONS=${3:-"--jacobian --reorder"}
+TOLERANCE=${4:-"1.0e-5"}
+
+echo "Executing Jacobian test script with options:" $OPTIONS > $LOG_FILE
+echo "" >> $LOG_FILE
+
+WORK_DIR=$(mktemp -d)
+
+for test in $1; do
+  echo $TESTS_DIR/$test >> $LOG_FILE
+  if [ -f $TESTS_DIR/$test/$test.kpp ]; then   # chemical mechanism in KPP format
+    mechanism_file=$TESTS_DIR/$test/$test.kpp
+  else   # by default, the chemical mechanism is in FACSIMILE format
+    mechanism_file=$TESTS_DIR/$test/$test.fac
+  fi
+
+  # Convert and compile the chemical mechanism with its Jacobian matrix,
+  # then compare the Jacobian matrix with the finite difference.
+  mech_dir=$WORK_DIR/$test
+  mkdir -p $mech_dir
+  cp $TESTS_DIR/$test/configuration/customRateFuncs.f90 $TESTS_DIR/$test/configuration/environmentVariables.config $mech_dir
+  python ./build/mech_converter.py $mechanism_file $mech_dir mcm/ $OPTIONS >> $LOG_FILE 2>&1 && \
+    make sharedlib SHAREDLIBDIR=$mech_dir >> $LOG_FILE 2>&1 && \
+    $FORT_COMP -o $mech_dir/jacobian_test_driver tests/jacobian_test_driver.f90 src/dataStructures.o \
+      $mech_dir/customRateFuncs.o $(ls $mech_dir/mechanism_shard_*.o 2>/dev/null) $mech_dir/mechanism_jac.o \
+      $mech_dir/mechanism.o >> $LOG_FILE 2>&1
+  exitcode=$?
+  if [ $exitcode -ne 0 ]; then
+    echo "Building" $test "failed with exit code" $exitcode >> $LOG_FILE
+    rm -rf $WORK_DIR
+    echo "==> Jacobian test FAILED"
+    echo "==> Jacobian test logfile:" $LOG_FILE
+    exit 1
+  fi
+
+  this_jacobian_test_output=$($mech_dir/jacobian_test_driver $mech_dir $TOLERANCE 2>&1)
+  exitcode=$?
+  echo "$this_jacobian_test_output" | tail -n 1 >> $LOG_FILE
+  if [ $exitcode -ne 0 ]; then
+    failed_jacobians="$failed_jacobians
+
+Differences found in $test ($OPTIONS):
+$this_jacobian_test_output"
+    echo $test "FAILED" >> $LOG_FILE
+  fi
+done
+
+rm -rf $WORK_DIR
+
+if [ -z "$failed_jacobians" ]; then
+  echo "==> Jacobian test PASSED"
+  jacobian_test_passed=0
+else
+  echo "==> Jacobian test FAILED"
+  echo "$failed_jacobians" >> $LOG_FILE
+  jacobian_test_passed=1
+fi
+echo "" >> $LOG_FILE
+echo "Execution of Jacobian test script finished." >> $LOG_FILE
+
+echo "==> Jacobian test logfile:" $LOG_FILE
+exit $jacobian_test_passed
@@ -0,0 +1,95 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script measures the number of calls per second of the update_p
+# subroutine of a chemical mechanism (the rate coefficients and the
+# reaction rates), converted by build/mech_converter.py with the
+# default options and with the options being benchmarked (e.g. --cse).
+#
+# Each version of the mechanism is converted, compiled and linked with
+# tests/rates_test_driver.f90 as in the rates test
+# (tests/run_rates_test.sh), which then calls update_p the given
+# number of times. The rates of the two versions must be identical.
+# By default, the mechanism is a synthetic MCM-like mechanism with
+# 3000 reactions (see tools/benchmark_converter.py).
+#
+# $1 is the Fortran compiler
+# $2 are the options of mech_converter.py to benchmark [default: --cse]
+# $3 is the chemical mechanism file [default: synthetic mechanism]
+# $4 is the number of calls of update_p [default: 20000]
+#
+# N.B.: the script MUST be run from the main directory of AtChem2.
+
+FORT_COMP=$1
+OPTIONS=${2:-"--cse"}
+MECHANISM_FILE=$3
+NUMBER_OF_CALLS=${4:-20000}
+
+WORK_DIR=$(mktemp -d)
+
+if [ -z "$MECHANISM_FILE" ]; then
+  MECHANISM_FILE=$WORK_DIR/synthetic.fac
+  python -c "import sys; sys.path.insert(0, 'tools'); import benchmark_converter as b; \
+reactions, ro2 = b.synthetic_mechanism(3000); b.write_fac('$MECHANISM_FILE', reactions, ro2)"
+fi
+
+echo "Mechanism:" $MECHANISM_FILE
+printf "%-20s %16s %10s\n" "options" "calls/s" "speedup"
+
+for version in ref new; do
+  mech_dir=$WORK_DIR/$version
+  mkdir -p $mech_dir
+  cp model/configuration/customRateFuncs.f90 model/configuration/environmentVariables.config $mech_dir
+  if [ $version == "ref" ]; then
+    options=""
+  else
+    options=$OPTIONS
+  fi
+  python ./build/mech_converter.py $MECHANISM_FILE $mech_dir mcm/ $options > $WORK_DIR/$version.log 2>&1 && \
+    make sharedlib SHAREDLIBDIR=$mech_dir >> $WORK_DIR/$version.log 2>&1 && \
+    $FORT_COMP -O2 -o $mech_dir/rates_test_driver tests/rates_test_driver.f90 src/dataStructures.o \
+      $mech_dir/customRateFuncs.o $(ls $mech_dir/mechanism_shard_*.o 2>/dev/null) $mech_dir/mechanism.o \
+      >> $WORK_DIR/$version.log 2>&1
+  if [ $? -ne 0 ]; then
+    echo "Building the mechanism ($version) failed:"
+    cat $WORK_DIR/$version.log
+    rm -rf $WORK_DIR
+    exit 1
+  fi
+
+  # The first line of mechanism.reac holds the number of species, reactions
+  # and rate coefficients (see tests/run_rates_test.sh).
+  read -r _ number_of_reactions number_of_q _ < $mech_dir/mechanism.reac
+  if [ $version == "ref" ]; then
+    number_of_ref_q=$number_of_q
+  fi
+  $mech_dir/rates_test_driver $number_of_reactions $number_of_q $number_of_ref_q > $WORK_DIR/$version.rates
+  calls_per_second=$($mech_dir/rates_test_driver $number_of_reactions $number_of_q $number_of_ref_q $NUMBER_OF_CALLS \
+                     | awk '{print $5}')
+  if [ $version == "ref" ]; then
+    ref_calls_per_second=$calls_per_second
+    label="(default)"
+  else
+    label=$OPTIONS
+  fi
+  printf "%-20s %16s %10.2f\n" "$label" $calls_per_second \
+         $(echo "$calls_per_second $ref_calls_per_second" | awk '{print $1 / $2}')
+done
+
+diff -q $WORK_DIR/ref.rates $WORK_DIR/new.rates > /dev/null
+exitcode=$?
+rm -rf $WORK_DIR
+if [ $exitcode -ne 0 ]; then
+  echo "ERROR: the rates are different with" $OPTIONS
+  exit 1
+fi
+exit 0
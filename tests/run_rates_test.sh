@@ -0,0 +1,110 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# This script executes the rates test on the chemical mechanisms of
+# the model tests, to ensure that the optional transformations of the
+# rate expressions made by build/mech_converter.py (e.g. --fold,
+# --cse) do not change the rate coefficients and the reaction rates.
+#
+# Each chemical mechanism is converted twice -- with the default
+# options, and with the options being tested -- and compiled with
+# tests/rates_test_driver.f90. The rate coefficients and the reaction
+# rates calculated by the two versions of the mechanism must be
+# identical.
+#
+# $1 is the list of model tests
+# $2 is the Fortran compiler
+# $3 are the options of mech_converter.py to test [default: --fold --cse]
+#
+# N.B.: the script MUST be run from the main directory of AtChem2.
+
+TESTS_DIR=tests/model_tests
+LOG_FILE=tests/ratestest.log
+FORT_COMP=$2
+OPTIONS=${3:-"--fold --cse"}
+
+echo "Executing rates test script with options:" $OPTIONS > $LOG_FILE
+echo "" >> $LOG_FILE
+
+WORK_DIR=$(mktemp -d)
+
+for test in $1; do
+  echo $TESTS_DIR/$test >> $LOG_FILE
+  if [ -f $TESTS_DIR/$test/$test.kpp ]; then   # chemical mechanism in KPP format
+    mechanism_file=$TESTS_DIR/$test/$test.kpp
+  else   # by default, the chemical mechanism is in FACSIMILE format
+    mechanism_file=$TESTS_DIR/$test/$test.fac
+  fi
+
+  # Convert and compile the chemical mechanism, with the default options (ref)
+  # and with the options being tested (new), then calculate the rates.
+  for version in ref new; do
+    mech_dir=$WORK_DIR/$test/$version
+    mkdir -p $mech_dir
+    cp $TESTS_DIR/$test/configuration/customRateFuncs.f90 $TESTS_DIR/$test/configuration/environmentVariables.config $mech_dir
+    if [ $version == "ref" ]; then
+      options=""
+    else
+      options=$OPTIONS
+    fi
+    python ./build/mech_converter.py $mechanism_file $mech_dir mcm/ $options >> $LOG_FILE 2>&1 && \
+      make sharedlib SHAREDLIBDIR=$mech_dir >> $LOG_FILE 2>&1 && \
+      $FORT_COMP -o $mech_dir/rates_test_driver tests/rates_test_driver.f90 src/dataStructures.o \
+        $mech_dir/customRateFuncs.o $(ls $mech_dir/mechanism_shard_*.o 2>/dev/null) $mech_dir/mechanism.o >> $LOG_FILE 2>&1
+    exitcode=$?
+    if [ $exitcode -ne 0 ]; then
+      echo "Building" $test "($version) failed with exit code" $exitcode >> $LOG_FILE
+      rm -rf $WORK_DIR
+      echo "==> Rates test FAILED"
+      echo "==> Rates test logfile:" $LOG_FILE
+      exit 1
+    fi
+  done
+
+  # The first line of mechanism.reac holds the number of species, reactions
+  # and rate coefficients. The reference number of rate coefficients is used
+  # for both versions, as the options may add elements to q (e.g. --cse).
+  read -r _ number_of_reactions number_of_ref_q _ < $WORK_DIR/$test/ref/mechanism.reac
+  read -r _ _ number_of_new_q _ < $WORK_DIR/$test/new/mechanism.reac
+  $WORK_DIR/$test/ref/rates_test_driver $number_of_reactions $number_of_ref_q $number_of_ref_q > $WORK_DIR/$test/ref.rates
+  $WORK_DIR/$test/new/rates_test_driver $number_of_reactions $number_of_new_q $number_of_ref_q > $WORK_DIR/$test/new.rates
+
+  this_rates_test_failures=$(diff $WORK_DIR/$test/ref.rates $WORK_DIR/$test/new.rates)
+  exitcode=$?
+  if [ $exitcode -eq 1 ]; then
+    failed_rates="$failed_rates
+
+Differences found in $test (ref < > $OPTIONS):
+$this_rates_test_failures"
+    echo $test "FAILED" >> $LOG_FILE
+  elif [ $exitcode -ne 0 ]; then
+    echo "diff gave an error on" $test ". Aborting." >> $LOG_FILE
+    rm -rf $WORK_DIR
+    exit 1
+  fi
+done
+
+rm -rf $WORK_DIR
+
+if [ -z "$failed_rates" ]; then
+  echo "==> Rates test PASSED"
+  rates_test_passed=0
+else
+  echo "==> Rates test FAILED"
+  echo "$failed_rates" >> $LOG_FILE
+  rates_test_passed=1
+fi
+echo "" >> $LOG_FILE
+echo "Execution of rates test script finished." >> $LOG_FILE
+
+echo "==> Rates test logfile:" $LOG_FILE
+exit $rates_test_passed
@@ -0,0 +1,81 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+module interpolation_test
+  use fruit
+  use types_mod
+  implicit none
+
+contains
+
+  subroutine test_findInterval
+    use types_mod
+    use interpolation_functions_mod
+    type(interpolation_cache) :: cache
+    real(kind=DP) :: x(3,6), y(3,6), t
+    integer(kind=NPI) :: ind, k, numberOfPoints(3)
+    logical :: same
+
+    ! sorted data, sorted data with a repeated time, unsorted data
+    x(1,:) = (/ 0.0_DP, 10.0_DP, 20.0_DP, 30.0_DP, 40.0_DP, 50.0_DP /)
+    x(2,:) = (/ 0.0_DP, 10.0_DP, 10.0_DP, 30.0_DP, 40.0_DP, 0.0_DP /)
+    x(3,:) = (/ 0.0_DP, 30.0_DP, 10.0_DP, 40.0_DP, 20.0_DP, 50.0_DP /)
+    y(:,:) = 1.0_DP
+    numberOfPoints = (/ 6_NPI, 5_NPI, 6_NPI /)
+
+    same = .true.
+    do ind = 1, 3
+      ! forwards, backwards, and outside the data
+      do k = -20, 120
+        t = 0.5_DP * abs( k - 50 ) - 5.0_DP
+        if ( findInterval( t, x, y, numberOfPoints(ind), ind, cache ) /= &
+             findIntervalByScan( t, x, numberOfPoints(ind), ind ) ) then
+          same = .false.
+        end if
+      end do
+    end do
+    call assert_true( same, "findInterval same as findIntervalByScan" )
+
+    call assert_true( findInterval( 25.0_DP, x, y, 6_NPI, 1_NPI, cache ) == 3, "findInterval sorted" )
+    call assert_true( findInterval( 50.0_DP, x, y, 6_NPI, 1_NPI, cache ) == 0, "findInterval end of data" )
+    call assert_true( findInterval( -1.0_DP, x, y, 6_NPI, 1_NPI, cache ) == 0, "findInterval before data" )
+    call assert_true( findInterval( 10.0_DP, x, y, 5_NPI, 2_NPI, cache ) == 3, "findInterval repeated time" )
+    call assert_true( findInterval( 15.0_DP, x, y, 6_NPI, 3_NPI, cache ) == 1, "findInterval unsorted" )
+
+    call resetInterpolationCache( cache )
+    call assert_false( allocated( cache%cursor ), "resetInterpolationCache" )
+  end subroutine test_findInterval
+
+  subroutine test_getConstrainedQuantAtT
+    use types_mod
+    use interpolation_functions_mod
+    type(interpolation_cache) :: cache
+    real(kind=DP) :: x(1,4), y(1,4), concAtT
+
+    x(1,:) = (/ 0.0_DP, 60.0_DP, 120.0_DP, 180.0_DP /)
+    y(1,:) = (/ 1.0_DP, 4.0_DP, 2.0_DP, 2.0_DP /)
+
+    ! piecewise constant interpolation
+    call getConstrainedQuantAtT( 90.0_DP, x, y, 4_NPI, 1_SI, 1_NPI, concAtT, cache )
+    call assert_true( concAtT == 4.0_DP, "getConstrainedQuantAtT constant" )
+
+    ! piecewise linear interpolation
+    call getConstrainedQuantAtT( 30.0_DP, x, y, 4_NPI, 2_SI, 1_NPI, concAtT, cache )
+    call assert_true( concAtT == 2.5_DP, "getConstrainedQuantAtT linear 1" )
+    call getConstrainedQuantAtT( 90.0_DP, x, y, 4_NPI, 2_SI, 1_NPI, concAtT, cache )
+    call assert_true( concAtT == 3.0_DP, "getConstrainedQuantAtT linear 2" )
+    call getConstrainedQuantAtT( 150.0_DP, x, y, 4_NPI, 2_SI, 1_NPI, concAtT, cache )
+    call assert_true( concAtT == 2.0_DP, "getConstrainedQuantAtT linear 3" )
+    call getConstrainedQuantAtT( 0.0_DP, x, y, 4_NPI, 2_SI, 1_NPI, concAtT, cache )
+    call assert_true( concAtT == 1.0_DP, "getConstrainedQuantAtT linear 4" )
+  end subroutine test_getConstrainedQuantAtT
+
+end module interpolation_test
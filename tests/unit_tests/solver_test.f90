@@ -0,0 +1,77 @@
+! -----------------------------------------------------------------------------
+!
+! Copyright (c) 2017 Sam Cox, Roberto Sommariva
+!
+! This file is part of the AtChem2 software package.
+!
+! This file is covered by the MIT license which can be found in the file
+! LICENSE.md at the top level of the AtChem2 distribution.
+!
+! -----------------------------------------------------------------------------
+
+module solver_test
+  use fruit
+  use types_mod
+  implicit none
+
+contains
+
+  subroutine test_stoichiometry
+    use types_mod
+    use solver_functions_mod
+    integer(kind=NPI) :: lhs(2, 5), rhs(2, 3)
+    real(kind=DP) :: lcoeff(5), rcoeff(3), r(3), y(5), dy(5)
+
+    ! reaction 1: 2 A + B -> 2 C + D
+    ! reaction 2: C -> A
+    ! reaction 3: 0.5 E + 3 D -> (no products)
+    lhs(1,:) = (/ 1_NPI, 2_NPI, 1_NPI, 3_NPI, 3_NPI /)
+    lhs(2,:) = (/ 1_NPI, 3_NPI, 2_NPI, 5_NPI, 4_NPI /)
+    lcoeff = (/ 2.0_DP, 1.0_DP, 1.0_DP, 0.5_DP, 3.0_DP /)
+    rhs(1,:) = (/ 1_NPI, 1_NPI, 2_NPI /)
+    rhs(2,:) = (/ 3_NPI, 4_NPI, 1_NPI /)
+    rcoeff = (/ 2.0_DP, 1.0_DP, 1.0_DP /)
+    call setStoichiometry( 3_NPI, 5_NPI, lhs, lcoeff, rhs, rcoeff )
+
+    call assert_true( all( rateReactantStart == (/ 1_NPI, 3_NPI, 4_NPI, 6_NPI /) ), "setStoichiometry reactions" )
+    call assert_true( all( rateReactants == (/ 1_NPI, 2_NPI, 3_NPI, 5_NPI, 4_NPI /) ), "setStoichiometry reactants" )
+    call assert_true( all( rateExponents == (/ 2_SI, 1_SI, 1_SI, 0_SI, 3_SI /) ), "setStoichiometry exponents" )
+    call assert_true( all( speciesTermStart == (/ 1_NPI, 3_NPI, 4_NPI, 6_NPI, 8_NPI, 9_NPI /) ), "setStoichiometry species" )
+
+    r = (/ 2.0_DP, 3.0_DP, 5.0_DP /)
+    y = (/ 2.0_DP, 3.0_DP, 7.0_DP, 11.0_DP, 4.0_DP /)
+    call multiplyByReactants( r, y )
+    call assert_true( all( r == (/ 24.0_DP, 21.0_DP, 13310.0_DP /) ), "multiplyByReactants" )
+
+    call sumStoichiometry( r, dy )
+    call assert_true( all( dy == (/ -27.0_DP, -24.0_DP, 27.0_DP, -39906.0_DP, -6655.0_DP /) ), "sumStoichiometry" )
+  end subroutine test_stoichiometry
+
+  subroutine test_store_rates
+    use types_mod
+    use solver_functions_mod
+    use reaction_rates_mod, only : reactionRates
+    integer(kind=NPI) :: lhs(2, 1), rhs(2, 2)
+    real(kind=DP) :: lcoeff(1), rcoeff(2), r(2), y(2)
+
+    ! reaction 1: A -> B
+    ! reaction 2: (no reactants) -> A
+    lhs(1,:) = (/ 1_NPI /)
+    lhs(2,:) = (/ 1_NPI /)
+    lcoeff = (/ 1.0_DP /)
+    rhs(1,:) = (/ 1_NPI, 2_NPI /)
+    rhs(2,:) = (/ 2_NPI, 1_NPI /)
+    rcoeff = (/ 1.0_DP, 1.0_DP /)
+    call setStoichiometry( 2_NPI, 2_NPI, lhs, lcoeff, rhs, rcoeff )
+
+    allocate (reactionRates(2))
+    reactionRates(:) = 0.0_DP
+    r = (/ 2.0_DP, 3.0_DP /)
+    y = (/ 5.0_DP, 7.0_DP /)
+    call multiplyByReactants( r, y )
+    call storeRates( r )
+    call assert_true( all( reactionRates == (/ 10.0_DP, 0.0_DP /) ), "storeRates" )
+    deallocate (reactionRates)
+  end subroutine test_store_rates
+
+end module solver_test
@@ -0,0 +1,495 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script measures the performance of the conversion of the
+# chemical mechanism (`build/mech_converter.py`) on synthetic
+# mechanisms of increasing size, to catch the regressions in the
+# complexity of the conversion (e.g. a lookup in a list for each
+# reaction, which makes the conversion quadratic in the number of
+# reactions).
+#
+# The synthetic mechanisms have the structure of the MCM: an inorganic
+# chemistry, and chains of organic species (VOC + OH/O3/NO3 -> RO2 ->
+# RO, ROOH, RNO3 -> carbonyl -> acyl peroxy radical <-> PAN -> RO2 of
+# the next chain), with rate expressions of the MCM (Arrhenius
+# expressions, generic rate coefficients, falloff reactions,
+# photolysis rates and reactions with the RO2 sum). Each mechanism is
+# written in FACSIMILE (.fac) and in KPP (.kpp) format.
+#
+# Each mechanism is converted in a new process, in stages: the .kpp
+# file is read with `kpp_conversion.py` and the .fac file with
+# `fix_mechanism_fac.py`, then the mechanism is converted with
+# `mech_converter.convert_to_fortran` (which reads the file again).
+# The wall time of each stage, the total wall time and the peak
+# resident memory of the process are printed, together with the
+# scaling exponent of the total wall time between consecutive sizes
+# (1 for a linear conversion, 2 for a quadratic conversion), and the
+# ratio to the previous run in the history file with the same options.
+# The results are appended to the history file (JSON).
+#
+# OPTIONS:
+#   --sizes "N ..."     numbers of reactions of the synthetic mechanisms
+#                       [default: "300 3000 30000 100000"]
+#   --formats F ...     formats of the mechanism files (fac, kpp)
+#                       [default: fac kpp]
+#   --options "..."     options of mech_converter.py (e.g. "--cse --fold")
+#   --history FILE      history file [default: benchmark_converter.json]
+#   --label TEXT        label of the run in the history file
+#   --seed N            seed of the synthetic mechanisms [default: 0]
+#   --keep DIR          keep the mechanism files and the converted
+#                       mechanisms in DIR
+#
+# Usage:
+#   python tools/benchmark_converter.py
+#   python tools/benchmark_converter.py --sizes "1000 10000" --formats kpp --options "--cse"
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import re
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import datetime
+import platform
+import tempfile
+import resource
+import subprocess
+import contextlib
+import multiprocessing
+import concurrent.futures
+
+main_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(main_dir, 'build'))
+import fix_mechanism_fac
+import kpp_conversion
+import mech_converter
+
+# Generic rate coefficients of the MCM (see kpp_conversion.parse_kpp).
+genericRates = [('KRO2NO', '2.7D-12*EXP(360/TEMP)'), ('KRO2HO2', '2.91D-13*EXP(1300/TEMP)'),
+                ('KAPHO2', '5.2D-13*EXP(980/TEMP)'), ('KAPNO', '7.5D-12*EXP(290/TEMP)'),
+                ('KRO2NO3', '2.3D-12'), ('KNO3AL', '1.44D-12*EXP(-1862/TEMP)'),
+                ('KDEC', '1.00D+06'), ('KROPRIM', '2.50D-14*EXP(-300/TEMP)'),
+                ('KROSEC', '2.50D-14*EXP(-300/TEMP)'), ('KCH3O2', '1.03D-13*EXP(365/TEMP)'),
+                ('K298CH3O2', '3.5D-13'), ('K14ISOM1', '3.00D7*EXP(-5300/TEMP)')]
+
+# Falloff reactions of the MCM: name, index, k0 (without M), kinf and Fc.
+falloffRates = [('KMT03', '3', '3.6D-30*(TEMP/300)**-4.1', '1.9D-12*(TEMP/300)**0.2', '0.35'),
+                ('KMT04', '4', '1.3D-03*(TEMP/300)**-3.5*EXP(-11000/TEMP)',
+                 '9.7D+14*(TEMP/300)**0.1*EXP(-11080/TEMP)', '0.35'),
+                ('KMT07', '7', '7.4D-31*(TEMP/300)**-2.4', '3.3D-11*(TEMP/300)**-0.3', '0.81'),
+                ('KMT08', '8', '3.2D-30*(TEMP/300)**-4.5', '3.0D-11', '0.41'),
+                ('KFPAN', 'C', '3.28D-28*(TEMP/300)**-6.87', '1.125D-11*(TEMP/300)**-1.105', '0.30'),
+                ('KBPAN', 'D', '1.10D-05*EXP(-10100/TEMP)', '1.90D17*EXP(-14100/TEMP)', '0.30')]
+
+# Inorganic chemistry: reactants, products, rate expression.
+inorganicReactions = [
+    ('O3', 'O1D', 'J(1)'), ('O3', 'O', 'J(2)'),
+    ('O1D', 'O', '3.2D-11*EXP(67/TEMP)*O2+2.0D-11*EXP(130/TEMP)*N2'),
+    ('O1D', 'OH + OH', '2.14D-10*H2O'), ('O', 'O3', '5.6D-34*N2*(TEMP/300)**-2.6*O2'),
+    ('NO + O3', 'NO2', '1.4D-12*EXP(-1310/TEMP)'), ('NO2', 'NO + O', 'J(4)'),
+    ('OH + NO2', 'HNO3', 'KMT08'), ('OH + NO', 'HONO', 'KMT07'), ('HONO', 'OH + NO', 'J(7)'),
+    ('HO2 + NO', 'OH + NO2', '3.45D-12*EXP(270/TEMP)'),
+    ('HO2 + HO2', 'H2O2', '2.20D-13*KMT06*EXP(600/TEMP)+1.90D-33*M*KMT06*EXP(980/TEMP)'),
+    ('H2O2', 'OH + OH', 'J(3)'), ('OH + O3', 'HO2', '1.70D-12*EXP(-940/TEMP)'),
+    ('HO2 + O3', 'OH', '2.03D-16*(TEMP/300)**4.57*EXP(693/TEMP)'),
+    ('NO2 + O3', 'NO3', '1.4D-13*EXP(-2470/TEMP)'), ('NO3', 'NO', 'J(5)'),
+    ('NO3', 'NO2 + O', 'J(6)'), ('OH + CO', 'HO2', 'KMT05'), ('NO2 + NO3', 'N2O5', 'KMT03'),
+    ('N2O5', 'NO2 + NO3', 'KMT04')]
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def complex_rates():
+    """
+    Return the complex rate coefficients of the synthetic mechanisms, in
+    the order in which they are defined.
+
+    Returns:
+        rates (list): (name, expression) of each rate coefficient
+    """
+
+    rates = [('KMT05', '1.44D-13*(1+(M/4.2D+19))'),
+             ('KMT06', '1 + (1.40D-21*EXP(2200/TEMP)*H2O)')]
+    for name, n, k0, kinf, fc in falloffRates:
+        rates += [('K' + n + '0', k0 + '*M'), ('K' + n + 'I', kinf),
+                  ('KR' + n, 'K' + n + '0/K' + n + 'I'), ('FC' + n, fc),
+                  ('NC' + n, '0.75-1.27*(LOG10(FC' + n + '))'),
+                  ('F' + n, '10**(LOG10(FC' + n + ')/(1+(LOG10(KR' + n + ')/NC' + n + ')**2))'),
+                  (name, '(K' + n + '0*K' + n + 'I)*F' + n + '/(K' + n + '0+K' + n + 'I)')]
+    return rates
+
+def arrhenius(rng, low, high):
+    """
+    Return a random Arrhenius expression A*EXP(B/TEMP), in the format of
+    the MCM.
+
+    Args:
+        rng (random.Random): random number generator
+        low (float): lowest decimal exponent of A
+        high (float): highest decimal exponent of A
+
+    Returns:
+        expression (str): the rate expression
+    """
+
+    mantissa, exponent = ('%.2E' % 10**rng.uniform(low, high)).split('E')
+    return mantissa + 'D' + exponent + '*EXP(' + str(rng.randrange(-2500, 1500, 10)) + '/TEMP)'
+
+def chain_reactions(rng, i):
+    """
+    Return the reactions of chain i of the synthetic mechanism: the
+    oxidation of VOCi to the peroxy radical RiO2, its reactions with NO,
+    HO2, NO3 and the RO2 sum, and the degradation of the products to
+    the peroxy radical of chain i+1.
+
+    Args:
+        rng (random.Random): random number generator
+        i (int): number of the chain
+
+    Returns:
+        reactions (list): (reactants, products, rate expression) of each reaction
+        ro2 (list): names of the peroxy radicals of the chain
+    """
+
+    voc, ro2, rooh, ro, rno3 = 'VOC%d' % i, 'R%dO2' % i, 'R%dOOH' % i, 'R%dO' % i, 'R%dNO3' % i
+    carb, aco3, pan, acid = 'CARB%d' % i, 'ACO%dO3' % i, 'PAN%d' % i, 'ACID%d' % i
+    next_ro2 = 'R%dO2' % (i + 1)
+    branch = rng.uniform(0.01, 0.3)
+    reactions = [
+        ('OH + ' + voc, ro2, arrhenius(rng, -12, -10)),
+        ('O3 + ' + voc, carb + ' + OH', arrhenius(rng, -17, -15)),
+        ('NO3 + ' + voc, ro2 + ' + NO2', 'KNO3AL*%.1f' % rng.uniform(1, 8)),
+        (ro2 + ' + NO', ro + ' + NO2', 'KRO2NO*%.3f' % (1 - branch)),
+        (ro2 + ' + NO', rno3, 'KRO2NO*%.3f' % branch),
+        (ro2 + ' + HO2', rooh, 'KRO2HO2*%.3f' % rng.uniform(0.3, 0.9)),
+        (ro2 + ' + NO3', ro + ' + NO2', 'KRO2NO3'),
+        (ro2, ro, '%.2fD-13*0.6*RO2' % rng.uniform(1, 9)),
+        (ro2, carb, '%.2fD-13*0.2*RO2' % rng.uniform(1, 9)),
+        (ro, carb + ' + HO2', rng.choice(['KROPRIM', 'KROSEC']) + '*O2'),
+        (rooh, ro + ' + OH', 'J(41)'),
+        ('OH + ' + rooh, ro2, '1.90D-12*EXP(190/TEMP)'),
+        (rno3, ro + ' + NO2', 'J(%d)' % rng.choice([51, 52, 53, 54, 55])),
+        ('OH + ' + carb, aco3, arrhenius(rng, -12, -11)),
+        (carb, next_ro2 + ' + HO2 + CO', 'J(%d)' % rng.choice([11, 12, 15, 22])),
+        (aco3 + ' + NO2', pan, 'KFPAN'),
+        (pan, aco3 + ' + NO2', 'KBPAN'),
+        (aco3 + ' + NO', next_ro2 + ' + NO2', 'KAPNO'),
+        (aco3 + ' + HO2', acid + ' + O3', 'KAPHO2*0.44'),
+        (aco3, next_ro2, '1.00D-11*0.7*RO2')]
+    return reactions, [ro2, aco3]
+
+def synthetic_mechanism(number_of_reactions, seed=0):
+    """
+    Generate a synthetic chemical mechanism with the structure of the
+    MCM (see the documentation at the top of this file).
+
+    Args:
+        number_of_reactions (int): number of reactions
+        seed (int): seed of the random number generator
+
+    Returns:
+        reactions (list): (reactants, products, rate expression) of each reaction
+        ro2 (list): names of the peroxy radicals in the reactions
+    """
+
+    rng = random.Random(seed)
+    reactions = list(inorganicReactions)
+    ro2 = []
+    i = 1
+    while len(reactions) < number_of_reactions:
+        chain, chain_ro2 = chain_reactions(rng, i)
+        reactions += chain
+        ro2 += chain_ro2
+        i += 1
+    reactions = reactions[:number_of_reactions]
+    species = set(x.strip() for reactants, products, _ in reactions
+                  for x in (reactants + ' + ' + products).split('+'))
+    return reactions, [x for x in ro2 if x in species]
+
+def write_fac(fac_file, reactions, ro2):
+    """
+    Write a chemical mechanism in FACSIMILE format.
+
+    Args:
+        fac_file (str): path to the .fac file
+        reactions (list): (reactants, products, rate expression) of each reaction
+        ro2 (list): names of the peroxy radicals
+    """
+
+    with open(fac_file, 'w') as fac:
+        fac.write('* Synthetic chemical mechanism: ' + str(len(reactions)) + ' reactions ;\n*;\n')
+        fac.write('* Generic Rate Coefficients ;\n*;\n')
+        for name, rate in genericRates:
+            fac.write(name + ' = ' + rate.replace('**', '@') + ' ;\n')
+        fac.write('*;\n* Complex reactions ;\n*;\n')
+        for name, rate in complex_rates():
+            fac.write(name + ' = ' + rate.replace('**', '@') + ' ;\n')
+        fac.write('*;\n* Peroxy radicals. ;\n*;\n')
+        fac.write('RO2 = ' + ' + '.join(ro2) + ' ;\n')
+        fac.write('*;\n* Reaction definitions. ;\n*;\n')
+        for reactants, products, rate in reactions:
+            rate = re.sub(r'J\((\d+)\)', r'J<\1>', rate).replace('**', '@')
+            fac.write('% ' + rate + ' : ' + reactants + ' = ' + products + ' ;\n')
+        fac.write('*;\n* End of Subset.  No. of Reactions = ' + str(len(reactions)) + ' ;\n')
+
+def write_kpp(kpp_file, reactions, ro2):
+    """
+    Write a chemical mechanism in KPP format, with the structure of the
+    files generated by the MCM web extractor.
+
+    Args:
+        kpp_file (str): path to the .kpp file
+        reactions (list): (reactants, products, rate expression) of each reaction
+        ro2 (list): names of the peroxy radicals
+    """
+
+    species = sorted(set(x.strip() for reactants, products, _ in reactions
+                         for x in (reactants + ' + ' + products).split('+')))
+    with open(kpp_file, 'w') as kpp:
+        kpp.write('{ Synthetic chemical mechanism: ' + str(len(reactions)) + ' reactions }\n')
+        kpp.write('#INLINE F90_GLOBAL \n REAL(dp)::M, N2, O2, RO2, H2O \n #ENDINLINE\n')
+        kpp.write('#INCLUDE atoms \n#DEFVAR\n')
+        for x in species:
+            kpp.write(x + ' = IGNORE ;\n')
+        kpp.write('#INLINE F90_RCONST \n USE constants\n !end of USE statements \n !\n')
+        kpp.write(' ! start of executable statements\n RO2 = & \n')
+        for k in range(0, len(ro2), 4):
+            kpp.write(' ' + ' + '.join('C(ind_' + x + ')' for x in ro2[k:k + 4])
+                      + (' + & \n' if k + 4 < len(ro2) else ' \n'))
+        for name, rate in genericRates + complex_rates():
+            kpp.write(name + ' = ' + rate + '\n')
+        kpp.write('CALL mcm_constants(time, temp, M, N2, O2, RO2, H2O) \n #ENDINLINE \n')
+        kpp.write('#EQUATIONS\n')
+        for k, (reactants, products, rate) in enumerate(reactions, 1):
+            kpp.write('{' + str(k) + '.} ' + reactants + ' = ' + products + ' : ' + rate + ' ;\n')
+
+def peak_rss():
+    """
+    Return the peak resident memory of the current process.
+
+    Returns:
+        rss (float): peak resident memory, in MB
+    """
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kB on Linux, and in bytes on macOS.
+    return rss / 1024.0**2 if sys.platform == 'darwin' else rss / 1024.0
+
+def run_stages(mech_file, mech_dir, mcm_dir, options):
+    """
+    Convert a chemical mechanism in stages, and measure the wall time of
+    each stage and the peak resident memory. This function is run in a
+    new process, with the messages of the conversion written to
+    mech_converter.log in the output directory.
+
+    Args:
+        mech_file (str): path to the mechanism file
+        mech_dir (str): path to the output directory
+        mcm_dir (str): path to the MCM data files directory
+        options (dict): keyword arguments of convert_to_fortran()
+
+    Returns:
+        stages (dict): wall time of each stage, in seconds
+        rss (float): peak resident memory of the process, in MB
+    """
+
+    stages = {}
+    with open(os.path.join(mech_dir, 'mech_converter.log'), 'w') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            start = time.perf_counter()
+            if mech_file.endswith('.kpp'):
+                for _ in kpp_conversion.fac_lines(mech_file):
+                    pass
+                stages['kpp_conversion'] = time.perf_counter() - start
+            else:
+                with open(mech_file, 'r') as input_mech:
+                    for _ in fix_mechanism_fac.fix_fac_lines(input_mech, mech_file):
+                        pass
+                stages['fix_mechanism_fac'] = time.perf_counter() - start
+            start = time.perf_counter()
+            mech_converter.convert_to_fortran(mech_file, mech_dir, mcm_dir, **options)
+            stages['convert_to_fortran'] = time.perf_counter() - start
+    return stages, peak_rss()
+
+def benchmark(mech_file, mech_dir, mcm_dir, options):
+    """
+    Convert a chemical mechanism in a new process (so that the peak
+    resident memory is that of this conversion only).
+
+    Args:
+        mech_file (str): path to the mechanism file
+        mech_dir (str): path to the output directory
+        mcm_dir (str): path to the MCM data files directory
+        options (dict): keyword arguments of convert_to_fortran()
+
+    Returns:
+        stages (dict): wall time of each stage, in seconds
+        rss (float): peak resident memory of the process, in MB
+    """
+
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(run_stages, mech_file, mech_dir, mcm_dir, options).result()
+
+def git_commit():
+    """
+    Return the commit of the AtChem2 directory, if it is a git repository.
+
+    Returns:
+        commit (str): hash of the commit (with '+' if there are uncommitted
+                      changes), or None
+    """
+
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=main_dir,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        changes = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                          cwd=main_dir, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if changes.strip() else '')
+
+def read_history(history_file):
+    """
+    Read the runs in the history file. A missing file has no runs.
+
+    Args:
+        history_file (str): path to the history file
+
+    Returns:
+        runs (list): the runs, oldest first
+    """
+
+    if not os.path.isfile(history_file):
+        return []
+    with open(history_file, 'r') as history:
+        return json.load(history)
+
+def previous_results(runs, options):
+    """
+    Find the results of the last run with the same options of
+    mech_converter.py, for each format and size.
+
+    Args:
+        runs (list): the runs in the history file, oldest first
+        options (list): options of mech_converter.py
+
+    Returns:
+        previous (dict): result for each (format, number of reactions)
+    """
+
+    previous = {}
+    for run in runs:
+        if run.get('options') == options:
+            for result in run['results']:
+                previous[(result['format'], result['reactions'])] = result
+    return previous
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the performance of the conversion of the chemical mechanism on '
+        'synthetic mechanisms of increasing size.')
+    parser.add_argument('--sizes', default='300 3000 30000 100000', metavar='"N ..."',
+                        help='numbers of reactions of the synthetic mechanisms [default: %(default)s]')
+    parser.add_argument('--formats', nargs='+', choices=['fac', 'kpp'], default=['fac', 'kpp'],
+                        help='formats of the mechanism files [default: fac kpp]')
+    parser.add_argument('--options', default='', metavar='"..."',
+                        help='options of mech_converter.py (e.g. "--cse --fold")')
+    parser.add_argument('--history', default='benchmark_converter.json', metavar='FILE',
+                        help='history file [default: %(default)s]')
+    parser.add_argument('--label', default='', help='label of the run in the history file')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic mechanisms [default: %(default)s]')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='keep the mechanism files and the converted mechanisms in DIR')
+    args = parser.parse_args()
+
+    sizes = sorted(int(n) for n in args.sizes.split())
+    assert sizes and sizes[0] >= 100, 'The synthetic mechanisms must have at least 100 reactions'
+    option_list = args.options.split()
+    converter_parser = argparse.ArgumentParser()
+    mech_converter.add_converter_options(converter_parser)
+    options = mech_converter.converter_options(converter_parser.parse_args(option_list))
+
+    work_dir = args.keep if args.keep else tempfile.mkdtemp()
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    mcm_dir = os.path.join(work_dir, 'mcm')
+    if not os.path.isdir(mcm_dir):
+        os.makedirs(mcm_dir)
+
+    runs = read_history(args.history)
+    previous = previous_results(runs, option_list)
+    results = []
+    print('%-6s %9s %9s %12s %12s %12s %10s %8s %10s' % (
+        'format', 'reactions', 'species', 'read (s)', 'convert (s)', 'total (s)',
+        'RSS (MB)', 'scaling', 'previous'))
+    for number_of_reactions in sizes:
+        reactions, ro2 = synthetic_mechanism(number_of_reactions, args.seed)
+        species = set(x.strip() for reactants, products, _ in reactions
+                      for x in (reactants + ' + ' + products).split('+'))
+        # All the peroxy radicals are in the RO2 reference list.
+        with open(os.path.join(mcm_dir, 'peroxy-radicals_v3.3.1'), 'w') as ro2_file:
+            ro2_file.write(''.join(x + '\n' for x in ro2))
+        for mech_format in args.formats:
+            name = 'synthetic_' + str(number_of_reactions)
+            mech_file = os.path.join(work_dir, name + '.' + mech_format)
+            mech_dir = os.path.join(work_dir, name + '_' + mech_format)
+            if mech_format == 'fac':
+                write_fac(mech_file, reactions, ro2)
+            else:
+                write_kpp(mech_file, reactions, ro2)
+            if not os.path.isdir(mech_dir):
+                os.makedirs(mech_dir)
+            for filename in ['environmentVariables.config', 'customRateFuncs.f90']:
+                shutil.copy(os.path.join(main_dir, 'model', 'configuration', filename), mech_dir)
+
+            stages, rss = benchmark(mech_file, mech_dir, mcm_dir, options)
+            result = {'format': mech_format, 'reactions': number_of_reactions,
+                      'species': len(species), 'stages': stages,
+                      'wall_time': sum(stages.values()), 'peak_rss_mb': rss}
+            # Scaling exponent of the wall time from the previous size.
+            smaller = [r for r in results if r['format'] == mech_format]
+            scaling = ''
+            if smaller:
+                scaling = '%.2f' % (math.log(result['wall_time'] / smaller[-1]['wall_time'])
+                                    / math.log(float(number_of_reactions) / smaller[-1]['reactions']))
+            ratio = ''
+            if (mech_format, number_of_reactions) in previous:
+                ratio = '%.2fx' % (result['wall_time']
+                                   / previous[(mech_format, number_of_reactions)]['wall_time'])
+            results.append(result)
+            read_stage = 'kpp_conversion' if mech_format == 'kpp' else 'fix_mechanism_fac'
+            print('%-6s %9d %9d %12.3f %12.3f %12.3f %10.1f %8s %10s' % (
+                mech_format, number_of_reactions, len(species), stages[read_stage],
+                stages['convert_to_fortran'], result['wall_time'], rss, scaling, ratio))
+            sys.stdout.flush()
+
+    runs.append({'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'label': args.label, 'commit': git_commit(), 'options': option_list,
+                 'seed': args.seed, 'python': platform.python_version(),
+                 'platform': platform.platform(), 'results': results})
+    with open(args.history, 'w') as history:
+        json.dump(runs, history, indent=2)
+        history.write('\n')
+    print('Results appended to ' + args.history)
+    if not args.keep:
+        shutil.rmtree(work_dir)
+
+# Call the main function if executed as script
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# This script compares the solver types (`solver type` in
+# solver.parameters) on a model: it runs AtChem2 once with each solver
+# type and reports the walltime, the number of steps, the number of
+# evaluations of the right-hand side (by the solver, by the linear
+# solver and for the sparse Jacobian matrix) and the number of
+# evaluations of the Jacobian matrix.
+#
+# $1 is the model directory, with the same layout as the model tests
+#    (e.g. `tests/model_tests/spec_model_kpp/`): the chemical mechanism
+#    (*.kpp or *.fac) and the `configuration/` and `constraints/`
+#    sub-directories. Argument $1 is NOT optional.
+#
+# $2 is the list of solver types to compare. By default, argument $2
+#    is: "1 2 3 4" (solver type 4 requires AtChem2 compiled with KLU).
+#
+# The model directory is not modified: the configuration is copied to a
+# temporary directory. Options for mech_converter.py (e.g.
+# `--jacobian`) can be passed with the environment variable
+# ATCHEM2_CONVERTER_OPTIONS.
+#
+# Usage:
+#   ./tools/benchmark_solvers.sh tests/model_tests/spec_model_kpp/
+#   ./tools/benchmark_solvers.sh /path/to/full/mcm/model "2 4"
+# -----------------------------------------------------------------------------
+
+MODEL_DIR=${1%/}
+SOLVER_TYPES=${2:-"1 2 3 4"}
+
+if [ -z "$MODEL_DIR" ] || [ ! -d "$MODEL_DIR/configuration" ]; then
+  echo "Usage: ./tools/benchmark_solvers.sh /path/to/model/directory [\"solver types\"]"
+  exit 1
+fi
+
+mechanism_file=$(ls $MODEL_DIR/*.kpp 2>/dev/null | head -n 1)
+if [ -z "$mechanism_file" ]; then
+  mechanism_file=$(ls $MODEL_DIR/*.fac 2>/dev/null | head -n 1)
+fi
+if [ -z "$mechanism_file" ]; then
+  echo "No chemical mechanism (*.kpp or *.fac) found in" $MODEL_DIR
+  exit 1
+fi
+
+WORK_DIR=$(mktemp -d)
+cp -r $MODEL_DIR/configuration $WORK_DIR/configuration
+mkdir -p $WORK_DIR/constraints
+if [ -d $MODEL_DIR/constraints ]; then
+  cp -r $MODEL_DIR/constraints/. $WORK_DIR/constraints/
+fi
+
+./build/build_atchem2.sh $mechanism_file $WORK_DIR/configuration/ mcm/ &> $WORK_DIR/build.log
+if [ $? -ne 0 ]; then
+  echo "Building" $mechanism_file "failed, see" $WORK_DIR/build.log
+  exit 1
+fi
+
+echo "Model:" $MODEL_DIR
+failed=0
+printf "%-12s %12s %10s %10s %10s %10s %10s\n" "solver type" "walltime (s)" "steps" "f-s" "f-s (LS)" "f-s (Jac)" "J-s"
+
+for solver_type in $SOLVER_TYPES; do
+  sed -i.bak "7s/^[[:space:]]*[0-9]*/$solver_type/" $WORK_DIR/configuration/solver.parameters
+  rm -rf $WORK_DIR/output
+  mkdir -p $WORK_DIR/output/reactionRates
+  start=$(date +%s.%N)
+  ./atchem2 --shared_lib=$WORK_DIR/configuration/mechanism.so --output=$WORK_DIR/output \
+            --configuration=$WORK_DIR/configuration --mcm=mcm --constraints=$WORK_DIR/constraints \
+            > $WORK_DIR/run_$solver_type.out 2>&1
+  exitcode=$?
+  end=$(date +%s.%N)
+  if [ $exitcode -ne 0 ] || ! grep -q "No. steps" $WORK_DIR/run_$solver_type.out; then
+    printf "%-12s %12s\n" $solver_type "failed (see $WORK_DIR/run_$solver_type.out)"
+    failed=1
+    continue
+  fi
+
+  # number of steps, right-hand side and Jacobian evaluations (final statistics)
+  steps=$(grep "No. steps" $WORK_DIR/run_$solver_type.out | awk '{print $4}')
+  rhs=$(grep "No. steps" $WORK_DIR/run_$solver_type.out | awk '{print $8}')
+  jacs=$(grep "No. steps" $WORK_DIR/run_$solver_type.out | awk '{print $12}')
+  # right-hand side evaluations by the linear solver (NFELS column of
+  # mainSolverParameters.output, not available for the sparse solver)
+  rhs_ls=$(awk 'NR == 1 { for (i = 1; i <= NF; i++) if ($i == "NFELS") col = i } END { print (col ? $col : 0) }' \
+               $WORK_DIR/output/mainSolverParameters.output)
+  if [ "$solver_type" == "4" ]; then
+    rhs_ls=0
+  fi
+  rhs_jac=$(grep "No. f-s for the sparse Jacobian" $WORK_DIR/run_$solver_type.out | awk '{print $NF}')
+  printf "%-12s %12.2f %10s %10s %10s %10s %10s\n" $solver_type $(echo "$end - $start" | bc) \
+         $steps $rhs $rhs_ls ${rhs_jac:-0} $jacs
+done
+
+# keep the temporary directory if a run has failed
+if [ $failed -eq 0 ]; then
+  rm -rf $WORK_DIR
+fi
+exit $failed
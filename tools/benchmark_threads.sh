@@ -0,0 +1,114 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# This script measures the scaling of AtChem2 with the number of
+# threads (`number of threads` in model.parameters): it runs AtChem2
+# on a model with 1 to N threads and reports the walltime, the number
+# of evaluations of the right-hand side, the evaluations per second
+# and the speedup relative to 1 thread. AtChem2 must be compiled with
+# OpenMP (see $OPENMP in the Makefile), otherwise all the runs use 1
+# thread.
+#
+# $1 is the model directory, with the same layout as the model tests
+#    (e.g. `tests/model_tests/spec_model_kpp/`): the chemical mechanism
+#    (*.kpp or *.fac) and the `configuration/` and `constraints/`
+#    sub-directories. Argument $1 is NOT optional.
+#
+# $2 is the maximum number of threads N. By default, argument $2 is
+#    the number of cores.
+#
+# The model directory is not modified: the configuration is copied to a
+# temporary directory. Options for mech_converter.py (e.g. `--shards
+# 8`, so that the reaction rates are also calculated in parallel) can
+# be passed with the environment variable ATCHEM2_CONVERTER_OPTIONS.
+#
+# Usage:
+#   ./tools/benchmark_threads.sh tests/model_tests/spec_model_kpp/ 4
+#   ATCHEM2_CONVERTER_OPTIONS="--shards 32" ./tools/benchmark_threads.sh /path/to/full/mcm/model 32
+# -----------------------------------------------------------------------------
+
+MODEL_DIR=${1%/}
+MAX_THREADS=${2:-$(getconf _NPROCESSORS_ONLN)}
+
+if [ -z "$MODEL_DIR" ] || [ ! -d "$MODEL_DIR/configuration" ]; then
+  echo "Usage: ./tools/benchmark_threads.sh /path/to/model/directory [maximum number of threads]"
+  exit 1
+fi
+
+mechanism_file=$(ls $MODEL_DIR/*.kpp 2>/dev/null | head -n 1)
+if [ -z "$mechanism_file" ]; then
+  mechanism_file=$(ls $MODEL_DIR/*.fac 2>/dev/null | head -n 1)
+fi
+if [ -z "$mechanism_file" ]; then
+  echo "No chemical mechanism (*.kpp or *.fac) found in" $MODEL_DIR
+  exit 1
+fi
+
+WORK_DIR=$(mktemp -d)
+cp -r $MODEL_DIR/configuration $WORK_DIR/configuration
+mkdir -p $WORK_DIR/constraints
+if [ -d $MODEL_DIR/constraints ]; then
+  cp -r $MODEL_DIR/constraints/. $WORK_DIR/constraints/
+fi
+
+./build/build_atchem2.sh $mechanism_file $WORK_DIR/configuration/ mcm/ &> $WORK_DIR/build.log
+if [ $? -ne 0 ]; then
+  echo "Building" $mechanism_file "failed, see" $WORK_DIR/build.log
+  exit 1
+fi
+
+# the number of threads is on line 15 of model.parameters: add the
+# optional lines 14 and 15 if they are missing
+parameters=$WORK_DIR/configuration/model.parameters
+if [ $(wc -l < $parameters) -lt 14 ]; then
+  echo "0            reaction rates at output times only (0 = no, 1 = yes)" >> $parameters
+fi
+if [ $(wc -l < $parameters) -lt 15 ]; then
+  echo "1            number of threads (0 = set by OpenMP; only used if compiled with OpenMP)" >> $parameters
+fi
+
+echo "Model:" $MODEL_DIR
+failed=0
+printf "%-8s %12s %10s %14s %8s\n" "threads" "walltime (s)" "f-s" "f-s per second" "speedup"
+
+for threads in $(seq 1 $MAX_THREADS); do
+  sed -i.bak "15s/^[[:space:]]*[0-9]*/$threads/" $parameters
+  rm -rf $WORK_DIR/output
+  mkdir -p $WORK_DIR/output/reactionRates
+  start=$(date +%s.%N)
+  ./atchem2 --shared_lib=$WORK_DIR/configuration/mechanism.so --output=$WORK_DIR/output \
+            --configuration=$WORK_DIR/configuration --mcm=mcm --constraints=$WORK_DIR/constraints \
+            > $WORK_DIR/run_$threads.out 2>&1
+  exitcode=$?
+  end=$(date +%s.%N)
+  if [ $exitcode -ne 0 ] || ! grep -q "No. steps" $WORK_DIR/run_$threads.out; then
+    printf "%-8s %12s\n" $threads "failed (see $WORK_DIR/run_$threads.out)"
+    failed=1
+    continue
+  fi
+
+  walltime=$(echo "$end - $start" | bc)
+  if [ $threads -eq 1 ]; then
+    walltime_1=$walltime
+  fi
+  # right-hand side evaluations (final statistics)
+  rhs=$(grep "No. steps" $WORK_DIR/run_$threads.out | awk '{print $8}')
+  printf "%-8s %12.2f %10s %14.1f %8.2f\n" $threads $walltime $rhs $(echo "$rhs / $walltime" | bc -l) \
+         $(echo "${walltime_1:-$walltime} / $walltime" | bc -l)
+done
+
+# keep the temporary directory if a run has failed
+if [ $failed -eq 0 ]; then
+  rm -rf $WORK_DIR
+fi
+exit $failed
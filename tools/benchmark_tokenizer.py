@@ -0,0 +1,189 @@
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -------------------------------------------------------------------- #
+# This script measures the time taken by the tokenizer of the rate
+# expressions (`mech_converter.tokenise_and_process`), which is called
+# for each generic rate coefficient, each complex rate coefficient and
+# each reaction rate of the chemical mechanism.
+#
+# A synthetic MCM-like mechanism (see `tools/benchmark_converter.py`)
+# is converted with `mech_converter.convert_to_fortran`, and the
+# arguments of each call of tokenise_and_process are recorded. The
+# recorded calls are then repeated with the current version of
+# tokenise_and_process and, if given, with the version of a reference
+# revision of `build/mech_converter.py`, and the best wall time of the
+# repetitions is printed, with the speedup over the reference. The
+# results of the two versions must be identical.
+#
+# The wall time of the whole conversion is measured by
+# `tools/benchmark_converter.py`.
+#
+# OPTIONS:
+#   --reactions N       number of reactions of the synthetic mechanism
+#                       [default: 17000]
+#   --repeat N          number of repetitions [default: 5]
+#   --reference REV     git revision of the reference version of
+#                       build/mech_converter.py
+#   --seed N            seed of the synthetic mechanism [default: 0]
+#
+# Usage:
+#   python tools/benchmark_tokenizer.py
+#   python tools/benchmark_tokenizer.py --reference 7a13f91~1
+# -------------------------------------------------------------------- #
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import importlib.util
+import subprocess
+import contextlib
+
+main_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(main_dir, 'build'))
+sys.path.insert(0, os.path.join(main_dir, 'tools'))
+import mech_converter
+import benchmark_converter
+
+
+# =========================== FUNCTIONS =========================== #
+
+
+def record_calls(mech_file, mech_dir, mcm_dir):
+    """
+    Convert a chemical mechanism and record the arguments of each call of
+    tokenise_and_process, with the messages of the conversion written to
+    mech_converter.log in the output directory.
+
+    Args:
+        mech_file (str): path to the mechanism file
+        mech_dir (str): path to the output directory
+        mcm_dir (str): path to the MCM data files directory
+
+    Returns:
+        calls (list): arguments of each call of tokenise_and_process
+    """
+
+    calls = []
+    tokenise_and_process = mech_converter.tokenise_and_process
+
+    def recorder(*args):
+        calls.append(args)
+        return tokenise_and_process(*args)
+
+    mech_converter.tokenise_and_process = recorder
+    try:
+        with open(os.path.join(mech_dir, 'mech_converter.log'), 'w') as log_file:
+            with contextlib.redirect_stdout(log_file):
+                mech_converter.convert_to_fortran(mech_file, mech_dir, mcm_dir)
+    finally:
+        mech_converter.tokenise_and_process = tokenise_and_process
+    return calls
+
+def reference_tokenizer(revision, work_dir):
+    """
+    Load tokenise_and_process from build/mech_converter.py at a git revision.
+
+    Args:
+        revision (str): git revision
+        work_dir (str): directory of the reference version of mech_converter.py
+
+    Returns:
+        tokenise_and_process (function): reference version of tokenise_and_process
+    """
+
+    source = subprocess.check_output(['git', 'show', revision + ':build/mech_converter.py'],
+                                     cwd=main_dir)
+    reference_file = os.path.join(work_dir, 'mech_converter_reference.py')
+    with open(reference_file, 'wb') as reference:
+        reference.write(source)
+    spec = importlib.util.spec_from_file_location('mech_converter_reference', reference_file)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.tokenise_and_process
+
+def time_calls(tokenise_and_process, calls, repeat):
+    """
+    Repeat the recorded calls of tokenise_and_process.
+
+    Args:
+        tokenise_and_process (function): version of tokenise_and_process
+        calls (list): arguments of each call
+        repeat (int): number of repetitions
+
+    Returns:
+        best (float): best wall time of the repetitions, in seconds
+        results (list): result of each call
+    """
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [tokenise_and_process(*args) for args in calls]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the time taken by the tokenizer of the rate expressions.')
+    parser.add_argument('--reactions', type=int, default=17000,
+                        help='number of reactions of the synthetic mechanism [default: %(default)s]')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='number of repetitions [default: %(default)s]')
+    parser.add_argument('--reference', metavar='REV',
+                        help='git revision of the reference version of build/mech_converter.py')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the synthetic mechanism [default: %(default)s]')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    mcm_dir = os.path.join(work_dir, 'mcm')
+    mech_dir = os.path.join(work_dir, 'mechanism')
+    os.makedirs(mcm_dir)
+    os.makedirs(mech_dir)
+    reactions, ro2 = benchmark_converter.synthetic_mechanism(args.reactions, args.seed)
+    with open(os.path.join(mcm_dir, 'peroxy-radicals_v3.3.1'), 'w') as ro2_file:
+        ro2_file.write(''.join(x + '\n' for x in ro2))
+    mech_file = os.path.join(work_dir, 'synthetic.fac')
+    benchmark_converter.write_fac(mech_file, reactions, ro2)
+    for filename in ['environmentVariables.config', 'customRateFuncs.f90']:
+        shutil.copy(os.path.join(main_dir, 'model', 'configuration', filename), mech_dir)
+
+    calls = record_calls(mech_file, mech_dir, mcm_dir)
+    print('Mechanism: %d reactions, %d rate expressions' % (args.reactions, len(calls)))
+    print('%-12s %12s %14s %10s' % ('version', 'time (s)', 'expressions/s', 'speedup'))
+    versions = []
+    if args.reference:
+        # The reference version may not take the names of the custom rate
+        # functions (which are not used by the synthetic mechanism).
+        versions.append((args.reference, reference_tokenizer(args.reference, work_dir),
+                         [call[:2] for call in calls]))
+    versions.append(('current', mech_converter.tokenise_and_process, calls))
+    exitcode = 0
+    reference_time = reference_results = None
+    for label, tokenise_and_process, version_calls in versions:
+        best, results = time_calls(tokenise_and_process, version_calls, args.repeat)
+        if reference_time is None:
+            reference_time, reference_results = best, results
+        elif results != reference_results:
+            exitcode = 1
+        print('%-12s %12.3f %14.0f %10.2f' % (label, best, len(calls) / best, reference_time / best))
+    shutil.rmtree(work_dir)
+    if exitcode != 0:
+        print('ERROR: the results are different from the reference version')
+    sys.exit(exitcode)
+
+# Call the main function if executed as script
+if __name__ == '__main__':
+    main()
@@ -17,6 +17,10 @@
 # The default Fortran compiler is GNU gfortran. A different compiler
 # can be specified by optional input argument `$2`.
 #
+# The KLU sparse direct solver (solver type 4 of AtChem2) is enabled
+# if the path to SuiteSparse (with `include/` and `lib/`
+# sub-directories) is specified by optional input argument `$3`.
+#
 # Website: https://computing.llnl.gov/projects/sundials/
 # Requirements: fortran compiler (default: gfortran), cmake, make
 #
@@ -24,6 +28,8 @@
 #   ./install_cvode.sh ~/path/to/dependencies/directory
 #     OR
 #   ./install_cvode.sh ~/path/to/dependencies/directory /path/to/fortran/compiler
+#     OR
+#   ./install_cvode.sh ~/path/to/dependencies/directory /path/to/fortran/compiler /path/to/suitesparse
 # -----------------------------------------------------------------------------
 
 SUNDIALS_VERSION="2.7.0"
@@ -55,6 +61,17 @@ else
     fi
 fi
 
+# enable KLU (optional)
+if [ -z "$3" ] ; then
+    KLU_OPTIONS="-DKLU_ENABLE:BOOL=OFF"
+else
+    if [ ! -d "$3" ] ; then
+        printf "\n[suitesparse] %s does not exist\n" "$3"
+        exit 1
+    fi
+    KLU_OPTIONS="-DKLU_ENABLE:BOOL=ON -DKLU_INCLUDE_DIR=$3/include -DKLU_LIBRARY_DIR=$3/lib"
+fi
+
 # download archive
 SUNDIALS_DIR="sundials-${SUNDIALS_VERSION}"
 SUNDIALS_ARCHIVE="v${SUNDIALS_VERSION}.tar.gz"
@@ -86,6 +103,7 @@ cmake -DCMAKE_INSTALL_PREFIX="$DEP_DIR/cvode" \
       -DBUILD_IDAS:BOOL=OFF \
       -DBUILD_KINSOL:BOOL=OFF \
       -DLAPACK_ENABLE:BOOL=OFF \
+      $KLU_OPTIONS \
       -DFCMIX_ENABLE:BOOL=ON \
       -DEXAMPLES_ENABLE:BOOL=OFF \
       -DCMAKE_MACOSX_RPATH:BOOL=ON \
@@ -0,0 +1,115 @@
+#!/bin/bash
+# -----------------------------------------------------------------------------
+#
+# Copyright (c) 2017 Sam Cox, Roberto Sommariva
+#
+# This file is part of the AtChem2 software package.
+#
+# This file is covered by the MIT license which can be found in the file
+# LICENSE.md at the top level of the AtChem2 distribution.
+#
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# This script reduces the chemical mechanism of a model to a skeletal
+# mechanism, within a given error on the target species (see
+# `build/mechanism_reduction.py`): it runs AtChem2 once with the full
+# mechanism (reference run), then, for each threshold of the Directed
+# Relation Graph method in decreasing order, writes the skeletal
+# mechanism, runs AtChem2 with it, and compares the concentrations of
+# the target species to the reference run. The first skeletal
+# mechanism (i.e. the smallest) within the tolerance is kept.
+#
+# $1 is the model directory, with the same layout as the model tests
+#    (e.g. `tests/model_tests/spec_model_kpp/`): the chemical mechanism
+#    (*.kpp or *.fac) and the `configuration/` and `constraints/`
+#    sub-directories. Argument $1 is NOT optional.
+#
+# $2 is the path of the skeletal mechanism file to write (.fac).
+#    Argument $2 is NOT optional.
+#
+# $3 is the list of thresholds, in decreasing order. By default,
+#    argument $3 is: "0.5 0.3 0.2 0.1 0.05 0.02 0.01".
+#
+# The target species and the tolerance can be set with the
+# environment variables ATCHEM2_REDUCTION_TARGETS [default: "O3 OH HO2
+# NO NO2"] and ATCHEM2_REDUCTION_TOLERANCE [default: 0.05]. The model
+# directory is not modified: the configuration is copied to a
+# temporary directory, the reaction rates output step size is set to
+# the step size of the model, and the target species are added to
+# outputSpecies.config.
+#
+# Usage:
+#   ./tools/reduce_mechanism.sh tests/model_tests/spec_model_1/ skeletal.fac
+#   ATCHEM2_REDUCTION_TARGETS="O3 OH" ./tools/reduce_mechanism.sh /path/to/model skeletal.fac "0.2 0.1"
+# -----------------------------------------------------------------------------
+
+MODEL_DIR=${1%/}
+SKELETAL_FILE=$2
+THRESHOLDS=${3:-"0.5 0.3 0.2 0.1 0.05 0.02 0.01"}
+TARGETS=${ATCHEM2_REDUCTION_TARGETS:-"O3 OH HO2 NO NO2"}
+TOLERANCE=${ATCHEM2_REDUCTION_TOLERANCE:-0.05}
+
+if [ -z "$MODEL_DIR" ] || [ ! -d "$MODEL_DIR/configuration" ] || [ -z "$SKELETAL_FILE" ]; then
+  echo "Usage: ./tools/reduce_mechanism.sh /path/to/model/directory skeletal.fac [\"thresholds\"]"
+  exit 1
+fi
+
+mechanism_file=$(ls $MODEL_DIR/*.kpp 2>/dev/null | head -n 1)
+if [ -z "$mechanism_file" ]; then
+  mechanism_file=$(ls $MODEL_DIR/*.fac 2>/dev/null | head -n 1)
+fi
+if [ -z "$mechanism_file" ]; then
+  echo "No chemical mechanism (*.kpp or *.fac) found in" $MODEL_DIR
+  exit 1
+fi
+
+WORK_DIR=$(mktemp -d)
+cp -r $MODEL_DIR/configuration $WORK_DIR/configuration
+mkdir -p $WORK_DIR/constraints
+if [ -d $MODEL_DIR/constraints ]; then
+  cp -r $MODEL_DIR/constraints/. $WORK_DIR/constraints/
+fi
+
+# Output the reaction rates at each step, and the concentrations of the target species.
+step_size=$(sed -n '2p' $WORK_DIR/configuration/model.parameters | awk '{print $1}')
+sed -i.bak "13s/^[[:space:]]*[0-9]*/$step_size/" $WORK_DIR/configuration/model.parameters
+for species in $TARGETS; do
+  grep -qx "$species" $WORK_DIR/configuration/outputSpecies.config || echo $species >> $WORK_DIR/configuration/outputSpecies.config
+done
+
+# Build the model with a chemical mechanism ($1) and run it, with the output in $2.
+run_model() {
+  ./build/build_atchem2.sh $1 $WORK_DIR/configuration/ mcm/ &> $WORK_DIR/build.log || return 1
+  rm -rf $2
+  mkdir -p $2/reactionRates
+  ./atchem2 --shared_lib=$WORK_DIR/configuration/mechanism.so --output=$2 \
+            --configuration=$WORK_DIR/configuration --mcm=mcm --constraints=$WORK_DIR/constraints \
+            > $2.out 2>&1
+}
+
+if ! run_model $mechanism_file $WORK_DIR/reference; then
+  echo "Reference run failed, see" $WORK_DIR
+  exit 1
+fi
+
+for threshold in $THRESHOLDS; do
+  echo "-> Threshold" $threshold
+  python ./build/mechanism_reduction.py reduce $mechanism_file $WORK_DIR/reference \
+         $WORK_DIR/configuration $WORK_DIR/skeletal_$threshold.fac --threshold $threshold --targets "$TARGETS" \
+    | grep "Reduction" || continue
+  if ! run_model $WORK_DIR/skeletal_$threshold.fac $WORK_DIR/skeletal_$threshold; then
+    echo "Run with the skeletal mechanism failed, see" $WORK_DIR/skeletal_$threshold.out
+    continue
+  fi
+  if python ./build/mechanism_reduction.py validate $WORK_DIR/reference $WORK_DIR/skeletal_$threshold \
+            --targets "$TARGETS" --tolerance $TOLERANCE; then
+    cp $WORK_DIR/skeletal_$threshold.fac $SKELETAL_FILE
+    echo "=> skeletal mechanism (threshold $threshold) written to:" $SKELETAL_FILE
+    rm -rf $WORK_DIR
+    exit 0
+  fi
+done
+
+echo "No skeletal mechanism within the tolerance, see" $WORK_DIR
+exit 1